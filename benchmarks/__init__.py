@@ -0,0 +1 @@
+# Paquete con las pruebas de carga y rendimiento de la tienda
@@ -0,0 +1,124 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+import main as api
+from benchmarks.comun import percentil, preparar_aplicacion
+from services import ControlAdmision, MiddlewareAdmision
+
+
+# Latencia de las compras mientras un cliente inunda la tienda de lecturas.
+# Unos clientes hacen pedidos a ritmo constante y otro, desde una sola IP, pide el
+# catálogo completo con muchas conexiones a la vez y sin hacer caso de Retry-After
+# (tras un rechazo solo espera el tiempo de ida y vuelta, '--rtt-ms'). Todo va por
+# un cliente ASGI en el mismo proceso, sin red. Se compara sin control de admisión,
+# descartando las lecturas sobrantes y con un límite por cliente además del descarte.
+
+
+def escenarios(args) -> Dict[str, Optional[dict]]:
+    # Nombre -> opciones de ControlAdmision (None: sin middleware)
+    descarte = {"max_pedidos": args.max_pedidos, "max_lecturas": args.max_lecturas}
+    return {
+        "sin inundación": None,
+        "inundación sin control": None,
+        "descarte de lecturas": descarte,
+        "límite por cliente": {**descarte, "limite_cliente": (args.tasa_cliente, args.tasa_cliente * 2)},
+    }
+
+
+async def ejecutar(opciones: Optional[dict], inundar: bool, args) -> Dict[str, float]:
+    productos = preparar_aplicacion(num_productos=args.productos)
+    aplicacion = api.app
+    if opciones is not None:
+        api.control_admision = ControlAdmision(**opciones)
+        aplicacion = MiddlewareAdmision(api.app, api.control_admision)
+    compradores = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=aplicacion, client=("10.0.0.1", 1000)), base_url="http://tienda"
+    )
+    inundador = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=aplicacion, client=("10.0.0.66", 6666)), base_url="http://tienda"
+    )
+    clientes = [
+        api.tienda_service.registrar_usuario("cliente", f"Cliente {i}", f"cliente{i}@tienda.es", "Calle 1").id
+        for i in range(args.compradores)
+    ]
+    latencias: List[float] = []
+    errores = 0
+    lecturas = {"servidas": 0, "rechazadas": 0}
+    fin = time.perf_counter() + args.segundos
+
+    async def comprador(indice: int) -> None:
+        nonlocal errores
+        siguiente = time.perf_counter()
+        n = 0
+        while time.perf_counter() < fin:
+            producto_id = str(productos[(indice * 7919 + n) % len(productos)])
+            n += 1
+            inicio = time.perf_counter()
+            respuesta = await compradores.post("/pedidos", json={
+                "cliente_id": str(clientes[indice]),
+                "items": [{"producto_id": producto_id, "cantidad": 1}],
+            })
+            latencias.append(time.perf_counter() - inicio)
+            errores += respuesta.status_code != 201
+            # Ritmo constante: el siguiente pedido sale a su hora aunque este tardara
+            siguiente += 1 / args.pedidos_por_comprador
+            await asyncio.sleep(max(0.0, siguiente - time.perf_counter()))
+
+    async def lector() -> None:
+        while time.perf_counter() < fin:
+            respuesta = await inundador.get("/productos")
+            if respuesta.status_code == 200:
+                lecturas["servidas"] += 1
+            else:
+                lecturas["rechazadas"] += 1
+                await asyncio.sleep(args.rtt_ms / 1000)
+
+    tareas = [comprador(i) for i in range(args.compradores)]
+    if inundar:
+        tareas += [lector() for _ in range(args.lectores)]
+    inicio = time.perf_counter()
+    await asyncio.gather(*tareas)
+    duracion = time.perf_counter() - inicio
+    await compradores.aclose()
+    await inundador.aclose()
+    api.tienda_service.cerrar()
+    return {
+        "pedidos_s": len(latencias) / duracion,
+        "p50_ms": percentil(latencias, 0.50) * 1000,
+        "p99_ms": percentil(latencias, 0.99) * 1000,
+        "errores": errores,
+        "servidas_s": lecturas["servidas"] / duracion,
+        "rechazadas_s": lecturas["rechazadas"] / duracion,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latencia de las compras durante una inundación de lecturas")
+    parser.add_argument("--productos", type=int, default=2_000)
+    parser.add_argument("--compradores", type=int, default=20)
+    parser.add_argument("--pedidos-por-comprador", type=float, default=20.0, help="Pedidos por segundo de cada comprador")
+    parser.add_argument("--lectores", type=int, default=200, help="Conexiones del cliente que inunda")
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="Espera del inundador tras un rechazo")
+    parser.add_argument("--max-pedidos", type=int, default=16, help="Compras en curso con control de admisión")
+    parser.add_argument("--max-lecturas", type=int, default=4, help="Lecturas en curso con control de admisión")
+    parser.add_argument("--tasa-cliente", type=float, default=50.0, help="Peticiones por segundo por cliente")
+    parser.add_argument("--segundos", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{args.compradores} compradores a {args.pedidos_por_comprador:.0f} pedidos/s y "
+          f"{args.lectores} conexiones leyendo {args.productos} productos:")
+    print(f"{'escenario':>24} {'pedidos/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errores':>8} "
+          f"{'lecturas/s':>11} {'rechazadas/s':>13}")
+    for nombre, opciones in escenarios(args).items():
+        r = asyncio.run(ejecutar(opciones, nombre != "sin inundación", args))
+        print(f"{nombre:>24} {r['pedidos_s']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errores']:>8} "
+              f"{r['servidas_s']:>11.0f} {r['rechazadas_s']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+from __future__ import annotations
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_exportacion import rss_mb
+from models import ProductoElectronico
+from services import TiendaService
+
+
+# Memoria residente con muchos pedidos, con y sin archivo de pedidos antiguos.
+# Cada modo se ejecuta en un proceso aparte (la memoria que libera Python no
+# siempre vuelve al sistema) que crea pedidos por lotes de 1000 y compacta cada
+# 'compactar_cada' pedidos, como haría el hilo del archivo. Con archivo se mide
+# además el coste de leer una página de historial y de exportar un cliente.
+
+
+def ejecutar_modo(args) -> None:
+    archivo = args.modo == "archivo"
+    servicio = TiendaService(memoria_pedidos=args.presupuesto_mb * 1024 * 1024 if archivo else None)
+    productos = servicio.añadir_productos(
+        [ProductoElectronico(f"Producto {i}", 1 + i % 500, 10**12) for i in range(args.productos)]
+    )
+    clientes = [servicio.registrar_usuario("cliente", f"Cliente {i}", f"c{i}@tienda.es", "Calle 1")
+                for i in range(args.clientes)]
+    aleatorio = random.Random(42)
+    bloque = args.pedidos // 10
+    creados = 0
+    pedir = compactar = 0.0
+    while creados < args.pedidos:
+        inicio = time.perf_counter()
+        servicio.realizar_pedidos([
+            (aleatorio.choice(clientes).id,
+             {p.id: aleatorio.randint(1, 5) for p in aleatorio.sample(productos, args.lineas_por_pedido)})
+            for _ in range(1000)
+        ])
+        creados += 1000
+        pedir += time.perf_counter() - inicio
+        if archivo and creados % args.compactar_cada == 0:
+            inicio = time.perf_counter()
+            servicio.archivar_pedidos()
+            compactar += time.perf_counter() - inicio
+        if creados % bloque == 0:
+            print(json.dumps({
+                "pedidos": creados, "calientes": len(servicio.pedidos), "archivados": len(servicio.archivo),
+                "rss": rss_mb(), "bytes_archivo": servicio.archivo.memoria(), "pedir": pedir,
+                "compactar": compactar,
+            }), flush=True)
+            pedir = compactar = 0.0
+
+    if archivo:
+        cliente = clientes[0].id
+        total = len(servicio.listar_pedidos_usuario(cliente))
+        for nombre, after in (
+            ("primera página (archivo)", None),
+            ("última página (calientes)", servicio.listar_pedidos_usuario(cliente)[-51].id),
+        ):
+            repeticiones = 2000
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                servicio.listar_pedidos_usuario(cliente, limit=50, after=after)
+            print(json.dumps({"consulta": nombre, "us": (time.perf_counter() - inicio) / repeticiones * 1e6}))
+        inicio = time.perf_counter()
+        exportados = sum(1 for _ in servicio.iterar_pedidos(cliente))
+        assert exportados == total
+        print(json.dumps({"consulta": f"exportar un cliente ({total} pedidos)",
+                          "us": (time.perf_counter() - inicio) * 1e6}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memoria y consultas con archivo de pedidos")
+    parser.add_argument("--pedidos", type=int, default=2_000_000)
+    parser.add_argument("--lineas-por-pedido", type=int, default=2)
+    parser.add_argument("--productos", type=int, default=1_000)
+    parser.add_argument("--clientes", type=int, default=1_000)
+    parser.add_argument("--presupuesto-mb", type=int, default=128)
+    parser.add_argument("--compactar-cada", type=int, default=20_000)
+    parser.add_argument("--modo", choices=("caliente", "archivo"))
+    args = parser.parse_args()
+    if args.modo:
+        ejecutar_modo(args)
+        return
+
+    for modo in ("caliente", "archivo"):
+        print(f"\n{modo}:" + (f" presupuesto de {args.presupuesto_mb} MB para los pedidos calientes"
+                              if modo == "archivo" else " todos los pedidos en memoria"))
+        proceso = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_archivo", "--modo", modo] + sys.argv[1:],
+            capture_output=True, text=True, check=True,
+        )
+        for linea in proceso.stdout.splitlines():
+            datos = json.loads(linea)
+            if "consulta" in datos:
+                print(f"  {datos['consulta']}: {datos['us']:.1f} µs")
+            else:
+                print(f"  {datos['pedidos']:>9} pedidos: RSS {datos['rss']:6.0f} MB, calientes {datos['calientes']:>8}, "
+                      f"archivados {datos['archivados']:>8} ({datos['bytes_archivo'] / 1e6:.0f} MB), "
+                      f"pedidos {datos['pedir']:.1f} s, compactación {datos['compactar']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+import main as api
+from benchmarks.comun import percentil, preparar_aplicacion
+
+
+# Comparativa A/B de los endpoints en modo hilos (cada petición salta al
+# threadpool, como los endpoints síncronos) y en modo asíncrono (el servicio se
+# ejecuta en el bucle de eventos). Las peticiones van por un cliente ASGI en el
+# mismo proceso, sin red: mitad GET /productos/{id} y mitad POST /pedidos.
+# Con --persistencia cada pedido espera además al fsync del WAL (group commit).
+
+
+async def ejecutar(
+    usar_hilos: bool,
+    concurrencia: int,
+    peticiones: int,
+    num_productos: int,
+    directorio: Optional[str],
+    semilla: int,
+) -> Dict[str, float]:
+    productos = preparar_aplicacion(usar_hilos, num_productos, directorio)
+    latencias: List[float] = []
+    errores = 0
+    transporte = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://tienda") as cliente:
+        # Un cliente de la tienda por cada cliente concurrente
+        clientes = []
+        for i in range(concurrencia):
+            respuesta = await cliente.post("/usuarios", json={
+                "nombre": f"Cliente {i}", "email": f"cliente{i}@tienda.es",
+                "tipo": "cliente", "direccion_postal": "Calle Falsa 123",
+            })
+            clientes.append(respuesta.json()["id"])
+        por_cliente = max(1, peticiones // concurrencia)
+
+        async def trabajador(indice: int) -> None:
+            nonlocal errores
+            aleatorio = random.Random(semilla + indice)
+            for n in range(por_cliente):
+                producto_id = str(aleatorio.choice(productos))
+                inicio = time.perf_counter()
+                if n % 2:
+                    respuesta = await cliente.get(f"/productos/{producto_id}")
+                else:
+                    respuesta = await cliente.post("/pedidos", json={
+                        "cliente_id": clientes[indice],
+                        "items": [{"producto_id": producto_id, "cantidad": 1}],
+                    })
+                latencias.append(time.perf_counter() - inicio)
+                if respuesta.status_code >= 400:
+                    errores += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador(i) for i in range(concurrencia)))
+        duracion = time.perf_counter() - inicio
+    api.tienda_service.cerrar()
+
+    return {
+        "peticiones_por_segundo": len(latencias) / duracion,
+        "p50_ms": percentil(latencias, 0.50) * 1000,
+        "p99_ms": percentil(latencias, 0.99) * 1000,
+        "errores": errores,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Comparativa de los endpoints en modo hilos y asíncrono")
+    parser.add_argument("--concurrencia", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--peticiones", type=int, default=5000, help="Peticiones por nivel de concurrencia")
+    parser.add_argument("--productos", type=int, default=200)
+    parser.add_argument("--persistencia", action="store_true", help="Activa el WAL síncrono en un directorio temporal")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'modo':<7} {'clientes':>9} {'peticiones/s':>13} {'p50 ms':>8} {'p99 ms':>8} {'errores':>8}")
+    for concurrencia in args.concurrencia:
+        for nombre, usar_hilos in (("hilos", True), ("async", False)):
+            directorio = tempfile.mkdtemp(prefix="tienda-bench-") if args.persistencia else None
+            try:
+                r = asyncio.run(ejecutar(
+                    usar_hilos, concurrencia, args.peticiones, args.productos, directorio, args.semilla
+                ))
+            finally:
+                if directorio:
+                    shutil.rmtree(directorio, ignore_errors=True)
+            print(
+                f"{nombre:<7} {concurrencia:>9} {r['peticiones_por_segundo']:>13.0f} "
+                f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errores']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
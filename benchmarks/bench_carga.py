@@ -0,0 +1,130 @@
+from __future__ import annotations
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from benchmarks.bench_exportacion import rss_mb
+from services import TiendaService
+from services.Carga_Masiva import CargaMasiva, ProgresoCarga
+
+
+# Carga masiva de ficheros generados: filas/s y MB/s de cada fase frente a solo leer
+# los mismos ficheros, memoria residente máxima durante la carga frente a la final
+# (lo que ocupa de más la tubería) y tiempo de construir los índices al final.
+
+
+def generar(directorio: str, formato: str, args) -> dict:
+    # Escribimos usuarios, productos y pedidos (en orden de fecha) y devolvemos las rutas
+    aleatorio = random.Random(1)
+    extension = "jsonl" if formato == "ndjson" else "csv"
+    rutas = {fase: os.path.join(directorio, f"{fase}.{extension}") for fase in ("usuarios", "productos", "pedidos")}
+    clientes = [UUID(int=aleatorio.getrandbits(128), version=4) for _ in range(args.usuarios)]
+    productos = [UUID(int=aleatorio.getrandbits(128), version=4) for _ in range(args.productos)]
+
+    with open(rutas["usuarios"], "w") as f:
+        if formato == "csv":
+            f.write("id,tipo,nombre,email,direccion_postal\n")
+        for i, cliente_id in enumerate(clientes):
+            if formato == "csv":
+                f.write(f"{cliente_id},cliente,Cliente {i},cliente{i}@tienda.es,Calle {i}\n")
+            else:
+                f.write(f'{{"id":"{cliente_id}","tipo":"cliente","nombre":"Cliente {i}",'
+                        f'"email":"cliente{i}@tienda.es","direccion_postal":"Calle {i}"}}\n')
+
+    with open(rutas["productos"], "w") as f:
+        if formato == "csv":
+            f.write("id,tipo,nombre,precio,stock,garantia_meses\n")
+        for i, producto_id in enumerate(productos):
+            precio = 1 + i % 5000 / 10
+            if formato == "csv":
+                f.write(f"{producto_id},electronico,Producto {i},{precio},1000,24\n")
+            else:
+                f.write(f'{{"id":"{producto_id}","tipo":"electronico","nombre":"Producto {i}",'
+                        f'"precio":{precio},"stock":1000,"garantia_meses":24}}\n')
+
+    fecha = datetime(2020, 1, 1)
+    paso = timedelta(seconds=1)
+    with open(rutas["pedidos"], "w") as f:
+        if formato == "csv":
+            f.write("pedido_id,fecha,cliente_id,producto_id,cantidad,precio_unitario\n")
+        for _ in range(args.pedidos):
+            pedido_id = UUID(int=aleatorio.getrandbits(128), version=4)
+            cliente_id = clientes[aleatorio.randrange(len(clientes))]
+            lineas = [
+                (productos[aleatorio.randrange(len(productos))], 1 + aleatorio.randrange(3))
+                for _ in range(args.lineas_por_pedido)
+            ]
+            fecha += paso
+            texto = fecha.isoformat()
+            if formato == "csv":
+                for producto_id, cantidad in lineas:
+                    f.write(f"{pedido_id},{texto},{cliente_id},{producto_id},{cantidad},9.99\n")
+            else:
+                items = ",".join(
+                    f'{{"producto_id":"{producto_id}","cantidad":{cantidad},"precio_unitario":9.99}}'
+                    for producto_id, cantidad in lineas
+                )
+                f.write(f'{{"id":"{pedido_id}","fecha":"{texto}","cliente_id":"{cliente_id}","items":[{items}]}}\n')
+    return rutas
+
+
+def leer(ruta: str) -> float:
+    # Segundos de solo recorrer el fichero línea a línea (el límite de la E/S)
+    inicio = time.perf_counter()
+    with open(ruta, "rb") as f:
+        for _ in f:
+            pass
+    return time.perf_counter() - inicio
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Carga masiva de usuarios, productos y pedidos")
+    parser.add_argument("--usuarios", type=int, default=100_000)
+    parser.add_argument("--productos", type=int, default=1_000_000)
+    parser.add_argument("--pedidos", type=int, default=1_000_000)
+    parser.add_argument("--lineas-por-pedido", type=int, default=3)
+    parser.add_argument("--formato", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--trozo", type=int, default=10_000, help="Filas validadas de una vez")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="bench_carga_")
+    try:
+        inicio = time.perf_counter()
+        rutas = generar(directorio, args.formato, args)
+        print(f"Ficheros {args.formato} generados en {time.perf_counter() - inicio:.1f} s")
+
+        servicio = TiendaService()
+        rss_inicial = rss_mb()
+        medida = {"rss_max": rss_inicial}
+
+        def progreso(estado: ProgresoCarga) -> None:
+            medida["rss_max"] = max(medida["rss_max"], rss_mb())
+
+        carga = CargaMasiva(servicio, tamaño_trozo=args.trozo, progreso=progreso, intervalo_progreso=0.1)
+        print(f"{'fase':>10} {'filas':>10} {'filas/s':>10} {'MB/s':>8} {'lectura MB/s':>13} {'% de lectura':>13}")
+        for fase, ruta in rutas.items():
+            megas = os.path.getsize(ruta) / 1e6
+            solo_lectura = leer(ruta)
+            carga.cargar(fase, ruta)
+            r = carga.resumen[fase]
+            assert r["errores"] == 0, r
+            print(f"{fase:>10} {r['filas']:>10} {r['filas'] / r['segundos']:>10.0f} {megas / r['segundos']:>8.1f} "
+                  f"{megas / solo_lectura:>13.1f} {100 * solo_lectura / r['segundos']:>12.1f}%")
+        resultado = carga.terminar()
+        rss_final = rss_mb()
+        print(f"Índices construidos en {resultado['segundos_indices']:.2f} s")
+        print(f"{len(servicio.usuarios)} usuarios, {len(servicio.productos)} productos, "
+              f"{len(servicio.archivo)} pedidos archivados")
+        print(f"RSS: {rss_inicial:.0f} MB al empezar, {medida['rss_max']:.0f} MB máximo durante la carga, "
+              f"{rss_final:.0f} MB al terminar")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+from typing import Callable, Dict, List
+
+import httpx
+
+import main as api
+from benchmarks.comun import percentil, preparar_aplicacion
+from services.Diagnostico import Diagnostico, MiddlewareDiagnostico
+
+
+# Coste del diagnóstico en el camino de compra. Unos clientes hacen pedidos lo más
+# rápido que pueden por un cliente ASGI en el mismo proceso, sin el middleware de
+# diagnóstico, con él pero todo apagado, y con cada herramienta encendida: el
+# registro de lentas (con un umbral que no se alcanza, para medir solo el apunte),
+# el perfilador por muestreo y tracemalloc.
+
+
+def escenarios(args) -> Dict[str, Callable[[Diagnostico], None]]:
+    # Nombre -> cómo encender el diagnóstico antes de medir
+    return {
+        "sin diagnóstico": None,
+        "apagado": lambda d: None,
+        "lentas": lambda d: d.lentas.iniciar(api.tienda_service, 10.0),
+        "perfilador": lambda d: d.perfilador.iniciar(args.intervalo_ms / 1000, max_segundos=3600),
+        "tracemalloc": lambda d: d.memoria.iniciar(1),
+    }
+
+
+async def ejecutar(encender, args) -> Dict[str, float]:
+    productos = preparar_aplicacion(num_productos=args.productos)
+    aplicacion = api.app
+    diagnostico = Diagnostico(token="bench")
+    if encender is not None:
+        aplicacion = MiddlewareDiagnostico(api.app, diagnostico)
+        encender(diagnostico)
+    cliente_http = httpx.AsyncClient(transport=httpx.ASGITransport(app=aplicacion), base_url="http://tienda")
+    clientes = [
+        api.tienda_service.registrar_usuario("cliente", f"Cliente {i}", f"cliente{i}@tienda.es", "Calle 1").id
+        for i in range(args.compradores)
+    ]
+    latencias: List[float] = []
+    fin = time.perf_counter() + args.segundos
+
+    async def comprador(indice: int) -> None:
+        n = 0
+        while time.perf_counter() < fin:
+            producto_id = str(productos[(indice * 7919 + n) % len(productos)])
+            n += 1
+            inicio = time.perf_counter()
+            respuesta = await cliente_http.post("/pedidos", json={
+                "cliente_id": str(clientes[indice]),
+                "items": [{"producto_id": producto_id, "cantidad": 1}],
+            })
+            latencias.append(time.perf_counter() - inicio)
+            assert respuesta.status_code == 201, respuesta.text
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(comprador(i) for i in range(args.compradores)))
+    duracion = time.perf_counter() - inicio
+    await cliente_http.aclose()
+    coste = diagnostico.perfilador.estado()["coste"]
+    diagnostico.cerrar()
+    api.tienda_service.cerrar()
+    return {
+        "pedidos_s": len(latencias) / duracion,
+        "p50_ms": percentil(latencias, 0.50) * 1000,
+        "p99_ms": percentil(latencias, 0.99) * 1000,
+        "coste": coste,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Coste del diagnóstico en los pedidos")
+    parser.add_argument("--productos", type=int, default=2_000)
+    parser.add_argument("--compradores", type=int, default=10)
+    parser.add_argument("--intervalo-ms", type=float, default=10.0, help="Milisegundos entre muestras del perfilador")
+    parser.add_argument("--segundos", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{args.compradores} compradores sin pausa:")
+    print(f"{'escenario':>16} {'pedidos/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'% perfilador':>13}")
+    base = None
+    for nombre, encender in escenarios(args).items():
+        r = asyncio.run(ejecutar(encender, args))
+        base = base or r["pedidos_s"]
+        print(f"{nombre:>16} {r['pedidos_s']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {100 * r['coste']:>12.2f}%"
+              f"  ({100 * (r['pedidos_s'] / base - 1):+.1f}% pedidos/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import argparse
+import random
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from models import Cliente, Pedido, ProductoElectronico
+from services.Estadisticas import AgregadosVentas
+
+
+# Coste de las estadísticas de ventas: cuánto añade la actualización incremental
+# a cada pedido, cuánto tarda el recálculo completo (vectorizado con NumPy y
+# pedido a pedido) y cuánto tarda una lectura de los rankings.
+
+
+def generar_pedidos(num_lineas: int, lineas_por_pedido: int, num_productos: int, num_clientes: int) -> list:
+    # Pedidos sintéticos repartidos en 90 días
+    aleatorio = random.Random(42)
+    productos = [ProductoElectronico(f"Producto {i}", 1 + i % 500, 10) for i in range(num_productos)]
+    clientes = [Cliente(f"Cliente {i}", f"cliente{i}@tienda.es", "Calle 1") for i in range(num_clientes)]
+    inicio = datetime(2024, 1, 1)
+    pedidos = []
+    for _ in range(num_lineas // lineas_por_pedido):
+        lineas = [(p, aleatorio.randint(1, 5), p.precio_centimos)
+                  for p in aleatorio.sample(productos, lineas_por_pedido)]
+        fecha = inicio + timedelta(minutes=aleatorio.randrange(90 * 24 * 60))
+        pedidos.append(Pedido.restaurar(uuid4(), aleatorio.choice(clientes), fecha, lineas))
+    return pedidos
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Actualización y recálculo de las estadísticas de ventas")
+    parser.add_argument("--lineas", type=int, default=2_000_000)
+    parser.add_argument("--lineas-por-pedido", type=int, default=5)
+    parser.add_argument("--productos", type=int, default=10_000)
+    parser.add_argument("--clientes", type=int, default=100_000)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    pedidos = generar_pedidos(args.lineas, args.lineas_por_pedido, args.productos, args.clientes)
+    print(f"{len(pedidos)} pedidos generados en {time.perf_counter() - inicio:.1f} s")
+
+    incremental = AgregadosVentas()
+    muestra = pedidos[:200_000]
+    inicio = time.perf_counter()
+    for pedido in muestra:
+        incremental.registrar((pedido,))
+    print(f"Actualización incremental: {(time.perf_counter() - inicio) / len(muestra) * 1e6:.2f} µs por pedido")
+
+    agregados = AgregadosVentas()
+    inicio = time.perf_counter()
+    lineas = agregados.recalcular(nullcontext, lambda: (pedidos, None))
+    vectorizado = time.perf_counter() - inicio
+    print(f"Recálculo vectorizado: {vectorizado:.2f} s para {lineas} líneas "
+          f"({lineas / vectorizado / 1e6:.1f} M líneas/s)")
+
+    comprobacion = AgregadosVentas()
+    inicio = time.perf_counter()
+    comprobacion.registrar(pedidos)
+    python = time.perf_counter() - inicio
+    print(f"Recálculo pedido a pedido: {python:.2f} s ({python / vectorizado:.1f}x más lento)")
+    assert comprobacion.resumen() == agregados.resumen()
+    # Con empates el orden entre iguales puede variar, así que comparamos el valor del ranking
+    for posicion, criterio in ((1, "unidades"), (2, "ingresos")):
+        assert ([fila[posicion] for fila in comprobacion.top_productos(10, criterio)]
+                == [fila[posicion] for fila in agregados.top_productos(10, criterio)])
+    assert [fila[3] for fila in comprobacion.top_clientes(10)] == [fila[3] for fila in agregados.top_clientes(10)]
+
+    inicio = time.perf_counter()
+    for _ in range(10_000):
+        agregados.top_productos(10)
+    print(f"top_productos(10): {(time.perf_counter() - inicio) / 10_000 * 1e6:.1f} µs por lectura")
+
+
+if __name__ == "__main__":
+    main()
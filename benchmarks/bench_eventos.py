@@ -0,0 +1,76 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+
+from models import ProductoElectronico
+from services import TiendaService
+
+
+# Coste de los eventos de stock para quien hace pedidos y para la memoria.
+# Los pedidos se hacen desde un hilo (como los del threadpool de la API) mientras
+# el bucle de eventos reparte los cambios a suscriptores que no leen nunca: el
+# peor caso, un cliente lento que no vacía su cola. Se compara el coste por pedido
+# sin suscriptores, con suscriptores de un producto cada uno y con suscriptores de
+# todo el catálogo, y se comprueba que los eventos pendientes siguen acotados.
+
+
+def hacer_pedidos(servicio: TiendaService, productos, cliente, pedidos: int, lineas: int) -> float:
+    aleatorio = random.Random(42)
+    inicio = time.perf_counter()
+    for _ in range(pedidos):
+        servicio.realizar_pedido(cliente.id, {p.id: 1 for p in aleatorio.sample(productos, lineas)})
+    return (time.perf_counter() - inicio) / pedidos * 1e6
+
+
+async def escenario(nombre: str, suscriptores: int, por_producto: bool, args) -> None:
+    servicio = TiendaService()
+    productos = servicio.añadir_productos(
+        [ProductoElectronico(f"Producto {i}", 10.0 + i, 10**12) for i in range(args.productos)]
+    )
+    cliente = servicio.registrar_usuario("cliente", "Cliente", "cliente@tienda.es", "Calle 1")
+    canal = servicio.canal_stock
+    aleatorio = random.Random(7)
+
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    suscripciones = [
+        canal.suscribir([aleatorio.choice(productos).id]) if por_producto else canal.suscribir()
+        for _ in range(suscriptores)
+    ]
+    por_suscriptor = (tracemalloc.get_traced_memory()[0] - antes) / max(1, suscriptores)
+    tracemalloc.stop()
+
+    us = await asyncio.to_thread(hacer_pedidos, servicio, productos, cliente, args.pedidos, args.lineas_por_pedido)
+    # Dejamos que el bucle termine el último reparto
+    await asyncio.sleep(0.1)
+    pendientes = max((len(s._pendientes) for s in suscripciones), default=0)
+    estadisticas = canal.estadisticas()
+    print(f"  {nombre:<38} {us:8.1f} µs/pedido  repartos {estadisticas['repartos']:>6}  "
+          f"eventos {estadisticas['eventos']:>9}  agrupados {estadisticas['agrupados']:>9}  "
+          f"máx. pendientes {pendientes:>5}" + (f"  {por_suscriptor:.0f} B/suscriptor" if suscriptores else ""))
+    for suscripcion in suscripciones:
+        canal.cancelar(suscripcion)
+    servicio.cerrar()
+
+
+async def principal(args) -> None:
+    print(f"{args.pedidos} pedidos de {args.lineas_por_pedido} líneas sobre {args.productos} productos:")
+    await escenario("sin suscriptores", 0, False, args)
+    await escenario(f"{args.suscriptores} suscriptores de un producto", args.suscriptores, True, args)
+    await escenario(f"{args.suscriptores} suscriptores de todo", args.suscriptores, False, args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Coste de los eventos de stock con clientes lentos")
+    parser.add_argument("--pedidos", type=int, default=20_000)
+    parser.add_argument("--lineas-por-pedido", type=int, default=2)
+    parser.add_argument("--productos", type=int, default=1_000)
+    parser.add_argument("--suscriptores", type=int, default=10_000)
+    asyncio.run(principal(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
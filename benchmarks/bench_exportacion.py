@@ -0,0 +1,94 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+from urllib.parse import urlencode
+
+import main as api
+from benchmarks.bench_estadisticas import generar_pedidos
+from services import TiendaService
+
+
+# Exportación en streaming de muchos pedidos: tiempo hasta el primer byte,
+# MB/s y memoria residente durante el envío. La respuesta se consume
+# llamando directamente a la aplicación ASGI y descartando los bloques, igual
+# que haría un cliente que los escribe a disco.
+
+
+def rss_mb() -> float:
+    # Memoria residente actual (Linux)
+    with open("/proc/self/status") as estado:
+        for linea in estado:
+            if linea.startswith("VmRSS:"):
+                return int(linea.split()[1]) / 1024
+    return 0.0
+
+
+async def descargar(ruta: str, parametros: dict) -> dict:
+    terminado = asyncio.Event()
+    cuerpo_leido = False
+
+    async def recibir():
+        # Primero el cuerpo (vacío) de la petición; después la respuesta en streaming
+        # espera una desconexión, que solo llega cuando se ha enviado todo
+        nonlocal cuerpo_leido
+        if not cuerpo_leido:
+            cuerpo_leido = True
+            return {"type": "http.request", "body": b""}
+        await terminado.wait()
+        return {"type": "http.disconnect"}
+
+    inicio = time.perf_counter()
+    medida = {"primer_byte": None, "bytes": 0, "rss_max": rss_mb(), "estado": None}
+
+    async def enviar(mensaje) -> None:
+        if mensaje["type"] == "http.response.start":
+            medida["estado"] = mensaje["status"]
+        elif mensaje["type"] == "http.response.body" and mensaje.get("body"):
+            if medida["primer_byte"] is None:
+                medida["primer_byte"] = time.perf_counter() - inicio
+            medida["bytes"] += len(mensaje["body"])
+            medida["rss_max"] = max(medida["rss_max"], rss_mb())
+        if mensaje["type"] == "http.response.body" and not mensaje.get("more_body", False):
+            terminado.set()
+
+    scope = {
+        "type": "http", "method": "GET", "path": ruta, "raw_path": ruta.encode(),
+        "query_string": urlencode(parametros).encode(), "headers": [], "http_version": "1.1",
+        "scheme": "http", "server": ("tienda", 80), "client": ("127.0.0.1", 1), "root_path": "",
+    }
+    await api.app(scope, recibir, enviar)
+    medida["segundos"] = time.perf_counter() - inicio
+    return medida
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Exportación en streaming de pedidos")
+    parser.add_argument("--pedidos", type=int, default=1_000_000)
+    parser.add_argument("--lineas-por-pedido", type=int, default=3)
+    parser.add_argument("--clientes", type=int, default=10_000)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    pedidos = generar_pedidos(args.pedidos * args.lineas_por_pedido, args.lineas_por_pedido, 1_000, args.clientes)
+    servicio = TiendaService()
+    for pedido in pedidos:
+        servicio.usuarios[pedido.cliente.id] = pedido.cliente
+        servicio.pedidos[pedido.id] = pedido
+        for producto, _, _, _ in pedido.lineas():
+            servicio.productos[producto.id] = producto
+    del pedidos
+    servicio.reconstruir_indices()
+    api.tienda_service = servicio
+    print(f"{len(servicio.pedidos)} pedidos preparados en {time.perf_counter() - inicio:.1f} s, RSS {rss_mb():.0f} MB")
+
+    for formato in ("ndjson", "csv"):
+        medida = asyncio.run(descargar("/export/pedidos", {"formato": formato}))
+        assert medida["estado"] == 200
+        megas = medida["bytes"] / 1e6
+        print(f"{formato}: {megas:.0f} MB en {medida['segundos']:.1f} s ({megas / medida['segundos']:.1f} MB/s), "
+              f"primer byte en {medida['primer_byte'] * 1000:.1f} ms, RSS máximo {medida['rss_max']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
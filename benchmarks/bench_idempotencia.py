@@ -0,0 +1,90 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+import main as api
+from benchmarks.bench_exportacion import rss_mb
+from benchmarks.comun import preparar_aplicacion
+from services import CacheIdempotencia
+
+
+# Reintentos de POST /pedidos con Idempotency-Key: cada pedido se envía varias
+# veces a la vez (como un cliente que reintenta tras un timeout) y al final se
+# comprueba que el stock solo se descontó una vez por pedido. También mide el
+# coste de la cabecera frente a pedidos sin ella y la memoria de la caché cuando
+# llegan muchas más claves distintas de las que caben (debe quedarse plana).
+
+STOCK = 10_000_000
+
+
+async def tormenta(pedidos: int, reintentos: int, con_clave: bool) -> dict:
+    productos = preparar_aplicacion(num_productos=1, stock=STOCK)
+    transporte = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://tienda") as cliente:
+        cliente_id = (await cliente.post("/usuarios", json={
+            "nombre": "Cliente", "email": "cliente@tienda.es", "tipo": "cliente", "direccion_postal": "Calle 1",
+        })).json()["id"]
+        cuerpo = {"cliente_id": cliente_id, "items": [{"producto_id": str(productos[0]), "cantidad": 1}]}
+
+        async def enviar(clave: str) -> httpx.Response:
+            cabeceras = {"Idempotency-Key": clave} if con_clave else {}
+            return await cliente.post("/pedidos", json=cuerpo, headers=cabeceras)
+
+        inicio = time.perf_counter()
+        respuestas = []
+        for _ in range(pedidos):
+            clave = uuid.uuid4().hex
+            respuestas += await asyncio.gather(*(enviar(clave) for _ in range(reintentos)))
+        duracion = time.perf_counter() - inicio
+        stock = (await cliente.get(f"/productos/{productos[0]}")).json()["stock"]
+    assert all(r.status_code == 201 for r in respuestas)
+    return {
+        "peticiones_s": len(respuestas) / duracion,
+        "descontadas": STOCK - stock,
+        "repetidas": sum(r.headers.get("Idempotent-Replayed") == "true" for r in respuestas),
+    }
+
+
+async def memoria(claves: int, max_entradas: int) -> None:
+    cache = CacheIdempotencia(max_entradas=max_entradas)
+    # Cuerpo del tamaño de un PedidoRead con dos líneas
+    cuerpo = b"x" * 450
+
+    async def generar() -> bytes:
+        return bytes(cuerpo)
+
+    inicio = time.perf_counter()
+    tramo = claves // 4
+    for i in range(claves):
+        await cache.ejecutar((i, uuid.uuid4().hex), i, generar)
+        if (i + 1) % tramo == 0:
+            print(f"  {i + 1} claves: {cache.estadisticas()['entradas']} guardadas, RSS {rss_mb():.0f} MB")
+    print(f"  {(time.perf_counter() - inicio) / claves * 1e6:.1f} µs por clave nueva, "
+          f"{cache.expulsiones} expulsiones")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reintentos de pedidos con Idempotency-Key")
+    parser.add_argument("--pedidos", type=int, default=1000)
+    parser.add_argument("--reintentos", type=int, default=5, help="Copias simultáneas de cada pedido")
+    parser.add_argument("--claves", type=int, default=1_000_000, help="Claves distintas para la prueba de memoria")
+    parser.add_argument("--max-entradas", type=int, default=50_000)
+    args = parser.parse_args()
+
+    for con_clave in (False, True):
+        medida = asyncio.run(tormenta(args.pedidos, args.reintentos, con_clave))
+        print(f"{'con' if con_clave else 'sin'} Idempotency-Key: {medida['peticiones_s']:.0f} peticiones/s, "
+              f"{medida['descontadas']} unidades descontadas para {args.pedidos} pedidos "
+              f"x {args.reintentos} envíos, {medida['repetidas']} respuestas repetidas")
+        if con_clave:
+            assert medida["descontadas"] == args.pedidos
+    print(f"Memoria con {args.claves} claves distintas (máximo {args.max_entradas}):")
+    asyncio.run(memoria(args.claves, args.max_entradas))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+from __future__ import annotations
+import argparse
+import random
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.comun import percentil
+from models import Producto, ProductoElectronico
+from services import TiendaService
+from services.Serializadores import productos_json
+
+
+# Lecturas del catálogo mientras otros hilos hacen pedidos.
+# Cada pedido compra una unidad de los dos productos de una pareja (mismo nombre y
+# un precio propio, así que salen juntos al ordenar por precio): en cualquier
+# estado consistente los dos tienen el mismo stock y una lectura que los ve
+# distintos ha visto un pedido a medias. Comparamos tres formas de leer con los
+# mismos hilos escritores:
+#   - vivos: los objetos del inventario tal cual (lo que se hacía antes)
+#   - lock global: los mismos objetos con todas las franjas del motor de reservas
+#     adquiridas mientras se copian (consistente, pero detiene los pedidos)
+#   - instantáneas: la última versión publicada del catálogo, sin locks
+# Las lecturas son páginas de 50 productos por precio y, cada 'completo_cada', el
+# listado completo, serializadas a JSON como en la API. Con un intervalo de cambio
+# de hilo corto ('--cambio-hilo') los hilos se intercalan más, como con varios núcleos.
+
+
+def preparar(num_parejas: int, num_escritores: int):
+    servicio = TiendaService()
+    productos: List[Producto] = []
+    for i in range(num_parejas):
+        productos += [ProductoElectronico(f"Pareja {i}", 10.0 + i / 100, 10**9) for _ in range(2)]
+    servicio.añadir_productos(productos)
+    clientes = [
+        servicio.registrar_usuario("cliente", f"Cliente {i}", f"cliente{i}@tienda.es", "Calle 1").id
+        for i in range(num_escritores)
+    ]
+    return servicio, productos, clientes
+
+
+def lectores_modo(servicio: TiendaService, modo: str) -> Dict[str, Callable]:
+    # Funciones de lectura (página y listado completo) de cada modo
+    def copiar(productos):
+        return [p.copia(p.stock, p.retenido) for p in productos]
+
+    if modo == "vivos":
+        return {
+            "pagina": lambda after: servicio.indice_productos.buscar(limit=50, after=after),
+            "completo": lambda: list(servicio.productos.values()),
+        }
+    if modo == "lock global":
+        def pagina(after):
+            with servicio.reservas.bloquear_todo():
+                productos, siguiente = servicio.indice_productos.buscar(limit=50, after=after)
+                return copiar(productos), siguiente
+
+        def completo():
+            with servicio.reservas.bloquear_todo():
+                return copiar(servicio.productos.values())
+
+        return {"pagina": pagina, "completo": completo}
+    return {
+        "pagina": lambda after: servicio.buscar_productos(limit=50, cursor=after),
+        "completo": servicio.listar_productos,
+    }
+
+
+def rotas(productos: List[Producto]) -> int:
+    # Parejas completas en la lectura con distinto stock
+    por_nombre: Dict[str, List[int]] = {}
+    for producto in productos:
+        por_nombre.setdefault(producto.nombre, []).append(producto.stock)
+    return sum(1 for stocks in por_nombre.values() if len(stocks) == 2 and stocks[0] != stocks[1])
+
+
+def ejecutar(modo: str, args) -> Dict[str, float]:
+    servicio, productos, clientes = preparar(args.parejas, args.escritores)
+    leer = lectores_modo(servicio, modo)
+    parar = threading.Event()
+    latencias: List[List[float]] = [[] for _ in clientes]
+    lecturas = [0] * args.lectores
+    rotas_total = [0] * args.lectores
+
+    def escritor(indice: int) -> None:
+        aleatorio = random.Random(indice)
+        while not parar.is_set():
+            pareja = aleatorio.randrange(args.parejas)
+            items = {productos[2 * pareja].id: 1, productos[2 * pareja + 1].id: 1}
+            inicio = time.perf_counter()
+            servicio.realizar_pedido(clientes[indice], items)
+            latencias[indice].append(time.perf_counter() - inicio)
+
+    def lector(indice: int) -> None:
+        after = None
+        while not parar.is_set():
+            if args.completo_cada and lecturas[indice] % args.completo_cada == args.completo_cada - 1:
+                pagina = leer["completo"]()
+            else:
+                pagina, after = leer["pagina"](after)
+            productos_json(pagina)
+            rotas_total[indice] += rotas(pagina)
+            lecturas[indice] += 1
+
+    hilos = [threading.Thread(target=escritor, args=(i,)) for i in range(args.escritores)]
+    hilos += [threading.Thread(target=lector, args=(i,)) for i in range(args.lectores)]
+    for hilo in hilos:
+        hilo.start()
+    time.sleep(args.segundos)
+    parar.set()
+    for hilo in hilos:
+        hilo.join()
+    todas = [latencia for lista in latencias for latencia in lista]
+    return {
+        "lecturas_s": sum(lecturas) / args.segundos,
+        "pedidos_s": len(todas) / args.segundos,
+        "p99_pedido_ms": percentil(todas, 0.99) * 1000 if todas else 0.0,
+        "rotas": sum(rotas_total),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Lecturas del catálogo con pedidos concurrentes")
+    parser.add_argument("--parejas", type=int, default=1_000, help="Parejas de productos (el catálogo tiene el doble)")
+    parser.add_argument("--escritores", type=int, default=2, help="Hilos haciendo pedidos")
+    parser.add_argument("--lectores", type=int, default=4, help="Hilos leyendo el catálogo")
+    parser.add_argument("--completo-cada", type=int, default=50, help="Un listado completo cada N lecturas (0: nunca)")
+    parser.add_argument("--segundos", type=float, default=5.0)
+    parser.add_argument("--cambio-hilo", type=float, default=0.0001, help="Intervalo de cambio de hilo en segundos")
+    args = parser.parse_args()
+    sys.setswitchinterval(args.cambio_hilo)
+
+    print(f"{args.escritores} hilos con pedidos y {args.lectores} leyendo un catálogo de {2 * args.parejas} productos:")
+    print(f"{'modo':>14} {'lecturas/s':>11} {'pedidos/s':>10} {'p99 pedido':>11} {'lecturas rotas':>15}")
+    for modo in ("vivos", "lock global", "instantáneas"):
+        r = ejecutar(modo, args)
+        print(f"{modo:>14} {r['lecturas_s']:>11.0f} {r['pedidos_s']:>10.0f} "
+              f"{r['p99_pedido_ms']:>8.2f} ms {r['rotas']:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from __future__ import annotations
+import argparse
+import gc
+import tracemalloc
+
+from models import ProductoRopa
+from services import TiendaService
+
+
+# Mide la memoria ocupada por producto y por pedido con tracemalloc
+# Cuenta todo lo que guarda el servicio: objetos, índices, catálogo y agregados
+
+
+def medir(num_productos: int, num_pedidos: int):
+    tienda = TiendaService()
+    cliente = tienda.registrar_usuario("cliente", "Cliente", "cliente@tienda.es", "Calle Falsa 123")
+
+    gc.collect()
+    tracemalloc.start()
+    inicio = tracemalloc.get_traced_memory()[0]
+    productos = []
+    for i in range(num_productos):
+        producto = ProductoRopa(f"Camiseta {i}", 9.99 + i % 100, 1_000_000 + i, "M", "rojo")
+        productos.append(tienda.añadir_producto(producto).id)
+    tras_productos = tracemalloc.get_traced_memory()[0]
+    for i in range(num_pedidos):
+        # Pedidos de dos líneas, el caso más habitual
+        tienda.realizar_pedido(cliente.id, {
+            productos[i % num_productos]: 1,
+            productos[(i + 7) % num_productos]: 2,
+        })
+    gc.collect()
+    final = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tienda.cerrar()
+
+    # Descontamos la lista auxiliar de ids que solo usa el benchmark
+    auxiliar = 8 * num_productos
+    return (tras_productos - inicio - auxiliar) / num_productos, (final - tras_productos) / num_pedidos
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de memoria por producto y por pedido")
+    parser.add_argument("--productos", type=int, default=10_000)
+    parser.add_argument("--pedidos", type=int, default=20_000)
+    args = parser.parse_args()
+
+    por_producto, por_pedido = medir(args.productos, args.pedidos)
+    print(f"{'bytes/producto':>15} {'bytes/pedido':>13}")
+    print(f"{por_producto:>15.1f} {por_pedido:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
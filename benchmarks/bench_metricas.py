@@ -0,0 +1,125 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+
+import main as api
+from services import TiendaService, RegistroMetricas, MiddlewareMetricas
+from models import ProductoElectronico
+from benchmarks.comun import preparar_aplicacion
+
+
+# Coste de la instrumentación: cuánto añade el middleware a cada petición,
+# cuánto añade el cronómetro a cada operación del servicio, cuánto cuesta
+# exportar /metrics y cómo escalan los contadores fragmentados con varios hilos
+# frente a un contador protegido con un lock.
+
+
+async def aplicacion_minima(scope, receive, send) -> None:
+    # Aplicación ASGI que responde sin hacer nada (como haría el router)
+    scope["route"] = SimpleNamespace(path="/productos/{producto_id}")
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def medir_asgi(app, peticiones: int) -> float:
+    # Nanosegundos por petición llamando directamente a la aplicación ASGI
+    async def recibir():
+        return {"type": "http.request", "body": b""}
+
+    async def enviar(mensaje) -> None:
+        pass
+
+    inicio = time.perf_counter_ns()
+    for _ in range(peticiones):
+        await app({"type": "http", "method": "GET", "path": "/productos/x"}, recibir, enviar)
+    return (time.perf_counter_ns() - inicio) / peticiones
+
+
+def medir_servicio(operaciones: int) -> tuple:
+    # Nanosegundos por llamada de obtener_producto con y sin cronómetro
+    tienda = TiendaService()
+    producto = tienda.añadir_producto(ProductoElectronico("Producto", 10.0, 10))
+    sin_cronometro = TiendaService.obtener_producto.__wrapped__
+    inicio = time.perf_counter_ns()
+    for _ in range(operaciones):
+        sin_cronometro(tienda, producto.id)
+    base = (time.perf_counter_ns() - inicio) / operaciones
+    inicio = time.perf_counter_ns()
+    for _ in range(operaciones):
+        tienda.obtener_producto(producto.id)
+    return base, (time.perf_counter_ns() - inicio) / operaciones
+
+
+async def medir_peticion_completa(peticiones: int) -> float:
+    # Microsegundos por petición GET /productos/{id} a través de toda la aplicación
+    producto_id = preparar_aplicacion(num_productos=1)[0]
+    transporte = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://tienda") as cliente:
+        inicio = time.perf_counter()
+        for _ in range(peticiones):
+            await cliente.get(f"/productos/{producto_id}")
+        return (time.perf_counter() - inicio) / peticiones * 1e6
+
+
+def medir_hilos(num_hilos: int, incrementos: int) -> tuple:
+    # Segundos para que 'num_hilos' hilos incrementen el mismo contador
+    contador = RegistroMetricas().contador("prueba_total", "Prueba.").con()
+    lock = threading.Lock()
+    total = [0]
+
+    def fragmentado() -> None:
+        for _ in range(incrementos):
+            contador.incrementar()
+
+    def con_lock() -> None:
+        for _ in range(incrementos):
+            with lock:
+                total[0] += 1
+
+    tiempos = []
+    for objetivo in (fragmentado, con_lock):
+        hilos = [threading.Thread(target=objetivo) for _ in range(num_hilos)]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        tiempos.append(time.perf_counter() - inicio)
+    assert contador.valor() == total[0] == num_hilos * incrementos
+    return tuple(tiempos)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Coste por petición de las métricas")
+    parser.add_argument("--peticiones", type=int, default=100_000)
+    parser.add_argument("--hilos", type=int, default=8)
+    args = parser.parse_args()
+
+    registro = RegistroMetricas()
+    sin = asyncio.run(medir_asgi(aplicacion_minima, args.peticiones))
+    con = asyncio.run(medir_asgi(MiddlewareMetricas(aplicacion_minima, registro), args.peticiones))
+    print(f"Middleware: {con - sin:.0f} ns por petición ({sin:.0f} ns sin métricas, {con:.0f} ns con métricas)")
+
+    base, cronometrado = medir_servicio(args.peticiones)
+    print(f"Cronómetro del servicio: {cronometrado - base:.0f} ns por operación "
+          f"(obtener_producto {base:.0f} ns -> {cronometrado:.0f} ns)")
+
+    completa = asyncio.run(medir_peticion_completa(min(args.peticiones, 5_000)))
+    print(f"Petición completa GET /productos/{{id}}: {completa:.0f} µs "
+          f"(la instrumentación es un {((con - sin) + (cronometrado - base)) / 10 / completa:.2f} %)")
+
+    inicio = time.perf_counter()
+    texto = api.metricas_http.exportar() + api.tienda_service.metricas.exportar()
+    print(f"Exportar /metrics: {(time.perf_counter() - inicio) * 1000:.2f} ms ({len(texto.splitlines())} líneas)")
+
+    fragmentado, con_lock = medir_hilos(args.hilos, args.peticiones)
+    print(f"{args.hilos} hilos x {args.peticiones} incrementos: fragmentado {fragmentado:.3f} s, con lock {con_lock:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import List
+from uuid import UUID
+
+from models import ProductoElectronico
+from services import TiendaService, Persistencia
+
+
+# Mide el coste de la persistencia (WAL + snapshots):
+#   - sobrecoste por pedido sin persistencia, con WAL asíncrono y con WAL síncrono
+#     (varios hilos esperando al mismo fsync gracias al group commit)
+#   - tiempo de generar un snapshot
+#   - tiempo de arranque con snapshot + cola del WAL frente a reproducir todo el WAL
+
+
+def poblar(tienda: TiendaService, num_productos: int):
+    cliente = tienda.registrar_usuario("cliente", "Cliente", "cliente@tienda.es", "Calle Falsa 123")
+    productos: List[UUID] = []
+    for i in range(num_productos):
+        productos.append(tienda.añadir_producto(ProductoElectronico(f"Producto {i}", 10.0, 10**12)).id)
+    return cliente.id, productos
+
+
+def lanzar_pedidos(tienda: TiendaService, cliente_id: UUID, productos: List[UUID], num_pedidos: int, hilos: int = 1) -> float:
+    # Devolvemos los segundos empleados en realizar 'num_pedidos' pedidos
+    def trabajador(desplazamiento: int, cantidad: int) -> None:
+        for i in range(desplazamiento, desplazamiento + cantidad):
+            tienda.realizar_pedido(cliente_id, {productos[i % len(productos)]: 1})
+
+    por_hilo = num_pedidos // hilos
+    inicio = time.perf_counter()
+    if hilos == 1:
+        trabajador(0, num_pedidos)
+    else:
+        trabajadores = [threading.Thread(target=trabajador, args=(i * por_hilo, por_hilo)) for i in range(hilos)]
+        for t in trabajadores:
+            t.start()
+        for t in trabajadores:
+            t.join()
+    return time.perf_counter() - inicio
+
+
+def medir_arranque(directorio: str) -> tuple:
+    inicio = time.perf_counter()
+    tienda = TiendaService(persistencia=Persistencia(directorio, snapshot_cada=0))
+    duracion = time.perf_counter() - inicio
+    pedidos = len(tienda.pedidos)
+    tienda.cerrar()
+    return duracion, pedidos
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark del WAL y los snapshots")
+    parser.add_argument("--pedidos", type=int, default=1_000_000)
+    parser.add_argument("--cola", type=int, default=10_000, help="Pedidos escritos después del snapshot")
+    parser.add_argument("--muestra-sincrono", type=int, default=4_000)
+    parser.add_argument("--hilos-sincrono", type=int, default=16)
+    parser.add_argument("--productos", type=int, default=1_000)
+    parser.add_argument("--directorio", default=None, help="Directorio de trabajo (por defecto uno temporal)")
+    args = parser.parse_args()
+
+    base = args.directorio or tempfile.mkdtemp(prefix="tienda-bench-")
+    try:
+        # Sin persistencia
+        tienda = TiendaService()
+        cliente_id, productos = poblar(tienda, args.productos)
+        t_memoria = lanzar_pedidos(tienda, cliente_id, productos, args.pedidos)
+        print(f"Sin persistencia:  {t_memoria:8.2f} s  {t_memoria / args.pedidos * 1e6:8.2f} µs/pedido")
+
+        # WAL asíncrono: el pedido no espera al fsync
+        directorio = os.path.join(base, "asincrono")
+        tienda = TiendaService(persistencia=Persistencia(directorio, sincrono=False, snapshot_cada=0))
+        cliente_id, productos = poblar(tienda, args.productos)
+        t_wal = lanzar_pedidos(tienda, cliente_id, productos, args.pedidos)
+        print(f"WAL asíncrono:     {t_wal:8.2f} s  {t_wal / args.pedidos * 1e6:8.2f} µs/pedido "
+              f"(+{(t_wal - t_memoria) / args.pedidos * 1e6:.2f} µs)")
+
+        # Arranque reproduciendo el WAL completo
+        tienda.cerrar()
+        t_arranque_wal, recuperados = medir_arranque(directorio)
+        print(f"Arranque solo WAL: {t_arranque_wal:8.2f} s  ({recuperados} pedidos)")
+
+        # Snapshot y arranque con snapshot + cola
+        tienda = TiendaService(persistencia=Persistencia(directorio, sincrono=False, snapshot_cada=0))
+        inicio = time.perf_counter()
+        tienda.crear_snapshot()
+        print(f"Snapshot:          {time.perf_counter() - inicio:8.2f} s")
+        lanzar_pedidos(tienda, cliente_id, productos, args.cola)
+        tienda.cerrar()
+        t_arranque, recuperados = medir_arranque(directorio)
+        print(f"Arranque snapshot: {t_arranque:8.2f} s  ({recuperados} pedidos, cola de {args.cola})")
+
+        # WAL síncrono con group commit
+        directorio = os.path.join(base, "sincrono")
+        tienda = TiendaService(persistencia=Persistencia(directorio, sincrono=True, snapshot_cada=0))
+        cliente_id, productos = poblar(tienda, args.productos)
+        muestra = args.muestra_sincrono - args.muestra_sincrono % args.hilos_sincrono
+        t_sync = lanzar_pedidos(tienda, cliente_id, productos, muestra, hilos=args.hilos_sincrono)
+        tienda.cerrar()
+        print(f"WAL síncrono:      {muestra / t_sync:8.0f} pedidos/s con {args.hilos_sincrono} hilos")
+    finally:
+        if args.directorio is None:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import httpx
+
+import main as api
+from benchmarks.comun import percentil, preparar_aplicacion
+from services.Reportes import GestorReportes
+
+
+# Latencia de las compras mientras se piden informes pesados sin parar. Unos clientes
+# hacen pedidos a ritmo constante por un cliente ASGI en el mismo proceso y otros
+# piden informes (ingresos por semana, productos y clientes más vendidos) sobre un
+# historial archivado y esperan a que terminen consultando /reportes/{id}. Se compara
+# sin informes, calculándolos en un hilo del propio proceso (el mismo código, pero
+# con el GIL compartido con las peticiones) y en el pool de procesos.
+
+INFORMES = [
+    {"tipo": "ingresos", "periodo": "semana"},
+    {"tipo": "productos", "criterio": "ingresos", "n": 100},
+    {"tipo": "clientes", "criterio": "gasto", "n": 100},
+]
+
+
+def preparar(args):
+    # Catálogo, clientes e historial archivado; cada pedido cambia la versión de los
+    # datos, así que ningún informe se reutiliza durante la medida
+    productos = preparar_aplicacion(num_productos=args.productos)
+    servicio = api.tienda_service
+    clientes = [
+        servicio.registrar_usuario("cliente", f"Cliente {i}", f"cliente{i}@tienda.es", "Calle 1").id
+        for i in range(args.clientes)
+    ]
+    aleatorio = random.Random(7)
+    for inicio in range(0, args.historial, 1000):
+        servicio.realizar_pedidos([
+            (aleatorio.choice(clientes), {p: aleatorio.randint(1, 3) for p in aleatorio.sample(productos, 3)})
+            for _ in range(min(1000, args.historial - inicio))
+        ])
+    servicio.archivar_pedidos(antes=servicio.pedidos[next(reversed(servicio.pedidos))].fecha)
+    return productos, clientes
+
+
+async def ejecutar(modo: str, args) -> Dict[str, float]:
+    productos, clientes = preparar(args)
+    api.gestor_reportes = GestorReportes(api.tienda_service, procesos=args.procesos)
+    if modo == "hilo":
+        # Mismo gestor, pero con un ejecutor de hilos en lugar del pool de procesos
+        api.gestor_reportes._pool = ThreadPoolExecutor(args.procesos)
+    cliente_http = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://tienda")
+    latencias: List[float] = []
+    duraciones: List[float] = []
+    errores = 0
+    fin = time.perf_counter() + args.segundos
+
+    async def comprador(indice: int) -> None:
+        nonlocal errores
+        siguiente = time.perf_counter()
+        n = 0
+        while time.perf_counter() < fin:
+            producto_id = str(productos[(indice * 7919 + n) % len(productos)])
+            n += 1
+            inicio = time.perf_counter()
+            respuesta = await cliente_http.post("/pedidos", json={
+                "cliente_id": str(clientes[indice % len(clientes)]),
+                "items": [{"producto_id": producto_id, "cantidad": 1}],
+            })
+            latencias.append(time.perf_counter() - inicio)
+            errores += respuesta.status_code != 201
+            siguiente += 1 / args.pedidos_por_comprador
+            await asyncio.sleep(max(0.0, siguiente - time.perf_counter()))
+
+    async def informador(indice: int) -> None:
+        n = indice
+        while time.perf_counter() < fin:
+            respuesta = await cliente_http.post("/reportes", json=INFORMES[n % len(INFORMES)])
+            n += 1
+            ruta = respuesta.headers["location"]
+            while True:
+                estado = (await cliente_http.get(ruta)).json()
+                if estado["estado"] in ("terminado", "error"):
+                    break
+                await asyncio.sleep(0.01)
+            assert estado["estado"] == "terminado", estado["error"]
+            duraciones.append(estado["segundos"])
+
+    tareas = [comprador(i) for i in range(args.compradores)]
+    if modo != "sin informes":
+        tareas += [informador(i) for i in range(args.informadores)]
+    inicio = time.perf_counter()
+    await asyncio.gather(*tareas)
+    duracion = time.perf_counter() - inicio
+    await cliente_http.aclose()
+    compartidos = api.gestor_reportes.estadisticas()["bytes_compartidos"]
+    api.gestor_reportes.cerrar()
+    api.tienda_service.cerrar()
+    return {
+        "pedidos_s": len(latencias) / duracion,
+        "p50_ms": percentil(latencias, 0.50) * 1000,
+        "p99_ms": percentil(latencias, 0.99) * 1000,
+        "errores": errores,
+        "informes": len(duraciones),
+        "informe_ms": sum(duraciones) / len(duraciones) * 1000 if duraciones else 0.0,
+        "compartidos_mb": compartidos / 1e6,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latencia de las compras mientras se calculan informes")
+    parser.add_argument("--historial", type=int, default=300_000, help="Pedidos archivados antes de medir")
+    parser.add_argument("--productos", type=int, default=2_000)
+    parser.add_argument("--clientes", type=int, default=5_000)
+    parser.add_argument("--compradores", type=int, default=10)
+    parser.add_argument("--pedidos-por-comprador", type=float, default=20.0, help="Pedidos por segundo de cada comprador")
+    parser.add_argument("--informadores", type=int, default=2, help="Clientes que piden informes sin parar")
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--segundos", type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(f"{args.compradores} compradores a {args.pedidos_por_comprador:.0f} pedidos/s, {args.informadores} "
+          f"clientes pidiendo informes sobre {args.historial} pedidos archivados:")
+    print(f"{'modo':>14} {'pedidos/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errores':>8} "
+          f"{'informes':>9} {'ms/informe':>11} {'compartido MB':>14}")
+    for modo in ("sin informes", "hilo", "procesos"):
+        r = asyncio.run(ejecutar(modo, args))
+        print(f"{modo:>14} {r['pedidos_s']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errores']:>8} "
+              f"{r['informes']:>9} {r['informe_ms']:>11.0f} {r['compartidos_mb']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
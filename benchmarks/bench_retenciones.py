@@ -0,0 +1,89 @@
+from __future__ import annotations
+import argparse
+import random
+import time
+
+from benchmarks.bench_exportacion import rss_mb
+from models import ProductoElectronico
+from services import TiendaService
+from services.Rueda_Temporizadores import RuedaTemporizadores
+
+
+# Reservas de stock con caducidad: coste de crear, cancelar y confirmar reservas
+# con cientos de miles activas, coste de cada tick de la rueda de temporizadores
+# según cuántos temporizadores tenga pendientes (debe ser constante) y tiempo en
+# liberar todas las reservas cuando caducan. Al final comprueba que el stock
+# disponible más el vendido vuelve a ser el inicial.
+
+STOCK = 10_000_000
+
+
+def coste_tick(pendientes: int, ticks: int) -> float:
+    # Microsegundos por tick de una rueda con 'pendientes' temporizadores lejanos
+    ahora = [0.0]
+    rueda = RuedaTemporizadores(resolucion=1, reloj=lambda: ahora[0])
+    for i in range(pendientes):
+        rueda.programar(i, 1_000_000 + i)
+    inicio = time.perf_counter()
+    for _ in range(ticks):
+        ahora[0] += 1
+        rueda.avanzar()
+    return (time.perf_counter() - inicio) / ticks * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reservas de stock con caducidad")
+    parser.add_argument("--reservas", type=int, default=500_000)
+    parser.add_argument("--productos", type=int, default=1_000)
+    parser.add_argument("--ttl", type=float, default=30.0, help="Caducidad media de las reservas (s)")
+    args = parser.parse_args()
+
+    aleatorio = random.Random(1)
+    servicio = TiendaService()
+    cliente = servicio.registrar_usuario("cliente", "Cliente", "cliente@tienda.es", "Calle 1")
+    productos = servicio.añadir_productos([
+        ProductoElectronico(f"Producto {i}", 10 + i % 90, STOCK) for i in range(args.productos)
+    ])
+    items = [{aleatorio.choice(productos).id: aleatorio.randint(1, 3)} for _ in range(args.reservas)]
+
+    # Las que se confirman o cancelan no caducan durante la prueba
+    confirmar = [servicio.retener_stock(cliente.id, pedido, 3600) for pedido in items[:10_000]]
+    cancelar = [servicio.retener_stock(cliente.id, pedido, 3600) for pedido in items[10_000:20_000]]
+    memoria = rss_mb()
+    inicio = time.perf_counter()
+    retenciones = [
+        servicio.retener_stock(cliente.id, pedido, args.ttl * (0.5 + aleatorio.random()))
+        for pedido in items[20_000:]
+    ]
+    duracion = time.perf_counter() - inicio
+    print(f"{len(retenciones)} reservas creadas: {duracion / len(retenciones) * 1e6:.1f} µs por reserva, "
+          f"{(rss_mb() - memoria) * 1024 * 1024 / len(retenciones):.0f} bytes por reserva")
+
+    inicio = time.perf_counter()
+    for retencion in confirmar:
+        servicio.confirmar_retencion(retencion.id)
+    print(f"Confirmar con {len(servicio.retenciones)} activas: "
+          f"{(time.perf_counter() - inicio) / len(confirmar) * 1e6:.1f} µs por reserva")
+    inicio = time.perf_counter()
+    for retencion in cancelar:
+        servicio.cancelar_retencion(retencion.id)
+    print(f"Cancelar con {len(servicio.retenciones)} activas: "
+          f"{(time.perf_counter() - inicio) / len(cancelar) * 1e6:.1f} µs por reserva")
+
+    for pendientes in (0, 10_000, args.reservas):
+        print(f"Tick de la rueda con {pendientes} temporizadores pendientes: {coste_tick(pendientes, 10_000):.2f} µs")
+
+    # Esperamos a que el hilo de la rueda libere todas las reservas restantes
+    ultima = max(r.vence for r in retenciones)
+    while len(servicio.retenciones):
+        time.sleep(0.01)
+    print(f"{len(retenciones)} reservas caducadas liberadas; la última "
+          f"{(time.monotonic() - ultima) * 1000:.0f} ms después de su caducidad")
+    vendidas = sum(c for r in confirmar for c in r.productos_cantidades.values())
+    assert sum(p.stock for p in productos) + vendidas == STOCK * args.productos
+    assert all(p.retenido == 0 for p in productos)
+    servicio.cerrar()
+
+
+if __name__ == "__main__":
+    main()
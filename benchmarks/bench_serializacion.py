@@ -0,0 +1,101 @@
+from __future__ import annotations
+import argparse
+import time
+from typing import Callable, List
+
+from pydantic import TypeAdapter
+
+import main as api
+from models import Cliente, ProductoElectronico, ProductoRopa
+from services import TiendaService
+from services.Serializadores import pedidos_json, productos_json
+
+
+# CPU por listado de la serialización directa (services.Serializadores) frente a
+# crear un ProductoRead/PedidoRead por objeto y volcarlos con un TypeAdapter,
+# que es lo que hacía la API antes. También comprueba que los bytes coinciden.
+
+JSON_PRODUCTOS = TypeAdapter(List[api.ProductoRead])
+JSON_PEDIDOS = TypeAdapter(List[api.PedidoRead])
+
+
+def productos_con_modelos(productos) -> bytes:
+    return JSON_PRODUCTOS.dump_json([
+        api.ProductoRead(
+            id=p.id,
+            tipo=p.tipo,
+            nombre=p.nombre,
+            precio=p.precio,
+            stock=p.stock,
+            retenido=p.retenido,
+            garantia_meses=getattr(p, "garantia_meses", None),
+            talla=getattr(p, "talla", None),
+            color=getattr(p, "color", None),
+        )
+        for p in productos
+    ])
+
+
+def pedidos_con_modelos(pedidos) -> bytes:
+    return JSON_PEDIDOS.dump_json([
+        api.PedidoRead(
+            id=pedido.id,
+            cliente_id=pedido.cliente.id,
+            nombre_cliente=pedido.cliente.nombre,
+            fecha=pedido.fecha,
+            items=[
+                api.PedidoItemRead(
+                    producto_id=producto.id,
+                    nombre_producto=producto.nombre,
+                    cantidad=cantidad,
+                    precio_unitario=precio / 100,
+                    subtotal=subtotal / 100,
+                )
+                for producto, cantidad, precio, subtotal in pedido.lineas()
+            ],
+            total=pedido.total,
+        )
+        for pedido in pedidos
+    ])
+
+
+def cpu_ms(funcion: Callable[[], bytes], repeticiones: int) -> float:
+    # Milisegundos de CPU por llamada (process_time no cuenta esperas)
+    funcion()
+    inicio = time.process_time()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.process_time() - inicio) / repeticiones * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CPU de serializar listados con y sin modelos de Pydantic")
+    parser.add_argument("--elementos", type=int, default=10_000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    tienda = TiendaService()
+    productos = [
+        ProductoElectronico(f"Producto {i}", 10 + i % 90, 100) if i % 2 else
+        ProductoRopa(f"Producto {i}", 5 + i % 40, 100, "M", "azul")
+        for i in range(args.elementos)
+    ]
+    tienda.añadir_productos(productos)
+    cliente = tienda.registrar_usuario("cliente", "Cliente", "cliente@tienda.es", "Calle 1")
+    for i in range(args.elementos):
+        tienda.realizar_pedido(cliente.id, {productos[i].id: 1, productos[-i - 1].id: 1})
+    pedidos = tienda.listar_pedidos_usuario(cliente.id)
+
+    for nombre, elementos, con_modelos, directo in (
+        ("productos", productos, productos_con_modelos, productos_json),
+        ("pedidos", pedidos, pedidos_con_modelos, pedidos_json),
+    ):
+        assert con_modelos(elementos) == directo(elementos)
+        antes = cpu_ms(lambda: con_modelos(elementos), args.repeticiones)
+        despues = cpu_ms(lambda: directo(elementos), args.repeticiones)
+        print(f"{len(elementos)} {nombre}: modelos {antes:.1f} ms, directo {despues:.1f} ms "
+              f"({antes - despues:.1f} ms de CPU ahorrados, {antes / despues:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
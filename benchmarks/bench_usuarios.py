@@ -0,0 +1,62 @@
+from __future__ import annotations
+import argparse
+import random
+import time
+
+from benchmarks.bench_exportacion import rss_mb
+from services import TiendaService
+
+
+# Búsqueda de usuarios por email con el índice frente a recorrer todos los
+# usuarios, coste del registro con la comprobación de email único y coste de
+# una página de usuarios de un rol al principio y al final del listado (debe
+# ser el mismo: la página es un corte de la lista del rol).
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Índice de usuarios por email y por rol")
+    parser.add_argument("--usuarios", type=int, default=1_000_000)
+    parser.add_argument("--busquedas", type=int, default=100_000)
+    args = parser.parse_args()
+
+    servicio = TiendaService()
+    memoria = rss_mb()
+    inicio = time.perf_counter()
+    for i in range(args.usuarios):
+        if i % 10:
+            servicio.registrar_usuario("cliente", f"Cliente {i}", f"cliente{i}@tienda.es", "Calle 1")
+        else:
+            servicio.registrar_usuario("admin", f"Admin {i}", f"admin{i}@tienda.es")
+    duracion = time.perf_counter() - inicio
+    print(f"{args.usuarios} usuarios registrados: {duracion / args.usuarios * 1e6:.1f} µs por usuario, "
+          f"{(rss_mb() - memoria) * 1024 * 1024 / args.usuarios:.0f} bytes por usuario")
+
+    aleatorio = random.Random(1)
+    emails = [f"CLIENTE{aleatorio.randrange(1, args.usuarios, 10) + 1}@tienda.es" for _ in range(args.busquedas)]
+    inicio = time.perf_counter()
+    for email in emails:
+        servicio.obtener_usuario_por_email(email)
+    indice = (time.perf_counter() - inicio) / len(emails)
+
+    # El recorrido lineal equivalente (solo unas pocas búsquedas: es lento)
+    inicio = time.perf_counter()
+    for email in emails[:10]:
+        buscado = email.casefold()
+        next(u for u in servicio.usuarios.values() if u.email.casefold() == buscado)
+    lineal = (time.perf_counter() - inicio) / 10
+    print(f"Búsqueda por email: índice {indice * 1e6:.2f} µs, recorrido lineal {lineal * 1e3:.1f} ms "
+          f"({lineal / indice:.0f}x)")
+
+    clientes = servicio.listar_usuarios("cliente")
+    for nombre, posicion in (("primera", 0), ("última", len(clientes) - 100)):
+        cursor = None
+        if posicion:
+            _, cursor = servicio.paginar_usuarios("cliente", posicion)
+        inicio = time.perf_counter()
+        for _ in range(1000):
+            servicio.paginar_usuarios("cliente", 100, cursor)
+        print(f"Página de 100 clientes ({nombre}): {(time.perf_counter() - inicio) / 1000 * 1e6:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
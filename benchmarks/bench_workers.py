@@ -0,0 +1,172 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from benchmarks.comun import guardar_resultados, metrica
+
+
+# Escalado con varios procesos: arranca uvicorn con --workers N compartiendo el
+# estado en SQLite (TIENDA_SQLITE), lanza varios procesos generadores de carga
+# (lecturas de productos y pedidos) durante un tiempo fijo y mide peticiones por
+# segundo. Al final comprueba que el stock de cada producto más las unidades
+# vendidas coincide con el stock inicial, es decir, que ningún worker vendió
+# unidades que no había.
+
+STOCK_INICIAL = 1_000_000
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def arrancar_servidor(workers: int, ruta_db: str, puerto: int) -> subprocess.Popen:
+    entorno = {**os.environ, "TIENDA_SQLITE": ruta_db}
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(workers),
+         "--port", str(puerto), "--log-level", "warning"],
+        env=entorno,
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        try:
+            if httpx.get(f"{url}/metrics", timeout=1).status_code == 200:
+                return proceso
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError("El servidor no arrancó a tiempo.")
+
+
+def preparar_datos(url: str, num_productos: int) -> Tuple[str, List[str]]:
+    cliente = httpx.post(f"{url}/usuarios", json={
+        "nombre": "Cliente", "email": "cliente@tienda.es", "tipo": "cliente", "direccion_postal": "Calle 1",
+    }).json()["id"]
+    productos = httpx.post(f"{url}/productos/bulk", json=[
+        {"tipo": "electronico", "nombre": f"Producto {i}", "precio": 10 + i % 90, "stock": STOCK_INICIAL}
+        for i in range(num_productos)
+    ], timeout=60).json()["resultados"]
+    return cliente, [r["id"] for r in productos]
+
+
+async def generar_carga(
+    url: str, cliente_id: str, productos: List[str], duracion: float, conexiones: int,
+    proporcion_pedidos: float, semilla: int,
+) -> Dict[str, Any]:
+    aleatorio = random.Random(semilla)
+    peticiones = errores = 0
+    vendidas: Dict[str, int] = {}
+    limite = time.monotonic() + duracion
+
+    async def trabajador(cliente: httpx.AsyncClient) -> None:
+        nonlocal peticiones, errores
+        while time.monotonic() < limite:
+            if aleatorio.random() < proporcion_pedidos:
+                items = {p: aleatorio.randint(1, 3) for p in aleatorio.sample(productos, 2)}
+                respuesta = await cliente.post("/pedidos", json={
+                    "cliente_id": cliente_id,
+                    "items": [{"producto_id": p, "cantidad": c} for p, c in items.items()],
+                })
+                if respuesta.status_code == 201:
+                    for producto_id, cantidad in items.items():
+                        vendidas[producto_id] = vendidas.get(producto_id, 0) + cantidad
+            else:
+                respuesta = await cliente.get(f"/productos/{aleatorio.choice(productos)}")
+            peticiones += 1
+            if respuesta.status_code >= 400:
+                errores += 1
+
+    limites = httpx.Limits(max_connections=conexiones)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as cliente:
+        await asyncio.gather(*(trabajador(cliente) for _ in range(conexiones)))
+    return {"peticiones": peticiones, "errores": errores, "vendidas": vendidas}
+
+
+def proceso_generador(argumentos: tuple, cola: multiprocessing.Queue) -> None:
+    cola.put(asyncio.run(generar_carga(*argumentos)))
+
+
+def medir(workers: int, args: argparse.Namespace) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as directorio:
+        puerto = puerto_libre()
+        url = f"http://127.0.0.1:{puerto}"
+        servidor = arrancar_servidor(workers, os.path.join(directorio, "tienda.db"), puerto)
+        try:
+            cliente_id, productos = preparar_datos(url, args.productos)
+            # Damos tiempo a que todos los workers repliquen el catálogo
+            time.sleep(1)
+            cola: multiprocessing.Queue = multiprocessing.Queue()
+            generadores = [
+                multiprocessing.Process(target=proceso_generador, args=(
+                    (url, cliente_id, productos, args.duracion, args.conexiones, args.pedidos, i), cola,
+                ))
+                for i in range(args.generadores)
+            ]
+            inicio = time.perf_counter()
+            for generador in generadores:
+                generador.start()
+            resultados = [cola.get() for _ in generadores]
+            transcurrido = time.perf_counter() - inicio
+            for generador in generadores:
+                generador.join()
+
+            # Comprobación de stock (preguntamos a cualquier worker tras la replicación)
+            time.sleep(1)
+            vendidas: Dict[str, int] = {}
+            for resultado in resultados:
+                for producto_id, cantidad in resultado["vendidas"].items():
+                    vendidas[producto_id] = vendidas.get(producto_id, 0) + cantidad
+            for producto_id in productos:
+                stock = httpx.get(f"{url}/productos/{producto_id}").json()["stock"]
+                if stock + vendidas.get(producto_id, 0) != STOCK_INICIAL:
+                    raise AssertionError(f"Stock incoherente en {producto_id}: {stock} + {vendidas.get(producto_id, 0)}")
+        finally:
+            servidor.terminate()
+            servidor.wait()
+    peticiones = sum(r["peticiones"] for r in resultados)
+    return {
+        "peticiones_s": peticiones / transcurrido,
+        "errores": sum(r["errores"] for r in resultados),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Escalado de la API con varios workers sobre SQLite")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos de carga por medida")
+    parser.add_argument("--generadores", type=int, default=4, help="Procesos que generan carga")
+    parser.add_argument("--conexiones", type=int, default=16, help="Conexiones por generador")
+    parser.add_argument("--pedidos", type=float, default=0.2, help="Proporción de peticiones que son pedidos")
+    parser.add_argument("--productos", type=int, default=1_000)
+    parser.add_argument("--salida", default=None, help="Fichero JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs; {args.generadores} generadores x {args.conexiones} conexiones, "
+          f"{args.pedidos:.0%} pedidos")
+    resultados: Dict[str, Dict[str, Any]] = {}
+    base = None
+    for workers in args.workers:
+        medida = medir(workers, args)
+        base = base or medida["peticiones_s"]
+        print(f"{workers} workers: {medida['peticiones_s']:.0f} peticiones/s "
+              f"({medida['peticiones_s'] / base:.2f}x), {medida['errores']:.0f} errores, stock coherente")
+        resultados[f"workers_{workers}.peticiones_s"] = metrica(medida["peticiones_s"], "peticiones/s", True)
+    if args.salida:
+        guardar_resultados(args.salida, resultados, vars(args))
+
+
+if __name__ == "__main__":
+    main()
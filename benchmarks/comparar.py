@@ -0,0 +1,62 @@
+from __future__ import annotations
+import argparse
+import sys
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.comun import cargar_resultados
+
+
+# Compara unos resultados con una línea base guardada y marca las regresiones:
+# una métrica empeora si cambia en la dirección mala más que la tolerancia
+# (p. ej. 0.15 = un 15 %). Termina con código 1 si hay alguna regresión.
+
+
+def comparar(
+    base: Dict[str, Dict[str, Any]],
+    actual: Dict[str, Dict[str, Any]],
+    tolerancia: float,
+) -> List[Tuple[str, float, float, float, str]]:
+    # Devolvemos (métrica, base, actual, cambio relativo, estado) de las métricas comunes
+    filas = []
+    for nombre in sorted(base.keys() & actual.keys()):
+        valor_base = base[nombre]["valor"]
+        valor_actual = actual[nombre]["valor"]
+        cambio = (valor_actual - valor_base) / valor_base if valor_base else 0.0
+        # Cambio positivo = mejora, tanto si la métrica sube como si baja
+        mejora = cambio if base[nombre]["mayor_es_mejor"] else -cambio
+        if mejora < -tolerancia:
+            estado = "REGRESIÓN"
+        elif mejora > tolerancia:
+            estado = "mejora"
+        else:
+            estado = "igual"
+        filas.append((nombre, valor_base, valor_actual, cambio, estado))
+    return filas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compara resultados de benchmarks con una línea base")
+    parser.add_argument("base", help="JSON de la línea base")
+    parser.add_argument("actual", help="JSON con los resultados nuevos")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="Cambio relativo tolerado (0.15 = 15 %%)")
+    args = parser.parse_args()
+
+    base = cargar_resultados(args.base)
+    actual = cargar_resultados(args.actual)
+    filas = comparar(base, actual, args.tolerancia)
+
+    print(f"{'métrica':<48} {'base':>12} {'actual':>12} {'cambio':>8}  estado")
+    for nombre, valor_base, valor_actual, cambio, estado in filas:
+        print(f"{nombre:<48} {valor_base:>12.2f} {valor_actual:>12.2f} {cambio:>+8.1%}  {estado}")
+    for nombre in sorted(base.keys() - actual.keys()):
+        print(f"{nombre:<48} falta en los resultados nuevos")
+
+    regresiones = [f for f in filas if f[4] == "REGRESIÓN"]
+    if regresiones:
+        print(f"{len(regresiones)} regresiones por encima del {args.tolerancia:.0%}.")
+        sys.exit(1)
+    print("Sin regresiones.")
+
+
+if __name__ == "__main__":
+    main()
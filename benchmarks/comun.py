@@ -0,0 +1,91 @@
+from __future__ import annotations
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+import main as api
+from models import ProductoElectronico
+from services import TiendaService, TiendaServiceAsync, Persistencia
+
+
+# Utilidades compartidas por los benchmarks: percentiles, preparación de la
+# aplicación en el mismo proceso y formato JSON de los resultados.
+#
+# Formato de un fichero de resultados:
+#   {"meta": {...entorno...},
+#    "resultados": {"<métrica>": {"valor": float, "unidad": str, "mayor_es_mejor": bool}}}
+
+
+def percentil(valores: List[float], p: float) -> float:
+    # Percentil por el método del rango más cercano (p entre 0 y 1)
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def preparar_aplicacion(
+    usar_hilos: bool = False,
+    num_productos: int = 200,
+    directorio: Optional[str] = None,
+    stock: int = 10_000_000,
+) -> List[UUID]:
+    # Sustituimos el servicio de la aplicación por uno nuevo y le damos un catálogo
+    # Antes cerramos el anterior y su gestor de informes (hilos, WAL y procesos)
+    api.gestor_reportes.cerrar()
+    api.tienda_service.cerrar()
+    persistencia = Persistencia(directorio, snapshot_cada=0) if directorio else None
+    servicio = TiendaService(persistencia=persistencia)
+    api.tienda_service = servicio
+    api.tienda_async = TiendaServiceAsync(servicio, usar_hilos=usar_hilos, ejecutar_en_hilo=api.run_in_threadpool)
+    api.cache_respuestas = api.crear_cache_respuestas()
+    api.cache_idempotencia = api.crear_cache_idempotencia()
+    api.control_admision = api.crear_control_admision()
+    api.gestor_reportes = api.crear_gestor_reportes()
+    return [
+        servicio.añadir_producto(ProductoElectronico(f"Producto {i}", 10.0 + i, stock)).id
+        for i in range(num_productos)
+    ]
+
+
+def metrica(valor: float, unidad: str, mayor_es_mejor: bool) -> Dict[str, Any]:
+    return {"valor": valor, "unidad": unidad, "mayor_es_mejor": mayor_es_mejor}
+
+
+def entorno() -> Dict[str, Any]:
+    # Datos del entorno para saber si dos resultados son comparables
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "implementacion": platform.python_implementation(),
+        "sistema": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+    }
+
+
+def guardar_resultados(ruta: str, resultados: Dict[str, Dict[str, Any]], parametros: Dict[str, Any]) -> None:
+    # Escribimos los resultados en JSON (si existe el fichero, se sustituye)
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        json.dump(
+            {"meta": {**entorno(), "parametros": parametros}, "resultados": resultados},
+            archivo, indent=2, ensure_ascii=False,
+        )
+        archivo.write("\n")
+
+
+def cargar_resultados(ruta: str) -> Dict[str, Dict[str, Any]]:
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)["resultados"]
@@ -0,0 +1,134 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+import main as api
+from benchmarks.comun import guardar_resultados, metrica, percentil, preparar_aplicacion
+
+
+# Escenarios de carga sobre la API completa, ejecutada en el mismo proceso a
+# través de un transporte ASGI (sin red ni servidor, funciona sin conexión).
+# Cada escenario reparte las peticiones entre varios tipos según su peso y
+# mide peticiones/segundo y percentiles de latencia.
+
+# Peso de cada tipo de petición en cada escenario
+ESCENARIOS: Dict[str, Dict[str, int]] = {
+    "navegacion": {"buscar": 40, "producto": 40, "historial": 10, "pedido": 10},
+    "compra": {"buscar": 10, "producto": 10, "historial": 10, "pedido": 70},
+    "mixto": {"buscar": 25, "producto": 25, "historial": 10, "pedido": 40},
+}
+
+PALABRAS = ["producto", "1", "2", "3", "4", "5"]
+
+
+async def peticion(
+    cliente: httpx.AsyncClient,
+    tipo: str,
+    aleatorio: random.Random,
+    cliente_id: str,
+    productos: List[str],
+) -> httpx.Response:
+    if tipo == "buscar":
+        return await cliente.get("/productos", params={
+            "q": aleatorio.choice(PALABRAS), "orden": aleatorio.choice(["precio", "-precio", "nombre"]), "limit": 20,
+        })
+    if tipo == "producto":
+        return await cliente.get(f"/productos/{aleatorio.choice(productos)}")
+    if tipo == "historial":
+        return await cliente.get(f"/usuarios/{cliente_id}/pedidos", params={"limit": 20})
+    return await cliente.post("/pedidos", json={
+        "cliente_id": cliente_id,
+        "items": [
+            {"producto_id": producto_id, "cantidad": aleatorio.randint(1, 3)}
+            for producto_id in aleatorio.sample(productos, aleatorio.randint(1, 3))
+        ],
+    })
+
+
+async def ejecutar_escenario(
+    escenario: str,
+    concurrencia: int,
+    peticiones: int,
+    num_productos: int,
+    semilla: int,
+) -> Dict[str, float]:
+    productos = [str(p) for p in preparar_aplicacion(num_productos=num_productos)]
+    tipos, pesos = zip(*ESCENARIOS[escenario].items())
+    latencias: List[float] = []
+    errores = 0
+    transporte = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://tienda") as cliente:
+        clientes = []
+        for i in range(concurrencia):
+            respuesta = await cliente.post("/usuarios", json={
+                "nombre": f"Cliente {i}", "email": f"cliente{i}@tienda.es",
+                "tipo": "cliente", "direccion_postal": "Calle Falsa 123",
+            })
+            clientes.append(respuesta.json()["id"])
+        por_cliente = max(1, peticiones // concurrencia)
+
+        async def trabajador(indice: int) -> None:
+            nonlocal errores
+            aleatorio = random.Random(semilla + indice)
+            secuencia = aleatorio.choices(tipos, weights=pesos, k=por_cliente)
+            for tipo in secuencia:
+                inicio = time.perf_counter()
+                respuesta = await peticion(cliente, tipo, aleatorio, clientes[indice], productos)
+                latencias.append(time.perf_counter() - inicio)
+                if respuesta.status_code >= 400:
+                    errores += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador(i) for i in range(concurrencia)))
+        duracion = time.perf_counter() - inicio
+    api.tienda_service.cerrar()
+
+    return {
+        "peticiones_por_segundo": len(latencias) / duracion,
+        "p50_ms": percentil(latencias, 0.50) * 1000,
+        "p95_ms": percentil(latencias, 0.95) * 1000,
+        "p99_ms": percentil(latencias, 0.99) * 1000,
+        "errores": errores,
+    }
+
+
+def ejecutar(escenarios: List[str], concurrencia: int, peticiones: int, num_productos: int, semilla: int) -> Dict[str, Dict[str, Any]]:
+    resultados: Dict[str, Dict[str, Any]] = {}
+    for escenario in escenarios:
+        r = asyncio.run(ejecutar_escenario(escenario, concurrencia, peticiones, num_productos, semilla))
+        if r["errores"]:
+            raise RuntimeError(f"El escenario {escenario} tuvo {r['errores']} respuestas con error.")
+        resultados[f"macro.{escenario}.peticiones_por_segundo"] = metrica(r["peticiones_por_segundo"], "req/s", True)
+        for p in ("p50_ms", "p95_ms", "p99_ms"):
+            resultados[f"macro.{escenario}.{p}"] = metrica(r[p], "ms", False)
+        print(
+            f"{escenario:<12} {r['peticiones_por_segundo']:>13.0f} "
+            f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}"
+        )
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Escenarios de carga sobre la API en el mismo proceso")
+    parser.add_argument("--escenarios", nargs="+", default=list(ESCENARIOS), choices=list(ESCENARIOS))
+    parser.add_argument("--concurrencia", type=int, default=50, help="Clientes concurrentes")
+    parser.add_argument("--peticiones", type=int, default=5_000, help="Peticiones por escenario")
+    parser.add_argument("--productos", type=int, default=1_000)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default=None, help="Fichero JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    print(f"{'escenario':<12} {'peticiones/s':>13} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    resultados = ejecutar(args.escenarios, args.concurrencia, args.peticiones, args.productos, args.semilla)
+    if args.salida:
+        guardar_resultados(args.salida, resultados, vars(args))
+        print(f"Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
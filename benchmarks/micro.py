@@ -0,0 +1,129 @@
+from __future__ import annotations
+import argparse
+import gc
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from models import Pedido, ProductoElectronico
+from services import TiendaService
+from benchmarks.comun import guardar_resultados, metrica
+
+
+# Microbenchmarks de las operaciones del servicio a distintos tamaños de datos.
+# Cada medida ejecuta la operación 'operaciones' veces sobre una tienda que ya
+# tiene 'tamaño' elementos, repite la medida varias veces y se queda con la
+# mejor (la menos afectada por el ruido del sistema). Resultado en µs/operación.
+
+
+def medir(preparar: Callable[[], Callable[[int], Any]], operaciones: int, repeticiones: int) -> float:
+    # 'preparar' construye el estado de partida y devuelve la operación a medir
+    # (recibe el número de iteración); la preparación no entra en el tiempo
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        operacion = preparar()
+        gc.collect()
+        gc.disable()
+        try:
+            inicio = time.perf_counter()
+            for i in range(operaciones):
+                operacion(i)
+            mejor = min(mejor, time.perf_counter() - inicio)
+        finally:
+            gc.enable()
+    return mejor / operaciones * 1e6
+
+
+def tienda_con(tamaño: int, semilla: int):
+    # Tienda con 'tamaño' clientes y productos (stock de sobra para no rechazar pedidos)
+    aleatorio = random.Random(semilla)
+    tienda = TiendaService()
+    clientes = [
+        tienda.registrar_usuario("cliente", f"Cliente {i}", f"cliente{i}@tienda.es", "Calle Falsa 123").id
+        for i in range(tamaño)
+    ]
+    productos = [
+        ProductoElectronico(f"Producto {i}", round(aleatorio.uniform(5, 500), 2), 10_000_000)
+        for i in range(tamaño)
+    ]
+    tienda.añadir_productos(productos)
+    return tienda, clientes, [p.id for p in productos], aleatorio
+
+
+def registrar_usuario(tamaño: int, semilla: int):
+    tienda, _, _, _ = tienda_con(tamaño, semilla)
+    return lambda i: tienda.registrar_usuario("cliente", f"Nuevo {i}", f"nuevo{i}@tienda.es", "Calle Falsa 123")
+
+
+def añadir_producto(tamaño: int, semilla: int):
+    tienda, _, _, _ = tienda_con(tamaño, semilla)
+    return lambda i: tienda.añadir_producto(ProductoElectronico(f"Nuevo {i}", 10.0 + i % 100, 10))
+
+
+def realizar_pedido(tamaño: int, semilla: int):
+    # Pedidos de 1 a 3 líneas sobre productos aleatorios
+    tienda, clientes, productos, aleatorio = tienda_con(tamaño, semilla)
+    pedidos = [
+        (aleatorio.choice(clientes), {p: aleatorio.randint(1, 3) for p in aleatorio.sample(productos, aleatorio.randint(1, 3))})
+        for _ in range(10_000)
+    ]
+    return lambda i: tienda.realizar_pedido(*pedidos[i % len(pedidos)])
+
+
+def listar_pedidos_usuario(tamaño: int, semilla: int):
+    # Un cliente con 'tamaño' pedidos; pedimos páginas de 50 desde posiciones aleatorias
+    tienda, clientes, productos, aleatorio = tienda_con(min(tamaño, 1000), semilla)
+    cliente = clientes[0]
+    pedidos = [tienda.realizar_pedido(cliente, {aleatorio.choice(productos): 1}).id for _ in range(tamaño)]
+    cursores = [aleatorio.choice(pedidos) for _ in range(1000)]
+    return lambda i: tienda.listar_pedidos_usuario(cliente, limit=50, after=cursores[i % len(cursores)])
+
+
+def calcular_total(tamaño: int, semilla: int):
+    # Un pedido con 'tamaño' líneas (como mucho 1000)
+    tienda, clientes, productos, _ = tienda_con(min(tamaño, 1000), semilla)
+    cliente = tienda.obtener_usuario(clientes[0])
+    pedido = Pedido(cliente, {tienda.obtener_producto(p): 1 for p in productos})
+    return lambda i: pedido.calcular_total()
+
+
+OPERACIONES: Dict[str, Callable[[int, int], Callable[[int], Any]]] = {
+    "registrar_usuario": registrar_usuario,
+    "añadir_producto": añadir_producto,
+    "realizar_pedido": realizar_pedido,
+    "listar_pedidos_usuario": listar_pedidos_usuario,
+    "calcular_total": calcular_total,
+}
+
+
+def ejecutar(tamaños: List[int], operaciones: int, repeticiones: int, semilla: int, filtro: List[str]) -> Dict[str, Dict[str, Any]]:
+    resultados: Dict[str, Dict[str, Any]] = {}
+    for nombre, preparar in OPERACIONES.items():
+        if filtro and nombre not in filtro:
+            continue
+        for tamaño in tamaños:
+            us = medir(lambda: preparar(tamaño, semilla), operaciones, repeticiones)
+            resultados[f"micro.{nombre}[n={tamaño}]"] = metrica(us, "us/op", mayor_es_mejor=False)
+            print(f"{nombre:<24} {tamaño:>9} {us:>12.2f}")
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmarks de TiendaService")
+    parser.add_argument("--tamaños", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--operaciones", type=int, default=2_000, help="Operaciones por medida")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Se toma la mejor de las repeticiones")
+    parser.add_argument("--solo", nargs="*", default=[], choices=list(OPERACIONES), help="Operaciones a medir")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default=None, help="Fichero JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    print(f"{'operación':<24} {'tamaño':>9} {'µs/op':>12}")
+    resultados = ejecutar(args.tamaños, args.operaciones, args.repeticiones, args.semilla, args.solo)
+    if args.salida:
+        guardar_resultados(args.salida, resultados, vars(args))
+        print(f"Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
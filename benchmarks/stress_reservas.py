@@ -0,0 +1,108 @@
+from __future__ import annotations
+import argparse
+import random
+import threading
+import time
+from typing import Dict, List
+from uuid import UUID
+
+from models import ProductoElectronico
+from services import TiendaService
+
+
+# Prueba de estrés multihilo del motor de reservas de stock.
+# Lanzamos pedidos concurrentes sobre un catálogo pequeño (mucha contención)
+# y al final comprobamos que:
+#   - ningún producto tiene stock negativo
+#   - stock inicial - stock final == unidades vendidas en pedidos aceptados
+# Además medimos pedidos/segundo según crece el número de hilos.
+# Las mismas invariantes se comprueban a menor escala en tests/test_reservas_stock.py.
+
+
+def preparar_tienda(num_productos: int, stock: int):
+    # Creamos una tienda con un cliente por hilo y un catálogo de prueba
+    tienda = TiendaService()
+    productos: List[UUID] = []
+    for i in range(num_productos):
+        producto = ProductoElectronico(f"Producto {i}", 10.0 + i, stock)
+        tienda.añadir_producto(producto)
+        productos.append(producto.id)
+    return tienda, productos
+
+
+def ejecutar(num_hilos: int, pedidos_por_hilo: int, num_productos: int, stock: int, semilla: int) -> Dict[str, float]:
+    tienda, productos = preparar_tienda(num_productos, stock)
+    clientes = [
+        tienda.registrar_usuario("cliente", f"Cliente {i}", f"cliente{i}@tienda.es", "Calle Falsa 123").id
+        for i in range(num_hilos)
+    ]
+    vendidos: List[Dict[UUID, int]] = [dict() for _ in range(num_hilos)]
+    rechazados = [0] * num_hilos
+    barrera = threading.Barrier(num_hilos + 1)
+
+    def trabajador(indice: int) -> None:
+        aleatorio = random.Random(semilla + indice)
+        cliente_id = clientes[indice]
+        barrera.wait()
+        for _ in range(pedidos_por_hilo):
+            # Cada pedido toca entre 1 y 3 productos distintos
+            lineas = aleatorio.sample(productos, aleatorio.randint(1, min(3, len(productos))))
+            items = {producto_id: aleatorio.randint(1, 3) for producto_id in lineas}
+            try:
+                tienda.realizar_pedido(cliente_id, items)
+            except ValueError:
+                rechazados[indice] += 1
+                continue
+            for producto_id, cantidad in items.items():
+                vendidos[indice][producto_id] = vendidos[indice].get(producto_id, 0) + cantidad
+
+    hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(num_hilos)]
+    for hilo in hilos:
+        hilo.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    # Comprobamos las invariantes del inventario
+    for producto_id in productos:
+        producto = tienda.obtener_producto(producto_id)
+        total_vendido = sum(v.get(producto_id, 0) for v in vendidos)
+        assert producto.stock >= 0, f"Stock negativo en {producto.nombre}"
+        assert stock - producto.stock == total_vendido, (
+            f"Stock perdido en {producto.nombre}: inicial {stock}, final {producto.stock}, vendido {total_vendido}"
+        )
+    aceptados = len(tienda.pedidos)
+    assert aceptados + sum(rechazados) == num_hilos * pedidos_por_hilo
+
+    return {
+        "hilos": num_hilos,
+        "aceptados": aceptados,
+        "rechazados": sum(rechazados),
+        "segundos": duracion,
+        "pedidos_por_segundo": (num_hilos * pedidos_por_hilo) / duracion if duracion else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prueba de estrés del motor de reservas de stock")
+    parser.add_argument("--hilos", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--pedidos", type=int, default=5000, help="Pedidos por hilo")
+    parser.add_argument("--productos", type=int, default=20)
+    parser.add_argument("--stock", type=int, default=20000)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'hilos':>6} {'aceptados':>10} {'rechazados':>11} {'segundos':>9} {'pedidos/s':>11}")
+    for num_hilos in args.hilos:
+        r = ejecutar(num_hilos, args.pedidos, args.productos, args.stock, args.semilla)
+        print(
+            f"{r['hilos']:>6} {r['aceptados']:>10} {r['rechazados']:>11} "
+            f"{r['segundos']:>9.3f} {r['pedidos_por_segundo']:>11.0f}"
+        )
+    print("Invariantes de stock verificadas: sin stock negativo ni unidades perdidas.")
+
+
+if __name__ == "__main__":
+    main()
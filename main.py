@@ -1,20 +1,266 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import List, Optional, Dict
+import asyncio
+import json
+import math
+import os
+import sys
+from contextlib import asynccontextmanager
+import time
+from datetime import date, datetime
+from typing import Any, Callable, List, Optional, Dict, Hashable, Tuple
 from uuid import UUID
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, EmailStr, Field
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, EmailStr, Field, ValidationError
 
-from services import TiendaService
-from models import Usuario
+from services import TiendaService, TiendaServiceAsync, Persistencia, AlmacenCompartido, CacheRespuestas
+from services import RegistroMetricas, MiddlewareMetricas, CacheIdempotencia, ConflictoIdempotencia, ClaveIdempotencia
+from services import ControlAdmision, MiddlewareAdmision, LimiteSuperado
+from services.Exportacion import FORMATOS, exportar_pedidos, exportar_productos
+from services.Carga_Masiva import FASES as FASES_CARGA, cargar_tienda, imprimir_progreso
+from services.Retenciones import Retencion, RetencionNoEncontrada
+from services.Reportes import GestorReportes, ReporteNoEncontrado, TrabajoReporte
+from services.Diagnostico import Diagnostico, MiddlewareDiagnostico
+from services.Indice_Usuarios import rol_usuario
+from services.Serializadores import (
+    producto_json, productos_json, pedido_json, pedidos_json, usuario_json, usuarios_json
+)
+from models import Usuario, Pedido
 from models import Producto, ProductoElectronico, ProductoRopa
 
+
+def crear_persistencia() -> Optional[Persistencia]:
+    # Activamos la persistencia en disco si se indica un directorio de datos
+    directorio = os.environ.get("TIENDA_DATA_DIR")
+    if not directorio:
+        return None
+    return Persistencia(
+        directorio,
+        sincrono=os.environ.get("TIENDA_WAL_SINCRONO", "1") != "0",
+        snapshot_cada=int(os.environ.get("TIENDA_SNAPSHOT_CADA", "100000")),
+    )
+
+
+def crear_compartido() -> Optional[AlmacenCompartido]:
+    # Con varios workers (uvicorn --workers N) todos comparten el estado en una base SQLite
+    ruta = os.environ.get("TIENDA_SQLITE")
+    if not ruta:
+        return None
+    return AlmacenCompartido(
+        ruta, intervalo_sincronizacion=float(os.environ.get("TIENDA_SINCRONIZAR_MS", "20")) / 1000
+    )
+
+
+def crear_cache_respuestas() -> CacheRespuestas:
+    # Tamaño de la caché de respuestas (número de entradas y megabytes)
+    return CacheRespuestas(
+        max_entradas=int(os.environ.get("TIENDA_CACHE_ENTRADAS", "1024")),
+        max_bytes=int(os.environ.get("TIENDA_CACHE_MB", "64")) * 1024 * 1024,
+    )
+
+
+def crear_cache_idempotencia() -> CacheIdempotencia:
+    # Tiempo que se recuerdan las claves de idempotencia (segundos) y número máximo de claves
+    return CacheIdempotencia(
+        ttl=float(os.environ.get("TIENDA_IDEMPOTENCIA_TTL", "86400")),
+        max_entradas=int(os.environ.get("TIENDA_IDEMPOTENCIA_ENTRADAS", "50000")),
+    )
+
+
+def leer_tasa(valor: str) -> Tuple[float, int]:
+    # "tasa/ráfaga" en peticiones por segundo (sin ráfaga, la de un segundo a esa tasa)
+    tasa, _, rafaga = valor.strip().partition("/")
+    return float(tasa), int(rafaga) if rafaga else max(1, math.ceil(float(tasa)))
+
+
+def crear_control_admision() -> ControlAdmision:
+    # Límites por cliente ("tasa/ráfaga" común y por ruta: "POST /pedidos=5/10,GET /productos=50")
+    # y peticiones de compra y lecturas en curso (0: sin máximo)
+    limite = os.environ.get("TIENDA_LIMITE_CLIENTE")
+    limites_ruta: Dict[Tuple[str, str], Tuple[float, int]] = {}
+    for entrada in os.environ.get("TIENDA_LIMITES_RUTA", "").split(","):
+        if entrada.strip():
+            ruta, _, tasa = entrada.rpartition("=")
+            metodo, _, plantilla = ruta.strip().partition(" ")
+            limites_ruta[(metodo, plantilla.strip())] = leer_tasa(tasa)
+    return ControlAdmision(
+        limite_cliente=leer_tasa(limite) if limite else None,
+        limites_ruta=limites_ruta,
+        max_pedidos=int(os.environ.get("TIENDA_PEDIDOS_EN_CURSO", "0")),
+        espera_pedido=float(os.environ.get("TIENDA_PEDIDOS_ESPERA", "2")),
+        max_lecturas=int(os.environ.get("TIENDA_LECTURAS_EN_CURSO", "0")),
+        max_claves=int(os.environ.get("TIENDA_ADMISION_CLIENTES", "100000")),
+    )
+
+
+def opciones_archivo() -> Dict[str, float]:
+    # Política del archivo de pedidos: edad (horas) y memoria de los pedidos calientes (MB)
+    opciones: Dict[str, float] = {}
+    horas = os.environ.get("TIENDA_ARCHIVO_HORAS")
+    if horas:
+        opciones["archivar_tras"] = float(horas) * 3600
+    megas = os.environ.get("TIENDA_PEDIDOS_MB")
+    if megas:
+        opciones["memoria_pedidos"] = int(float(megas) * 1024 * 1024)
+    return opciones
+
+
+def cargar_datos_iniciales(servicio: TiendaService) -> None:
+    # Sembramos la tienda con los ficheros de TIENDA_CARGA_USUARIOS, _PRODUCTOS y _PEDIDOS
+    # (CSV o JSONL); solo si está vacía, así que con persistencia se carga una vez
+    ficheros = {fase: os.environ.get(f"TIENDA_CARGA_{fase.upper()}") for fase in FASES_CARGA}
+    if not any(ficheros.values()):
+        return
+    if servicio.usuarios or servicio.productos or servicio.pedidos or len(servicio.archivo):
+        print("La tienda ya tiene datos: no se cargan los ficheros de TIENDA_CARGA_*.", file=sys.stderr)
+        return
+    cargar_tienda(
+        servicio, **ficheros,
+        max_errores=int(os.environ.get("TIENDA_CARGA_MAX_ERRORES", "0")),
+        progreso=imprimir_progreso,
+    )
+
+
+def crear_gestor_reportes() -> GestorReportes:
+    # Procesos para los informes (por defecto, todos los núcleos menos uno) y trabajos recordados
+    procesos = os.environ.get("TIENDA_REPORTES_PROCESOS")
+    return GestorReportes(
+        tienda_service,
+        procesos=int(procesos) if procesos else None,
+        max_trabajos=int(os.environ.get("TIENDA_REPORTES_TRABAJOS", "1000")),
+    )
+
+
+def crear_diagnostico() -> Optional[Diagnostico]:
+    # Perfilador, memoria y peticiones lentas solo si se configura TIENDA_DIAGNOSTICO_TOKEN,
+    # el secreto que hay que enviar en X-Diagnostico-Token (además de ser administrador)
+    token = os.environ.get("TIENDA_DIAGNOSTICO_TOKEN")
+    if not token:
+        return None
+    # Tipos cuyos objetos vivos se cuentan en las instantáneas de memoria
+    return Diagnostico(
+        token,
+        tipos=(Pedido, Producto, Usuario, BaseModel),
+        max_instantaneas=int(os.environ.get("TIENDA_DIAGNOSTICO_INSTANTANEAS", "10")),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Al arrancar cargamos los datos iniciales (si se indican) y al parar paramos los
+    # procesos de informes y volcamos a disco los registros pendientes
+    cargar_datos_iniciales(tienda_service)
+    yield
+    if diagnostico is not None:
+        diagnostico.cerrar()
+    gestor_reportes.cerrar()
+    tienda_service.cerrar()
+
+
 # Creamos la instancia de FastAPI
-app = FastAPI(title="Tienda Online API")
-# Creamos la instancia del servicio de la tienda
-tienda_service = TiendaService()
+app = FastAPI(title="Tienda Online API", lifespan=lifespan)
+# Creamos la instancia del servicio de la tienda (recupera el estado si hay persistencia
+# o si comparte una base de datos con otros workers)
+tienda_service = TiendaService(persistencia=crear_persistencia(), compartido=crear_compartido(), **opciones_archivo())
+# Fachada asyncio que usan los endpoints (TIENDA_ASYNC=0 lo ejecuta todo en el threadpool)
+tienda_async = TiendaServiceAsync(
+    tienda_service,
+    usar_hilos=os.environ.get("TIENDA_ASYNC", "1") == "0",
+    ejecutar_en_hilo=run_in_threadpool,
+)
+# Creamos la caché de respuestas serializadas de los endpoints de lectura
+cache_respuestas = crear_cache_respuestas()
+# Respuestas de POST /pedidos por clave de idempotencia (para los reintentos)
+cache_idempotencia = crear_cache_idempotencia()
+# Límites por cliente, compras en curso y descarte de lecturas con sobrecarga (solo si se configuran)
+control_admision = crear_control_admision()
+# Informes pesados en procesos aparte
+gestor_reportes = crear_gestor_reportes()
+if control_admision.activo:
+    app.add_middleware(MiddlewareAdmision, control=control_admision)
+
+# Diagnóstico en producción (None si no se activa)
+diagnostico = crear_diagnostico()
+if diagnostico is not None:
+    app.add_middleware(MiddlewareDiagnostico, diagnostico=diagnostico)
+
+# Métricas HTTP (latencia por ruta) y de la caché; las del servicio están en tienda_service.metricas
+metricas_http = RegistroMetricas()
+if os.environ.get("TIENDA_METRICAS", "1") != "0":
+    app.add_middleware(MiddlewareMetricas, registro=metricas_http)
+metricas_http.indicador(
+    "tienda_cache_entradas", "Respuestas guardadas en la caché.",
+    lambda: cache_respuestas.estadisticas()["entradas"],
+)
+metricas_http.indicador(
+    "tienda_cache_bytes", "Memoria ocupada por la caché de respuestas.",
+    lambda: cache_respuestas.estadisticas()["bytes"],
+)
+metricas_http.indicador(
+    "tienda_cache_eventos_total", "Aciertos, fallos, respuestas 304 y expulsiones de la caché.",
+    lambda: (
+        ((evento,), cache_respuestas.estadisticas()[evento])
+        for evento in ("aciertos", "fallos", "no_modificados", "expulsiones")
+    ),
+    ("evento",),
+    tipo="counter",
+)
+metricas_http.indicador(
+    "tienda_idempotencia_entradas", "Claves de idempotencia guardadas.",
+    lambda: cache_idempotencia.estadisticas()["entradas"],
+)
+metricas_http.indicador(
+    "tienda_idempotencia_eventos_total",
+    "Pedidos ejecutados, repeticiones, esperas, conflictos, caducadas y expulsiones por clave de idempotencia.",
+    lambda: (
+        ((evento,), cache_idempotencia.estadisticas()[evento])
+        for evento in ("ejecuciones", "repeticiones", "esperas", "conflictos", "caducadas", "expulsiones")
+    ),
+    ("evento",),
+    tipo="counter",
+)
+metricas_http.indicador(
+    "tienda_reportes_trabajos", "Informes recordados por estado.",
+    lambda: (
+        ((estado,), gestor_reportes.estadisticas()[estado])
+        for estado in ("pendiente", "en_curso", "terminado", "error")
+    ),
+    ("estado",),
+)
+metricas_http.indicador(
+    "tienda_reportes_total", "Informes calculados, fallidos y servidos sin recalcular (misma versión de los datos).",
+    lambda: (
+        ((resultado,), gestor_reportes.estadisticas()[resultado])
+        for resultado in ("calculados", "fallidos", "aciertos")
+    ),
+    ("resultado",),
+    tipo="counter",
+)
+metricas_http.indicador(
+    "tienda_reportes_memoria_compartida_bytes", "Bytes del archivo de pedidos copiados a memoria compartida.",
+    lambda: gestor_reportes.estadisticas()["bytes_compartidos"],
+)
+metricas_http.indicador(
+    "tienda_admision_en_curso", "Compras y lecturas en curso y compras esperando plaza.",
+    lambda: (
+        ((estado,), control_admision.estadisticas()[estado])
+        for estado in ("pedidos_en_curso", "pedidos_esperando", "lecturas_en_curso")
+    ),
+    ("estado",),
+)
+metricas_http.indicador(
+    "tienda_admision_clientes", "Clientes con estado en los limitadores de tasa.",
+    lambda: control_admision.estadisticas()["clientes"],
+)
+metricas_http.indicador(
+    "tienda_admision_rechazos_total", "Peticiones rechazadas por límite del cliente o por sobrecarga.",
+    lambda: (((motivo,), total) for motivo, total in control_admision.rechazos.items()),
+    ("motivo",),
+    tipo="counter",
+)
 
 # ---------------------- SCHEMAS ---------------------- #
 
@@ -56,7 +302,9 @@ class ProductoRead(BaseModel):
     tipo: str
     nombre: str
     precio: float
+    # Stock disponible y unidades retenidas por reservas pendientes de confirmar
     stock: int
+    retenido: int
     # Atributos opcionales
     garantia_meses: Optional[int] = None
     talla: Optional[str] = None
@@ -96,185 +344,666 @@ class PedidoRead(BaseModel):
     total: float
 
 
+class ArchivoPedidosRead(BaseModel):
+    # Esquema con el tamaño de los dos niveles del historial de pedidos
+    calientes: int
+    archivados: int
+    segmentos: int
+    bytes_archivo: int
+
+
+class ArchivadoRead(BaseModel):
+    # Resultado de compactar pedidos en el archivo
+    archivados: int
+    segundos: float
+
+
+# ------ RESERVAS ------ #
+
+class ReservaCreate(BaseModel):
+    # Esquema para apartar el stock de un pedido mientras el cliente paga
+    cliente_id: UUID
+    items: List[PedidoItemCreate]
+    # Segundos que se mantiene la reserva si no se confirma ni se cancela
+    ttl_segundos: float = Field(default=900, gt=0, le=24 * 3600)
+
+
+class ReservaItemRead(BaseModel):
+    # Esquema de una línea de una reserva
+    producto_id: UUID
+    nombre_producto: str
+    cantidad: int
+
+
+class ReservaRead(BaseModel):
+    # Esquema para leer/devolver una reserva activa
+    id: UUID
+    cliente_id: UUID
+    items: List[ReservaItemRead]
+    expira: datetime
+
+
+# ------ LOTES ------ #
+
+class ResultadoLoteProducto(BaseModel):
+    # Resultado de un elemento de una carga masiva de productos
+    indice: int
+    id: Optional[UUID] = None
+    error: Optional[str] = None
+
+
+class ResultadoLotePedido(BaseModel):
+    # Resultado de un elemento de un lote de pedidos
+    indice: int
+    id: Optional[UUID] = None
+    total: Optional[float] = None
+    error: Optional[str] = None
+
+
+class LoteProductosRead(BaseModel):
+    # Esquema de respuesta de la carga masiva de productos
+    total: int
+    correctos: int
+    fallidos: int
+    resultados: List[ResultadoLoteProducto]
+
+
+class LotePedidosRead(BaseModel):
+    # Esquema de respuesta del lote de pedidos
+    total: int
+    correctos: int
+    fallidos: int
+    resultados: List[ResultadoLotePedido]
+
+
+# Número máximo de elementos que aceptamos en una sola petición de lote
+MAX_ELEMENTOS_LOTE = 100_000
+
+
+# ------ ESTADÍSTICAS ------ #
+
+class ResumenVentasRead(BaseModel):
+    # Totales de ventas de la tienda
+    pedidos: int
+    unidades: int
+    ingresos: float
+
+
+class VentasProductoRead(BaseModel):
+    # Ventas acumuladas de un producto
+    producto_id: UUID
+    nombre: str
+    unidades: int
+    ingresos: float
+
+
+class VentasClienteRead(BaseModel):
+    # Compras acumuladas de un cliente
+    cliente_id: UUID
+    nombre: str
+    pedidos: int
+    unidades: int
+    gasto: float
+
+
+class VentasDiaRead(BaseModel):
+    # Ventas de un día
+    dia: date
+    pedidos: int
+    unidades: int
+    ingresos: float
+
+
+class RecalculoRead(BaseModel):
+    # Resultado de recalcular las estadísticas desde los pedidos
+    lineas: int
+    segundos: float
+
+
+# ------ INFORMES ------ #
+
+class ReporteCreate(BaseModel):
+    # Esquema para pedir un informe sobre todo el historial de pedidos
+    tipo: str = Field(pattern="^(ingresos|productos|clientes)$")
+    # Días incluidos (sin ellos, todo el historial)
+    desde: Optional[date] = None
+    hasta: Optional[date] = None
+    # "ingresos": agrupación por "dia", "semana" o "mes"
+    periodo: Optional[str] = None
+    # "productos" (unidades, ingresos o pedidos) y "clientes" (gasto, pedidos o unidades):
+    # orden del ranking y número de filas
+    criterio: Optional[str] = None
+    n: int = Field(default=100, ge=1, le=10_000)
+
+
+class ReporteRead(BaseModel):
+    # Estado de un informe: "pendiente", "en_curso", "terminado" o "error"
+    id: UUID
+    tipo: str
+    parametros: Dict[str, Any]
+    estado: str
+    # Versión de los datos con la que se calcula
+    version: int
+    creado: datetime
+    segundos: Optional[float] = None
+    resultado: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+
+# ------ DIAGNÓSTICO ------ #
+
+class PerfilCreate(BaseModel):
+    # Esquema para empezar a perfilar: milisegundos entre muestras y duración máxima
+    intervalo_ms: float = Field(default=10.0, ge=1, le=1000)
+    segundos: float = Field(default=60.0, gt=0, le=3600)
+
+
+class MemoriaCreate(BaseModel):
+    # Esquema para arrancar la traza de memoria: niveles de pila guardados por reserva
+    marcos: int = Field(default=1, ge=1, le=100)
+
+
+class LentasCreate(BaseModel):
+    # Esquema para registrar las peticiones que tardan más de 'umbral_ms'
+    umbral_ms: float = Field(default=100.0, ge=0)
+    max_entradas: int = Field(default=1000, ge=1, le=100_000)
+
+
+class PerfilRead(BaseModel):
+    activo: bool
+    intervalo_ms: float
+    muestras: int
+    pilas: int
+    segundos: float
+    # Fracción del tiempo que el perfilador ha tenido el GIL
+    coste: float
+
+
+class TipoMemoriaRead(BaseModel):
+    objetos: int
+    bytes: int
+
+
+class InstantaneaMemoriaRead(BaseModel):
+    id: int
+    fecha: datetime
+    bytes_trazados: int
+    pico_bytes: int
+    # Objetos vivos de los modelos y esquemas por clase
+    tipos: Dict[str, TipoMemoriaRead]
+
+
+class MemoriaRead(BaseModel):
+    activa: bool
+    marcos: int
+    bytes_trazados: int
+    pico_bytes: int
+    instantaneas: List[InstantaneaMemoriaRead]
+
+
+class LineaMemoriaRead(BaseModel):
+    archivo: str
+    linea: int
+    bytes: int
+    diferencia_bytes: int
+    bloques: int
+    diferencia_bloques: int
+
+
+class DiferenciaTipoRead(BaseModel):
+    tipo: str
+    objetos: int
+    diferencia_objetos: int
+    bytes: int
+    diferencia_bytes: int
+
+
+class DiferenciaMemoriaRead(BaseModel):
+    desde: int
+    hasta: int
+    diferencia_bytes: int
+    lineas: List[LineaMemoriaRead]
+    tipos: List[DiferenciaTipoRead]
+
+
+class LentasRead(BaseModel):
+    activo: bool
+    umbral_ms: Optional[float] = None
+    # Peticiones medidas, lentas y guardadas
+    medidas: int
+    lentas: int
+    guardadas: int
+
+
+class OperacionLentaRead(BaseModel):
+    llamadas: int
+    segundos: float
+
+
+class PeticionLentaRead(BaseModel):
+    fecha: datetime
+    metodo: str
+    ruta: str
+    estado: int
+    segundos: float
+    # Operaciones de TiendaService de la petición, de la que más tarda a la que menos
+    operaciones: Dict[str, OperacionLentaRead]
+
+
+class DiagnosticoRead(BaseModel):
+    perfil: PerfilRead
+    memoria: MemoriaRead
+    lentas: LentasRead
+
+
+# ------ CACHÉ ------ #
+
+class EstadisticasCacheRead(BaseModel):
+    # Esquema de las estadísticas de la caché de respuestas
+    entradas: int
+    bytes: int
+    max_entradas: int
+    max_bytes: int
+    aciertos: int
+    fallos: int
+    no_modificados: int
+    expulsiones: int
+    tasa_aciertos: float
+
+
+# ---------------------- AUXILIARES ---------------------- #
+
+def construir_producto(datos: ProductoCreate) -> Producto:
+    # Creamos el producto del dominio según su tipo
+    tipo_lower = datos.tipo.lower()
+    if tipo_lower == "electronico":
+        return ProductoElectronico(
+            nombre=datos.nombre,
+            precio=datos.precio,
+            stock=datos.stock,
+            garantia_meses=datos.garantia_meses or 24
+        )
+    elif tipo_lower == "ropa":
+        # Validamos que tenga talla y color
+        if not datos.talla or not datos.color:
+            raise ValueError("Los productos de ropa requieren talla y color.")
+        return ProductoRopa(
+            nombre=datos.nombre,
+            precio=datos.precio,
+            stock=datos.stock,
+            talla=datos.talla,
+            color=datos.color
+        )
+    else:
+        raise ValueError("Tipo de producto no válido. Usa 'electronico' o 'ropa'.")
+
+
+def reserva_a_read(retencion: Retencion) -> ReservaRead:
+    # Convertimos una retención del servicio al esquema de la API
+    return ReservaRead(
+        id=retencion.id,
+        cliente_id=retencion.cliente.id,
+        items=[
+            ReservaItemRead(producto_id=p.id, nombre_producto=p.nombre, cantidad=cantidad)
+            for p, cantidad in retencion.productos_cantidades.items()
+        ],
+        expira=retencion.expira,
+    )
+
+
+def respuesta_json(cuerpo: bytes, status_code: int = 200) -> Response:
+    # Respuesta con el JSON ya generado por services.Serializadores
+    # El response_model del endpoint sigue documentando el esquema en OpenAPI,
+    # pero FastAPI no vuelve a validar una Response
+    return Response(content=cuerpo, status_code=status_code, media_type="application/json")
+
+
+def admitir_cliente(cliente_id: UUID, ruta: str) -> None:
+    # Límite por cliente de las rutas con el cliente en el cuerpo (el middleware no lo ve)
+    try:
+        control_admision.limitar(cliente_id.int, "POST", ruta)
+    except LimiteSuperado as e:
+        raise HTTPException(status_code=e.estado, detail=str(e), headers={"Retry-After": e.reintentar})
+
+
+def exigir_admin(usuario_id: Optional[UUID], token: Optional[str]) -> Diagnostico:
+    # Los endpoints de diagnóstico solo existen con TIENDA_DIAGNOSTICO_TOKEN y solo los usa
+    # quien presente ese token en X-Diagnostico-Token y sea un administrador (X-Usuario-Id)
+    if diagnostico is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not diagnostico.autorizado(token):
+        raise HTTPException(status_code=401, detail="Falta la cabecera X-Diagnostico-Token o no es válida.")
+    if usuario_id is None:
+        raise HTTPException(status_code=401, detail="Falta la cabecera X-Usuario-Id.")
+    try:
+        usuario = tienda_service.obtener_usuario(usuario_id)
+    except ValueError:
+        usuario = None
+    if usuario is None or not usuario.is_admin():
+        raise HTTPException(status_code=403, detail="Solo un administrador puede usar el diagnóstico.")
+    return diagnostico
+
+
+async def leer_lote(request: Request) -> List[Any]:
+    # Leemos el cuerpo de una petición de lote como array JSON o como NDJSON
+    # En NDJSON cada línea es un elemento; una línea mal formada se guarda como
+    # excepción para devolver su error sin rechazar el resto del lote
+    cuerpo = await request.body()
+    tipo_contenido = request.headers.get("content-type", "")
+    if "ndjson" in tipo_contenido or "jsonl" in tipo_contenido:
+        elementos: List[Any] = []
+        for linea in cuerpo.splitlines():
+            if not linea.strip():
+                continue
+            try:
+                elementos.append(json.loads(linea))
+            except ValueError as e:
+                elementos.append(ValueError(f"JSON no válido: {e}"))
+    else:
+        try:
+            elementos = json.loads(cuerpo)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"JSON no válido: {e}")
+        if not isinstance(elementos, list):
+            raise HTTPException(status_code=400, detail="El cuerpo debe ser un array JSON o NDJSON.")
+    if len(elementos) > MAX_ELEMENTOS_LOTE:
+        raise HTTPException(status_code=413, detail=f"Un lote admite como máximo {MAX_ELEMENTOS_LOTE} elementos.")
+    return elementos
+
+
+def estado_lote(correctos: int, fallidos: int) -> int:
+    # Código de respuesta de un lote: 201 si se creó todo, 207 si solo una parte y
+    # 400 si no se creó nada (el cuerpo trae el error de cada elemento)
+    if not fallidos:
+        return 201
+    return 207 if correctos else 400
+
+
+def validar_lote(elementos: List[Any], esquema: type[BaseModel]) -> List[BaseModel | str]:
+    # Validamos todos los elementos en una sola pasada y devolvemos, en el mismo
+    # orden, el modelo validado o el mensaje de error de cada elemento
+    validados: List[BaseModel | str] = []
+    for elemento in elementos:
+        if isinstance(elemento, Exception):
+            validados.append(str(elemento))
+            continue
+        try:
+            validados.append(esquema.model_validate(elemento))
+        except ValidationError as e:
+            validados.append("; ".join(
+                f"{'.'.join(str(parte) for parte in error['loc'])}: {error['msg']}" for error in e.errors()
+            ))
+    return validados
+
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    # Comprobamos si alguno de los ETags de If-None-Match (o "*") es el actual
+    if not if_none_match:
+        return False
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato == "*" or candidato.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def respuesta_versionada(
+    request: Request,
+    clave: Hashable,
+    version: int,
+    renderizar: Callable[[], Tuple[bytes, Dict[str, str]]],
+    pesado: bool = False,
+) -> Response:
+    # Respondemos a una lectura usando la versión de los datos que devuelve:
+    # - si el cliente ya tiene esa versión (If-None-Match) respondemos 304 sin cuerpo
+    # - si la caché tiene la respuesta de esa versión devolvemos sus bytes
+    # - si no, la generamos con 'renderizar' (cuerpo y cabeceras) y la guardamos
+    #   (en un hilo si es pesada, p. ej. un listado completo)
+    # La versión se lee antes de generar la respuesta, así que nunca se guarda
+    # una respuesta más antigua que la versión con la que queda asociada
+    etag = tienda_service.versiones.etag(version)
+    cabeceras_cache = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        cache_respuestas.registrar_no_modificado()
+        return Response(status_code=304, headers=cabeceras_cache)
+    entrada = cache_respuestas.obtener(clave, version)
+    if entrada is None:
+        cuerpo, cabeceras = await tienda_async.ejecutar(renderizar, pesado=pesado)
+        entrada = cache_respuestas.guardar(clave, version, cuerpo, cabeceras)
+    return Response(
+        content=entrada.cuerpo,
+        media_type="application/json",
+        headers={**entrada.cabeceras, **cabeceras_cache},
+    )
+
+
+def cuerpo_lote_openapi(esquema: str) -> Dict[str, Any]:
+    # Documentamos en OpenAPI el cuerpo de los endpoints de lote (lo leemos a mano)
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": {"$ref": f"#/components/schemas/{esquema}"}}
+                },
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        }
+    }
+
+
 # ---------------------- ENDPOINTS ---------------------- #
 
 # ------ USUARIOS ------ #
 
 @app.post("/usuarios", response_model=UsuarioRead, status_code=201)
-def crear_usuario(datos: UsuarioCreate) -> UsuarioRead:
+async def crear_usuario(datos: UsuarioCreate) -> Response:
     # Endpoint para crear un nuevo usuario
     try:
         # Registramos el usuario usando el servicio
-        usuario = tienda_service.registrar_usuario(
+        usuario = await tienda_async.registrar_usuario(
             tipo=datos.tipo,
             nombre=datos.nombre,
             email=datos.email,
             direccion=datos.direccion_postal
         )
         # Devolvemos el usuario creado en formato UsuarioRead
-        return UsuarioRead(
-            id=usuario.id,
-            nombre=usuario.nombre,
-            email=usuario.email,
-            es_admin=usuario.is_admin()
-        )
+        return respuesta_json(usuario_json(usuario), status_code=201)
     except ValueError as e:
         # Si hay un error de validación, devolvemos un error 400
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/usuarios/{usuario_id}", response_model=UsuarioRead)
-def obtener_usuario(usuario_id: UUID) -> UsuarioRead:
+async def obtener_usuario(usuario_id: UUID) -> Response:
     # Endpoint para obtener un usuario específico por ID
     try:
         # Obtenemos el usuario del servicio
         usuario = tienda_service.obtener_usuario(usuario_id)
         # Devolvemos el usuario en formato UsuarioRead
-        return UsuarioRead(
-            id=usuario.id,
-            nombre=usuario.nombre,
-            email=usuario.email,
-            es_admin=usuario.is_admin()
-        )
+        return respuesta_json(usuario_json(usuario))
     except ValueError as e:
         # Si no existe, devolvemos un error 404
         raise HTTPException(status_code=404, detail=str(e))
 
 
 @app.get("/usuarios", response_model=List[UsuarioRead])
-def listar_usuarios() -> List[UsuarioRead]:
-    # Endpoint para listar todos los usuarios
-    # Obtenemos todos los usuarios del servicio
-    usuarios = tienda_service.listar_usuarios()
-    # Convertimos cada usuario al formato UsuarioRead
-    return [
-        UsuarioRead(
-            id=u.id,
-            nombre=u.nombre,
-            email=u.email,
-            es_admin=u.is_admin()
-        )
-        for u in usuarios
-    ]
+async def listar_usuarios(
+    request: Request,
+    email: Optional[str] = Query(default=None, description="Email exacto (sin distinguir mayúsculas)"),
+    rol: Optional[str] = Query(default=None, pattern="^(cliente|admin)$"),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    cursor: Optional[str] = Query(default=None, description="Valor de la cabecera X-Next-Cursor de la página anterior"),
+) -> Response:
+    # Endpoint para listar los usuarios por orden de registro, todos o de un rol
+    # Con 'limit' pagina con cursor (la cabecera X-Next-Cursor indica la página siguiente)
+    # Con 'email' devuelve una lista con el usuario de ese email o vacía
+    if email is not None:
+        # Consulta directa al índice de emails: no pasa por la caché
+        usuario = tienda_service.indice_usuarios.por_email(email)
+        encontrados = [usuario] if usuario is not None and rol in (None, rol_usuario(usuario)) else []
+        return respuesta_json(usuarios_json(encontrados))
+    completo = limit is None and cursor is None
+    
+    def renderizar() -> Tuple[bytes, Dict[str, str]]:
+        cabeceras: Dict[str, str] = {}
+        if completo:
+            # Obtenemos todos los usuarios (del rol) del servicio
+            usuarios = tienda_service.listar_usuarios(rol)
+        else:
+            try:
+                usuarios, siguiente = tienda_service.paginar_usuarios(rol, limit or 50, cursor)
+            except ValueError as e:
+                # Si el cursor no es válido, devolvemos un error 400
+                raise HTTPException(status_code=400, detail=str(e))
+            if siguiente:
+                cabeceras["X-Next-Cursor"] = siguiente
+        # Convertimos cada usuario al formato UsuarioRead
+        return usuarios_json(usuarios), cabeceras
+    
+    clave = ("usuarios", tuple(sorted(request.query_params.multi_items())))
+    version = tienda_service.versiones.coleccion("usuarios")
+    return await respuesta_versionada(request, clave, version, renderizar, pesado=completo)
 
 
 # ------ PRODUCTOS ------ #
 
 @app.post("/productos", response_model=ProductoRead, status_code=201)
-def crear_producto(datos: ProductoCreate) -> ProductoRead:
+async def crear_producto(datos: ProductoCreate) -> Response:
     # Endpoint para crear un nuevo producto
     try:
-        tipo_lower = datos.tipo.lower()
-        
         # Creamos el producto según su tipo
-        if tipo_lower == "electronico":
-            producto = ProductoElectronico(
-                nombre=datos.nombre,
-                precio=datos.precio,
-                stock=datos.stock,
-                garantia_meses=datos.garantia_meses or 24
-            )
-        elif tipo_lower == "ropa":
-            # Validamos que tenga talla y color
-            if not datos.talla or not datos.color:
-                raise ValueError("Los productos de ropa requieren talla y color.")
-            producto = ProductoRopa(
-                nombre=datos.nombre,
-                precio=datos.precio,
-                stock=datos.stock,
-                talla=datos.talla,
-                color=datos.color
-            )
-        else:
-            raise ValueError("Tipo de producto no válido. Usa 'electronico' o 'ropa'.")
+        producto = construir_producto(datos)
         
         # Añadimos el producto al inventario
-        tienda_service.añadir_producto(producto)
+        await tienda_async.añadir_producto(producto)
         
         # Devolvemos el producto creado en formato ProductoRead
-        return ProductoRead(
-            id=producto.id,
-            tipo=tipo_lower,
-            nombre=producto.nombre,
-            precio=producto.precio,
-            stock=producto.stock,
-            garantia_meses=getattr(producto, 'garantia_meses', None),
-            talla=getattr(producto, 'talla', None),
-            color=getattr(producto, 'color', None)
-        )
+        return respuesta_json(producto_json(producto), status_code=201)
     except ValueError as e:
         # Si hay un error de validación, devolvemos un error 400
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post(
+    "/productos/bulk",
+    response_model=LoteProductosRead,
+    status_code=201,
+    openapi_extra=cuerpo_lote_openapi("ProductoCreate"),
+)
+async def crear_productos_lote(request: Request, response: Response) -> LoteProductosRead:
+    # Endpoint para cargar miles de productos de una vez (array JSON o NDJSON)
+    # Leemos el cuerpo en el bucle de eventos y procesamos el lote en el threadpool
+    elementos = await leer_lote(request)
+    lote = await tienda_async.ejecutar(procesar_lote_productos, elementos, pesado=True)
+    response.status_code = estado_lote(lote.correctos, lote.fallidos)
+    return lote
+
+
+def procesar_lote_productos(elementos: List[Any]) -> LoteProductosRead:
+    # Validamos y construimos todos los productos en una sola pasada
+    resultados: List[ResultadoLoteProducto] = []
+    productos: List[Producto] = []
+    for indice, datos in enumerate(validar_lote(elementos, ProductoCreate)):
+        if isinstance(datos, str):
+            resultados.append(ResultadoLoteProducto(indice=indice, error=datos))
+            continue
+        try:
+            producto = construir_producto(datos)
+        except ValueError as e:
+            resultados.append(ResultadoLoteProducto(indice=indice, error=str(e)))
+            continue
+        productos.append(producto)
+        resultados.append(ResultadoLoteProducto(indice=indice, id=producto.id))
+    
+    # Añadimos todos los productos válidos con una única operación sobre el inventario
+    tienda_service.añadir_productos(productos)
+    
+    return LoteProductosRead(
+        total=len(resultados),
+        correctos=len(productos),
+        fallidos=len(resultados) - len(productos),
+        resultados=resultados
+    )
+
+
 @app.get("/productos", response_model=List[ProductoRead])
-def listar_productos() -> List[ProductoRead]:
-    # Endpoint para listar todos los productos
-    # Obtenemos todos los productos del servicio
-    productos = tienda_service.listar_productos()
-    resultado = []
+async def listar_productos(
+    request: Request,
+    q: Optional[str] = Query(default=None, description="Texto a buscar en el nombre (admite prefijos)"),
+    tipo: Optional[str] = None,
+    talla: Optional[str] = None,
+    color: Optional[str] = None,
+    precio_min: Optional[float] = Query(default=None, ge=0),
+    precio_max: Optional[float] = Query(default=None, ge=0),
+    solo_con_stock: bool = False,
+    orden: str = Query(default="precio", pattern="^-?(precio|nombre)$"),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    cursor: Optional[str] = Query(default=None, description="Valor de la cabecera X-Next-Cursor de la página anterior"),
+) -> Response:
+    # Endpoint para listar o buscar productos
+    # Sin parámetros devuelve todo el inventario; con filtros usa los índices del
+    # servicio y pagina con cursor (la cabecera X-Next-Cursor indica la página siguiente)
+    # Cada combinación de parámetros se cachea según la versión del catálogo
+    filtros = (q, tipo, talla, color, precio_min, precio_max, limit, cursor)
+    completo = not solo_con_stock and all(f is None for f in filtros)
     
-    # Convertimos cada producto al formato ProductoRead
-    for p in productos:
-        # Determinamos el tipo de producto
-        if isinstance(p, ProductoElectronico):
-            tipo = "electronico"
-        elif isinstance(p, ProductoRopa):
-            tipo = "ropa"
+    def renderizar() -> Tuple[bytes, Dict[str, str]]:
+        cabeceras: Dict[str, str] = {}
+        if completo:
+            # Obtenemos todos los productos del servicio
+            productos = tienda_service.listar_productos()
         else:
-            tipo = "generico"
+            try:
+                productos, siguiente = tienda_service.buscar_productos(
+                    texto=q,
+                    tipo=tipo,
+                    talla=talla,
+                    color=color,
+                    precio_min=precio_min,
+                    precio_max=precio_max,
+                    solo_con_stock=solo_con_stock,
+                    orden=orden,
+                    limit=limit or 50,
+                    cursor=cursor,
+                )
+            except ValueError as e:
+                # Si el cursor o el orden no son válidos, devolvemos un error 400
+                raise HTTPException(status_code=400, detail=str(e))
+            if siguiente:
+                cabeceras["X-Next-Cursor"] = siguiente
         
-        resultado.append(ProductoRead(
-            id=p.id,
-            tipo=tipo,
-            nombre=p.nombre,
-            precio=p.precio,
-            stock=p.stock,
-            garantia_meses=getattr(p, 'garantia_meses', None),
-            talla=getattr(p, 'talla', None),
-            color=getattr(p, 'color', None)
-        ))
+        # Convertimos cada producto al formato ProductoRead
+        return productos_json(productos), cabeceras
     
-    return resultado
+    clave = ("productos", tuple(sorted(request.query_params.multi_items())))
+    version = tienda_service.versiones.coleccion("productos")
+    return await respuesta_versionada(request, clave, version, renderizar, pesado=completo)
 
 
 @app.get("/productos/{producto_id}", response_model=ProductoRead)
-def obtener_producto(producto_id: UUID) -> ProductoRead:
-    # Endpoint para obtener un producto específico por ID
-    try:
-        # Obtenemos el producto del servicio
-        p = tienda_service.obtener_producto(producto_id)
-        
-        # Determinamos el tipo de producto
-        if isinstance(p, ProductoElectronico):
-            tipo = "electronico"
-        elif isinstance(p, ProductoRopa):
-            tipo = "ropa"
-        else:
-            tipo = "generico"
-        
-        # Devolvemos el producto en formato ProductoRead
-        return ProductoRead(
-            id=p.id,
-            tipo=tipo,
-            nombre=p.nombre,
-            precio=p.precio,
-            stock=p.stock,
-            garantia_meses=getattr(p, 'garantia_meses', None),
-            talla=getattr(p, 'talla', None),
-            color=getattr(p, 'color', None)
-        )
-    except ValueError as e:
+async def obtener_producto(producto_id: UUID, request: Request) -> Response:
+    # Endpoint para obtener un producto específico por ID (cacheado según su versión)
+    version = tienda_service.versiones.entidad("productos", producto_id)
+    # Leemos el producto de la última versión publicada del catálogo (stock y
+    # unidades retenidas de un mismo instante, nunca de un pedido a medias)
+    p = tienda_service.instantanea_catalogo().obtener(producto_id)
+    if p is None:
         # Si no existe, devolvemos un error 404
-        raise HTTPException(status_code=404, detail=str(e))
+        raise HTTPException(status_code=404, detail=f"Producto con id {producto_id} no encontrado.")
+    
+    # Devolvemos el producto en formato ProductoRead
+    return await respuesta_versionada(
+        request, ("producto", producto_id), version, lambda: (producto_json(p), {})
+    )
 
 
 @app.delete("/productos/{producto_id}", status_code=204)
-def eliminar_producto(producto_id: UUID) -> None:
+async def eliminar_producto(producto_id: UUID) -> None:
     # Endpoint para eliminar un producto del inventario
     try:
         # Eliminamos el producto usando el servicio
-        tienda_service.eliminar_producto(producto_id)
+        await tienda_async.eliminar_producto(producto_id)
     except ValueError as e:
         # Si no existe, devolvemos un error 404
         raise HTTPException(status_code=404, detail=str(e))
@@ -283,71 +1012,552 @@ def eliminar_producto(producto_id: UUID) -> None:
 # ------ PEDIDOS ------ #
 
 @app.post("/pedidos", response_model=PedidoRead, status_code=201)
-def crear_pedido(datos: PedidoCreate) -> PedidoRead:
+async def crear_pedido(
+    datos: PedidoCreate,
+    idempotency_key: Optional[str] = Header(default=None, min_length=1, max_length=255),
+) -> Response:
     # Endpoint para crear un nuevo pedido
+    # Con la cabecera Idempotency-Key un reintento devuelve el pedido original sin tocar el stock
+    admitir_cliente(datos.cliente_id, "/pedidos")
     try:
         # Convertimos la lista de items a un diccionario
         items_dict: Dict[UUID, int] = {item.producto_id: item.cantidad for item in datos.items}
-        # Creamos el pedido usando el servicio
-        pedido = tienda_service.realizar_pedido(datos.cliente_id, items_dict)
-        
-        # Construimos la lista de items para la respuesta
-        items_read = []
-        for producto, cantidad in pedido.productos_cantidades.items():
-            items_read.append(PedidoItemRead(
-                producto_id=producto.id,
-                nombre_producto=producto.nombre,
-                cantidad=cantidad,
-                precio_unitario=producto.precio,
-                subtotal=producto.precio * cantidad
-            ))
-        
-        # Devolvemos el pedido creado en formato PedidoRead
-        return PedidoRead(
-            id=pedido.id,
-            cliente_id=pedido.cliente.id,
-            nombre_cliente=pedido.cliente.nombre,
-            fecha=pedido.fecha,
-            items=items_read,
-            total=pedido.calcular_total()
+        idempotencia = None
+        if idempotency_key is not None:
+            # La clave es de cada cliente y la huella detecta si se reutiliza con otros
+            # items (el hash de UUIDs y enteros es el mismo en todos los workers); con
+            # persistencia o varios workers la clave también se guarda con el pedido
+            huella = hash(frozenset(items_dict.items()))
+            idempotencia = ClaveIdempotencia(idempotency_key, huella, cache_idempotencia.ttl)
+
+        async def realizar() -> bytes:
+            # Creamos el pedido usando el servicio (el stock se reserva sin salir del bucle de eventos)
+            return pedido_json(await tienda_async.realizar_pedido(datos.cliente_id, items_dict, idempotencia))
+
+        if idempotency_key is None:
+            # Devolvemos el pedido creado en formato PedidoRead
+            return respuesta_json(await realizar(), status_code=201)
+        cuerpo, repetida = await cache_idempotencia.ejecutar(
+            (datos.cliente_id, idempotency_key), idempotencia.huella, realizar
         )
+        respuesta = respuesta_json(cuerpo, status_code=201)
+        if repetida:
+            respuesta.headers["Idempotent-Replayed"] = "true"
+        return respuesta
+    except ConflictoIdempotencia as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except ValueError as e:
         # Si hay un error de validación, devolvemos un error 400
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post(
+    "/pedidos/batch",
+    response_model=LotePedidosRead,
+    status_code=201,
+    openapi_extra=cuerpo_lote_openapi("PedidoCreate"),
+)
+async def crear_pedidos_lote(request: Request, response: Response) -> LotePedidosRead:
+    # Endpoint para crear muchos pedidos de una vez (array JSON o NDJSON)
+    # El stock se reserva agrupado por producto: cada producto se ajusta una vez por lote
+    elementos = await leer_lote(request)
+    lote = await tienda_async.ejecutar(procesar_lote_pedidos, elementos, pesado=True)
+    response.status_code = estado_lote(lote.correctos, lote.fallidos)
+    return lote
+
+
+def procesar_lote_pedidos(elementos: List[Any]) -> LotePedidosRead:
+    # Validamos todos los pedidos en una sola pasada
+    resultados: List[Optional[ResultadoLotePedido]] = []
+    lote: List[tuple] = []
+    posiciones: List[int] = []
+    for indice, datos in enumerate(validar_lote(elementos, PedidoCreate)):
+        if isinstance(datos, str):
+            resultados.append(ResultadoLotePedido(indice=indice, error=datos))
+            continue
+        posiciones.append(indice)
+        lote.append((datos.cliente_id, {item.producto_id: item.cantidad for item in datos.items}))
+        resultados.append(None)
+    
+    # Realizamos todos los pedidos válidos con una única reserva de stock
+    for indice, resultado in zip(posiciones, tienda_service.realizar_pedidos(lote)):
+        if isinstance(resultado, ValueError):
+            resultados[indice] = ResultadoLotePedido(indice=indice, error=str(resultado))
+        else:
+            resultados[indice] = ResultadoLotePedido(
+                indice=indice, id=resultado.id, total=resultado.total
+            )
+    
+    fallidos = sum(1 for r in resultados if r.error is not None)
+    return LotePedidosRead(
+        total=len(resultados),
+        correctos=len(resultados) - fallidos,
+        fallidos=fallidos,
+        resultados=resultados
+    )
+
+
 @app.get("/usuarios/{cliente_id}/pedidos", response_model=List[PedidoRead])
-def listar_pedidos_cliente(cliente_id: UUID) -> List[PedidoRead]:
-    # Endpoint para listar todos los pedidos de un cliente
+async def listar_pedidos_cliente(
+    cliente_id: UUID,
+    request: Request,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    after: Optional[UUID] = Query(default=None, description="Id del último pedido de la página anterior"),
+) -> Response:
+    # Endpoint para listar los pedidos de un cliente por orden de fecha
+    # Admite filtrar por rango de fechas y paginar con 'limit' y 'after'
     try:
         # Verificamos que el usuario existe
         tienda_service.obtener_usuario(cliente_id)
-        # Obtenemos todos los pedidos del cliente
-        pedidos = tienda_service.listar_pedidos_usuario(cliente_id)
+    except ValueError as e:
+        # Si no existe el usuario, devolvemos un error 404
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    def renderizar() -> Tuple[bytes, Dict[str, str]]:
+        try:
+            # Obtenemos la página de pedidos del cliente usando el índice
+            pedidos = tienda_service.listar_pedidos_usuario(
+                cliente_id, desde=desde, hasta=hasta, limit=limit, after=after
+            )
+        except ValueError as e:
+            # Si el cursor no es válido, devolvemos un error 400
+            raise HTTPException(status_code=400, detail=str(e))
         
-        resultado = []
         # Convertimos cada pedido al formato PedidoRead
-        for pedido in pedidos:
-            items_read = []
-            for producto, cantidad in pedido.productos_cantidades.items():
-                items_read.append(PedidoItemRead(
-                    producto_id=producto.id,
-                    nombre_producto=producto.nombre,
-                    cantidad=cantidad,
-                    precio_unitario=producto.precio,
-                    subtotal=producto.precio * cantidad
-                ))
-            
-            resultado.append(PedidoRead(
-                id=pedido.id,
-                cliente_id=pedido.cliente.id,
-                nombre_cliente=pedido.cliente.nombre,
-                fecha=pedido.fecha,
-                items=items_read,
-                total=pedido.calcular_total()
-            ))
-        
-        return resultado
+        return pedidos_json(pedidos), {}
+    
+    # Cacheamos cada página según la versión del historial de este cliente
+    clave = ("pedidos", cliente_id, tuple(sorted(request.query_params.multi_items())))
+    version = tienda_service.versiones.entidad("pedidos", cliente_id)
+    return await respuesta_versionada(request, clave, version, renderizar, pesado=limit is None)
+
+
+@app.get("/pedidos/archivo", response_model=ArchivoPedidosRead)
+async def estado_archivo_pedidos() -> ArchivoPedidosRead:
+    # Endpoint para consultar cuántos pedidos hay en memoria y cuántos archivados
+    archivo = tienda_service.archivo
+    return ArchivoPedidosRead(
+        calientes=len(tienda_service.pedidos),
+        archivados=len(archivo),
+        segmentos=len(archivo.segmentos),
+        bytes_archivo=archivo.memoria(),
+    )
+
+
+@app.post("/pedidos/archivar", response_model=ArchivadoRead)
+async def archivar_pedidos(
+    antes: Optional[datetime] = Query(default=None, description="Archiva los pedidos anteriores a esta fecha"),
+) -> ArchivadoRead:
+    # Endpoint para compactar ya los pedidos antiguos (sin 'antes', según la política configurada)
+    inicio = time.perf_counter()
+    archivados = await tienda_async.ejecutar(tienda_service.archivar_pedidos, antes, pesado=True)
+    return ArchivadoRead(archivados=archivados, segundos=time.perf_counter() - inicio)
+
+
+# ------ RESERVAS ------ #
+
+@app.post("/reservas", response_model=ReservaRead, status_code=201)
+async def crear_reserva(datos: ReservaCreate) -> ReservaRead:
+    # Endpoint para apartar stock durante 'ttl_segundos' (se libera solo si caduca)
+    admitir_cliente(datos.cliente_id, "/reservas")
+    try:
+        items_dict: Dict[UUID, int] = {item.producto_id: item.cantidad for item in datos.items}
+        retencion = await tienda_async.retener_stock(datos.cliente_id, items_dict, datos.ttl_segundos)
+        return reserva_a_read(retencion)
     except ValueError as e:
-        # Si no existe el usuario, devolvemos un error 404
+        # Cliente o producto inexistente o sin stock suficiente
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/reservas/{reserva_id}", response_model=ReservaRead)
+async def obtener_reserva(reserva_id: UUID) -> ReservaRead:
+    # Endpoint para consultar una reserva activa
+    try:
+        return reserva_a_read(tienda_service.obtener_retencion(reserva_id))
+    except RetencionNoEncontrada as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.post("/reservas/{reserva_id}/confirmar", response_model=PedidoRead, status_code=201)
+async def confirmar_reserva(reserva_id: UUID) -> Response:
+    # Endpoint para convertir una reserva en un pedido con el stock que tenía apartado
+    try:
+        pedido = await tienda_async.confirmar_retencion(reserva_id)
+        return respuesta_json(pedido_json(pedido), status_code=201)
+    except RetencionNoEncontrada as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        # Algún producto se eliminó mientras estaba reservado
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/reservas/{reserva_id}", status_code=204)
+async def cancelar_reserva(reserva_id: UUID) -> None:
+    # Endpoint para cancelar una reserva y devolver su stock
+    try:
+        await tienda_async.cancelar_retencion(reserva_id)
+    except RetencionNoEncontrada as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+# ------ EXPORTACIÓN ------ #
+
+@app.get("/export/productos", response_class=StreamingResponse)
+async def exportar_catalogo(
+    formato: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    tipo: Optional[str] = None,
+) -> StreamingResponse:
+    # Endpoint para descargar el catálogo completo en NDJSON o CSV
+    # Se genera por páginas a medida que se envía (memoria constante)
+    return StreamingResponse(
+        exportar_productos(tienda_service.iterar_productos(tipo=tipo), formato),
+        media_type=FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="productos.{formato}"'},
+    )
+
+
+@app.get("/export/pedidos", response_class=StreamingResponse)
+async def exportar_historial(
+    formato: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    cliente_id: Optional[UUID] = None,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+) -> StreamingResponse:
+    # Endpoint para descargar los pedidos (de todos los clientes o de uno) en NDJSON o CSV
+    # En CSV hay una fila por línea de pedido
+    if cliente_id is not None:
+        try:
+            # Verificamos que el usuario existe
+            tienda_service.obtener_usuario(cliente_id)
+        except ValueError as e:
+            # Si no existe el usuario, devolvemos un error 404
+            raise HTTPException(status_code=404, detail=str(e))
+    return StreamingResponse(
+        exportar_pedidos(tienda_service.iterar_pedidos(cliente_id, desde=desde, hasta=hasta), formato),
+        media_type=FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="pedidos.{formato}"'},
+    )
+
+
+# ------ EVENTOS ------ #
+
+@app.websocket("/eventos/productos")
+async def eventos_productos_ws(
+    websocket: WebSocket,
+    producto_id: Optional[List[UUID]] = Query(default=None),
+    tipo: Optional[str] = None,
+) -> None:
+    # Canal WebSocket con los cambios de productos (altas, stock y bajas), filtrado
+    # por ids y/o tipo. Cada mensaje es un array JSON con el último estado de cada
+    # producto que cambió desde el mensaje anterior
+    await websocket.accept()
+    canal = tienda_service.canal_stock
+    suscripcion = canal.suscribir(producto_id, tipo)
+    
+    async def vigilar_cierre() -> None:
+        # El cliente no envía nada: solo esperamos a que se desconecte
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            suscripcion.cerrar()
+    
+    vigilante = asyncio.create_task(vigilar_cierre())
+    try:
+        while (eventos := await suscripcion.siguientes()) is not None:
+            await websocket.send_text((b"[" + b",".join(eventos) + b"]").decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        vigilante.cancel()
+        canal.cancelar(suscripcion)
+
+
+@app.get("/eventos/productos", response_class=StreamingResponse)
+async def eventos_productos_sse(
+    producto_id: Optional[List[UUID]] = Query(default=None),
+    tipo: Optional[str] = None,
+) -> StreamingResponse:
+    # El mismo canal como Server-Sent Events: un 'data:' por producto cambiado y un
+    # comentario cada 15 s sin cambios para mantener abierta la conexión
+    async def flujo():
+        canal = tienda_service.canal_stock
+        suscripcion = canal.suscribir(producto_id, tipo)
+        try:
+            yield b": conectado\n\n"
+            while (eventos := await suscripcion.siguientes(espera=15)) is not None:
+                yield b"".join(b"data: " + evento + b"\n\n" for evento in eventos) if eventos else b": sigue\n\n"
+        finally:
+            canal.cancelar(suscripcion)
+    
+    return StreamingResponse(flujo(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# ------ ESTADÍSTICAS ------ #
+
+@app.get("/estadisticas/resumen", response_model=ResumenVentasRead)
+async def resumen_ventas() -> ResumenVentasRead:
+    # Endpoint con los totales de ventas (se leen de los agregados, sin recorrer pedidos)
+    resumen = tienda_service.estadisticas.resumen()
+    return ResumenVentasRead(
+        pedidos=resumen["pedidos"],
+        unidades=resumen["unidades"],
+        ingresos=resumen["ingresos"] / 100
+    )
+
+
+@app.get("/estadisticas/productos", response_model=List[VentasProductoRead])
+async def top_productos(
+    n: int = Query(default=10, ge=1, le=100),
+    criterio: str = Query(default="unidades", pattern="^(unidades|ingresos)$"),
+) -> List[VentasProductoRead]:
+    # Endpoint con los productos más vendidos por unidades o por ingresos
+    return [
+        VentasProductoRead(producto_id=p.id, nombre=p.nombre, unidades=unidades, ingresos=ingresos / 100)
+        for p, unidades, ingresos in tienda_service.estadisticas.top_productos(n, criterio)
+    ]
+
+
+@app.get("/estadisticas/productos/{producto_id}", response_model=VentasProductoRead)
+async def ventas_producto(producto_id: UUID) -> VentasProductoRead:
+    # Endpoint con las ventas acumuladas de un producto
+    try:
+        producto = tienda_service.obtener_producto(producto_id)
+    except ValueError as e:
+        # Si no existe, devolvemos un error 404
+        raise HTTPException(status_code=404, detail=str(e))
+    unidades, ingresos = tienda_service.estadisticas.producto(producto)
+    return VentasProductoRead(
+        producto_id=producto.id, nombre=producto.nombre, unidades=unidades, ingresos=ingresos / 100
+    )
+
+
+@app.get("/estadisticas/clientes", response_model=List[VentasClienteRead])
+async def top_clientes(n: int = Query(default=10, ge=1, le=100)) -> List[VentasClienteRead]:
+    # Endpoint con los clientes que más han gastado
+    return [
+        VentasClienteRead(
+            cliente_id=c.id, nombre=c.nombre, pedidos=pedidos, unidades=unidades, gasto=gasto / 100
+        )
+        for c, pedidos, unidades, gasto in tienda_service.estadisticas.top_clientes(n)
+    ]
+
+
+@app.get("/estadisticas/clientes/{cliente_id}", response_model=VentasClienteRead)
+async def ventas_cliente(cliente_id: UUID) -> VentasClienteRead:
+    # Endpoint con las compras acumuladas de un cliente
+    try:
+        cliente = tienda_service.obtener_usuario(cliente_id)
+    except ValueError as e:
+        # Si no existe, devolvemos un error 404
+        raise HTTPException(status_code=404, detail=str(e))
+    pedidos, unidades, gasto = tienda_service.estadisticas.cliente(cliente)
+    return VentasClienteRead(
+        cliente_id=cliente.id, nombre=cliente.nombre, pedidos=pedidos, unidades=unidades, gasto=gasto / 100
+    )
+
+
+@app.get("/estadisticas/dias", response_model=List[VentasDiaRead])
+async def ventas_por_dia(desde: Optional[date] = None, hasta: Optional[date] = None) -> List[VentasDiaRead]:
+    # Endpoint con las ventas de cada día (opcionalmente entre dos fechas, ambas incluidas)
+    return [
+        VentasDiaRead(dia=dia, pedidos=pedidos, unidades=unidades, ingresos=ingresos / 100)
+        for dia, pedidos, unidades, ingresos in tienda_service.estadisticas.por_dia(desde, hasta)
+    ]
+
+
+@app.post("/estadisticas/recalcular", response_model=RecalculoRead)
+async def recalcular_estadisticas() -> RecalculoRead:
+    # Endpoint para reconstruir las estadísticas desde todos los pedidos (en un hilo)
+    inicio = time.perf_counter()
+    lineas = await tienda_async.ejecutar(tienda_service.recalcular_estadisticas, pesado=True)
+    return RecalculoRead(lineas=lineas, segundos=time.perf_counter() - inicio)
+
+
+# ------ INFORMES ------ #
+
+def reporte_a_read(trabajo: TrabajoReporte) -> ReporteRead:
+    return ReporteRead(
+        id=trabajo.id,
+        tipo=trabajo.tipo,
+        parametros=trabajo.parametros,
+        estado=trabajo.estado,
+        version=trabajo.version,
+        creado=trabajo.creado,
+        segundos=trabajo.segundos,
+        resultado=trabajo.resultado,
+        error=trabajo.error,
+    )
+
+
+@app.post("/reportes", response_model=ReporteRead, status_code=202)
+async def crear_reporte(datos: ReporteCreate, response: Response) -> ReporteRead:
+    # Endpoint para lanzar un informe en los procesos de informes; se consulta en
+    # /reportes/{id}. Con los mismos datos y parámetros devuelve el informe ya hecho
+    try:
+        # La instantánea de los pedidos se prepara en un hilo
+        trabajo = await run_in_threadpool(gestor_reportes.enviar, datos.tipo, datos.model_dump(exclude={"tipo"}))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["Location"] = f"/reportes/{trabajo.id}"
+    return reporte_a_read(trabajo)
+
+
+@app.get("/reportes/{reporte_id}", response_model=ReporteRead)
+async def obtener_reporte(reporte_id: UUID) -> ReporteRead:
+    # Endpoint para consultar el estado de un informe y, cuando termina, su resultado
+    try:
+        return reporte_a_read(gestor_reportes.obtener(reporte_id))
+    except ReporteNoEncontrado as e:
         raise HTTPException(status_code=404, detail=str(e))
+
+
+# ------ DIAGNÓSTICO ------ #
+
+@app.get("/diagnostico", response_model=DiagnosticoRead)
+async def estado_diagnostico(
+    x_usuario_id: Optional[UUID] = Header(default=None), x_diagnostico_token: Optional[str] = Header(default=None)
+) -> DiagnosticoRead:
+    # Endpoint con el estado del perfilador, la traza de memoria y el registro de lentas
+    return DiagnosticoRead(**exigir_admin(x_usuario_id, x_diagnostico_token).estado())
+
+
+@app.post("/diagnostico/perfil", response_model=PerfilRead, status_code=201)
+async def iniciar_perfil(
+    datos: Optional[PerfilCreate] = None,
+    x_usuario_id: Optional[UUID] = Header(default=None),
+    x_diagnostico_token: Optional[str] = Header(default=None),
+) -> PerfilRead:
+    # Endpoint para empezar a perfilar por muestreo (se para solo tras 'segundos')
+    perfilador = exigir_admin(x_usuario_id, x_diagnostico_token).perfilador
+    datos = datos or PerfilCreate()
+    try:
+        perfilador.iniciar(datos.intervalo_ms / 1000, datos.segundos)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PerfilRead(**perfilador.estado())
+
+
+@app.delete("/diagnostico/perfil", response_model=PerfilRead)
+async def detener_perfil(
+    x_usuario_id: Optional[UUID] = Header(default=None), x_diagnostico_token: Optional[str] = Header(default=None)
+) -> PerfilRead:
+    # Endpoint para parar el perfilador (las pilas se siguen pudiendo descargar)
+    perfilador = exigir_admin(x_usuario_id, x_diagnostico_token).perfilador
+    await run_in_threadpool(perfilador.detener)
+    return PerfilRead(**perfilador.estado())
+
+
+@app.get("/diagnostico/perfil", response_class=Response)
+async def pilas_perfil(
+    x_usuario_id: Optional[UUID] = Header(default=None), x_diagnostico_token: Optional[str] = Header(default=None)
+) -> Response:
+    # Endpoint con las pilas colapsadas del último perfilado (para flamegraph.pl o speedscope)
+    perfilador = exigir_admin(x_usuario_id, x_diagnostico_token).perfilador
+    return Response(content=perfilador.colapsadas(), media_type="text/plain; charset=utf-8")
+
+
+@app.post("/diagnostico/memoria", response_model=MemoriaRead, status_code=201)
+async def iniciar_memoria(
+    datos: Optional[MemoriaCreate] = None,
+    x_usuario_id: Optional[UUID] = Header(default=None),
+    x_diagnostico_token: Optional[str] = Header(default=None),
+) -> MemoriaRead:
+    # Endpoint para arrancar tracemalloc
+    memoria = exigir_admin(x_usuario_id, x_diagnostico_token).memoria
+    try:
+        memoria.iniciar((datos or MemoriaCreate()).marcos)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return MemoriaRead(**memoria.estado())
+
+
+@app.delete("/diagnostico/memoria", response_model=MemoriaRead)
+async def detener_memoria(
+    x_usuario_id: Optional[UUID] = Header(default=None), x_diagnostico_token: Optional[str] = Header(default=None)
+) -> MemoriaRead:
+    # Endpoint para parar tracemalloc y olvidar las instantáneas
+    memoria = exigir_admin(x_usuario_id, x_diagnostico_token).memoria
+    memoria.detener()
+    return MemoriaRead(**memoria.estado())
+
+
+@app.post("/diagnostico/memoria/instantaneas", response_model=InstantaneaMemoriaRead, status_code=201)
+async def tomar_instantanea(
+    x_usuario_id: Optional[UUID] = Header(default=None), x_diagnostico_token: Optional[str] = Header(default=None)
+) -> InstantaneaMemoriaRead:
+    # Endpoint para tomar una instantánea de la memoria y contar los objetos por tipo
+    memoria = exigir_admin(x_usuario_id, x_diagnostico_token).memoria
+    try:
+        return InstantaneaMemoriaRead(**await run_in_threadpool(memoria.instantanea))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/diagnostico/memoria/diferencia", response_model=DiferenciaMemoriaRead)
+async def diferencia_memoria(
+    desde: Optional[int] = Query(default=None, description="Instantánea inicial (por defecto, la anterior a la final)"),
+    hasta: Optional[int] = Query(default=None, description="Instantánea final (por defecto, la última)"),
+    n: int = Query(default=20, ge=1, le=1000, description="Líneas de código que se muestran"),
+    x_usuario_id: Optional[UUID] = Header(default=None),
+    x_diagnostico_token: Optional[str] = Header(default=None),
+) -> DiferenciaMemoriaRead:
+    # Endpoint con el crecimiento de memoria entre dos instantáneas, por línea y por tipo
+    memoria = exigir_admin(x_usuario_id, x_diagnostico_token).memoria
+    try:
+        return DiferenciaMemoriaRead(**await run_in_threadpool(memoria.diferencia, desde, hasta, n))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/diagnostico/lentas", response_model=LentasRead, status_code=201)
+async def iniciar_lentas(
+    datos: Optional[LentasCreate] = None,
+    x_usuario_id: Optional[UUID] = Header(default=None),
+    x_diagnostico_token: Optional[str] = Header(default=None),
+) -> LentasRead:
+    # Endpoint para registrar las peticiones lentas (o cambiar el umbral)
+    lentas = exigir_admin(x_usuario_id, x_diagnostico_token).lentas
+    datos = datos or LentasCreate()
+    lentas.iniciar(tienda_service, datos.umbral_ms / 1000, datos.max_entradas)
+    return LentasRead(**lentas.estado())
+
+
+@app.delete("/diagnostico/lentas", response_model=LentasRead)
+async def detener_lentas(
+    x_usuario_id: Optional[UUID] = Header(default=None), x_diagnostico_token: Optional[str] = Header(default=None)
+) -> LentasRead:
+    # Endpoint para dejar de registrar peticiones lentas (las guardadas se conservan)
+    lentas = exigir_admin(x_usuario_id, x_diagnostico_token).lentas
+    lentas.detener()
+    return LentasRead(**lentas.estado())
+
+
+@app.get("/diagnostico/lentas", response_model=List[PeticionLentaRead])
+async def peticiones_lentas(
+    x_usuario_id: Optional[UUID] = Header(default=None), x_diagnostico_token: Optional[str] = Header(default=None)
+) -> List[PeticionLentaRead]:
+    # Endpoint con las peticiones lentas guardadas, de la más reciente a la más antigua
+    lentas = exigir_admin(x_usuario_id, x_diagnostico_token).lentas
+    return [PeticionLentaRead(**entrada) for entrada in reversed(list(lentas.entradas))]
+
+
+# ------ MÉTRICAS ------ #
+
+@app.get("/metrics", response_class=Response)
+async def exportar_metricas() -> Response:
+    # Endpoint con todas las métricas en formato de texto de Prometheus
+    return Response(
+        content=metricas_http.exportar() + tienda_service.metricas.exportar(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+# ------ CACHÉ ------ #
+
+@app.get("/cache/estadisticas", response_model=EstadisticasCacheRead)
+async def estadisticas_cache() -> EstadisticasCacheRead:
+    # Endpoint para consultar el uso de la caché de respuestas
+    return EstadisticasCacheRead(**cache_respuestas.estadisticas())
@@ -1,11 +1,22 @@
 from __future__ import annotations
+import struct
 from datetime import datetime   # Importamos datetime para registrar la fecha y hora del pedido
 from uuid import uuid4, UUID
-from typing import Dict
+from typing import Dict, Iterator, List, Tuple
+
+# Cada línea se empaqueta como (cantidad, precio unitario, subtotal) en un único
+# bloque de bytes; los importes se guardan en céntimos enteros para evitar errores
+# de redondeo de los float
+_LINEA = struct.Struct("<qqq")
 
 
 class Pedido:
     # Usamos UUID en lugar de contador incremental para asignar IDs únicos
+    # Usamos __slots__ y guardamos las líneas empaquetadas en lugar de un diccionario:
+    # una tupla con los productos y un bloque de bytes con cantidades e importes
+    # El precio de cada línea y el total se fijan al crear el pedido, así que el
+    # histórico no cambia aunque después se modifique el precio de un producto
+    __slots__ = ("id", "cliente", "fecha", "total_centimos", "_productos", "_lineas")
     
     def __init__(self, cliente, productos_cantidades):
         # Asignamos un ID único al pedido usando UUID4
@@ -13,24 +24,82 @@ class Pedido:
         
         # Guardamos el cliente que hace el pedido
         self.cliente = cliente
-        # Guardamos un diccionario con los productos y sus cantidades
-        self.productos_cantidades = productos_cantidades
+        # Guardamos los productos y, empaquetados, sus cantidades y el precio unitario
+        # en el momento de la compra
+        self._empaquetar([(p, c, p.precio_centimos) for p, c in productos_cantidades.items()])
         # Registramos la fecha y hora en que se realiza el pedido
         self.fecha = datetime.now()
     
+    @classmethod
+    def restaurar(cls, pedido_id: UUID, cliente, fecha: datetime, lineas: List[Tuple]) -> Pedido:
+        # Reconstruimos un pedido ya existente (por ejemplo al cargarlo desde disco)
+        # 'lineas' contiene tuplas (producto, cantidad, precio_unitario en céntimos)
+        pedido = cls.__new__(cls)
+        pedido.id = pedido_id
+        pedido.cliente = cliente
+        pedido.fecha = fecha
+        pedido._empaquetar(lineas)
+        return pedido
+    
+    @classmethod
+    def desde_columnas(
+        cls, pedido_id: UUID, cliente, fecha: datetime, productos: Tuple, lineas: bytes, total_centimos: int
+    ) -> Pedido:
+        # Reconstruimos un pedido a partir de sus líneas ya empaquetadas (por ejemplo
+        # desde el archivo de pedidos antiguos) sin volver a calcular los importes
+        pedido = cls.__new__(cls)
+        pedido.id = pedido_id
+        pedido.cliente = cliente
+        pedido.fecha = fecha
+        pedido._productos = productos
+        pedido._lineas = lineas
+        pedido.total_centimos = total_centimos
+        return pedido
+    
+    def _empaquetar(self, lineas: List[Tuple]) -> None:
+        # Calculamos una sola vez los subtotales y el total del pedido
+        self._productos = tuple(producto for producto, _, _ in lineas)
+        partes = []
+        total = 0
+        for _, cantidad, precio in lineas:
+            subtotal = precio * cantidad
+            total += subtotal
+            partes.append(_LINEA.pack(cantidad, precio, subtotal))
+        self._lineas = b"".join(partes)
+        self.total_centimos = total
+    
+    def lineas(self) -> Iterator[Tuple]:
+        # Recorremos las líneas como tuplas (producto, cantidad, precio_unitario, subtotal)
+        # con los importes en céntimos
+        for producto, (cantidad, precio, subtotal) in zip(self._productos, _LINEA.iter_unpack(self._lineas)):
+            yield producto, cantidad, precio, subtotal
+    
+    def columnas(self) -> Tuple[Tuple, bytes]:
+        # Devolvemos los productos y el bloque empaquetado de las líneas tal cual
+        # (tres int64 little-endian por línea: cantidad, precio y subtotal en céntimos)
+        # para poder agregar muchos pedidos de golpe sin desempaquetar línea a línea
+        return self._productos, self._lineas
+    
+    @property
+    def productos_cantidades(self) -> Dict:
+        # Mantenemos la vista de diccionario producto -> cantidad para compatibilidad
+        return {producto: cantidad for producto, cantidad, _, _ in self.lineas()}
+    
+    @property
+    def total(self) -> float:
+        # Importe total en euros a partir del valor guardado en céntimos
+        return self.total_centimos / 100
+    
     def calcular_total(self):
-        # Calculamos el importe total del pedido multiplicando precio por cantidad
-        total = 0.0
-        for producto, cantidad in self.productos_cantidades.items():
-            total += producto.precio * cantidad
-        return total
+        # El total se calcula al crear el pedido; aquí solo lo devolvemos en euros
+        return self.total
     
     def __str__(self):
         # Generamos una representación en texto del pedido
         lineas = [f"Pedido #{self.id} - Cliente: {self.cliente.nombre} - Fecha: {self.fecha}"]
         # Añadimos al texto cada producto con su cantidad y subtotal
-        for producto, cantidad in self.productos_cantidades.items():
-            lineas.append(f"  - {producto.nombre} x {cantidad} = {producto.precio * cantidad:.2f}€")
+        for producto, cantidad, _, subtotal in self.lineas():
+            lineas.append(f"  - {producto.nombre} x {cantidad} = {subtotal / 100:.2f}€")
         # Añadimos el total al final
         lineas.append(f"TOTAL: {self.calcular_total():.2f}€")
         return "\n".join(lineas)
@@ -1,8 +1,29 @@
 from __future__ import annotations
 from uuid import uuid4, UUID
 
+# Clase de producto -> atributos que 'copia' traslada tal cual (los demás se fijan aparte)
+_CAMPOS_COPIA = {}
+
+
+def _campos_copia(clase):
+    campos = _CAMPOS_COPIA.get(clase)
+    if campos is None:
+        propios = ("stock", "retenido")
+        campos = tuple(
+            campo for c in reversed(clase.__mro__) for campo in getattr(c, "__slots__", ()) if campo not in propios
+        )
+        _CAMPOS_COPIA[clase] = campos
+    return campos
+
 
 class Producto:
+    # Usamos __slots__ para no reservar un __dict__ por cada producto
+    # 'retenido' son las unidades apartadas por reservas pendientes de confirmar (ya
+    # descontadas de 'stock', que siempre es el stock disponible para vender)
+    __slots__ = ("id", "nombre", "precio", "stock", "retenido")
+    # Etiqueta de tipo de cada clase de producto (se usa en la API y en los índices)
+    tipo = "generico"
+    
     def __init__(self, nombre, precio, stock):
         # Generamos un identificador único para cada producto
         self.id = uuid4()
@@ -12,6 +33,8 @@ class Producto:
         self.precio = precio
         # Guardamos el stock inicial
         self.stock = stock
+        # Inicialmente no hay unidades retenidas
+        self.retenido = 0
         
         # Validamos que el precio no sea negativo
         if self.precio < 0:
@@ -23,8 +46,13 @@ class Producto:
         if not self.nombre:
             raise ValueError("El nombre no puede estar vacío.")
     
+    @property
+    def precio_centimos(self):
+        # Precio en céntimos enteros (los pedidos guardan los importes así)
+        return round(self.precio * 100)
+    
     def hay_stock(self, cantidad):
-        # Comprobamos si tenemos suficientes unidades disponibles
+        # Comprobamos si tenemos suficientes unidades disponibles (sin contar las retenidas)
         return cantidad > 0 and self.stock >= cantidad
     
     def actualizar_stock(self, delta):
@@ -36,12 +64,25 @@ class Producto:
         # Actualizamos el stock
         self.stock = nuevo_stock
     
+    def copia(self, stock, retenido):
+        # Copia desvinculada del producto con el stock y las unidades retenidas de una
+        # versión ya publicada del catálogo: no cambia aunque cambie el original
+        copia = object.__new__(type(self))
+        for campo in _campos_copia(type(self)):
+            setattr(copia, campo, getattr(self, campo))
+        copia.stock = stock
+        copia.retenido = retenido
+        return copia
+    
     def __str__(self):
         # Devolvemos una representación en texto del producto
         return f"[Producto#{self.id}] {self.nombre} - {self.precio:.2f}€ (stock: {self.stock})"
 
 
 class ProductoElectronico(Producto):
+    __slots__ = ("garantia_meses",)
+    tipo = "electronico"
+    
     def __init__(self, nombre, precio, stock, garantia_meses=24):
         # Llamamos al constructor de la clase padre Producto
         super().__init__(nombre, precio, stock)
@@ -57,6 +98,9 @@ class ProductoElectronico(Producto):
 
 
 class ProductoRopa(Producto):
+    __slots__ = ("talla", "color")
+    tipo = "ropa"
+    
     def __init__(self, nombre, precio, stock, talla, color):
         # Llamamos al constructor de la clase padre Producto
         super().__init__(nombre, precio, stock)
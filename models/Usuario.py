@@ -4,6 +4,8 @@ from uuid import uuid4
 class Usuario:
     # Definimos la clase base que representa un usuario de la tienda
     # Usamos UUID en lugar de contador incremental para asignar IDs únicos
+    # Usamos __slots__ para no reservar un __dict__ por cada usuario
+    __slots__ = ("id", "nombre", "email")
     
     def __init__(self, nombre, email):
         # Asignamos un ID único usando UUID4
@@ -31,6 +33,8 @@ class Usuario:
 
 class Cliente(Usuario):
     # Definimos un cliente que hereda de Usuario y añade dirección postal
+    __slots__ = ("direccion",)
+    
     def __init__(self, nombre, email, direccion):
         # Llamamos al constructor de Usuario
         super().__init__(nombre, email)
@@ -48,6 +52,8 @@ class Cliente(Usuario):
 
 class Administrador(Usuario):
     # Definimos un administrador que hereda de Usuario
+    __slots__ = ()
+    
     def __init__(self, nombre, email):
         # Llamamos al constructor de Usuario
         super().__init__(nombre, email)
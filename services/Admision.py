@@ -0,0 +1,281 @@
+from __future__ import annotations
+import asyncio
+import math
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+from uuid import UUID
+
+from pydantic_core import to_json
+from starlette.routing import compile_path
+
+# Rutas del camino de compra: tienen prioridad y un número máximo en curso
+RUTAS_PEDIDO = frozenset(("/pedidos", "/pedidos/batch", "/reservas"))
+# Rutas cuyo cliente viene en el cuerpo: el límite por cliente lo aplica el endpoint
+RUTAS_CLIENTE_EN_CUERPO = frozenset((("POST", "/pedidos"), ("POST", "/reservas")))
+
+_USUARIO_EN_RUTA = re.compile(r"/usuarios/([0-9a-fA-F-]{32,36})(?:/|$)")
+
+
+class LimiteSuperado(Exception):
+    # Petición rechazada por el control de admisión
+    # 'estado' es 429 (el cliente supera su límite) o 503 (la tienda está saturada) y
+    # 'espera' los segundos tras los que tiene sentido reintentar
+    def __init__(self, mensaje: str, estado: int, espera: float):
+        super().__init__(mensaje)
+        self.estado = estado
+        self.espera = espera
+
+    @property
+    def reintentar(self) -> str:
+        # Valor de la cabecera Retry-After (segundos enteros, como mínimo 1)
+        return str(max(1, math.ceil(self.espera)))
+
+
+class LimitadorTokens:
+    # Cubo de tokens por clave: 'tasa' peticiones por segundo con ráfagas de hasta 'rafaga'
+    # De cada clave solo se guarda un número, el instante en que su cubo vuelve a estar
+    # lleno (el algoritmo GCRA, equivalente al cubo de tokens). Una clave con el cubo
+    # lleno no aporta nada y se olvida: las claves que gastan se mueven al final y las
+    # inactivas se purgan desde el principio. Con más de 'max_claves' se olvidan las
+    # más antiguas, que vuelven a empezar con el cubo lleno.
+    # Solo se usa desde el bucle de eventos, así que no necesita locks.
+
+    def __init__(self, tasa: float, rafaga: int, max_claves: int = 100_000, reloj: Callable[[], float] = time.monotonic):
+        if tasa <= 0 or rafaga < 1 or max_claves <= 0:
+            raise ValueError("La tasa, la ráfaga y el número de claves del limitador deben ser mayores que cero.")
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.max_claves = max_claves
+        self._reloj = reloj
+        # Tiempo que repone un token y tiempo que tarda en llenarse el cubo vacío
+        self._intervalo = 1.0 / tasa
+        self._capacidad = rafaga * self._intervalo
+        self._llenos: OrderedDict[Hashable, float] = OrderedDict()
+        # Estadísticas
+        self.admitidas = 0
+        self.rechazadas = 0
+        self.olvidadas = 0
+
+    def __len__(self) -> int:
+        return len(self._llenos)
+
+    def consumir(self, clave: Hashable) -> float:
+        # Gastamos un token de la clave: devolvemos 0 si se admite o, si el cubo está
+        # vacío, los segundos que faltan para el siguiente token
+        ahora = self._reloj()
+        lleno = max(self._llenos.get(clave, ahora), ahora) + self._intervalo
+        if lleno - ahora > self._capacidad:
+            self.rechazadas += 1
+            return lleno - ahora - self._capacidad
+        self._llenos[clave] = lleno
+        self._llenos.move_to_end(clave)
+        self.admitidas += 1
+        self._purgar(ahora)
+        return 0.0
+
+    def _purgar(self, ahora: float) -> None:
+        # Olvidamos las claves con el cubo ya lleno y las que sobran (tiempo constante amortizado)
+        while self._llenos:
+            clave, lleno = next(iter(self._llenos.items()))
+            if lleno > ahora and len(self._llenos) <= self.max_claves:
+                break
+            self._llenos.popitem(last=False)
+            if lleno > ahora:
+                self.olvidadas += 1
+
+
+def clasificar(metodo: str, ruta: str) -> Optional[str]:
+    # Clase de una petición: "pedido" (prioritaria), "lectura" (la primera que se
+    # descarta), "escritura" o None para las que no pasan por el control (las
+    # métricas y las conexiones largas de eventos)
+    if ruta == "/metrics" or ruta.startswith("/eventos/"):
+        return None
+    if metodo in ("GET", "HEAD"):
+        return "lectura"
+    if metodo == "POST" and (ruta in RUTAS_PEDIDO or (ruta.startswith("/reservas/") and ruta.endswith("/confirmar"))):
+        return "pedido"
+    return "escritura"
+
+
+def identificar(scope) -> Hashable:
+    # Clave del cliente de una petición: el id de usuario de la ruta si lo hay (como
+    # entero, igual que el cliente_id de los pedidos) o la dirección IP
+    coincidencia = _USUARIO_EN_RUTA.match(scope["path"])
+    if coincidencia:
+        try:
+            return UUID(coincidencia.group(1)).int
+        except ValueError:
+            pass
+    cliente = scope.get("client")
+    return cliente[0] if cliente else "desconocido"
+
+
+class ControlAdmision:
+    # Decide qué peticiones entran cuando la tienda va cargada
+    #   - límites por cliente: un cubo de tokens por cliente en cada ruta configurada
+    #     ('limites_ruta', plantilla -> (tasa, ráfaga)) y uno común para el resto de
+    #     rutas ('limite_cliente'); superarlo es un 429
+    #   - como mucho 'max_pedidos' peticiones de compra en curso; las siguientes
+    #     esperan en orden de llegada hasta 'espera_pedido' segundos y después son un 503
+    #   - como mucho 'max_lecturas' lecturas en curso, y ninguna nueva mientras haya
+    #     compras esperando plaza: las lecturas sobrantes son un 503 inmediato
+    # Sin nada configurado no limita nada. Solo se usa desde el bucle de eventos.
+
+    def __init__(
+        self,
+        limite_cliente: Optional[Tuple[float, int]] = None,
+        limites_ruta: Optional[Dict[Tuple[str, str], Tuple[float, int]]] = None,
+        max_pedidos: int = 0,
+        espera_pedido: float = 2.0,
+        max_lecturas: int = 0,
+        max_claves: int = 100_000,
+        reloj: Callable[[], float] = time.monotonic,
+    ):
+        if max_pedidos < 0 or max_lecturas < 0 or espera_pedido <= 0:
+            raise ValueError("Los máximos en curso no pueden ser negativos y la espera debe ser mayor que cero.")
+        self._por_defecto = LimitadorTokens(*limite_cliente, max_claves, reloj) if limite_cliente else None
+        self._por_ruta: List[Tuple[str, re.Pattern, LimitadorTokens]] = [
+            (metodo.upper(), compile_path(plantilla)[0], LimitadorTokens(tasa, rafaga, max_claves, reloj))
+            for (metodo, plantilla), (tasa, rafaga) in (limites_ruta or {}).items()
+        ]
+        self.max_pedidos = max_pedidos
+        self.espera_pedido = espera_pedido
+        self.max_lecturas = max_lecturas
+        self.pedidos_en_curso = 0
+        self.lecturas_en_curso = 0
+        # Compras esperando plaza, en orden de llegada
+        self._esperando: Deque[asyncio.Future] = deque()
+        # Estadísticas
+        self.rechazos = {"cliente": 0, "pedidos": 0, "lecturas": 0}
+
+    @property
+    def activo(self) -> bool:
+        return bool(self._por_defecto is not None or self._por_ruta or self.max_pedidos or self.max_lecturas)
+
+    def limitar(self, cliente: Hashable, metodo: str, ruta: str) -> None:
+        # Gastamos un token del cliente en el cubo de la ruta (LimiteSuperado si no quedan)
+        limitador = self._por_defecto
+        for metodo_ruta, patron, limitador_ruta in self._por_ruta:
+            if metodo_ruta == metodo and patron.match(ruta):
+                limitador = limitador_ruta
+                break
+        if limitador is None:
+            return
+        espera = limitador.consumir(cliente)
+        if espera:
+            self.rechazos["cliente"] += 1
+            raise LimiteSuperado("Demasiadas peticiones de este cliente, inténtalo más tarde.", 429, espera)
+
+    async def entrar_pedido(self) -> None:
+        # Ocupamos una plaza de compra, esperando nuestro turno si no hay ninguna libre
+        if not self.max_pedidos or (self.pedidos_en_curso < self.max_pedidos and not self._esperando):
+            self.pedidos_en_curso += 1
+            return
+        futuro = asyncio.get_running_loop().create_future()
+        self._esperando.append(futuro)
+        try:
+            await asyncio.wait_for(futuro, self.espera_pedido)
+        except BaseException as e:
+            if futuro.done() and not futuro.cancelled():
+                # Nos cedieron la plaza justo al cancelarnos: pasa a la siguiente compra
+                self.salir_pedido()
+            else:
+                futuro.cancel()
+                try:
+                    self._esperando.remove(futuro)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.rechazos["pedidos"] += 1
+                raise LimiteSuperado("La tienda está saturada, inténtalo de nuevo.", 503, 1.0) from None
+            raise
+
+    def salir_pedido(self) -> None:
+        # Cedemos la plaza a la primera compra que espera o la dejamos libre
+        while self._esperando:
+            futuro = self._esperando.popleft()
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.pedidos_en_curso -= 1
+
+    def entrar_lectura(self) -> None:
+        # Las lecturas no esperan: si sobran se descartan en el acto
+        if self._esperando or (self.max_lecturas and self.lecturas_en_curso >= self.max_lecturas):
+            self.rechazos["lecturas"] += 1
+            raise LimiteSuperado("La tienda está saturada, inténtalo de nuevo.", 503, 1.0)
+        self.lecturas_en_curso += 1
+
+    def salir_lectura(self) -> None:
+        self.lecturas_en_curso -= 1
+
+    def clientes(self) -> int:
+        # Claves que ocupan memoria ahora mismo en los limitadores
+        limitadores = [limitador for _, _, limitador in self._por_ruta]
+        if self._por_defecto is not None:
+            limitadores.append(self._por_defecto)
+        return sum(len(limitador) for limitador in limitadores)
+
+    def estadisticas(self) -> Dict[str, float]:
+        # Resumen: peticiones en curso, compras en espera, claves guardadas y rechazos por motivo
+        return {
+            "pedidos_en_curso": self.pedidos_en_curso,
+            "pedidos_esperando": len(self._esperando),
+            "lecturas_en_curso": self.lecturas_en_curso,
+            "clientes": self.clientes(),
+            **{f"rechazos_{motivo}": total for motivo, total in self.rechazos.items()},
+        }
+
+
+class MiddlewareAdmision:
+    # Middleware ASGI que aplica el control de admisión antes de enrutar la petición
+    # Las rechazadas reciben un JSON {"detail": ...} con la cabecera Retry-After y no
+    # llegan a la aplicación
+
+    def __init__(self, app, control: ControlAdmision):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        metodo, ruta = scope["method"], scope["path"]
+        clase = clasificar(metodo, ruta)
+        if clase is None:
+            await self.app(scope, receive, send)
+            return
+        control = self.control
+        try:
+            if (metodo, ruta) not in RUTAS_CLIENTE_EN_CUERPO:
+                control.limitar(identificar(scope), metodo, ruta)
+            if clase == "pedido":
+                await control.entrar_pedido()
+            elif clase == "lectura":
+                control.entrar_lectura()
+        except LimiteSuperado as e:
+            await rechazar(send, e)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if clase == "pedido":
+                control.salir_pedido()
+            elif clase == "lectura":
+                control.salir_lectura()
+
+
+async def rechazar(send, error: LimiteSuperado) -> None:
+    cuerpo = to_json({"detail": str(error)})
+    await send({
+        "type": "http.response.start",
+        "status": error.estado,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", error.reintentar.encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
@@ -0,0 +1,269 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from uuid import UUID
+
+from models import Producto
+from .Idempotencia import RespuestaRepetida, comprobar_huella
+from .Indice_Usuarios import normalizar_email
+from .Persistencia import CABECERA, Reconstruccion, leer_tramas
+from .Reserva_Stock import StockInsuficiente
+
+T = TypeVar("T")
+
+# Estado compartido entre varios procesos (p. ej. uvicorn --workers N) en SQLite
+# en modo WAL. Cada proceso mantiene su propia copia en memoria del catálogo, los
+# usuarios y los pedidos (así las lecturas no tocan la base de datos) y la base
+# de datos guarda cuatro cosas:
+# - 'stock': el stock de cada producto, que es la referencia para aceptar pedidos.
+#   Cada línea se descuenta con un UPDATE condicionado a que quede stock, dentro
+#   de la misma transacción que registra el pedido, así que dos procesos nunca
+#   venden la misma unidad.
+# - 'emails': el email normalizado de cada usuario, para que sea único entre todos
+#   los procesos (se inserta en la misma transacción que el registro del usuario).
+# - 'idempotencia': la clave de idempotencia de cada pedido que la trae, con su
+#   respuesta, insertada en la misma transacción que el pedido: un reintento que
+#   llega a otro proceso devuelve esa respuesta en vez de descontar otra vez.
+# - 'registros': el log de todas las mutaciones con el mismo formato binario que
+#   el WAL. Cada proceso aplica en orden los registros que aún no ha visto, tanto
+#   al escribir como periódicamente desde un hilo de fondo.
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS stock (
+    producto_id BLOB PRIMARY KEY,
+    unidades INTEGER NOT NULL CHECK (unidades >= 0)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS emails (
+    email TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS idempotencia (
+    cliente_id BLOB NOT NULL,
+    clave TEXT NOT NULL,
+    huella INTEGER NOT NULL,
+    cuerpo BLOB NOT NULL,
+    caduca REAL NOT NULL,
+    PRIMARY KEY (cliente_id, clave)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idempotencia_caduca ON idempotencia (caduca);
+CREATE TABLE IF NOT EXISTS registros (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    datos BLOB NOT NULL
+);
+"""
+
+
+class AlmacenCompartido:
+    # Base de datos SQLite compartida y réplica en memoria de un TiendaService
+    # Las escrituras de un mismo proceso se serializan con '_lock' (SQLite solo
+    # admite un escritor a la vez de todas formas): así cada proceso aplica sus
+    # propios registros justo después de confirmarlos y en el orden del log
+
+    def __init__(self, ruta: str, intervalo_sincronizacion: float = 0.02, espera_bloqueo: float = 30.0):
+        self.ruta = ruta
+        self.intervalo_sincronizacion = intervalo_sincronizacion
+        self._espera_bloqueo = espera_bloqueo
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ultimo = 0
+        self._servicio = None
+        self._reconstruccion: Optional[Reconstruccion] = None
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        conexion = self._conexion()
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.executescript(_ESQUEMA)
+
+    def _conexion(self) -> sqlite3.Connection:
+        # Una conexión por hilo; las transacciones se abren a mano con BEGIN IMMEDIATE
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=self._espera_bloqueo, isolation_level=None)
+            # En modo WAL basta con NORMAL: una caída del proceso no pierde transacciones
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    # Arranque
+    def cargar(self, servicio) -> None:
+        # Reconstruimos el servicio con todo el log y empezamos a seguir los cambios
+        self._servicio = servicio
+        self._reconstruccion = Reconstruccion(servicio)
+        with self._lock:
+            for seq, datos in self._leer(self._ultimo):
+                for contenido in leer_tramas(CABECERA + datos):
+                    self._reconstruccion.aplicar(contenido, aplicar_stock=True)
+                self._ultimo = seq
+            servicio.reconstruir_indices()
+            self._completar_emails(servicio)
+        if self.intervalo_sincronizacion > 0:
+            self._hilo = threading.Thread(target=self._bucle, name="sincronizacion", daemon=True)
+            self._hilo.start()
+
+    def _completar_emails(self, servicio) -> None:
+        # Las bases de datos anteriores a la tabla 'emails' no la tienen rellena
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            conexion.executemany(
+                "INSERT OR IGNORE INTO emails (email) VALUES (?)",
+                ((normalizar_email(u.email),) for u in servicio.usuarios.values()),
+            )
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+    def _leer(self, desde: int, hasta: Optional[int] = None) -> Iterable[Tuple[int, bytes]]:
+        if hasta is None:
+            return self._conexion().execute(
+                "SELECT seq, datos FROM registros WHERE seq > ? ORDER BY seq", (desde,)
+            ).fetchall()
+        return self._conexion().execute(
+            "SELECT seq, datos FROM registros WHERE seq > ? AND seq < ? ORDER BY seq", (desde, hasta)
+        ).fetchall()
+
+    # Sincronización
+    def sincronizar(self) -> int:
+        # Aplicamos los registros de otros procesos que aún no hemos visto
+        with self._lock:
+            return self._sincronizar()
+
+    def _sincronizar(self, hasta: Optional[int] = None) -> int:
+        # Hay que tener '_lock'; 'hasta' excluye el registro propio que se va a aplicar
+        aplicados = 0
+        for seq, datos in self._leer(self._ultimo, hasta):
+            self._servicio.replicar(self._reconstruccion, [bytes(c) for c in leer_tramas(CABECERA + datos)])
+            self._ultimo = seq
+            aplicados += 1
+        return aplicados
+
+    def _bucle(self) -> None:
+        while not self._parar.wait(self.intervalo_sincronizacion):
+            try:
+                self.sincronizar()
+            except sqlite3.OperationalError:
+                # Base de datos ocupada más tiempo del previsto: lo intentamos en la siguiente vuelta
+                pass
+
+    # Escritura
+    def escribir(
+        self,
+        registro: bytes,
+        mutacion: Callable[[], T],
+        altas: Iterable[Producto] = (),
+        baja: Optional[UUID] = None,
+        descontar: Optional[Dict[Producto, int]] = None,
+        email: Optional[str] = None,
+        idempotencia: Optional[Tuple[UUID, str, int, bytes, float]] = None,
+    ) -> T:
+        # Confirmamos en una transacción los cambios de stock y el registro y después
+        # aplicamos en memoria lo pendiente de otros procesos y nuestra 'mutacion'
+        # 'idempotencia' es (cliente_id, clave, huella, respuesta, caducidad) de un pedido
+        with self._lock:
+            conexion = self._conexion()
+            conexion.execute("BEGIN IMMEDIATE")
+            try:
+                if idempotencia is not None:
+                    # Lo primero: el reintento de un pedido aceptado no debe fallar por stock
+                    self._guardar_idempotencia(conexion, *idempotencia)
+                if altas:
+                    conexion.executemany(
+                        "INSERT INTO stock (producto_id, unidades) VALUES (?, ?)",
+                        [(p.id.bytes, p.stock) for p in altas],
+                    )
+                if baja is not None:
+                    if conexion.execute("DELETE FROM stock WHERE producto_id = ?", (baja.bytes,)).rowcount == 0:
+                        raise ValueError("Producto no encontrado.")
+                if descontar:
+                    self._descontar(conexion, descontar)
+                if email is not None:
+                    try:
+                        conexion.execute("INSERT INTO emails (email) VALUES (?)", (email,))
+                    except sqlite3.IntegrityError:
+                        raise ValueError("Ya existe un usuario con ese email.")
+                seq = conexion.execute("INSERT INTO registros (datos) VALUES (?)", (registro,)).lastrowid
+                conexion.execute("COMMIT")
+            except BaseException:
+                conexion.execute("ROLLBACK")
+                raise
+            return self._aplicar_propio(seq, mutacion)
+
+    def escribir_lote(
+        self,
+        pedidos: List[Dict[Producto, int]],
+        codificar: Callable[[List[Optional[str]]], bytes],
+        mutacion: Callable[[], T],
+    ) -> T:
+        # Reservamos un lote de pedidos en una sola transacción: cada pedido usa un
+        # savepoint para deshacer solo sus líneas si alguna se queda sin stock
+        # 'codificar' recibe por cada pedido None si se aceptó o el motivo del rechazo
+        with self._lock:
+            conexion = self._conexion()
+            conexion.execute("BEGIN IMMEDIATE")
+            try:
+                errores: List[Optional[str]] = []
+                for productos_cantidades in pedidos:
+                    conexion.execute("SAVEPOINT pedido")
+                    try:
+                        self._descontar(conexion, productos_cantidades)
+                        errores.append(None)
+                    except StockInsuficiente as e:
+                        conexion.execute("ROLLBACK TO pedido")
+                        errores.append(str(e))
+                    conexion.execute("RELEASE pedido")
+                seq = conexion.execute("INSERT INTO registros (datos) VALUES (?)", (codificar(errores),)).lastrowid
+                conexion.execute("COMMIT")
+            except BaseException:
+                conexion.execute("ROLLBACK")
+                raise
+            return self._aplicar_propio(seq, mutacion)
+
+    @staticmethod
+    def _descontar(conexion: sqlite3.Connection, productos_cantidades: Dict[Producto, int]) -> None:
+        # Descontamos cada línea solo si queda stock (el producto pudo eliminarse en otro proceso)
+        for producto, cantidad in productos_cantidades.items():
+            if cantidad <= 0 or conexion.execute(
+                "UPDATE stock SET unidades = unidades - ? WHERE producto_id = ? AND unidades >= ?",
+                (cantidad, producto.id.bytes, cantidad),
+            ).rowcount == 0:
+                raise StockInsuficiente(f"No hay stock suficiente para {producto.nombre}.")
+
+    @staticmethod
+    def _guardar_idempotencia(
+        conexion: sqlite3.Connection, cliente_id: UUID, clave: str, huella: int, cuerpo: bytes, caduca: float
+    ) -> None:
+        # Si la clave ya tiene respuesta (de este u otro proceso) la devolvemos con
+        # RespuestaRepetida y la transacción se deshace sin descontar nada
+        ahora = time.time()
+        fila = conexion.execute(
+            "SELECT huella, cuerpo FROM idempotencia WHERE cliente_id = ? AND clave = ? AND caduca > ?",
+            (cliente_id.bytes, clave, ahora),
+        ).fetchone()
+        if fila is not None:
+            comprobar_huella(fila[0], huella)
+            raise RespuestaRepetida(fila[1])
+        conexion.execute("DELETE FROM idempotencia WHERE caduca <= ?", (ahora,))
+        conexion.execute(
+            "INSERT OR REPLACE INTO idempotencia (cliente_id, clave, huella, cuerpo, caduca) VALUES (?, ?, ?, ?, ?)",
+            (cliente_id.bytes, clave, huella, cuerpo, caduca),
+        )
+
+    def _aplicar_propio(self, seq: int, mutacion: Callable[[], T]) -> T:
+        # Hay que tener '_lock': los registros anteriores al nuestro van primero
+        self._sincronizar(hasta=seq)
+        self._ultimo = seq
+        return mutacion()
+
+    def stock(self, producto_id: UUID) -> Optional[int]:
+        # Stock de referencia de un producto (None si no existe)
+        fila = self._conexion().execute(
+            "SELECT unidades FROM stock WHERE producto_id = ?", (producto_id.bytes,)
+        ).fetchone()
+        return fila[0] if fila else None
+
+    def cerrar(self) -> None:
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join()
@@ -0,0 +1,406 @@
+from __future__ import annotations
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from models import Cliente, Pedido, Producto
+
+# Archivo de pedidos antiguos en columnas
+# Los pedidos calientes (los recientes) son objetos Pedido en TiendaService.pedidos;
+# los antiguos se compactan en segmentos inmutables de arrays empaquetados, con
+# unos 44 bytes por pedido más 28 por línea en lugar de varios cientos. Los
+# segmentos no guardan objetos: clientes y productos van como números de un
+# registro del archivo, así que los productos eliminados solo dejan su id y su
+# nombre. Los pedidos se vuelven a crear como objetos Pedido solo al leerlos.
+
+# Memoria aproximada de un pedido caliente con dos líneas (objeto, UUID, fecha,
+# productos, líneas empaquetadas y sus entradas en el diccionario y el índice)
+BYTES_PEDIDO_CALIENTE = 600
+
+# Dos segmentos consecutivos se fusionan mientras el resultado no pase de este tamaño
+# (fusionar necesita memoria para el segmento nuevo mientras siguen los dos viejos)
+MAX_PEDIDOS_SEGMENTO = 500_000
+
+_EPOCA = datetime(1970, 1, 1)
+_MICROSEGUNDO = timedelta(microseconds=1)
+MICROSEGUNDOS_DIA = 86_400_000_000
+ORDINAL_EPOCA = _EPOCA.toordinal()
+_TAMAÑO_LINEA = 24
+
+# Fila de un segmento: (cliente, fecha en µs, id en bytes, total, productos, líneas empaquetadas)
+Fila = Tuple[int, int, bytes, int, Sequence[int], bytes]
+
+
+def microsegundos(fecha: datetime) -> int:
+    # Las fechas de los pedidos son locales sin zona: las guardamos como µs desde 1970
+    return (fecha - _EPOCA) // _MICROSEGUNDO
+
+
+def fecha_de_microsegundos(valor: int) -> datetime:
+    return _EPOCA + timedelta(microseconds=valor)
+
+
+class SegmentoPedidos:
+    # Segmento inmutable del archivo, ordenado por (cliente, fecha)
+    # Cada columna es un array tipado o un bloque de bytes:
+    #   - clientes, fechas (µs) y totales (céntimos): uno por pedido
+    #   - ids: 16 bytes por pedido
+    #   - inicio_lineas: posición de la primera línea de cada pedido (y el final)
+    #   - productos y lineas: uno por línea (número de producto y los tres int64
+    #     de Pedido: cantidad, precio y subtotal)
+    # Los pedidos de un cliente son un tramo contiguo que se localiza con bisect; un
+    # pedido se busca por id dentro del tramo de su cliente, así que no hace falta
+    # un índice por id.
+    __slots__ = ("clientes", "fechas", "totales", "ids", "inicio_lineas", "productos", "lineas")
+
+    def __init__(self, filas: Iterable[Fila]):
+        self.clientes = array("I")
+        self.fechas = array("q")
+        self.totales = array("q")
+        self.inicio_lineas = array("Q", [0])
+        self.productos = array("I")
+        ids = bytearray()
+        lineas = bytearray()
+        for cliente, fecha, pedido_id, total, productos, bloque in filas:
+            self.clientes.append(cliente)
+            self.fechas.append(fecha)
+            self.totales.append(total)
+            ids += pedido_id
+            self.productos.extend(productos)
+            lineas += bloque
+            self.inicio_lineas.append(len(self.productos))
+        self.ids = bytes(ids)
+        self.lineas = bytes(lineas)
+
+    def __len__(self) -> int:
+        return len(self.clientes)
+
+    def memoria(self) -> int:
+        # Bytes ocupados por las columnas del segmento
+        columnas = (self.clientes, self.fechas, self.totales, self.inicio_lineas, self.productos)
+        return sum(len(c) * c.itemsize for c in columnas) + len(self.ids) + len(self.lineas)
+
+    def tramo(self, cliente: int, desde: Optional[int] = None, hasta: Optional[int] = None) -> Tuple[int, int]:
+        # Filas [inicio, fin) del cliente con fecha (µs) en [desde, hasta]
+        inicio = bisect_left(self.clientes, cliente)
+        fin = bisect_right(self.clientes, cliente, inicio)
+        if desde is not None:
+            inicio = bisect_left(self.fechas, desde, inicio, fin)
+        if hasta is not None:
+            fin = bisect_right(self.fechas, hasta, inicio, fin)
+        return inicio, fin
+
+    def buscar(self, pedido_id: UUID, cliente: int) -> Optional[int]:
+        # Fila del pedido entre los del cliente o None si no está en este segmento
+        inicio, fin = self.tramo(cliente)
+        objetivo = pedido_id.bytes
+        posicion = self.ids.find(objetivo, 16 * inicio, 16 * fin)
+        # Solo valen coincidencias alineadas con el inicio de un id
+        while posicion != -1 and posicion % 16:
+            posicion = self.ids.find(objetivo, posicion + 1, 16 * fin)
+        return None if posicion == -1 else posicion // 16
+
+    def tramos_clientes(self) -> Iterator[Tuple[int, int, int]]:
+        # (cliente, inicio, fin) de cada cliente del segmento, en orden
+        inicio = 0
+        while inicio < len(self):
+            cliente = self.clientes[inicio]
+            fin = bisect_right(self.clientes, cliente, inicio)
+            yield cliente, inicio, fin
+            inicio = fin
+
+    @classmethod
+    def fusionar(cls, antiguo: SegmentoPedidos, nuevo: SegmentoPedidos) -> SegmentoPedidos:
+        # Fusionamos dos segmentos copiando tramos enteros de filas (no fila a fila):
+        # los pedidos de un cliente en 'antiguo' son anteriores a los de 'nuevo', así
+        # que basta con poner un tramo detrás del otro. Si no es así (un pedido que
+        # llegó tarde con una fecha antigua) ese cliente se intercala por fecha.
+        tramos: List[Tuple[SegmentoPedidos, int, int]] = []
+        pendientes = heapq.merge(
+            ((c, 0, i, f) for c, i, f in antiguo.tramos_clientes()),
+            ((c, 1, i, f) for c, i, f in nuevo.tramos_clientes()),
+        )
+        anterior = None
+        for cliente, origen, inicio, fin in pendientes:
+            segmento = nuevo if origen else antiguo
+            if anterior is not None and anterior[0] == cliente:
+                _, inicio_a, fin_a = anterior
+                anterior = None
+                if antiguo.fechas[fin_a - 1] > nuevo.fechas[inicio]:
+                    tramos.pop()
+                    filas = heapq.merge(
+                        ((antiguo.fechas[k], 0, k) for k in range(inicio_a, fin_a)),
+                        ((nuevo.fechas[k], 1, k) for k in range(inicio, fin)),
+                    )
+                    tramos.extend((nuevo if o else antiguo, k, k + 1) for _, o, k in filas)
+                    continue
+            elif origen == 0:
+                anterior = (cliente, inicio, fin)
+            tramos.append((segmento, inicio, fin))
+        return cls._copiar(tramos)
+
+    @classmethod
+    def _copiar(cls, tramos: List[Tuple[SegmentoPedidos, int, int]]) -> SegmentoPedidos:
+        # Nuevo segmento con los tramos de filas indicados, en ese orden
+        segmento = cls([])
+        ids = bytearray()
+        lineas = bytearray()
+        for origen, inicio, fin in tramos:
+            segmento.clientes.extend(origen.clientes[inicio:fin])
+            segmento.fechas.extend(origen.fechas[inicio:fin])
+            segmento.totales.extend(origen.totales[inicio:fin])
+            ids += origen.ids[16 * inicio:16 * fin]
+            primera, ultima = origen.inicio_lineas[inicio], origen.inicio_lineas[fin]
+            desplazamiento = len(segmento.productos) - primera
+            segmento.inicio_lineas.extend([k + desplazamiento for k in origen.inicio_lineas[inicio + 1:fin + 1]])
+            segmento.productos.extend(origen.productos[primera:ultima])
+            lineas += origen.lineas[_TAMAÑO_LINEA * primera:_TAMAÑO_LINEA * ultima]
+        segmento.ids = bytes(ids)
+        segmento.lineas = bytes(lineas)
+        return segmento
+
+
+class ColumnasSegmento:
+    # Columnas de un segmento con clientes y productos ya resueltos a objetos, para
+    # agregar el archivo en las estadísticas sin crear un Pedido por fila
+    __slots__ = ("productos", "lineas", "inicio_lineas", "clientes", "fechas", "totales")
+
+    def __init__(self, productos: Iterable[Producto], lineas: bytes, inicio_lineas: array,
+                 clientes: Iterable[Cliente], fechas: array, totales: array):
+        self.productos = productos
+        self.lineas = lineas
+        self.inicio_lineas = inicio_lineas
+        self.clientes = clientes
+        self.fechas = fechas
+        self.totales = totales
+
+
+class ArchivoPedidos:
+    # Segmentos del archivo (del más antiguo al más reciente) y registros de
+    # clientes y productos a los que apuntan sus filas
+    # 'productos' es el diccionario de productos vivos de TiendaService: una línea
+    # de un producto que sigue en el catálogo se resuelve a ese objeto y una de un
+    # producto eliminado al mismo objeto que tenía (el que siguen usando los pedidos
+    # calientes, véase 'retirar') o, si no lo conocemos (p. ej. tras una carga
+    # masiva), a un Producto mínimo con su id y su nombre (siempre el mismo)
+    # Solo el hilo que compacta añade segmentos; las lecturas usan una VistaArchivo
+    # con la tupla de segmentos de ese momento, que nunca cambia.
+
+    def __init__(self, productos: Dict[UUID, Producto]):
+        self._vivos = productos
+        self.segmentos: Tuple[SegmentoPedidos, ...] = ()
+        self._num_cliente: Dict[UUID, int] = {}
+        self._clientes: List[Cliente] = []
+        self._num_producto: Dict[UUID, int] = {}
+        self._productos: List[Tuple[UUID, str]] = []
+        self._retirados: Dict[int, Producto] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self.segmentos)
+
+    def memoria(self) -> int:
+        return sum(s.memoria() for s in self.segmentos)
+
+    def vista(self) -> VistaArchivo:
+        return VistaArchivo(self, self.segmentos)
+
+    # Compactación
+    def compactar(self, por_cliente: Dict[UUID, List[Pedido]]) -> SegmentoPedidos:
+        # Creamos un segmento con los pedidos de cada cliente (ordenados por fecha)
+        # sin publicarlo todavía: eso lo hace 'agregar'
+        numeros: Dict[Producto, int] = {}
+
+        def numero_producto(producto: Producto) -> int:
+            numero = numeros.get(producto)
+            if numero is None:
+                numero = self._num_producto.get(producto.id)
+                if numero is None:
+                    numero = self._num_producto[producto.id] = len(self._productos)
+                    self._productos.append((producto.id, producto.nombre))
+                    if self._vivos.get(producto.id) is not producto:
+                        # Ya eliminado del catálogo: lo resolvemos a este mismo objeto
+                        with self._lock:
+                            self._retirados[numero] = producto
+                numeros[producto] = numero
+            return numero
+
+        clientes = []
+        for pedidos in por_cliente.values():
+            cliente = pedidos[0].cliente
+            numero = self._num_cliente.get(cliente.id)
+            if numero is None:
+                numero = self._num_cliente[cliente.id] = len(self._clientes)
+                self._clientes.append(cliente)
+            clientes.append((numero, pedidos))
+        clientes.sort(key=lambda c: c[0])
+
+        def filas() -> Iterator[Fila]:
+            for numero, pedidos in clientes:
+                for pedido in pedidos:
+                    productos, lineas = pedido.columnas()
+                    yield (
+                        numero, microsegundos(pedido.fecha), pedido.id.bytes, pedido.total_centimos,
+                        [numero_producto(p) for p in productos], lineas,
+                    )
+
+        return SegmentoPedidos(filas())
+
+    def agregar(self, segmento: SegmentoPedidos) -> None:
+        # Publicamos un segmento con pedidos más recientes que los ya archivados
+        self.segmentos = self.segmentos + (segmento,)
+
+    def fusionar(self) -> int:
+        # Fusionamos los dos últimos segmentos mientras el penúltimo no sea más del
+        # doble que el último (así hay O(log n) segmentos) y devolvemos cuántas
+        # fusiones se hicieron. Las lecturas en curso siguen con los segmentos viejos.
+        fusiones = 0
+        while len(self.segmentos) >= 2:
+            penultimo, ultimo = self.segmentos[-2:]
+            if len(penultimo) > 2 * len(ultimo) or len(penultimo) + len(ultimo) > MAX_PEDIDOS_SEGMENTO:
+                break
+            self.segmentos = self.segmentos[:-2] + (SegmentoPedidos.fusionar(penultimo, ultimo),)
+            fusiones += 1
+        return fusiones
+
+    # Resolución de clientes y productos
+    def numero_cliente(self, cliente_id: UUID) -> Optional[int]:
+        return self._num_cliente.get(cliente_id)
+
+    def numero_producto(self, producto_id: UUID) -> Optional[int]:
+        return self._num_producto.get(producto_id)
+
+    def registrados(self) -> Tuple[int, int]:
+        # Clientes y productos registrados: los números de los segmentos publicados
+        # hasta ahora son siempre menores
+        return len(self._clientes), len(self._productos)
+
+    def cliente(self, numero: int) -> Cliente:
+        return self._clientes[numero]
+
+    def retirar(self, producto: Producto) -> None:
+        # Un producto se acaba de quitar del catálogo: sus líneas archivadas se
+        # resuelven al mismo objeto que las de los pedidos calientes (así las
+        # estadísticas, que agrupan por objeto, no lo cuentan dos veces)
+        # Se llama después de quitarlo de 'productos': si 'compactar' lo registra a
+        # la vez, o lo ve ya eliminado o su número ya está registrado aquí
+        numero = self._num_producto.get(producto.id)
+        if numero is not None:
+            with self._lock:
+                self._retirados[numero] = producto
+
+    def producto(self, numero: int) -> Producto:
+        producto_id, nombre = self._productos[numero]
+        producto = self._vivos.get(producto_id)
+        if producto is not None:
+            return producto
+        retirado = self._retirados.get(numero)
+        if retirado is None:
+            with self._lock:
+                retirado = self._retirados.get(numero)
+                if retirado is None:
+                    retirado = Producto(nombre, 0, 0)
+                    retirado.id = producto_id
+                    self._retirados[numero] = retirado
+        return retirado
+
+    def productos(self) -> List[Producto]:
+        # Todos los productos del registro, resueltos (por número)
+        return [self.producto(numero) for numero in range(len(self._productos))]
+
+
+class VistaArchivo:
+    # Lecturas sobre los segmentos publicados en un instante
+    # TiendaService toma la vista a la vez que lee los pedidos calientes, de forma
+    # que una compactación concurrente no hace que un pedido salga dos veces o ninguna
+
+    def __init__(self, archivo: ArchivoPedidos, segmentos: Tuple[SegmentoPedidos, ...]):
+        self.archivo = archivo
+        self.segmentos = segmentos
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self.segmentos)
+
+    def posicion(self, pedido_id: UUID, cliente_id: UUID) -> Optional[Tuple[int, int]]:
+        # (segmento, fila) de un pedido archivado del cliente o None si no está
+        cliente = self.archivo.numero_cliente(cliente_id)
+        if cliente is None:
+            return None
+        for numero, segmento in enumerate(self.segmentos):
+            fila = segmento.buscar(pedido_id, cliente)
+            if fila is not None:
+                return numero, fila
+        return None
+
+    def pedido(self, segmento: SegmentoPedidos, fila: int) -> Pedido:
+        # Creamos el Pedido de una fila con sus líneas empaquetadas tal cual
+        inicio, fin = segmento.inicio_lineas[fila], segmento.inicio_lineas[fila + 1]
+        return Pedido.desde_columnas(
+            UUID(bytes=segmento.ids[16 * fila:16 * fila + 16]),
+            self.archivo.cliente(segmento.clientes[fila]),
+            fecha_de_microsegundos(segmento.fechas[fila]),
+            tuple(map(self.archivo.producto, segmento.productos[inicio:fin])),
+            segmento.lineas[_TAMAÑO_LINEA * inicio:_TAMAÑO_LINEA * fin],
+            segmento.totales[fila],
+        )
+
+    def consultar(
+        self,
+        cliente_id: UUID,
+        desde: Optional[datetime] = None,
+        hasta: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[int, int]] = None,
+    ) -> List[Pedido]:
+        # Igual que IndicePedidosCliente.consultar, con 'after' como posición de 'posicion'
+        return list(self.iterar_cliente(cliente_id, desde, hasta, limit, after))
+
+    def iterar_cliente(
+        self,
+        cliente_id: UUID,
+        desde: Optional[datetime] = None,
+        hasta: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[int, int]] = None,
+    ) -> Iterator[Pedido]:
+        # Pedidos archivados de un cliente por orden de fecha, creados según se piden
+        numero = self.archivo.numero_cliente(cliente_id)
+        if numero is None:
+            return
+        desde_us = microsegundos(desde) if desde is not None else None
+        hasta_us = microsegundos(hasta) if hasta is not None else None
+        primero = after[0] if after is not None else 0
+        restantes = limit
+        for posicion in range(primero, len(self.segmentos)):
+            segmento = self.segmentos[posicion]
+            inicio, fin = segmento.tramo(numero, desde_us, hasta_us)
+            if after is not None and posicion == primero:
+                inicio = max(inicio, after[1] + 1)
+            if restantes is not None:
+                fin = min(fin, inicio + restantes)
+                restantes -= max(fin - inicio, 0)
+            for fila in range(inicio, fin):
+                yield self.pedido(segmento, fila)
+            if restantes == 0:
+                return
+
+    def iterar(self) -> Iterator[Pedido]:
+        # Todos los pedidos archivados, segmento a segmento
+        for segmento in self.segmentos:
+            for fila in range(len(segmento)):
+                yield self.pedido(segmento, fila)
+
+    def columnas(self) -> List[ColumnasSegmento]:
+        # Columnas de cada segmento para agregarlas en bloque
+        productos = self.archivo.productos()
+        return [
+            ColumnasSegmento(
+                map(productos.__getitem__, s.productos), s.lineas, s.inicio_lineas,
+                map(self.archivo.cliente, s.clientes), s.fechas, s.totales,
+            )
+            for s in self.segmentos
+        ]
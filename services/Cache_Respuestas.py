@@ -0,0 +1,99 @@
+from __future__ import annotations
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Hashable, Optional
+
+
+class EntradaCache:
+    # Respuesta ya serializada junto con la versión con la que se generó
+    __slots__ = ("version", "cuerpo", "cabeceras", "tamaño")
+
+    # Sobrecoste aproximado por entrada (objeto, clave y nodo del OrderedDict)
+    SOBRECOSTE = 200
+
+    def __init__(self, version: int, cuerpo: bytes, cabeceras: Dict[str, str]):
+        self.version = version
+        self.cuerpo = cuerpo
+        self.cabeceras = cabeceras
+        self.tamaño = len(cuerpo) + self.SOBRECOSTE
+
+
+class CacheRespuestas:
+    # Caché LRU acotada de respuestas serializadas (bytes JSON)
+    # Cada clave (ruta y parámetros) guarda la versión de los datos con la que se
+    # generó: si la versión actual es otra la entrada está obsoleta y se regenera.
+    # Así no hace falta invalidar nada al mutar, basta con subir la versión.
+
+    def __init__(self, max_entradas: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        if max_entradas <= 0 or max_bytes <= 0:
+            raise ValueError("El tamaño de la caché debe ser mayor que cero.")
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas: OrderedDict[Hashable, EntradaCache] = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        # Estadísticas
+        self.aciertos = 0
+        self.fallos = 0
+        self.no_modificados = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave: Hashable, version: int) -> Optional[EntradaCache]:
+        # Devolvemos la entrada si existe y se generó con la versión actual
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada.version != version:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada
+
+    def guardar(self, clave: Hashable, version: int, cuerpo: bytes, cabeceras: Dict[str, str]) -> EntradaCache:
+        # Guardamos (o sustituimos) la respuesta y expulsamos las menos usadas si nos pasamos
+        entrada = EntradaCache(version, cuerpo, cabeceras)
+        if entrada.tamaño > self.max_bytes:
+            # Una respuesta más grande que toda la caché no se guarda
+            return entrada
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                if anterior.version > version:
+                    # Otro hilo ya guardó una versión más reciente: la conservamos
+                    self._entradas[clave] = anterior
+                    return entrada
+                self._bytes -= anterior.tamaño
+            self._entradas[clave] = entrada
+            self._bytes += entrada.tamaño
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, expulsada = self._entradas.popitem(last=False)
+                self._bytes -= expulsada.tamaño
+                self.expulsiones += 1
+        return entrada
+
+    def registrar_no_modificado(self) -> None:
+        # Contamos las peticiones resueltas con 304 (el cliente ya tenía la respuesta)
+        with self._lock:
+            self.no_modificados += 1
+
+    def vaciar(self) -> None:
+        # Eliminamos todas las entradas (las estadísticas se conservan)
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estadisticas(self) -> Dict[str, float]:
+        # Resumen de uso: aciertos, fallos, expulsiones y memoria ocupada
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_entradas": self.max_entradas,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "no_modificados": self.no_modificados,
+                "expulsiones": self.expulsiones,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            }
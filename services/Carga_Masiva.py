@@ -0,0 +1,566 @@
+from __future__ import annotations
+import argparse
+import csv
+import gc
+import gzip
+import io
+import os
+import sys
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Annotated, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from pydantic import Field, TypeAdapter, ValidationError
+from typing_extensions import NotRequired, TypedDict
+
+from models import Usuario, Cliente, Administrador
+from models import Producto, ProductoElectronico, ProductoRopa
+from models import Pedido
+from .Archivo_Pedidos import microsegundos
+from .Indice_Usuarios import normalizar_email
+
+# Carga masiva de usuarios, productos y pedidos históricos desde CSV o JSONL.
+# Cada fichero se lee en streaming y se valida por trozos (una sola llamada a
+# Pydantic por trozo); las filas válidas van directas a los diccionarios del
+# servicio y los índices se construyen una sola vez al final. Los pedidos no pasan
+# por el nivel caliente: se agrupan por cliente y se compactan en segmentos del
+# archivo cada 'pedidos_por_segmento', así que la memoria intermedia no depende
+# del tamaño de los ficheros. Los pedidos históricos no descuentan stock: el stock
+# de los productos del fichero es el actual.
+#
+# Formatos (extensión .csv, .jsonl o .ndjson, opcionalmente con .gz):
+#   - usuarios: id (opcional), tipo (cliente o admin), nombre, email, direccion_postal
+#   - productos: los de la exportación (id opcional, tipo, nombre, precio, stock,
+#     garantia_meses, talla, color)
+#   - pedidos: los de la exportación; en JSONL un pedido por línea con sus items y en
+#     CSV una fila por línea de pedido (las de un mismo pedido, seguidas). Los
+#     pedidos de cada cliente deben venir por orden de fecha, como en la exportación.
+
+FASES = ("usuarios", "productos", "pedidos")
+# Mensajes de error que se guardan en el resumen (se cuentan todos)
+MAX_MENSAJES = 20
+
+
+class ErrorCarga(ValueError):
+    # La carga se detuvo: demasiadas filas no válidas o pedidos fuera de orden
+    pass
+
+
+# ---------------------- ESQUEMAS ---------------------- #
+
+# Las filas se validan a diccionarios (TypedDict) y no a modelos: crear millones de
+# instancias de BaseModel cuesta más que la propia validación
+
+class FilaUsuario(TypedDict):
+    id: NotRequired[Optional[UUID]]
+    tipo: NotRequired[str]
+    nombre: str
+    # Comprobación sintáctica barata: con millones de filas EmailStr domina la carga
+    email: Annotated[str, Field(pattern=r"^[^@\s]+@[^@\s]+\.[^@\s]+$")]
+    direccion_postal: NotRequired[Optional[str]]
+
+
+class FilaProducto(TypedDict):
+    id: NotRequired[Optional[UUID]]
+    tipo: str
+    nombre: str
+    precio: Annotated[float, Field(ge=0)]
+    stock: Annotated[int, Field(ge=0)]
+    garantia_meses: NotRequired[Optional[Annotated[int, Field(ge=0)]]]
+    talla: NotRequired[Optional[str]]
+    color: NotRequired[Optional[str]]
+
+
+class FilaLinea(TypedDict):
+    producto_id: UUID
+    cantidad: Annotated[int, Field(gt=0)]
+    # Sin precio se usa el precio actual del producto
+    precio_unitario: NotRequired[Optional[Annotated[float, Field(ge=0)]]]
+    # Permite cargar líneas de productos que ya no están en el catálogo
+    nombre_producto: NotRequired[Optional[str]]
+
+
+class FilaPedido(TypedDict):
+    id: NotRequired[Optional[UUID]]
+    cliente_id: UUID
+    fecha: datetime
+    items: Annotated[List[FilaLinea], Field(min_length=1)]
+
+
+ESQUEMAS = {"usuarios": FilaUsuario, "productos": FilaProducto, "pedidos": FilaPedido}
+_ADAPTADORES = {fase: TypeAdapter(List[esquema]) for fase, esquema in ESQUEMAS.items()}
+_ADAPTADORES_FILA = {fase: TypeAdapter(esquema) for fase, esquema in ESQUEMAS.items()}
+
+
+# ---------------------- LECTURA ---------------------- #
+
+class Fuente:
+    # Fichero de entrada: formato según la extensión y bytes leídos para el progreso
+    # (del fichero en disco, también si está comprimido)
+
+    def __init__(self, ruta: str):
+        nombre = ruta[:-3] if ruta.endswith(".gz") else ruta
+        extension = os.path.splitext(nombre)[1].lower()
+        if extension == ".csv":
+            self.formato = "csv"
+        elif extension in (".jsonl", ".ndjson"):
+            self.formato = "ndjson"
+        else:
+            raise ValueError(f"Formato no reconocido en {ruta}: usa .csv, .jsonl o .ndjson (opcionalmente .gz).")
+        self.ruta = ruta
+        self.tamaño = os.path.getsize(ruta)
+        self._crudo = open(ruta, "rb")
+        self.archivo = gzip.GzipFile(fileobj=self._crudo) if ruta.endswith(".gz") else self._crudo
+
+    def leidos(self) -> int:
+        return self._crudo.tell()
+
+    def cerrar(self) -> None:
+        self.archivo.close()
+        self._crudo.close()
+
+    def filas(self) -> Iterator[Tuple[int, Any]]:
+        # (número de fila, elemento): en JSONL la línea en bytes y en CSV un diccionario
+        # por fila sin las celdas vacías (así toman su valor por defecto)
+        if self.formato == "ndjson":
+            for numero, linea in enumerate(self.archivo, 1):
+                if linea.strip():
+                    yield numero, linea
+            return
+        texto = io.TextIOWrapper(self.archivo, encoding="utf-8", newline="")
+        try:
+            lector = csv.reader(texto)
+            columnas = next(lector, None)
+            if columnas is None:
+                return
+            columnas = [c.strip() for c in columnas]
+            for numero, fila in enumerate(lector, 2):
+                if fila:
+                    yield numero, {c: v for c, v in zip(columnas, fila) if v != ""}
+        finally:
+            # Soltamos el fichero sin cerrarlo: lo cierra 'cerrar'
+            texto.detach()
+
+
+def agrupar_lineas(filas: Iterable[Tuple[int, Dict[str, str]]]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    # Pedidos del CSV de la exportación (una fila por línea): juntamos las filas
+    # seguidas con el mismo pedido_id (sin pedido_id, cada fila es un pedido)
+    actual: Optional[Dict[str, Any]] = None
+    numero_actual = 0
+    for numero, fila in filas:
+        pedido_id = fila.get("pedido_id")
+        linea = {k: fila[k] for k in ("producto_id", "cantidad", "precio_unitario", "nombre_producto") if k in fila}
+        if actual is not None and pedido_id is not None and actual.get("id") == pedido_id:
+            actual["items"].append(linea)
+            continue
+        if actual is not None:
+            yield numero_actual, actual
+        actual = {"cliente_id": fila.get("cliente_id"), "fecha": fila.get("fecha"), "items": [linea]}
+        if pedido_id is not None:
+            actual["id"] = pedido_id
+        numero_actual = numero
+    if actual is not None:
+        yield numero_actual, actual
+
+
+def trozos(filas: Iterable[Tuple[int, Any]], tamaño: int) -> Iterator[Tuple[List[int], List[Any]]]:
+    numeros: List[int] = []
+    elementos: List[Any] = []
+    for numero, elemento in filas:
+        numeros.append(numero)
+        elementos.append(elemento)
+        if len(elementos) >= tamaño:
+            yield numeros, elementos
+            numeros, elementos = [], []
+    if elementos:
+        yield numeros, elementos
+
+
+def validar_trozo(fase: str, elementos: List[Any]) -> Tuple[List[Optional[Dict[str, Any]]], Dict[int, str]]:
+    # Validamos el trozo de una vez; si hay errores, Pydantic dice en qué posiciones y
+    # repetimos solo con las demás. Devolvemos las filas (None las no válidas) y los
+    # errores por posición
+    adaptador = _ADAPTADORES[fase]
+    en_json = isinstance(elementos[0], bytes)
+
+    def validar(lista: List[Any]) -> List[Dict[str, Any]]:
+        if en_json:
+            return adaptador.validate_json(b"[" + b",".join(lista) + b"]")
+        return adaptador.validate_python(lista)
+
+    try:
+        return validar(elementos), {}
+    except ValidationError as e:
+        errores: Dict[int, str] = {}
+        for error in e.errors(include_url=False):
+            posicion = error["loc"][0] if error["loc"] else None
+            if not isinstance(posicion, int):
+                # JSON mal formado: no sabemos qué línea es, así que probamos una a una
+                return _validar_una_a_una(fase, elementos)
+            if posicion not in errores:
+                errores[posicion] = _mensaje(error, error["loc"][1:])
+    validas = [elemento for posicion, elemento in enumerate(elementos) if posicion not in errores]
+    filas = iter(validar(validas) if validas else [])
+    return [None if posicion in errores else next(filas) for posicion in range(len(elementos))], errores
+
+
+def _validar_una_a_una(fase: str, elementos: List[Any]) -> Tuple[List[Optional[Dict[str, Any]]], Dict[int, str]]:
+    adaptador = _ADAPTADORES_FILA[fase]
+    filas: List[Optional[Dict[str, Any]]] = []
+    errores: Dict[int, str] = {}
+    for posicion, elemento in enumerate(elementos):
+        try:
+            if isinstance(elemento, bytes):
+                filas.append(adaptador.validate_json(elemento))
+            else:
+                filas.append(adaptador.validate_python(elemento))
+        except ValidationError as e:
+            filas.append(None)
+            error = e.errors(include_url=False)[0]
+            errores[posicion] = _mensaje(error, error["loc"])
+    return filas, errores
+
+
+def _mensaje(error: Dict[str, Any], loc: Tuple[Any, ...]) -> str:
+    # "campo.subcampo: mensaje" de un error de Pydantic
+    campo = ".".join(str(parte) for parte in loc)
+    return f"{campo}: {error['msg']}" if campo else error["msg"]
+
+
+# ---------------------- CONSTRUCCIÓN ---------------------- #
+
+@contextmanager
+def sin_recolector():
+    # Creamos millones de objetos pequeños que viven hasta el final: sin pausar el
+    # recolector de ciclos, sus pasadas recorren una y otra vez todo lo ya cargado
+    reactivar = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if reactivar:
+            gc.enable()
+
+
+def construir_usuario(fila: FilaUsuario) -> Usuario:
+    tipo = fila.get("tipo", "cliente").lower()
+    if tipo == "cliente":
+        direccion = fila.get("direccion_postal")
+        if not direccion:
+            raise ValueError("El cliente debe tener dirección postal.")
+        usuario = Cliente(fila["nombre"], fila["email"], direccion)
+    elif tipo in ("admin", "administrador"):
+        usuario = Administrador(fila["nombre"], fila["email"])
+    else:
+        raise ValueError("Tipo de usuario no válido. Usa 'cliente' o 'admin'.")
+    if fila.get("id") is not None:
+        usuario.id = fila["id"]
+    return usuario
+
+
+def construir_producto(fila: FilaProducto) -> Producto:
+    tipo = fila["tipo"].lower()
+    if tipo == "electronico":
+        garantia = fila.get("garantia_meses")
+        garantia = 24 if garantia is None else garantia
+        producto = ProductoElectronico(fila["nombre"], fila["precio"], fila["stock"], garantia)
+    elif tipo == "ropa":
+        talla, color = fila.get("talla"), fila.get("color")
+        if not talla or not color:
+            raise ValueError("Los productos de ropa requieren talla y color.")
+        producto = ProductoRopa(fila["nombre"], fila["precio"], fila["stock"], talla, color)
+    elif tipo == "generico":
+        producto = Producto(fila["nombre"], fila["precio"], fila["stock"])
+    else:
+        raise ValueError("Tipo de producto no válido. Usa 'electronico', 'ropa' o 'generico'.")
+    if fila.get("id") is not None:
+        producto.id = fila["id"]
+    return producto
+
+
+# ---------------------- CARGA ---------------------- #
+
+class ProgresoCarga:
+    # Estado de la fase en curso, para informar mientras se carga
+    __slots__ = ("fase", "ruta", "filas", "cargadas", "errores", "bytes_leidos", "bytes_totales", "inicio", "terminada")
+
+    def __init__(self, fase: str, ruta: str, bytes_totales: int):
+        self.fase = fase
+        self.ruta = ruta
+        self.filas = 0
+        self.cargadas = 0
+        self.errores = 0
+        self.bytes_leidos = 0
+        self.bytes_totales = bytes_totales
+        self.inicio = time.perf_counter()
+        self.terminada = False
+
+    def segundos(self) -> float:
+        return time.perf_counter() - self.inicio
+
+    def __str__(self) -> str:
+        segundos = self.segundos()
+        porcentaje = 100 * self.bytes_leidos / self.bytes_totales if self.bytes_totales else 100.0
+        estado = "terminada" if self.terminada else f"{porcentaje:.0f}%"
+        return (
+            f"{self.fase}: {_miles(self.cargadas)} cargadas y {_miles(self.errores)} errores de "
+            f"{_miles(self.filas)} filas ({estado} de {_miles(self.bytes_totales / 1e6)} MB, "
+            f"{_miles(self.filas / max(segundos, 1e-9))} filas/s)"
+        )
+
+
+def _miles(numero: float) -> str:
+    # Entero con punto como separador de miles
+    return f"{numero:,.0f}".replace(",", ".")
+
+
+class CargaMasiva:
+    # Una carga sobre un TiendaService vacío; 'cargar_tienda' la ejecuta entera
+
+    def __init__(
+        self,
+        servicio,
+        tamaño_trozo: int = 10_000,
+        pedidos_por_segmento: int = 100_000,
+        max_errores: int = 0,
+        progreso: Optional[Callable[[ProgresoCarga], None]] = None,
+        intervalo_progreso: float = 1.0,
+    ):
+        if servicio.compartido is not None:
+            raise ValueError("La carga masiva no está disponible con almacén compartido.")
+        if servicio.usuarios or servicio.productos or servicio.pedidos or len(servicio.archivo):
+            raise ValueError("La carga masiva necesita una tienda vacía.")
+        if tamaño_trozo <= 0 or pedidos_por_segmento <= 0 or max_errores < 0:
+            raise ValueError("Los trozos y los segmentos deben ser mayores que cero y los errores no negativos.")
+        self.servicio = servicio
+        self.tamaño_trozo = tamaño_trozo
+        self.pedidos_por_segmento = pedidos_por_segmento
+        self.max_errores = max_errores
+        self._progreso = progreso
+        self._intervalo_progreso = intervalo_progreso
+        self.resumen: Dict[str, Any] = {"errores": [], "total_errores": 0}
+        # Emails ya cargados (solo durante la carga: el índice de usuarios se crea al final)
+        self._emails: set = set()
+        # Pedidos pendientes de compactar, por cliente
+        self._por_cliente: Dict[UUID, List[Pedido]] = {}
+        self._pendientes = 0
+        # Fecha (µs) del último pedido archivado de cada cliente, por su número en el archivo
+        self._ultimas = array("q")
+        # Productos de las líneas que ya no están en el catálogo (id -> Producto mínimo)
+        self._retirados: Dict[UUID, Producto] = {}
+
+    def cargar(self, fase: str, ruta: str) -> None:
+        # Leemos, validamos y guardamos un fichero por trozos
+        fuente = Fuente(ruta)
+        progreso = ProgresoCarga(fase, ruta, fuente.tamaño)
+        guardar = {"usuarios": self._usuario, "productos": self._producto, "pedidos": self._pedido}[fase]
+        ultimo_aviso = time.perf_counter()
+        try:
+            with sin_recolector():
+                filas = fuente.filas()
+                if fase == "pedidos" and fuente.formato == "csv":
+                    filas = agrupar_lineas(filas)
+                for numeros, elementos in trozos(filas, self.tamaño_trozo):
+                    validadas, errores = validar_trozo(fase, elementos)
+                    for posicion, (numero, fila) in enumerate(zip(numeros, validadas)):
+                        error = errores.get(posicion)
+                        if error is None:
+                            try:
+                                guardar(fila)
+                                progreso.cargadas += 1
+                            except ValueError as e:
+                                error = str(e)
+                            # Fuera del try: un ErrorCarga al compactar detiene la carga,
+                            # no es un error de esta fila
+                            if fase == "pedidos" and self._pendientes >= self.pedidos_por_segmento:
+                                self._archivar()
+                        if error is not None:
+                            progreso.errores += 1
+                            self._error(f"{ruta}, fila {numero}: {error}")
+                    progreso.filas += len(elementos)
+                    progreso.bytes_leidos = fuente.leidos()
+                    if self._progreso is not None and time.perf_counter() - ultimo_aviso >= self._intervalo_progreso:
+                        self._progreso(progreso)
+                        ultimo_aviso = time.perf_counter()
+                if fase == "pedidos":
+                    self._archivar()
+        finally:
+            fuente.cerrar()
+        progreso.bytes_leidos = progreso.bytes_totales
+        progreso.terminada = True
+        self.resumen[fase] = {
+            "filas": progreso.filas, "cargadas": progreso.cargadas, "errores": progreso.errores,
+            "segundos": progreso.segundos(),
+        }
+        if self._progreso is not None:
+            self._progreso(progreso)
+
+    def terminar(self) -> Dict[str, Any]:
+        # Índices, catálogo y estadísticas de una vez, y un snapshot si hay persistencia
+        # (los registros cargados no pasan por el WAL)
+        inicio = time.perf_counter()
+        servicio = self.servicio
+        with sin_recolector():
+            servicio.reconstruir_indices()
+        for coleccion in FASES:
+            servicio.versiones.incrementar(coleccion)
+        self.resumen["segundos_indices"] = time.perf_counter() - inicio
+        if servicio.persistencia is not None:
+            inicio = time.perf_counter()
+            servicio.crear_snapshot()
+            self.resumen["segundos_snapshot"] = time.perf_counter() - inicio
+        return self.resumen
+
+    def _error(self, mensaje: str) -> None:
+        self.resumen["total_errores"] += 1
+        if len(self.resumen["errores"]) < MAX_MENSAJES:
+            self.resumen["errores"].append(mensaje)
+        if self.resumen["total_errores"] > self.max_errores:
+            raise ErrorCarga(f"Carga detenida tras {self.resumen['total_errores']} filas no válidas. {mensaje}")
+
+    # Cada fila válida
+    def _usuario(self, fila: FilaUsuario) -> None:
+        usuario = construir_usuario(fila)
+        email = normalizar_email(usuario.email)
+        if email in self._emails:
+            raise ValueError("Ya existe un usuario con ese email.")
+        if usuario.id in self.servicio.usuarios:
+            raise ValueError(f"Usuario con id {usuario.id} repetido.")
+        self._emails.add(email)
+        self.servicio.usuarios[usuario.id] = usuario
+
+    def _producto(self, fila: FilaProducto) -> None:
+        producto = construir_producto(fila)
+        if producto.id in self.servicio.productos:
+            raise ValueError(f"Producto con id {producto.id} repetido.")
+        self.servicio.productos[producto.id] = producto
+
+    def _pedido(self, fila: FilaPedido) -> None:
+        cliente_id = fila["cliente_id"]
+        cliente = self.servicio.usuarios.get(cliente_id)
+        if not isinstance(cliente, Cliente):
+            raise ValueError(f"El usuario {cliente_id} debe existir y ser un cliente.")
+        # Una línea por producto, como en los pedidos de la API: las repetidas con el
+        # mismo precio se suman y con precios distintos el pedido no es válido
+        lineas: Dict[UUID, List] = {}
+        for item in fila["items"]:
+            producto = self._linea_producto(item)
+            precio = item.get("precio_unitario")
+            precio = producto.precio_centimos if precio is None else round(precio * 100)
+            linea = lineas.get(producto.id)
+            if linea is None:
+                lineas[producto.id] = [producto, item["cantidad"], precio]
+            elif linea[2] == precio:
+                linea[1] += item["cantidad"]
+            else:
+                raise ValueError(f"El producto {producto.id} aparece en el pedido con precios distintos.")
+        fecha = fila["fecha"]
+        if fecha.tzinfo is not None:
+            fecha = fecha.astimezone().replace(tzinfo=None)
+        pedido_id = fila.get("id")
+        pedido = Pedido.restaurar(
+            pedido_id if pedido_id is not None else uuid4(), cliente, fecha, [tuple(l) for l in lineas.values()]
+        )
+        # 'cargar' los compacta al llegar a 'pedidos_por_segmento'
+        self._por_cliente.setdefault(cliente.id, []).append(pedido)
+        self._pendientes += 1
+
+    def _linea_producto(self, item: FilaLinea) -> Producto:
+        producto_id = item["producto_id"]
+        producto = self.servicio.productos.get(producto_id) or self._retirados.get(producto_id)
+        if producto is not None:
+            return producto
+        nombre = item.get("nombre_producto")
+        if not nombre:
+            raise ValueError(f"Producto con id {producto_id} no encontrado.")
+        # Producto que ya no está en el catálogo: el archivo solo guarda su id y su nombre
+        producto = Producto(nombre, 0, 0)
+        producto.id = producto_id
+        self._retirados[producto.id] = producto
+        return producto
+
+    def _archivar(self) -> None:
+        # Compactamos los pedidos pendientes en un segmento del archivo
+        if not self._por_cliente:
+            return
+        archivo = self.servicio.archivo
+        for cliente_id, pedidos in self._por_cliente.items():
+            pedidos.sort(key=lambda p: p.fecha)
+            numero = archivo.numero_cliente(cliente_id)
+            if numero is not None and numero < len(self._ultimas) and microsegundos(pedidos[0].fecha) < self._ultimas[numero]:
+                raise ErrorCarga(
+                    f"Los pedidos del cliente {cliente_id} no vienen por orden de fecha: ordena el fichero "
+                    "por fecha (o por cliente y fecha, como la exportación)."
+                )
+        por_cliente, self._por_cliente, self._pendientes = self._por_cliente, {}, 0
+        self.servicio.archivar_historico(por_cliente)
+        for cliente_id, pedidos in por_cliente.items():
+            numero = archivo.numero_cliente(cliente_id)
+            if numero >= len(self._ultimas):
+                self._ultimas.extend([0] * (numero + 1 - len(self._ultimas)))
+            self._ultimas[numero] = microsegundos(pedidos[-1].fecha)
+
+
+def cargar_tienda(
+    servicio,
+    usuarios: Optional[str] = None,
+    productos: Optional[str] = None,
+    pedidos: Optional[str] = None,
+    **opciones,
+) -> Dict[str, Any]:
+    # Cargamos los ficheros indicados (en orden: usuarios, productos y pedidos) en un
+    # TiendaService vacío y devolvemos un resumen con filas, errores y tiempos por fase
+    carga = CargaMasiva(servicio, **opciones)
+    for fase, ruta in zip(FASES, (usuarios, productos, pedidos)):
+        if ruta:
+            carga.cargar(fase, ruta)
+    return carga.terminar()
+
+
+def imprimir_progreso(progreso: ProgresoCarga) -> None:
+    print(progreso, file=sys.stderr, flush=True)
+
+
+# ---------------------- LÍNEA DE COMANDOS ---------------------- #
+
+def main(argumentos: Optional[List[str]] = None) -> int:
+    # python -m services.Carga_Masiva --usuarios u.csv --productos p.jsonl --pedidos o.ndjson --datos DIR
+    # Con --datos el resultado queda en un snapshot de ese directorio (el de TIENDA_DATA_DIR)
+    # y la aplicación arranca ya con los datos; sin él solo se comprueban los ficheros
+    from services import TiendaService, Persistencia
+
+    parser = argparse.ArgumentParser(description="Carga masiva de usuarios, productos y pedidos desde CSV o JSONL")
+    parser.add_argument("--usuarios")
+    parser.add_argument("--productos")
+    parser.add_argument("--pedidos")
+    parser.add_argument("--datos", help="Directorio de datos vacío donde guardar el resultado")
+    parser.add_argument("--max-errores", type=int, default=0, help="Filas no válidas que se toleran (se omiten)")
+    parser.add_argument("--trozo", type=int, default=10_000, help="Filas por trozo de validación")
+    args = parser.parse_args(argumentos)
+    if not (args.usuarios or args.productos or args.pedidos):
+        parser.error("indica al menos un fichero con --usuarios, --productos o --pedidos")
+
+    servicio = TiendaService(persistencia=Persistencia(args.datos, snapshot_cada=0) if args.datos else None)
+    try:
+        resumen = cargar_tienda(
+            servicio, args.usuarios, args.productos, args.pedidos,
+            tamaño_trozo=args.trozo, max_errores=args.max_errores, progreso=imprimir_progreso,
+        )
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        servicio.cerrar()
+    for mensaje in resumen["errores"]:
+        print(f"  {mensaje}", file=sys.stderr)
+    print(f"Índices construidos en {resumen['segundos_indices']:.1f} s", file=sys.stderr)
+    if "segundos_snapshot" in resumen:
+        print(f"Snapshot guardado en {args.datos} en {resumen['segundos_snapshot']:.1f} s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
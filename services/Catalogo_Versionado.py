@@ -0,0 +1,225 @@
+from __future__ import annotations
+from array import array
+from threading import RLock
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from models import Producto
+
+# Productos por trozo: un cambio de stock copia solo las columnas de su trozo
+TAMAÑO_TROZO = 1024
+
+
+class InstantaneaCatalogo:
+    # Versión inmutable del catálogo: los productos por orden de alta con el stock y
+    # las unidades retenidas que tenían al publicarse la versión.
+    # Las columnas están partidas en trozos de TAMAÑO_TROZO posiciones; una versión
+    # nueva comparte con la anterior todos los trozos que no cambian, así que
+    # publicar un pedido copia unos pocos KB y una lectura solo toma la referencia a
+    # la versión actual, sin locks, y la recorre aunque se publiquen otras mientras.
+    # Las posiciones no se reutilizan: un producto eliminado deja un hueco (None)
+    # hasta que se compacta el catálogo (con un diccionario de posiciones nuevo).
+    # Al diccionario de posiciones compartido solo se le añaden altas (que las
+    # versiones anteriores no ven porque caen fuera de sus posiciones ocupadas):
+    # nunca se le quita nada, o las versiones ya publicadas cambiarían.
+    __slots__ = ("version", "total", "_productos", "_stocks", "_retenidos", "_posiciones", "_ocupadas")
+
+    def __init__(
+        self,
+        version: int,
+        productos: Tuple[List[Optional[Producto]], ...],
+        stocks: Tuple[array, ...],
+        retenidos: Tuple[array, ...],
+        posiciones: Dict[UUID, int],
+        ocupadas: int,
+        total: int,
+    ):
+        self.version = version
+        # Productos activos en esta versión
+        self.total = total
+        self._productos = productos
+        self._stocks = stocks
+        self._retenidos = retenidos
+        # id -> posición; lo comparten las versiones hasta la siguiente compactación
+        self._posiciones = posiciones
+        # Posiciones asignadas (incluidos los huecos de los eliminados)
+        self._ocupadas = ocupadas
+
+    def __len__(self) -> int:
+        return self.total
+
+    def productos(self) -> List[Producto]:
+        # Copias de todos los productos activos con su stock en esta versión
+        resultado = []
+        for productos, stocks, retenidos in zip(self._productos, self._stocks, self._retenidos):
+            for producto, stock, retenido in zip(productos, stocks, retenidos):
+                if producto is not None:
+                    resultado.append(producto.copia(stock, retenido))
+        return resultado
+
+    def _posicion(self, producto_id: UUID) -> Optional[Tuple[int, int]]:
+        # Trozo y desplazamiento de un producto si está activo en esta versión
+        # (un alta posterior puede tener posición fuera de esta versión)
+        posicion = self._posiciones.get(producto_id)
+        if posicion is None or posicion >= self._ocupadas:
+            return None
+        trozo, desplazamiento = divmod(posicion, TAMAÑO_TROZO)
+        producto = self._productos[trozo][desplazamiento]
+        if producto is None or producto.id != producto_id:
+            return None
+        return trozo, desplazamiento
+
+    def obtener(self, producto_id: UUID) -> Optional[Producto]:
+        # Copia de un producto en esta versión (None si no existía o ya estaba eliminado)
+        posicion = self._posicion(producto_id)
+        if posicion is None:
+            return None
+        trozo, desplazamiento = posicion
+        return self._productos[trozo][desplazamiento].copia(
+            self._stocks[trozo][desplazamiento], self._retenidos[trozo][desplazamiento]
+        )
+
+    def copias(self, productos: Iterable[Producto]) -> List[Producto]:
+        # Sustituimos productos vivos (p. ej. los de una página del índice) por sus
+        # copias en esta versión, quitando los que no existen en ella
+        resultado = []
+        for producto in productos:
+            copia = self.obtener(producto.id)
+            if copia is not None:
+                resultado.append(copia)
+        return resultado
+
+
+class CatalogoVersionado:
+    # Publica versiones inmutables del catálogo (copy-on-write por trozos)
+    # Quien cambia productos los publica con las franjas de sus productos aún
+    # adquiridas: cada versión recoge entero el efecto de cada pedido, reserva o
+    # alta, y nunca un pedido a medias. Las escrituras se ordenan con un lock propio
+    # que solo se tiene mientras se copian los trozos afectados; las lecturas no lo
+    # toman nunca.
+
+    def __init__(self):
+        self._lock = RLock()
+        self._actual = InstantaneaCatalogo(0, (), (), (), {}, 0, 0)
+
+    @property
+    def lock(self) -> RLock:
+        # Reentrante: desde el bucle de eventos se toma antes sin esperar (ver
+        # TiendaService._indices_sin_esperar) y la escritura lo vuelve a tomar dentro
+        return self._lock
+
+    def actual(self) -> InstantaneaCatalogo:
+        # Versión publicada más reciente (O(1))
+        return self._actual
+
+    def publicar(self, productos: Iterable[Producto], altas: bool = False) -> None:
+        # Publicamos el estado actual de productos con stock cambiado o, con
+        # altas=True, de productos nuevos (un cambio de stock que llega después de
+        # eliminar el producto no lo vuelve a dar de alta)
+        with self._lock:
+            anterior = self._actual
+            posiciones = anterior._posiciones
+            lista_productos = list(anterior._productos)
+            stocks = list(anterior._stocks)
+            retenidos = list(anterior._retenidos)
+            copiados = set()
+            ocupadas = anterior._ocupadas
+            total = anterior.total
+            for producto in productos:
+                posicion = posiciones.get(producto.id)
+                if posicion is not None and posicion < anterior._ocupadas and \
+                        anterior._productos[posicion // TAMAÑO_TROZO][posicion % TAMAÑO_TROZO] is None:
+                    # Hueco de un producto eliminado: su posición no se vuelve a usar
+                    posicion = None
+                    if altas and posiciones is anterior._posiciones:
+                        # Si vuelve a darse de alta, las versiones anteriores deben
+                        # seguir viéndolo en su posición vieja: diccionario propio
+                        posiciones = dict(posiciones)
+                if posicion is None:
+                    if not altas:
+                        continue
+                    # Alta: nueva posición al final (si hace falta, en un trozo nuevo)
+                    posicion = ocupadas
+                    ocupadas += 1
+                    total += 1
+                    posiciones[producto.id] = posicion
+                    if posicion % TAMAÑO_TROZO == 0:
+                        lista_productos.append([])
+                        stocks.append(array("q"))
+                        retenidos.append(array("q"))
+                        copiados.add(len(stocks) - 1)
+                trozo, desplazamiento = divmod(posicion, TAMAÑO_TROZO)
+                if trozo not in copiados:
+                    lista_productos[trozo] = list(lista_productos[trozo])
+                    stocks[trozo] = array("q", stocks[trozo])
+                    retenidos[trozo] = array("q", retenidos[trozo])
+                    copiados.add(trozo)
+                if desplazamiento == len(stocks[trozo]):
+                    lista_productos[trozo].append(producto)
+                    stocks[trozo].append(producto.stock)
+                    retenidos[trozo].append(producto.retenido)
+                else:
+                    stocks[trozo][desplazamiento] = producto.stock
+                    retenidos[trozo][desplazamiento] = producto.retenido
+            self._actual = InstantaneaCatalogo(
+                anterior.version + 1, tuple(lista_productos), tuple(stocks), tuple(retenidos),
+                posiciones, ocupadas, total,
+            )
+
+    def eliminar(self, producto: Producto) -> None:
+        # Publicamos una versión sin el producto; si los huecos superan a los
+        # productos activos compactamos las posiciones
+        with self._lock:
+            anterior = self._actual
+            # La entrada del diccionario se queda (la usan las versiones anteriores);
+            # en esta versión el hueco basta para que el producto no exista
+            if anterior._posicion(producto.id) is None:
+                return
+            posicion = anterior._posiciones[producto.id]
+            trozo, desplazamiento = divmod(posicion, TAMAÑO_TROZO)
+            lista_productos = list(anterior._productos)
+            lista_productos[trozo] = list(lista_productos[trozo])
+            lista_productos[trozo][desplazamiento] = None
+            nueva = InstantaneaCatalogo(
+                anterior.version + 1, tuple(lista_productos), anterior._stocks, anterior._retenidos,
+                anterior._posiciones, anterior._ocupadas, anterior.total - 1,
+            )
+            if nueva._ocupadas - nueva.total > max(nueva.total, TAMAÑO_TROZO):
+                nueva = self._compactar(nueva)
+            self._actual = nueva
+
+    def reconstruir(self, productos: Iterable[Producto]) -> None:
+        # Publicamos un catálogo completo desde cero (tras una carga masiva)
+        with self._lock:
+            self._actual = self._construir(self._actual.version + 1, ((p, p.stock, p.retenido) for p in productos))
+
+    @classmethod
+    def _compactar(cls, instantanea: InstantaneaCatalogo) -> InstantaneaCatalogo:
+        # Volvemos a numerar las posiciones sin huecos (las versiones anteriores
+        # conservan su diccionario de posiciones, que ya no cambia)
+        filas = (
+            (producto, stock, retenido)
+            for productos, stocks, retenidos in zip(instantanea._productos, instantanea._stocks, instantanea._retenidos)
+            for producto, stock, retenido in zip(productos, stocks, retenidos)
+            if producto is not None
+        )
+        return cls._construir(instantanea.version, filas)
+
+    @staticmethod
+    def _construir(version: int, filas: Iterable[Tuple[Producto, int, int]]) -> InstantaneaCatalogo:
+        productos: List[List[Optional[Producto]]] = []
+        stocks: List[array] = []
+        retenidos: List[array] = []
+        posiciones: Dict[UUID, int] = {}
+        for posicion, (producto, stock, retenido) in enumerate(filas):
+            if posicion % TAMAÑO_TROZO == 0:
+                productos.append([])
+                stocks.append(array("q"))
+                retenidos.append(array("q"))
+            productos[-1].append(producto)
+            stocks[-1].append(stock)
+            retenidos[-1].append(retenido)
+            posiciones[producto.id] = posicion
+        return InstantaneaCatalogo(
+            version, tuple(productos), tuple(stocks), tuple(retenidos), posiciones, len(posiciones), len(posiciones)
+        )
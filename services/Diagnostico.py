@@ -0,0 +1,477 @@
+from __future__ import annotations
+import gc
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Diagnóstico en producción: perfilador por muestreo, instantáneas de memoria y
+# registro de peticiones lentas. Nada de esto cuesta mientras está apagado:
+#   - el perfilador es un hilo que solo existe mientras se perfila
+#   - tracemalloc solo se arranca a petición (con él activo, cada reserva de
+#     memoria cuesta bastante más)
+#   - las duraciones por petición se recogen sustituyendo el histograma de tiempos
+#     del servicio por uno que además las apunta, y se restaura al apagar el registro
+# Todo es por proceso: con varios workers cada uno tiene su propio diagnóstico.
+
+# Funciones (fichero, nombre) en las que un hilo está esperando sin hacer nada: las
+# muestras que terminan en ellas no se cuentan
+_ESPERAS = frozenset((
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("thread.py", "_worker"), ("connection.py", "wait"),
+))
+# Directorio del proyecto: las rutas de las pilas y de la memoria se muestran relativas a él
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+
+def _ruta(archivo: str) -> str:
+    # Ruta de un fichero relativa al proyecto (o solo el nombre, si es de la biblioteca)
+    if archivo.startswith(_RAIZ):
+        return archivo[len(_RAIZ):]
+    return os.path.basename(archivo)
+
+
+class PerfiladorMuestreo:
+    # Perfilador por muestreo: un hilo toma cada 'intervalo' segundos la pila de todos
+    # los hilos con sys._current_frames() y cuenta cuántas veces aparece cada una. El
+    # resultado son pilas colapsadas ("marco;marco;marco cuenta", de la raíz a la hoja),
+    # el formato de flamegraph.pl, speedscope o inferno. Cada pila empieza por el nombre
+    # del hilo. Se para solo tras 'max_segundos' para no quedarse encendido.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+        self._pilas: Counter[str] = Counter()
+        # Etiqueta de cada objeto código ya visto (se calcula una vez)
+        self._etiquetas: Dict[Any, str] = {}
+        self.intervalo = 0.0
+        self.muestras = 0
+        self.inicio: Optional[float] = None
+        self.fin: Optional[float] = None
+        # Segundos que el hilo ha pasado tomando muestras (su coste, con el GIL)
+        self.coste = 0.0
+
+    @property
+    def activo(self) -> bool:
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self, intervalo: float = 0.01, max_segundos: float = 60.0) -> None:
+        # Empezamos a perfilar desde cero (falla si ya se está perfilando)
+        if intervalo <= 0 or max_segundos <= 0:
+            raise ValueError("El intervalo y la duración del perfilado deben ser mayores que cero.")
+        with self._lock:
+            if self.activo:
+                raise ValueError("El perfilador ya está en marcha.")
+            self._pilas = Counter()
+            self._etiquetas = {}
+            self.intervalo = intervalo
+            self.muestras = 0
+            self.coste = 0.0
+            self.inicio = time.perf_counter()
+            self.fin = None
+            self._parar.clear()
+            self._hilo = threading.Thread(
+                target=self._muestrear, args=(max_segundos,), name="diagnostico-perfilador", daemon=True
+            )
+            self._hilo.start()
+
+    def detener(self) -> None:
+        # Paramos el hilo; las pilas se conservan hasta el siguiente perfilado
+        with self._lock:
+            hilo = self._hilo
+        if hilo is not None:
+            self._parar.set()
+            hilo.join()
+
+    def _muestrear(self, max_segundos: float) -> None:
+        propio = threading.get_ident()
+        limite = self.inicio + max_segundos
+        try:
+            while not self._parar.wait(self.intervalo):
+                inicio = time.perf_counter()
+                if inicio >= limite:
+                    break
+                nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+                marcos = sys._current_frames()
+                for ident, marco in marcos.items():
+                    if ident != propio:
+                        pila = self._pila(marco)
+                        if pila is not None:
+                            self._pilas[f"{nombres.get(ident, ident)};{pila}"] += 1
+                # No retenemos los marcos (ni sus variables) hasta la siguiente muestra
+                del marcos, marco
+                self.muestras += 1
+                self.coste += time.perf_counter() - inicio
+        finally:
+            self.fin = time.perf_counter()
+
+    def _pila(self, marco) -> Optional[str]:
+        # Pila de un hilo de la raíz a la hoja (None si el hilo está esperando)
+        codigo = marco.f_code
+        if (os.path.basename(codigo.co_filename), codigo.co_name) in _ESPERAS:
+            return None
+        etiquetas = []
+        while marco is not None:
+            codigo = marco.f_code
+            etiqueta = self._etiquetas.get(codigo)
+            if etiqueta is None:
+                nombre = getattr(codigo, "co_qualname", codigo.co_name)
+                etiqueta = self._etiquetas[codigo] = f"{nombre} ({_ruta(codigo.co_filename)}:{codigo.co_firstlineno})"
+            etiquetas.append(etiqueta)
+            marco = marco.f_back
+        etiquetas.reverse()
+        return ";".join(etiquetas)
+
+    def colapsadas(self) -> str:
+        # Pilas colapsadas, de la más frecuente a la menos
+        pilas = self._pilas.copy()
+        return "".join(f"{pila} {cuenta}\n" for pila, cuenta in pilas.most_common())
+
+    def estado(self) -> Dict[str, Any]:
+        if self.inicio is None:
+            segundos = 0.0
+        else:
+            segundos = (self.fin if self.fin is not None else time.perf_counter()) - self.inicio
+        return {
+            "activo": self.activo,
+            "intervalo_ms": self.intervalo * 1000,
+            "muestras": self.muestras,
+            "pilas": len(self._pilas),
+            "segundos": segundos,
+            # Fracción del tiempo que el perfilador ha tenido el GIL
+            "coste": self.coste / segundos if segundos else 0.0,
+        }
+
+
+class TrazaMemoria:
+    # Instantáneas de memoria con tracemalloc y recuento de objetos por tipo
+    # Cada instantánea guarda la memoria reservada por línea de código (tracemalloc) y,
+    # de los tipos vigilados (los modelos, los esquemas de Pydantic...), cuántos objetos
+    # hay vivos y su tamaño propio (sys.getsizeof, sin contar lo que referencian).
+    # Comparar dos instantáneas dice qué líneas y qué tipos explican el crecimiento.
+    # Contar los objetos recorre todos los del recolector: con millones de pedidos
+    # tarda del orden de un segundo y se hace con el GIL.
+
+    def __init__(self, tipos: Tuple[type, ...] = (), max_instantaneas: int = 10):
+        self.tipos = tuple(tipos)
+        self.max_instantaneas = max_instantaneas
+        self._lock = threading.Lock()
+        self._instantaneas: Deque[Dict[str, Any]] = deque(maxlen=max_instantaneas)
+        self._siguiente = 1
+        self.marcos = 0
+
+    @property
+    def activa(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def iniciar(self, marcos: int = 1) -> None:
+        # Arrancamos tracemalloc guardando 'marcos' niveles de pila por reserva
+        if marcos < 1:
+            raise ValueError("El número de marcos debe ser mayor que cero.")
+        with self._lock:
+            if tracemalloc.is_tracing():
+                raise ValueError("La traza de memoria ya está en marcha.")
+            self._instantaneas.clear()
+            self.marcos = marcos
+            tracemalloc.start(marcos)
+
+    def detener(self) -> None:
+        # Paramos tracemalloc y olvidamos las instantáneas (su memoria es la de la traza)
+        with self._lock:
+            tracemalloc.stop()
+            self._instantaneas.clear()
+
+    def instantanea(self) -> Dict[str, Any]:
+        # Tomamos una instantánea y devolvemos su resumen
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise ValueError("La traza de memoria no está en marcha.")
+            traza = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ))
+            actual, pico = tracemalloc.get_traced_memory()
+            instantanea = {
+                "id": self._siguiente,
+                "fecha": datetime.now(),
+                "bytes_trazados": actual,
+                "pico_bytes": pico,
+                "tipos": self._contar_tipos(),
+                "traza": traza,
+            }
+            self._siguiente += 1
+            self._instantaneas.append(instantanea)
+        return self._resumen(instantanea)
+
+    def _contar_tipos(self) -> Dict[str, List[int]]:
+        # Objetos vivos y bytes propios por tipo (el nombre de la clase concreta)
+        if not self.tipos:
+            return {}
+        cuentas: Dict[str, List[int]] = {}
+        etiquetas: Dict[type, Optional[str]] = {}
+        for objeto in gc.get_objects():
+            tipo = type(objeto)
+            etiqueta = etiquetas.get(tipo, False)
+            if etiqueta is False:
+                etiqueta = etiquetas[tipo] = tipo.__name__ if issubclass(tipo, self.tipos) else None
+            if etiqueta is not None:
+                cuenta = cuentas.get(etiqueta)
+                if cuenta is None:
+                    cuenta = cuentas[etiqueta] = [0, 0]
+                cuenta[0] += 1
+                cuenta[1] += sys.getsizeof(objeto)
+        return cuentas
+
+    def _buscar(self, instantaneas: List[Dict[str, Any]], instantanea_id: Optional[int]) -> int:
+        # Posición de una instantánea (sin id, la última)
+        if instantanea_id is None and instantaneas:
+            return len(instantaneas) - 1
+        for posicion, instantanea in enumerate(instantaneas):
+            if instantanea["id"] == instantanea_id:
+                return posicion
+        raise ValueError(f"No hay ninguna instantánea de memoria con id {instantanea_id}.")
+
+    def diferencia(self, desde: Optional[int] = None, hasta: Optional[int] = None, n: int = 20) -> Dict[str, Any]:
+        # Crecimiento entre dos instantáneas (por defecto, la última y la anterior): las 'n'
+        # líneas que más cambian y todos los tipos vigilados
+        instantaneas = list(self._instantaneas)
+        posicion = self._buscar(instantaneas, hasta)
+        final = instantaneas[posicion]
+        if desde is None:
+            if posicion == 0:
+                raise ValueError("No hay ninguna instantánea de memoria anterior con la que comparar.")
+            inicial = instantaneas[posicion - 1]
+        else:
+            inicial = instantaneas[self._buscar(instantaneas, desde)]
+        if inicial["id"] >= final["id"]:
+            raise ValueError("La instantánea inicial debe ser anterior a la final.")
+        lineas = []
+        for estadistica in final["traza"].compare_to(inicial["traza"], "lineno")[:n]:
+            marco = estadistica.traceback[0]
+            lineas.append({
+                "archivo": _ruta(marco.filename),
+                "linea": marco.lineno,
+                "bytes": estadistica.size,
+                "diferencia_bytes": estadistica.size_diff,
+                "bloques": estadistica.count,
+                "diferencia_bloques": estadistica.count_diff,
+            })
+        tipos = []
+        for tipo in set(final["tipos"]) | set(inicial["tipos"]):
+            objetos, tamaño = final["tipos"].get(tipo, (0, 0))
+            objetos_antes, tamaño_antes = inicial["tipos"].get(tipo, (0, 0))
+            tipos.append({
+                "tipo": tipo,
+                "objetos": objetos,
+                "diferencia_objetos": objetos - objetos_antes,
+                "bytes": tamaño,
+                "diferencia_bytes": tamaño - tamaño_antes,
+            })
+        tipos.sort(key=lambda t: (-abs(t["diferencia_bytes"]), t["tipo"]))
+        return {
+            "desde": inicial["id"],
+            "hasta": final["id"],
+            "diferencia_bytes": final["bytes_trazados"] - inicial["bytes_trazados"],
+            "lineas": lineas,
+            "tipos": tipos,
+        }
+
+    @staticmethod
+    def _resumen(instantanea: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": instantanea["id"],
+            "fecha": instantanea["fecha"],
+            "bytes_trazados": instantanea["bytes_trazados"],
+            "pico_bytes": instantanea["pico_bytes"],
+            "tipos": {tipo: {"objetos": o, "bytes": b} for tipo, (o, b) in sorted(instantanea["tipos"].items())},
+        }
+
+    def estado(self) -> Dict[str, Any]:
+        actual, pico = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "activa": self.activa,
+            "marcos": self.marcos,
+            "bytes_trazados": actual,
+            "pico_bytes": pico,
+            "instantaneas": [self._resumen(i) for i in list(self._instantaneas)],
+        }
+
+
+# Operaciones del servicio de la petición en curso: nombre -> [llamadas, segundos]
+_operaciones: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("operaciones_peticion", default=None)
+
+
+class _TiempoApuntado:
+    # Histograma de una operación que además suma su duración a la petición en curso
+    __slots__ = ("_histograma", "_nombre")
+
+    def __init__(self, histograma, nombre: str):
+        self._histograma = histograma
+        self._nombre = nombre
+
+    def observar(self, valor: float) -> None:
+        self._histograma.observar(valor)
+        operaciones = _operaciones.get()
+        if operaciones is not None:
+            cuenta = operaciones.get(self._nombre)
+            if cuenta is None:
+                operaciones[self._nombre] = [1, valor]
+            else:
+                cuenta[0] += 1
+                cuenta[1] += valor
+
+
+class _TiemposApuntados:
+    # Sustituto del histograma 'tienda_servicio_segundos' mientras hay registro de lentas
+    __slots__ = ("original", "_hijos")
+
+    def __init__(self, original):
+        self.original = original
+        self._hijos: Dict[str, _TiempoApuntado] = {}
+
+    def con(self, nombre: str) -> _TiempoApuntado:
+        hijo = self._hijos.get(nombre)
+        if hijo is None:
+            hijo = self._hijos[nombre] = _TiempoApuntado(self.original.con(nombre), nombre)
+        return hijo
+
+
+class RegistroLentas:
+    # Peticiones HTTP que tardan más de 'umbral' segundos, con el tiempo de cada
+    # operación de TiendaService que hicieron (las anidadas cuentan también dentro de
+    # la que las llama). Se guardan las 'max_entradas' más recientes.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servicio = None
+        self.umbral: Optional[float] = None
+        self.entradas: Deque[Dict[str, Any]] = deque(maxlen=1000)
+        self.medidas = 0
+        self.lentas = 0
+
+    @property
+    def activo(self) -> bool:
+        return self.umbral is not None
+
+    def iniciar(self, servicio, umbral: float, max_entradas: int = 1000) -> None:
+        # Empezamos a registrar (o cambiamos el umbral) apuntando las operaciones de 'servicio'
+        if umbral < 0 or max_entradas <= 0:
+            raise ValueError("El umbral no puede ser negativo y el número de entradas debe ser mayor que cero.")
+        with self._lock:
+            if self._servicio is not servicio:
+                self._restaurar()
+                servicio._tiempos = _TiemposApuntados(servicio._tiempos)
+                self._servicio = servicio
+            if self.entradas.maxlen != max_entradas:
+                self.entradas = deque(self.entradas, maxlen=max_entradas)
+            self.umbral = umbral
+
+    def detener(self) -> None:
+        # Dejamos de registrar y devolvemos al servicio su histograma; las entradas se conservan
+        with self._lock:
+            self.umbral = None
+            self._restaurar()
+
+    def _restaurar(self) -> None:
+        if self._servicio is not None:
+            tiempos = self._servicio._tiempos
+            if isinstance(tiempos, _TiemposApuntados):
+                self._servicio._tiempos = tiempos.original
+            self._servicio = None
+
+    def registrar(self, metodo: str, ruta: str, estado: int, segundos: float,
+                  operaciones: Dict[str, List[float]]) -> None:
+        self.medidas += 1
+        umbral = self.umbral
+        if umbral is None or segundos < umbral:
+            return
+        self.lentas += 1
+        self.entradas.append({
+            "fecha": datetime.now(),
+            "metodo": metodo,
+            "ruta": ruta,
+            "estado": estado,
+            "segundos": segundos,
+            "operaciones": {
+                nombre: {"llamadas": int(llamadas), "segundos": total}
+                for nombre, (llamadas, total) in sorted(operaciones.items(), key=lambda o: -o[1][1])
+            },
+        })
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "activo": self.activo,
+            "umbral_ms": self.umbral * 1000 if self.umbral is not None else None,
+            "medidas": self.medidas,
+            "lentas": self.lentas,
+            "guardadas": len(self.entradas),
+        }
+
+
+class Diagnostico:
+    # Las tres herramientas juntas, como las usa la API
+    # 'token' es el secreto que debe presentar quien las use (los ids de usuario no lo son)
+    def __init__(self, token: str, tipos: Tuple[type, ...] = (), max_instantaneas: int = 10):
+        if not token:
+            raise ValueError("El diagnóstico necesita un token.")
+        self._token = token.encode()
+        self.perfilador = PerfiladorMuestreo()
+        self.memoria = TrazaMemoria(tipos, max_instantaneas)
+        self.lentas = RegistroLentas()
+
+    def autorizado(self, token: Optional[str]) -> bool:
+        # Comparamos en tiempo constante para no dar pistas del token por el tiempo de respuesta
+        return token is not None and hmac.compare_digest(token.encode(), self._token)
+
+    def cerrar(self) -> None:
+        self.perfilador.detener()
+        self.lentas.detener()
+        if self.memoria.activa:
+            self.memoria.detener()
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "perfil": self.perfilador.estado(),
+            "memoria": self.memoria.estado(),
+            "lentas": self.lentas.estado(),
+        }
+
+
+class MiddlewareDiagnostico:
+    # Middleware ASGI del registro de peticiones lentas. Con el registro apagado solo
+    # comprueba un atributo y pasa la petición tal cual
+
+    def __init__(self, app, diagnostico: Diagnostico):
+        self.app = app
+        self.lentas = diagnostico.lentas
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or self.lentas.umbral is None:
+            await self.app(scope, receive, send)
+            return
+        operaciones: Dict[str, List[float]] = {}
+        marca = _operaciones.set(operaciones)
+        inicio = time.perf_counter()
+        estado = 500
+
+        async def enviar(mensaje) -> None:
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            segundos = time.perf_counter() - inicio
+            _operaciones.reset(marca)
+            ruta = getattr(scope.get("route"), "path", None) or scope["path"]
+            self.lentas.registrar(scope["method"], ruta, estado, segundos, operaciones)
@@ -0,0 +1,284 @@
+from __future__ import annotations
+import gc
+from contextlib import AbstractContextManager
+from datetime import date
+from itertools import chain
+from operator import attrgetter, itemgetter
+from threading import RLock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from models import Pedido, Producto, Cliente
+from .Archivo_Pedidos import MICROSEGUNDOS_DIA, ORDINAL_EPOCA, ColumnasSegmento, VistaArchivo
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - sin NumPy se recalcula pedido a pedido
+    np = None
+
+# Número de productos y clientes que se mantienen ordenados para los rankings
+CAPACIDAD_PODIO = 100
+
+
+class Podio:
+    # Los 'capacidad' elementos con mayor valor, mantenidos de forma incremental
+    # Funciona porque los valores solo crecen (las ventas se acumulan): un elemento
+    # que no está en el podio solo puede entrar cuando lo actualizamos, así que
+    # basta con compararlo con el mínimo actual del podio
+
+    def __init__(self, capacidad: int = CAPACIDAD_PODIO):
+        self.capacidad = capacidad
+        self._valores: Dict[Any, int] = {}
+        self._minimo: Optional[Any] = None
+
+    def actualizar(self, clave: Any, valor: int) -> None:
+        valores = self._valores
+        if clave in valores:
+            valores[clave] = valor
+            if clave is self._minimo:
+                self._minimo = min(valores, key=valores.__getitem__)
+        elif len(valores) < self.capacidad:
+            valores[clave] = valor
+            if self._minimo is None or valor < valores[self._minimo]:
+                self._minimo = clave
+        elif valor > valores[self._minimo]:
+            del valores[self._minimo]
+            valores[clave] = valor
+            self._minimo = min(valores, key=valores.__getitem__)
+
+    def mayores(self, n: int) -> List[Tuple[Any, int]]:
+        # Los n primeros de mayor a menor (como mucho 'capacidad')
+        return sorted(self._valores.items(), key=lambda e: e[1], reverse=True)[:n]
+
+
+class AgregadosVentas:
+    # Agregados de ventas que se actualizan con cada pedido en O(líneas):
+    # - por producto: unidades vendidas e ingresos
+    # - por cliente: pedidos, unidades y gasto
+    # - por día: pedidos, unidades e ingresos
+    # Los importes van en céntimos enteros, como en los pedidos. Las lecturas son
+    # consultas a diccionarios y los rankings se leen de podios ya ordenados.
+
+    def __init__(self):
+        self._lock = RLock()
+        self._vaciar()
+        # Pedidos registrados mientras se recalcula (None si no hay recálculo en curso)
+        self._pendientes: Optional[List[Pedido]] = None
+
+    @property
+    def lock(self) -> RLock:
+        # Reentrante: desde el bucle de eventos se toma antes sin esperar (ver
+        # TiendaService._indices_sin_esperar) y la escritura lo vuelve a tomar dentro
+        return self._lock
+
+    def _vaciar(self) -> None:
+        # producto -> [unidades, ingresos]
+        self._por_producto: Dict[Producto, List[int]] = {}
+        # cliente -> [pedidos, unidades, gasto]
+        self._por_cliente: Dict[Cliente, List[int]] = {}
+        # día -> [pedidos, unidades, ingresos]
+        self._por_dia: Dict[date, List[int]] = {}
+        self._totales = [0, 0, 0]
+        self._top_unidades = Podio()
+        self._top_ingresos = Podio()
+        self._top_clientes = Podio()
+
+    # Actualización incremental
+    def registrar(self, pedidos: Iterable[Pedido]) -> None:
+        # Sumamos los pedidos nuevos a los agregados
+        with self._lock:
+            for pedido in pedidos:
+                self._aplicar(pedido)
+                if self._pendientes is not None:
+                    self._pendientes.append(pedido)
+
+    def _aplicar(self, pedido: Pedido) -> None:
+        unidades_pedido = 0
+        por_producto = self._por_producto
+        for producto, cantidad, _, subtotal in pedido.lineas():
+            entrada = por_producto.get(producto)
+            if entrada is None:
+                entrada = por_producto[producto] = [0, 0]
+            entrada[0] += cantidad
+            entrada[1] += subtotal
+            unidades_pedido += cantidad
+            self._top_unidades.actualizar(producto, entrada[0])
+            self._top_ingresos.actualizar(producto, entrada[1])
+        total = pedido.total_centimos
+        cliente = self._por_cliente.get(pedido.cliente)
+        if cliente is None:
+            cliente = self._por_cliente[pedido.cliente] = [0, 0, 0]
+        cliente[0] += 1
+        cliente[1] += unidades_pedido
+        cliente[2] += total
+        self._top_clientes.actualizar(pedido.cliente, cliente[2])
+        dia = self._por_dia.get(pedido.fecha.date())
+        if dia is None:
+            dia = self._por_dia[pedido.fecha.date()] = [0, 0, 0]
+        dia[0] += 1
+        dia[1] += unidades_pedido
+        dia[2] += total
+        self._totales[0] += 1
+        self._totales[1] += unidades_pedido
+        self._totales[2] += total
+
+    # Recálculo completo
+    def recalcular(
+        self,
+        pausa: Callable[[], AbstractContextManager],
+        capturar: Callable[[], Tuple[List[Pedido], Optional[VistaArchivo]]],
+    ) -> int:
+        # Reconstruimos todos los agregados desde los pedidos y devolvemos cuántas
+        # líneas se procesaron. 'pausa' detiene los pedidos un instante para que
+        # 'capturar' copie la lista de pedidos (y la vista del archivo de pedidos
+        # antiguos, o None); los que lleguen mientras calculamos se apuntan aparte
+        # y se suman al resultado antes de sustituir los agregados
+        with pausa(), self._lock:
+            pedidos, archivo = capturar()
+            self._pendientes = []
+        try:
+            nuevos = AgregadosVentas()
+            if np is not None:
+                # Creamos millones de objetos pequeños: sin pausar el recolector de
+                # ciclos, sus pasadas recorren todos los pedidos una y otra vez y
+                # cuestan más que el propio cálculo
+                reactivar = gc.isenabled()
+                gc.disable()
+                try:
+                    lineas = nuevos._cargar_vectorizado(pedidos, archivo.columnas() if archivo is not None else [])
+                finally:
+                    if reactivar:
+                        gc.enable()
+            else:
+                lineas = 0
+                for pedido in chain(archivo.iterar() if archivo is not None else (), pedidos):
+                    nuevos._aplicar(pedido)
+                    lineas += len(pedido.columnas()[0])
+            with self._lock:
+                for pedido in self._pendientes:
+                    nuevos._aplicar(pedido)
+                for atributo in ("_por_producto", "_por_cliente", "_por_dia", "_totales",
+                                 "_top_unidades", "_top_ingresos", "_top_clientes"):
+                    setattr(self, atributo, getattr(nuevos, atributo))
+            return lineas
+        finally:
+            with self._lock:
+                self._pendientes = None
+
+    def _cargar_vectorizado(self, pedidos: List[Pedido], archivados: List[ColumnasSegmento]) -> int:
+        # Empaquetamos todas las líneas en arrays de NumPy y agregamos con bincount
+        # (un "group by" por producto, cliente y día sin bucles de Python por línea)
+        # Los segmentos del archivo ya están en columnas: se añaden sin crear pedidos
+        num_pedidos = len(pedidos) + sum(len(a.totales) for a in archivados)
+        if not num_pedidos:
+            return 0
+        columnas = list(map(Pedido.columnas, pedidos))
+        lineas = [b"".join(map(itemgetter(1), columnas))] + [a.lineas for a in archivados]
+        datos = np.frombuffer(b"".join(lineas), dtype="<i8").reshape(-1, 3)
+        cantidades, subtotales = datos[:, 0], datos[:, 2]
+        num_lineas = len(datos)
+        lineas_por_pedido = np.concatenate(
+            [np.fromiter(map(len, map(itemgetter(0), columnas)), np.int64, len(columnas))]
+            + [np.diff(np.frombuffer(a.inicio_lineas, np.uint64)).astype(np.int64) for a in archivados]
+        )
+
+        # Productos, clientes y días a índices densos: agrupamos por la identidad
+        # del objeto (id) con np.unique en lugar de usar un diccionario línea a línea
+        productos, indice_producto = _agrupar(
+            chain(chain.from_iterable(map(itemgetter(0), columnas)), *(a.productos for a in archivados)), num_lineas
+        )
+        clientes, indice_cliente = _agrupar(
+            chain(map(attrgetter("cliente"), pedidos), *(a.clientes for a in archivados)), num_pedidos
+        )
+        ordinales = np.concatenate(
+            [np.fromiter(map(date.toordinal, map(attrgetter("fecha"), pedidos)), np.int64, len(pedidos))]
+            + [np.frombuffer(a.fechas, np.int64) // MICROSEGUNDOS_DIA + ORDINAL_EPOCA for a in archivados]
+        )
+        dias, indice_dia = np.unique(ordinales, return_inverse=True)
+        totales = np.concatenate(
+            [np.fromiter(map(attrgetter("total_centimos"), pedidos), np.int64, len(pedidos))]
+            + [np.frombuffer(a.totales, np.int64) for a in archivados]
+        )
+        indice_pedido = np.repeat(np.arange(num_pedidos), lineas_por_pedido)
+        unidades_pedido = np.bincount(indice_pedido, weights=cantidades, minlength=num_pedidos)
+
+        def sumar(indices, pesos, tamaño) -> List[int]:
+            # bincount suma en float64, exacto para enteros por debajo de 2**53
+            return np.rint(np.bincount(indices, weights=pesos, minlength=tamaño)).astype(np.int64).tolist()
+
+        unidades = sumar(indice_producto, cantidades, len(productos))
+        ingresos = sumar(indice_producto, subtotales, len(productos))
+        self._por_producto = {p: [u, i] for p, u, i in zip(productos, unidades, ingresos)}
+        pedidos_cliente = np.bincount(indice_cliente, minlength=len(clientes)).tolist()
+        unidades_cliente = sumar(indice_cliente, unidades_pedido, len(clientes))
+        gasto_cliente = sumar(indice_cliente, totales, len(clientes))
+        self._por_cliente = {
+            c: [n, u, g] for c, n, u, g in zip(clientes, pedidos_cliente, unidades_cliente, gasto_cliente)
+        }
+        pedidos_dia = np.bincount(indice_dia, minlength=len(dias)).tolist()
+        unidades_dia = sumar(indice_dia, unidades_pedido, len(dias))
+        ingresos_dia = sumar(indice_dia, totales, len(dias))
+        self._por_dia = {
+            date.fromordinal(d): [n, u, i]
+            for d, n, u, i in zip(dias.tolist(), pedidos_dia, unidades_dia, ingresos_dia)
+        }
+        self._totales = [num_pedidos, int(cantidades.sum()), int(totales.sum())]
+
+        # Podios: seleccionamos los mayores con argpartition y los cargamos
+        for podio, claves, valores in (
+            (self._top_unidades, productos, unidades),
+            (self._top_ingresos, productos, ingresos),
+            (self._top_clientes, clientes, gasto_cliente),
+        ):
+            array = np.asarray(valores)
+            k = min(podio.capacidad, len(array))
+            for posicion in np.argpartition(-array, k - 1)[:k].tolist():
+                podio.actualizar(claves[posicion], valores[posicion])
+        return num_lineas
+
+    # Lecturas
+    def resumen(self) -> Dict[str, int]:
+        pedidos, unidades, ingresos = self._totales
+        return {"pedidos": pedidos, "unidades": unidades, "ingresos": ingresos}
+
+    def producto(self, producto: Producto) -> Tuple[int, int]:
+        # (unidades, ingresos) de un producto; ceros si no se ha vendido
+        unidades, ingresos = self._por_producto.get(producto, (0, 0))
+        return unidades, ingresos
+
+    def cliente(self, cliente: Cliente) -> Tuple[int, int, int]:
+        # (pedidos, unidades, gasto) de un cliente; ceros si no ha comprado
+        pedidos, unidades, gasto = self._por_cliente.get(cliente, (0, 0, 0))
+        return pedidos, unidades, gasto
+
+    def top_productos(self, n: int, criterio: str = "unidades") -> List[Tuple[Producto, int, int]]:
+        # Los n productos más vendidos por unidades o por ingresos
+        if criterio not in ("unidades", "ingresos"):
+            raise ValueError("El criterio debe ser 'unidades' o 'ingresos'.")
+        podio = self._top_unidades if criterio == "unidades" else self._top_ingresos
+        with self._lock:
+            mayores = podio.mayores(n)
+        return [(producto, *self.producto(producto)) for producto, _ in mayores]
+
+    def top_clientes(self, n: int) -> List[Tuple[Cliente, int, int, int]]:
+        # Los n clientes con mayor gasto
+        with self._lock:
+            mayores = self._top_clientes.mayores(n)
+        return [(cliente, *self.cliente(cliente)) for cliente, _ in mayores]
+
+    def por_dia(self, desde: Optional[date] = None, hasta: Optional[date] = None) -> List[Tuple[date, int, int, int]]:
+        # (día, pedidos, unidades, ingresos) de cada día con ventas en [desde, hasta]
+        with self._lock:
+            dias = list(self._por_dia.items())
+        return sorted(
+            (dia, *valores) for dia, valores in dias
+            if (desde is None or dia >= desde) and (hasta is None or dia <= hasta)
+        )
+
+
+def _agrupar(objetos: Iterable[Any], cantidad: int) -> Tuple[List[Any], Any]:
+    # Devolvemos los objetos distintos y, para cada posición, el índice de su objeto
+    # Los objetos siguen vivos mientras dura el recálculo, así que su id es estable
+    objetos = list(objetos)
+    identidades = np.fromiter(map(id, objetos), np.uint64, cantidad)
+    _, primera, indices = np.unique(identidades, return_index=True, return_inverse=True)
+    return [objetos[i] for i in primera.tolist()], indices
@@ -0,0 +1,176 @@
+from __future__ import annotations
+import asyncio
+from threading import RLock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from pydantic_core import to_json
+
+from models import Producto
+from .Serializadores import producto_a_dict
+
+
+class Suscripcion:
+    # Un cliente conectado al canal de cambios de stock
+    # Guarda como mucho un evento por producto: si un producto cambia varias veces
+    # antes de que el cliente reciba el anterior, solo queda el último valor. Así un
+    # cliente lento nunca acumula más de un evento por producto y nunca frena a quien
+    # publica. Si aun así pasa de 'max_pendientes' productos se descartan y el
+    # cliente recibe un evento "resincronizar" para que vuelva a leer el catálogo.
+    __slots__ = ("productos", "tipo", "max_pendientes", "_pendientes", "_aviso", "_desbordada", "_cerrada")
+
+    def __init__(self, productos: Optional[Set[UUID]], tipo: Optional[str], max_pendientes: int):
+        self.productos = productos
+        self.tipo = tipo
+        self.max_pendientes = max_pendientes
+        self._pendientes: Dict[UUID, bytes] = {}
+        self._aviso = asyncio.Event()
+        self._desbordada = False
+        self._cerrada = False
+
+    def poner(self, producto_id: UUID, evento: bytes) -> Tuple[bool, bool]:
+        # Dejamos el evento como el último del producto y despertamos al cliente
+        # Devolvemos si sustituyó a uno pendiente y si hubo que descartar los pendientes
+        sustituido = producto_id in self._pendientes
+        desborde = not sustituido and len(self._pendientes) >= self.max_pendientes
+        if desborde:
+            self._pendientes.clear()
+            self._desbordada = True
+        self._pendientes[producto_id] = evento
+        self._aviso.set()
+        return sustituido, desborde
+
+    async def siguientes(self, espera: Optional[float] = None) -> Optional[List[bytes]]:
+        # Esperamos a que haya eventos y los devolvemos todos (JSON ya codificado)
+        # Devolvemos [] si pasa 'espera' sin cambios y None si la suscripción se cerró
+        if not self._aviso.is_set() and not self._cerrada:
+            try:
+                await asyncio.wait_for(self._aviso.wait(), espera)
+            except asyncio.TimeoutError:
+                return []
+        if self._cerrada:
+            return None
+        self._aviso.clear()
+        eventos = list(self._pendientes.values())
+        self._pendientes = {}
+        if self._desbordada:
+            self._desbordada = False
+            eventos.insert(0, to_json({"evento": "resincronizar"}))
+        return eventos
+
+    def cerrar(self) -> None:
+        self._cerrada = True
+        self._aviso.set()
+
+
+class CanalStock:
+    # Cambios de stock, altas y bajas de productos para los clientes suscritos
+    # Las mutaciones (desde cualquier hilo) solo apuntan qué productos cambiaron y,
+    # si no lo estaba ya, programan un reparto en el bucle de eventos. El reparto
+    # lee el estado actual de cada producto (una ráfaga de pedidos sobre el mismo
+    # producto es un solo evento), lo codifica una vez y lo deja en las
+    # suscripciones interesadas, que se buscan en índices por producto y por tipo:
+    # los suscriptores que no esperan ese producto no cuestan nada.
+    # Las suscripciones y el reparto viven en el bucle de eventos de la aplicación.
+
+    def __init__(self, max_pendientes: int = 10_000):
+        self.max_pendientes = max_pendientes
+        # Suscripciones por producto concreto y por tipo (None: todos los productos)
+        self._por_producto: Dict[UUID, Set[Suscripcion]] = {}
+        self._por_tipo: Dict[Optional[str], Set[Suscripcion]] = {}
+        self.suscriptores = 0
+        # Productos cambiados desde el último reparto: id -> (producto, eliminado)
+        self._cambiados: Dict[UUID, Tuple[Producto, bool]] = {}
+        self._programado = False
+        self._bucle: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = RLock()
+        # Estadísticas
+        self.repartos = 0
+        self.eventos = 0
+        self.agrupados = 0
+        self.desbordes = 0
+
+    @property
+    def lock(self) -> RLock:
+        # Reentrante: desde el bucle de eventos se toma antes sin esperar (ver
+        # TiendaService._indices_sin_esperar) y la escritura lo vuelve a tomar dentro
+        return self._lock
+
+    def suscribir(self, productos: Optional[Iterable[UUID]] = None, tipo: Optional[str] = None) -> Suscripcion:
+        # Nueva suscripción a unos productos concretos y/o a un tipo (sin filtros, a todo)
+        self._bucle = asyncio.get_running_loop()
+        suscripcion = Suscripcion(set(productos) if productos else None, tipo, self.max_pendientes)
+        for indice, clave in self._claves(suscripcion):
+            indice.setdefault(clave, set()).add(suscripcion)
+        self.suscriptores += 1
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion) -> None:
+        suscripcion.cerrar()
+        # Quitamos los grupos que se quedan vacíos para que los índices no crezcan
+        # con cada producto al que alguna vez se suscribió alguien
+        for indice, clave in self._claves(suscripcion):
+            grupo = indice.get(clave)
+            if grupo is not None:
+                grupo.discard(suscripcion)
+                if not grupo:
+                    del indice[clave]
+        self.suscriptores -= 1
+
+    def _claves(self, suscripcion: Suscripcion) -> List[Tuple[Dict, object]]:
+        # Con productos concretos se indexa por producto (y el tipo se comprueba al repartir)
+        if suscripcion.productos is not None:
+            return [(self._por_producto, p) for p in suscripcion.productos]
+        return [(self._por_tipo, suscripcion.tipo)]
+
+    def publicar(self, productos: Iterable[Producto], eliminados: bool = False) -> None:
+        # Apuntamos productos dados de alta, con stock cambiado o eliminados
+        # Sin suscriptores no hace nada; con ellos no espera nunca a ningún cliente
+        if not self.suscriptores:
+            return
+        with self._lock:
+            for producto in productos:
+                self._cambiados[producto.id] = (producto, eliminados)
+            if self._programado:
+                return
+            self._programado = True
+        try:
+            self._bucle.call_soon_threadsafe(self._repartir)
+        except RuntimeError:
+            # El bucle ya se cerró (la aplicación se está parando)
+            with self._lock:
+                self._programado = False
+
+    def _repartir(self) -> None:
+        with self._lock:
+            cambiados = self._cambiados
+            self._cambiados = {}
+            self._programado = False
+        self.repartos += 1
+        todos = self._por_tipo.get(None, ())
+        for producto_id, (producto, eliminado) in cambiados.items():
+            por_producto = self._por_producto.get(producto_id, ())
+            por_tipo = self._por_tipo.get(producto.tipo, ())
+            if not (por_producto or por_tipo or todos):
+                continue
+            if eliminado:
+                evento = to_json({"evento": "eliminado", "id": producto_id, "tipo": producto.tipo})
+            else:
+                evento = to_json({"evento": "actualizado", **producto_a_dict(producto)})
+            for grupo in (por_producto, por_tipo, todos):
+                for suscripcion in grupo:
+                    if suscripcion.tipo is not None and suscripcion.tipo != producto.tipo:
+                        continue
+                    sustituido, desborde = suscripcion.poner(producto_id, evento)
+                    self.eventos += 1
+                    self.agrupados += sustituido
+                    self.desbordes += desborde
+
+    def estadisticas(self) -> Dict[str, int]:
+        return {
+            "suscriptores": self.suscriptores,
+            "repartos": self.repartos,
+            "eventos": self.eventos,
+            "agrupados": self.agrupados,
+            "desbordes": self.desbordes,
+        }
@@ -0,0 +1,106 @@
+from __future__ import annotations
+import csv
+import io
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from pydantic_core import to_json
+
+from models import Pedido, Producto
+from .Serializadores import CAMPOS_OPCIONALES_PRODUCTO, pedido_a_dict, producto_a_dict
+
+# Exportación en streaming del catálogo y de los pedidos en NDJSON o CSV.
+# Las funciones reciben un iterador (p. ej. TiendaService.iterar_pedidos) y
+# generan bloques de bytes de unos 64 KiB: la memoria usada no depende del
+# tamaño de la exportación y el primer bloque sale en cuanto hay 64 KiB.
+
+FORMATOS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+TAMAÑO_BLOQUE = 64 * 1024
+
+COLUMNAS_PRODUCTOS = ("id", "tipo", "nombre", "precio", "stock", "retenido") + CAMPOS_OPCIONALES_PRODUCTO
+COLUMNAS_PEDIDOS = (
+    "pedido_id", "fecha", "cliente_id", "nombre_cliente", "producto_id", "nombre_producto",
+    "cantidad", "precio_unitario", "subtotal", "total_pedido",
+)
+
+
+def _euros(centimos: int) -> str:
+    # Importe exacto en euros a partir de los céntimos (sin pasar por float)
+    signo = "-" if centimos < 0 else ""
+    centimos = abs(centimos)
+    return f"{signo}{centimos // 100}.{centimos % 100:02d}"
+
+
+def _filas_producto(p: Producto) -> List[list]:
+    datos = producto_a_dict(p)
+    return [["" if datos[c] is None else datos[c] for c in COLUMNAS_PRODUCTOS]]
+
+
+def _filas_pedidos() -> Callable[[Pedido], List[list]]:
+    # Una fila por línea del pedido, repitiendo los datos del pedido
+    # Convertir un UUID a texto es caro, así que guardamos el texto de cada producto
+    # y cliente ya visto (como mucho uno por producto del catálogo y por cliente)
+    productos: Dict[Producto, Tuple[str, str]] = {}
+    clientes: Dict[object, str] = {}
+
+    def filas(pedido: Pedido) -> List[list]:
+        cliente = clientes.get(pedido.cliente)
+        if cliente is None:
+            cliente = clientes[pedido.cliente] = str(pedido.cliente.id)
+        cabecera = [str(pedido.id), pedido.fecha.isoformat(), cliente, pedido.cliente.nombre]
+        total = _euros(pedido.total_centimos)
+        resultado = []
+        for producto, cantidad, precio, subtotal in pedido.lineas():
+            datos = productos.get(producto)
+            if datos is None:
+                datos = productos[producto] = (str(producto.id), producto.nombre)
+            resultado.append(cabecera + [*datos, cantidad, _euros(precio), _euros(subtotal), total])
+        return resultado
+
+    return filas
+
+
+def _ndjson(elementos: Iterable, a_dict: Callable) -> Iterator[bytes]:
+    bloque: List[bytes] = []
+    tamaño = 0
+    for elemento in elementos:
+        linea = to_json(a_dict(elemento)) + b"\n"
+        bloque.append(linea)
+        tamaño += len(linea)
+        if tamaño >= TAMAÑO_BLOQUE:
+            yield b"".join(bloque)
+            bloque.clear()
+            tamaño = 0
+    if bloque:
+        yield b"".join(bloque)
+
+
+def _csv(elementos: Iterable, columnas: tuple, filas: Callable) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator="\n")
+    escritor.writerow(columnas)
+    for elemento in elementos:
+        escritor.writerows(filas(elemento))
+        if buffer.tell() >= TAMAÑO_BLOQUE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    # La cabecera sale aunque no haya filas
+    yield buffer.getvalue().encode("utf-8")
+
+
+def exportar_productos(productos: Iterable[Producto], formato: str) -> Iterator[bytes]:
+    # NDJSON con el esquema de ProductoRead o CSV con una fila por producto
+    if formato == "ndjson":
+        return _ndjson(productos, producto_a_dict)
+    if formato == "csv":
+        return _csv(productos, COLUMNAS_PRODUCTOS, _filas_producto)
+    raise ValueError(f"Formato no válido. Usa uno de: {', '.join(FORMATOS)}.")
+
+
+def exportar_pedidos(pedidos: Iterable[Pedido], formato: str) -> Iterator[bytes]:
+    # NDJSON con el esquema de PedidoRead o CSV con una fila por línea de pedido
+    if formato == "ndjson":
+        return _ndjson(pedidos, pedido_a_dict)
+    if formato == "csv":
+        return _csv(pedidos, COLUMNAS_PEDIDOS, _filas_pedidos())
+    raise ValueError(f"Formato no válido. Usa uno de: {', '.join(FORMATOS)}.")
@@ -0,0 +1,203 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Tuple
+from uuid import UUID
+
+
+class ConflictoIdempotencia(ValueError):
+    # La clave ya se usó con otra petición distinta
+    pass
+
+
+class RespuestaRepetida(Exception):
+    # La clave ya tiene respuesta guardada junto a su pedido (en el WAL o en la base
+    # de datos compartida, quizá por otro worker): se devuelve esa respuesta
+    def __init__(self, cuerpo: bytes):
+        super().__init__("La petición ya se ejecutó con esta clave de idempotencia.")
+        self.cuerpo = cuerpo
+
+
+def comprobar_huella(guardada: int, huella: int) -> None:
+    if guardada != huella:
+        raise ConflictoIdempotencia("La clave de idempotencia ya se usó con otra petición.")
+
+
+class ClaveIdempotencia:
+    # Clave de un pedido que se guarda con el propio pedido: en el mismo registro del
+    # WAL o en la misma transacción de la base de datos compartida
+    # 'huella' tiene que ser igual en todos los procesos (no vale el hash de un str)
+    __slots__ = ("clave", "huella", "ttl")
+
+    def __init__(self, clave: str, huella: int, ttl: float):
+        self.clave = clave
+        self.huella = huella
+        self.ttl = ttl
+
+
+class _EnCurso:
+    # Petición que se está ejecutando: los duplicados esperan a su futuro
+    __slots__ = ("huella", "futuro")
+
+    def __init__(self, huella: int, futuro: asyncio.Future):
+        self.huella = huella
+        self.futuro = futuro
+
+
+class _Completada:
+    # Respuesta ya generada para una clave, válida hasta 'caduca'
+    __slots__ = ("huella", "cuerpo", "caduca")
+
+    def __init__(self, huella: int, cuerpo: bytes, caduca: float):
+        self.huella = huella
+        self.cuerpo = cuerpo
+        self.caduca = caduca
+
+
+class CacheIdempotencia:
+    # Respuestas de peticiones con cabecera Idempotency-Key
+    # La primera petición con una clave se ejecuta y su respuesta se guarda durante
+    # 'ttl' segundos; las repeticiones devuelven esa respuesta sin volver a ejecutarla
+    # y las que llegan mientras la primera sigue en curso esperan a que termine.
+    # Si la primera falla no se guarda nada y la siguiente repetición se ejecuta.
+    # Con persistencia o almacén compartido la respuesta también se guarda con el
+    # pedido: si la clave ya se usó antes de reiniciar o en otro worker, 'funcion'
+    # lanza RespuestaRepetida y se devuelve esa respuesta como repetida.
+    # Solo se usa desde el bucle de eventos, así que no necesita locks.
+    # Las completadas están en orden de inserción y todas tienen el mismo 'ttl', así
+    # que las caducadas y las que se expulsan por tamaño están siempre al principio.
+
+    def __init__(self, ttl: float = 24 * 3600, max_entradas: int = 50_000, reloj: Callable[[], float] = time.monotonic):
+        if ttl <= 0 or max_entradas <= 0:
+            raise ValueError("El TTL y el tamaño de la caché de idempotencia deben ser mayores que cero.")
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._reloj = reloj
+        self._completadas: OrderedDict[Hashable, _Completada] = OrderedDict()
+        self._en_curso: Dict[Hashable, _EnCurso] = {}
+        # Estadísticas
+        self.ejecuciones = 0
+        self.repeticiones = 0
+        self.esperas = 0
+        self.conflictos = 0
+        self.caducadas = 0
+        self.expulsiones = 0
+
+    async def ejecutar(
+        self, clave: Hashable, huella: int, funcion: Callable[[], Awaitable[bytes]]
+    ) -> Tuple[bytes, bool]:
+        # Devolvemos la respuesta de la clave y si es repetida (True) o recién generada
+        # 'huella' resume la petición: reutilizar la clave con otra petición es un error
+        while True:
+            self._purgar()
+            completada = self._completadas.get(clave)
+            if completada is not None:
+                self._comprobar(completada.huella, huella)
+                self.repeticiones += 1
+                return completada.cuerpo, True
+            en_curso = self._en_curso.get(clave)
+            if en_curso is None:
+                break
+            self._comprobar(en_curso.huella, huella)
+            self.esperas += 1
+            # 'shield' para que cancelar esta espera no cancele el futuro de los demás
+            await asyncio.shield(en_curso.futuro)
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_curso[clave] = _EnCurso(huella, futuro)
+        try:
+            try:
+                cuerpo = await funcion()
+                repetida = False
+                self.ejecuciones += 1
+            except RespuestaRepetida as e:
+                cuerpo = e.cuerpo
+                repetida = True
+                self.repeticiones += 1
+            except ConflictoIdempotencia:
+                self.conflictos += 1
+                raise
+            self._completadas[clave] = _Completada(huella, cuerpo, self._reloj() + self.ttl)
+            while len(self._completadas) > self.max_entradas:
+                self._completadas.popitem(last=False)
+                self.expulsiones += 1
+        finally:
+            # Despertamos a los duplicados: encontrarán la respuesta o lo volverán a intentar
+            del self._en_curso[clave]
+            futuro.set_result(None)
+        return cuerpo, repetida
+
+    def _comprobar(self, guardada: int, huella: int) -> None:
+        if guardada != huella:
+            self.conflictos += 1
+            comprobar_huella(guardada, huella)
+
+    def _purgar(self) -> None:
+        # Eliminamos las respuestas caducadas (tiempo constante amortizado)
+        ahora = self._reloj()
+        while self._completadas:
+            primera = next(iter(self._completadas.values()))
+            if primera.caduca > ahora:
+                break
+            self._completadas.popitem(last=False)
+            self.caducadas += 1
+
+    def estadisticas(self) -> Dict[str, float]:
+        # Resumen de uso: entradas guardadas y en curso, repeticiones y expulsiones
+        return {
+            "entradas": len(self._completadas),
+            "en_curso": len(self._en_curso),
+            "max_entradas": self.max_entradas,
+            "ttl": self.ttl,
+            "ejecuciones": self.ejecuciones,
+            "repeticiones": self.repeticiones,
+            "esperas": self.esperas,
+            "conflictos": self.conflictos,
+            "caducadas": self.caducadas,
+            "expulsiones": self.expulsiones,
+        }
+
+
+class RegistroIdempotencia:
+    # Claves de idempotencia guardadas con los pedidos en el WAL
+    # Se recuperan al arrancar y van en los snapshots, así que un reintento que llega
+    # después de reiniciar devuelve el pedido original. Las caducidades son de reloj
+    # de pared (sobreviven al proceso). Se modifica con el lock del WAL tomado; las
+    # lecturas son consultas sueltas al diccionario.
+
+    def __init__(self, reloj: Callable[[], float] = time.time):
+        self._reloj = reloj
+        self._entradas: OrderedDict[Tuple[UUID, str], _Completada] = OrderedDict()
+
+    def comprobar(self, cliente_id: UUID, clave: ClaveIdempotencia) -> None:
+        # Lanzamos RespuestaRepetida si la clave ya tiene respuesta
+        completada = self._entradas.get((cliente_id, clave.clave))
+        if completada is not None and completada.caduca > self._reloj():
+            comprobar_huella(completada.huella, clave.huella)
+            raise RespuestaRepetida(completada.cuerpo)
+
+    def guardar(self, cliente_id: UUID, clave: str, huella: int, cuerpo: bytes, caduca: float) -> None:
+        # Quitamos primero las caducadas (al principio salvo si cambió el TTL entre
+        # arranques; entonces alguna espera un poco más, pero nunca se devuelve)
+        ahora = self._reloj()
+        while self._entradas:
+            primera = next(iter(self._entradas.values()))
+            if primera.caduca > ahora:
+                break
+            self._entradas.popitem(last=False)
+        if caduca > ahora:
+            self._entradas[(cliente_id, clave)] = _Completada(huella, cuerpo, caduca)
+            self._entradas.move_to_end((cliente_id, clave))
+
+    def entradas(self) -> List[Tuple[UUID, str, int, bytes, float]]:
+        # Copia de las claves vigentes (para el snapshot)
+        ahora = self._reloj()
+        return [
+            (cliente_id, clave, c.huella, c.cuerpo, c.caduca)
+            for (cliente_id, clave), c in list(self._entradas.items())
+            if c.caduca > ahora
+        ]
+
+    def __len__(self) -> int:
+        return len(self._entradas)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from threading import RLock
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from models import Pedido
+
+
+class IndicePedidosCliente:
+    # Índice secundario que agrupa los pedidos de cada cliente ordenados por fecha
+    # Cada cliente tiene dos listas paralelas: las fechas y los pedidos
+    # De esta forma una consulta cuesta O(log n + tamaño de página) con bisect
+    # Las consultas no toman el lock: lo único que se hace sobre las listas
+    # publicadas es añadir al final (primero la fecha y luego el pedido), así que
+    # los primeros len(pedidos) elementos de las dos listas nunca cambian. Insertar
+    # en medio o quitar pedidos crea listas nuevas y sustituye la entrada del cliente
+    # (copy-on-write): una consulta en curso sigue con las listas que ya tenía.
+
+    def __init__(self):
+        # Diccionario cliente_id -> (fechas ordenadas, pedidos en el mismo orden)
+        self._por_cliente: Dict[UUID, Tuple[List[datetime], List[Pedido]]] = {}
+        # Protegemos las inserciones porque los pedidos llegan desde varios hilos
+        self._lock = RLock()
+
+    @property
+    def lock(self) -> RLock:
+        # Reentrante: desde el bucle de eventos se toma antes sin esperar (ver
+        # TiendaService._indices_sin_esperar) y la escritura lo vuelve a tomar dentro
+        return self._lock
+
+    def agregar(self, pedido: Pedido) -> None:
+        # Insertamos el pedido en la posición que le corresponde por fecha
+        with self._lock:
+            fechas, pedidos = self._por_cliente.setdefault(pedido.cliente.id, ([], []))
+            # Lo habitual es que el pedido sea el más reciente, así que evitamos el bisect
+            if not fechas or fechas[-1] <= pedido.fecha:
+                fechas.append(pedido.fecha)
+                pedidos.append(pedido)
+            else:
+                posicion = bisect_right(fechas, pedido.fecha)
+                self._por_cliente[pedido.cliente.id] = (
+                    fechas[:posicion] + [pedido.fecha] + fechas[posicion:],
+                    pedidos[:posicion] + [pedido] + pedidos[posicion:],
+                )
+
+    def reconstruir(self, pedidos: Iterable[Pedido]) -> None:
+        # Construimos el índice completo de una vez (más rápido que insertar uno a uno)
+        por_cliente: Dict[UUID, List[Pedido]] = {}
+        for pedido in pedidos:
+            por_cliente.setdefault(pedido.cliente.id, []).append(pedido)
+        indice: Dict[UUID, Tuple[List[datetime], List[Pedido]]] = {}
+        for cliente_id, lista in por_cliente.items():
+            lista.sort(key=lambda p: p.fecha)
+            indice[cliente_id] = ([p.fecha for p in lista], lista)
+        with self._lock:
+            self._por_cliente = indice
+
+    def consultar(
+        self,
+        cliente_id: UUID,
+        desde: Optional[datetime] = None,
+        hasta: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        after: Optional[Pedido] = None,
+    ) -> List[Pedido]:
+        # Devolvemos los pedidos del cliente dentro del rango [desde, hasta]
+        # empezando justo después del pedido 'after' y como mucho 'limit' pedidos
+        entrada = self._por_cliente.get(cliente_id)
+        if not entrada:
+            return []
+        fechas, pedidos = entrada
+        # Solo miramos los pedidos que ya estaban al empezar la consulta
+        total = len(pedidos)
+
+        # Calculamos el inicio con bisect según el cursor y la fecha mínima
+        inicio = 0
+        if desde is not None:
+            inicio = bisect_left(fechas, desde, 0, total)
+        if after is not None:
+            inicio = max(inicio, self._posicion_siguiente(fechas, pedidos, total, after))
+
+        # Calculamos el final según la fecha máxima (incluida)
+        fin = total
+        if hasta is not None:
+            fin = bisect_right(fechas, hasta, 0, total)
+
+        if limit is not None:
+            fin = min(fin, inicio + limit)
+        if inicio >= fin:
+            return []
+        return pedidos[inicio:fin]
+
+    @staticmethod
+    def _posicion_siguiente(fechas: List[datetime], pedidos: List[Pedido], total: int, after: Pedido) -> int:
+        # Buscamos el pedido del cursor entre los de su misma fecha (normalmente uno)
+        posicion = bisect_left(fechas, after.fecha, 0, total)
+        while posicion < total and fechas[posicion] == after.fecha:
+            if pedidos[posicion] is after:
+                return posicion + 1
+            posicion += 1
+        return posicion
+
+    def anteriores(self, corte: datetime) -> Dict[UUID, List[Pedido]]:
+        # Copiamos, cliente a cliente, los pedidos con fecha anterior a 'corte'
+        # (siempre el principio de su lista); se usa para pasarlos al archivo
+        with self._lock:
+            resultado = {}
+            for cliente_id, (fechas, pedidos) in self._por_cliente.items():
+                if fechas[0] < corte:
+                    resultado[cliente_id] = pedidos[:bisect_left(fechas, corte)]
+            return resultado
+
+    def quitar(self, por_cliente: Dict[UUID, List[Pedido]]) -> None:
+        # Quitamos del índice los pedidos ya archivados (los devueltos por 'anteriores')
+        with self._lock:
+            for cliente_id, archivados in por_cliente.items():
+                fechas, pedidos = self._por_cliente[cliente_id]
+                n = len(archivados)
+                if all(a is b for a, b in zip(pedidos, archivados)):
+                    fechas, pedidos = fechas[n:], pedidos[n:]
+                else:
+                    # Entró otro pedido antiguo entre medias: filtramos por identidad
+                    quitar = set(map(id, archivados))
+                    pedidos = [p for p in pedidos if id(p) not in quitar]
+                    fechas = [p.fecha for p in pedidos]
+                if pedidos:
+                    self._por_cliente[cliente_id] = (fechas, pedidos)
+                else:
+                    del self._por_cliente[cliente_id]
+
+    def contar(self, cliente_id: UUID) -> int:
+        # Devolvemos cuántos pedidos tiene indexados un cliente
+        entrada = self._por_cliente.get(cliente_id)
+        return len(entrada[1]) if entrada else 0
@@ -0,0 +1,390 @@
+from __future__ import annotations
+import base64
+import heapq
+import json
+import re
+import unicodedata
+from itertools import chain
+from bisect import bisect_left, bisect_right, insort
+from threading import RLock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from models import Producto
+
+# Ordenaciones admitidas por la búsqueda ("-" indica orden descendente)
+ORDENES = ("precio", "-precio", "nombre", "-nombre")
+
+
+def normalizar(texto: str) -> str:
+    # Pasamos a minúsculas y quitamos tildes para comparar sin distinguir acentos
+    if texto.isascii():
+        # Un texto ASCII no tiene tildes: basta con pasarlo a minúsculas
+        return texto.lower()
+    descompuesto = unicodedata.normalize("NFKD", texto.casefold())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+_PALABRA = re.compile(r"\w+")
+# En un alta masiva los productos nuevos entran en las listas ordenadas por trozos
+# y cada trozo se mezcla por grupos (ver '_añadir_ordenados')
+_TROZO_ORDENACION = 32768
+_GRUPO_MEZCLA = 1024
+
+
+def tokenizar(texto: str) -> List[str]:
+    # Dividimos un texto normalizado en palabras
+    return _PALABRA.findall(normalizar(texto))
+
+
+def codificar_cursor(orden: str, clave: Tuple) -> str:
+    # Cursor opaco con la clave de ordenación del último producto de la página
+    datos = json.dumps([orden.lstrip("-"), clave[0], format(clave[1], "032x")]).encode("utf-8")
+    return base64.urlsafe_b64encode(datos).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(orden: str, cursor: str) -> Tuple:
+    # Recuperamos la clave de un cursor y comprobamos que corresponde a la ordenación
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        campo, valor, producto_id = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        clave = (valor, int(producto_id, 16))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor no válido.")
+    if campo != orden.lstrip("-") or not isinstance(valor, (int, float) if campo == "precio" else str):
+        raise ValueError("El cursor no corresponde a la ordenación solicitada.")
+    return clave
+
+
+def _añadir_ordenados(lista: List, nuevos: List) -> None:
+    # Mezclamos elementos nuevos en una lista ordenada sin una ordenación grande:
+    # 'sort' tiene el GIL de principio a fin (cientos de ms con cientos de miles de
+    # tuplas) y pararía a los demás hilos, también al bucle de eventos. Ordenamos
+    # los nuevos por trozos y cada grupo pequeño de un trozo se ordena solo con el
+    # tramo de la lista en el que cae (Timsort mezcla dos tramos ya ordenados), así
+    # que ninguna llamada retiene el GIL más de unos milisegundos
+    if len(lista) + len(nuevos) <= _TROZO_ORDENACION:
+        lista += nuevos
+        lista.sort()
+        return
+    for inicio in range(0, len(nuevos), _TROZO_ORDENACION):
+        trozo = sorted(nuevos[inicio:inicio + _TROZO_ORDENACION])
+        tramos = []
+        desde = 0
+        for posicion in range(0, len(trozo), _GRUPO_MEZCLA):
+            grupo = trozo[posicion:posicion + _GRUPO_MEZCLA]
+            hasta = bisect_right(lista, grupo[-1], desde)
+            tramo = lista[desde:hasta]
+            tramo += grupo
+            tramo.sort()
+            tramos.append(tramo)
+            desde = hasta
+        tramos.append(lista[desde:])
+        lista[:] = chain.from_iterable(tramos)
+
+
+class IndiceProductos:
+    # Índices secundarios del catálogo para servir búsquedas sin recorrer todos los productos:
+    #   - índice invertido de palabras del nombre (con vocabulario ordenado para prefijos)
+    #   - índices hash por tipo, talla y color
+    #   - conjunto de productos con stock
+    #   - listas ordenadas por precio y por nombre para ordenar y paginar con bisect
+    # Internamente usamos el entero del UUID (producto.id.int) como identificador:
+    # los UUID se comparan y se hashean en Python, los enteros en C.
+
+    def __init__(self):
+        self._lock = RLock()
+        self._productos: Dict[int, Producto] = {}
+        # Claves con las que se indexó cada producto (para poder borrarlo aunque cambie)
+        self._claves: Dict[int, Tuple] = {}
+        self._palabras: Dict[str, Set[int]] = {}
+        self._vocabulario: List[str] = []
+        self._por_tipo: Dict[str, Set[int]] = {}
+        self._por_talla: Dict[str, Set[int]] = {}
+        self._por_color: Dict[str, Set[int]] = {}
+        self._con_stock: Set[int] = set()
+        self._por_precio: List[Tuple[float, int]] = []
+        self._por_nombre: List[Tuple[str, int]] = []
+
+    @property
+    def lock(self) -> RLock:
+        # Reentrante: desde el bucle de eventos se toma antes sin esperar (ver
+        # TiendaService._indices_sin_esperar) y la escritura lo vuelve a tomar dentro
+        return self._lock
+
+    # Mantenimiento
+    @staticmethod
+    def _calcular_claves(producto: Producto) -> Tuple:
+        # Claves de indexación: precio, nombre, tipo, talla, color y palabras del nombre
+        talla = getattr(producto, "talla", None)
+        color = getattr(producto, "color", None)
+        nombre = normalizar(producto.nombre)
+        return (
+            producto.precio,
+            nombre,
+            producto.tipo,
+            normalizar(talla) if talla else None,
+            normalizar(color) if color else None,
+            tuple(set(_PALABRA.findall(nombre))),
+        )
+
+    def agregar(self, producto: Producto) -> None:
+        self.agregar_lote([producto])
+
+    def agregar_lote(self, productos: Iterable[Producto]) -> None:
+        # Añadimos varios productos: si son pocos los insertamos en su posición con
+        # bisect y si son muchos los añadimos al final y reordenamos una sola vez
+        nuevos = [(p, self._calcular_claves(p)) for p in productos]
+        with self._lock:
+            for producto, _ in nuevos:
+                if producto.id.int in self._claves:
+                    self._eliminar(producto.id.int)
+            reordenar = len(nuevos) > 32
+            palabras_nuevas: List[str] = []
+            precios_nuevos: List[Tuple[float, int]] = []
+            nombres_nuevos: List[Tuple[str, int]] = []
+            for producto, claves in nuevos:
+                producto_id = producto.id.int
+                precio, nombre, tipo, talla, color, palabras = claves
+                self._productos[producto_id] = producto
+                self._claves[producto_id] = claves
+                for palabra in palabras:
+                    ids = self._palabras.get(palabra)
+                    if ids is None:
+                        ids = self._palabras[palabra] = set()
+                        if reordenar:
+                            palabras_nuevas.append(palabra)
+                        else:
+                            insort(self._vocabulario, palabra)
+                    ids.add(producto_id)
+                self._por_tipo.setdefault(tipo, set()).add(producto_id)
+                if talla is not None:
+                    self._por_talla.setdefault(talla, set()).add(producto_id)
+                if color is not None:
+                    self._por_color.setdefault(color, set()).add(producto_id)
+                if producto.stock > 0:
+                    self._con_stock.add(producto_id)
+                if reordenar:
+                    precios_nuevos.append((precio, producto_id))
+                    nombres_nuevos.append((nombre, producto_id))
+                else:
+                    insort(self._por_precio, (precio, producto_id))
+                    insort(self._por_nombre, (nombre, producto_id))
+            if reordenar:
+                _añadir_ordenados(self._por_precio, precios_nuevos)
+                _añadir_ordenados(self._por_nombre, nombres_nuevos)
+                _añadir_ordenados(self._vocabulario, palabras_nuevas)
+
+    def eliminar(self, producto_id: UUID) -> None:
+        with self._lock:
+            self._eliminar(producto_id.int)
+
+    def _eliminar(self, producto_id: int) -> None:
+        claves = self._claves.pop(producto_id, None)
+        if claves is None:
+            return
+        precio, nombre, tipo, talla, color, palabras = claves
+        del self._productos[producto_id]
+        for palabra in palabras:
+            ids = self._palabras[palabra]
+            ids.discard(producto_id)
+            if not ids:
+                del self._palabras[palabra]
+                del self._vocabulario[bisect_left(self._vocabulario, palabra)]
+        self._descartar(self._por_tipo, tipo, producto_id)
+        self._descartar(self._por_talla, talla, producto_id)
+        self._descartar(self._por_color, color, producto_id)
+        self._con_stock.discard(producto_id)
+        del self._por_precio[bisect_left(self._por_precio, (precio, producto_id))]
+        del self._por_nombre[bisect_left(self._por_nombre, (nombre, producto_id))]
+
+    @staticmethod
+    def _descartar(indice: Dict[str, Set[int]], clave: Optional[str], producto_id: int) -> None:
+        if clave is None:
+            return
+        ids = indice.get(clave)
+        if ids is not None:
+            ids.discard(producto_id)
+            if not ids:
+                del indice[clave]
+
+    def _cambios_disponibilidad(self, productos: Iterable[Producto]) -> List[Producto]:
+        # Productos que se han quedado sin stock o vuelven a tenerlo
+        return [p for p in productos if (p.stock > 0) != (p.id.int in self._con_stock)]
+
+    def cambia_disponibilidad(self, productos: Iterable[Producto]) -> bool:
+        # Si 'actualizar_stock' con estos productos tendría que tomar el lock
+        return bool(self._cambios_disponibilidad(productos))
+
+    def actualizar_stock(self, productos: Iterable[Producto]) -> None:
+        # Actualizamos el conjunto de productos con stock tras un cambio de inventario
+        # Solo tomamos el lock (el mismo de las búsquedas) si algún producto se queda
+        # sin stock o vuelve a tenerlo: un pedido normal no espera a ninguna búsqueda
+        cambios = self._cambios_disponibilidad(productos)
+        if not cambios:
+            return
+        with self._lock:
+            for producto in cambios:
+                producto_id = producto.id.int
+                if producto_id not in self._claves:
+                    continue
+                if producto.stock > 0:
+                    self._con_stock.add(producto_id)
+                else:
+                    self._con_stock.discard(producto_id)
+
+    def reconstruir(self, productos: Iterable[Producto]) -> None:
+        # Construimos todos los índices de una vez y sustituimos los actuales
+        nuevo = IndiceProductos()
+        nuevo.agregar_lote(productos)
+        with self._lock:
+            self.__dict__.update({k: v for k, v in nuevo.__dict__.items() if k != "_lock"})
+
+    # Consultas
+    def _ids_con_prefijo(self, prefijo: str):
+        # Productos con alguna palabra que empieza por el prefijo: si hay varias palabras
+        # devolvemos su unión perezosa para no copiar listas grandes en cada consulta
+        inicio = bisect_left(self._vocabulario, prefijo)
+        fin = bisect_left(self._vocabulario, prefijo + "\U0010ffff")
+        if fin - inicio == 1:
+            return self._palabras[self._vocabulario[inicio]]
+        return _Union([self._palabras[palabra] for palabra in self._vocabulario[inicio:fin]])
+
+    def buscar(
+        self,
+        texto: Optional[str] = None,
+        tipo: Optional[str] = None,
+        talla: Optional[str] = None,
+        color: Optional[str] = None,
+        precio_min: Optional[float] = None,
+        precio_max: Optional[float] = None,
+        solo_con_stock: bool = False,
+        orden: str = "precio",
+        limit: int = 50,
+        after: Optional[Tuple] = None,
+    ) -> Tuple[List[Producto], Optional[Tuple]]:
+        # Devolvemos una página de productos y la clave del último (cursor) si hay más
+        if orden not in ORDENES:
+            raise ValueError(f"Orden no válido. Usa uno de: {', '.join(ORDENES)}.")
+        if limit <= 0:
+            raise ValueError("El límite debe ser mayor que cero.")
+        por_precio = orden.lstrip("-") == "precio"
+        descendente = orden.startswith("-")
+
+        with self._lock:
+            # Reunimos los conjuntos de candidatos de cada filtro indexado
+            conjuntos: List = []
+            if texto:
+                for palabra in tokenizar(texto):
+                    conjuntos.append(self._ids_con_prefijo(palabra))
+            if tipo:
+                conjuntos.append(self._por_tipo.get(tipo.lower(), set()))
+            if talla:
+                conjuntos.append(self._por_talla.get(normalizar(talla), set()))
+            if color:
+                conjuntos.append(self._por_color.get(normalizar(color), set()))
+            if solo_con_stock:
+                conjuntos.append(self._con_stock)
+            conjuntos.sort(key=len)
+
+            claves = self._por_precio if por_precio else self._por_nombre
+            total = len(claves)
+            # Tramo de la lista ordenada que hay que recorrer (acotado por precio y cursor)
+            inicio, fin = 0, total
+            if por_precio:
+                if precio_min is not None:
+                    inicio = bisect_left(claves, (precio_min,))
+                if precio_max is not None:
+                    fin = bisect_right(claves, (precio_max, _ID_MAXIMO))
+            if after is not None:
+                if descendente:
+                    fin = min(fin, bisect_left(claves, after))
+                else:
+                    inicio = max(inicio, bisect_right(claves, after))
+            tramo = max(fin - inicio, 0)
+
+            filtra_precio = precio_min is not None or precio_max is not None
+
+            def en_rango(producto_id: int) -> bool:
+                precio = self._claves[producto_id][0]
+                return (precio_min is None or precio >= precio_min) and (precio_max is None or precio <= precio_max)
+
+            # Estimamos cuántos productos cumplen los filtros (suponiendo independencia)
+            # para elegir el plan más barato: recorrer el tramo ordenado filtrando sobre
+            # la marcha, o filtrar el conjunto más pequeño y ordenar solo esos candidatos
+            estimacion = float(tramo)
+            for conjunto in conjuntos:
+                estimacion *= len(conjunto) / total if total else 0
+            coste_recorrer = min(tramo, (limit + 1) * tramo / max(estimacion, 1.0))
+            coste_ordenar = len(conjuntos[0]) + estimacion if conjuntos else float("inf")
+
+            def ordenar_candidatos() -> List[Tuple]:
+                # Filtramos el conjunto más pequeño y nos quedamos con los primeros
+                # según el orden pedido (heap de tamaño limit + 1, sin ordenar todo)
+                base, resto = conjuntos[0], conjuntos[1:]
+                posicion_clave = 0 if por_precio else 1
+                seleccion = {
+                    (self._claves[i][posicion_clave], i)
+                    for i in base
+                    if all(i in c for c in resto) and (not filtra_precio or en_rango(i))
+                }
+                if after is not None:
+                    if descendente:
+                        seleccion = [c for c in seleccion if c < after]
+                    else:
+                        seleccion = [c for c in seleccion if c > after]
+                if descendente:
+                    return heapq.nlargest(limit + 1, seleccion)
+                return heapq.nsmallest(limit + 1, seleccion)
+
+            if coste_ordenar < coste_recorrer:
+                pagina = ordenar_candidatos()
+            else:
+                # Recorremos el tramo ordenado; si los filtros están correlacionados con
+                # el orden (p. ej. texto y orden por nombre) la estimación falla, así que
+                # limitamos el recorrido y pasamos al otro plan si se agota el presupuesto
+                presupuesto = max(4 * coste_recorrer, 1024) if conjuntos else tramo
+                comprobar_precio = not por_precio and filtra_precio
+                pagina = []
+                posiciones = range(fin - 1, inicio - 1, -1) if descendente else range(inicio, fin)
+                for visitados, posicion in enumerate(posiciones):
+                    if visitados > presupuesto:
+                        pagina = ordenar_candidatos()
+                        break
+                    clave = claves[posicion]
+                    producto_id = clave[1]
+                    if all(producto_id in c for c in conjuntos) and (not comprobar_precio or en_rango(producto_id)):
+                        pagina.append(clave)
+                        if len(pagina) > limit:
+                            break
+
+            productos = [self._productos[i] for _, i in pagina[:limit]]
+            siguiente = pagina[limit - 1] if len(pagina) > limit else None
+            return productos, siguiente
+
+    def __len__(self) -> int:
+        return len(self._productos)
+
+
+class _Union:
+    # Unión perezosa de varios conjuntos de ids (palabras que comparten un prefijo)
+    __slots__ = ("_conjuntos", "_tamano")
+
+    def __init__(self, conjuntos: List[Set[int]]):
+        self._conjuntos = conjuntos
+        # Cota superior del tamaño (un producto puede estar en varios conjuntos)
+        self._tamano = sum(len(c) for c in conjuntos)
+
+    def __contains__(self, producto_id: int) -> bool:
+        return any(producto_id in c for c in self._conjuntos)
+
+    def __iter__(self):
+        for conjunto in self._conjuntos:
+            yield from conjunto
+
+    def __len__(self) -> int:
+        return self._tamano
+
+
+# Identificador máximo para construir claves de búsqueda que queden al final de un valor
+_ID_MAXIMO = (1 << 128) - 1
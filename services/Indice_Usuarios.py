@@ -0,0 +1,97 @@
+from __future__ import annotations
+import base64
+import json
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models import Usuario
+
+# Roles por los que se pueden listar los usuarios
+ROLES = ("cliente", "admin")
+
+
+def normalizar_email(email: str) -> str:
+    # Los emails se comparan sin espacios alrededor y sin distinguir mayúsculas
+    return email.strip().casefold()
+
+
+def rol_usuario(usuario: Usuario) -> str:
+    return "admin" if usuario.is_admin() else "cliente"
+
+
+def codificar_cursor_usuarios(rol: Optional[str], posicion: int) -> str:
+    # Cursor opaco con el rol y la posición del primer usuario de la página siguiente
+    datos = json.dumps([rol or "", posicion]).encode("utf-8")
+    return base64.urlsafe_b64encode(datos).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor_usuarios(rol: Optional[str], cursor: str) -> int:
+    # Recuperamos la posición de un cursor y comprobamos que corresponde al mismo rol
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        rol_cursor, posicion = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor no válido.")
+    if rol_cursor != (rol or "") or not isinstance(posicion, int) or posicion < 0:
+        raise ValueError("El cursor no corresponde al rol solicitado.")
+    return posicion
+
+
+class IndiceUsuarios:
+    # Índices secundarios de usuarios:
+    #   - email normalizado -> usuario (único), para buscar por email en O(1)
+    #   - lista de usuarios de cada rol (y de todos) por orden de registro
+    # Los usuarios no se eliminan, así que las listas solo crecen: una página es un
+    # corte desde una posición y el cursor (la posición) sigue valiendo aunque
+    # entren usuarios nuevos mientras se pagina.
+
+    def __init__(self):
+        self._por_email: Dict[str, Usuario] = {}
+        self._por_rol: Dict[Optional[str], List[Usuario]] = {None: [], **{rol: [] for rol in ROLES}}
+        # Protegemos las altas porque los usuarios se registran desde varios hilos
+        self._lock = Lock()
+
+    def agregar(self, usuario: Usuario, unico: bool = True) -> None:
+        # Damos de alta el usuario; con unico=True rechazamos un email ya registrado
+        # (al reconstruir desde datos antiguos con duplicados se queda el primero)
+        email = normalizar_email(usuario.email)
+        with self._lock:
+            if email in self._por_email:
+                if unico:
+                    raise ValueError("Ya existe un usuario con ese email.")
+            else:
+                self._por_email[email] = usuario
+            self._por_rol[None].append(usuario)
+            self._por_rol[rol_usuario(usuario)].append(usuario)
+
+    def reconstruir(self, usuarios: Iterable[Usuario]) -> None:
+        # Construimos todos los índices de una vez y sustituimos los actuales
+        nuevo = IndiceUsuarios()
+        for usuario in usuarios:
+            nuevo.agregar(usuario, unico=False)
+        with self._lock:
+            self._por_email = nuevo._por_email
+            self._por_rol = nuevo._por_rol
+
+    def contiene_email(self, email: str) -> bool:
+        return normalizar_email(email) in self._por_email
+
+    def por_email(self, email: str) -> Optional[Usuario]:
+        return self._por_email.get(normalizar_email(email))
+
+    def listar(self, rol: Optional[str] = None) -> List[Usuario]:
+        return list(self._lista(rol))
+
+    def pagina(self, rol: Optional[str], limit: int, posicion: int = 0) -> Tuple[List[Usuario], Optional[int]]:
+        # Devolvemos 'limit' usuarios desde 'posicion' y la posición de la página
+        # siguiente (None si no hay más)
+        lista = self._lista(rol)
+        usuarios = lista[posicion:posicion + limit]
+        siguiente = posicion + limit
+        return usuarios, siguiente if siguiente < len(lista) else None
+
+    def _lista(self, rol: Optional[str]) -> List[Usuario]:
+        lista = self._por_rol.get(rol)
+        if lista is None:
+            raise ValueError(f"Rol no válido. Usa uno de: {', '.join(ROLES)}.")
+        return lista
@@ -0,0 +1,517 @@
+from __future__ import annotations
+import asyncio
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from contextlib import AbstractContextManager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from uuid import UUID
+
+from models import Usuario, Cliente, Administrador
+from models import Producto, ProductoElectronico, ProductoRopa
+from models import Pedido
+from .Reserva_Stock import FranjasOcupadas
+
+T = TypeVar("T")
+
+# Formato binario de los registros
+# Cada fichero (WAL o snapshot) empieza con una cabecera fija y después contiene
+# tramas: longitud (uint32) + crc32 (uint32) + contenido del registro.
+# El primer byte del contenido indica el tipo de registro:
+#   U -> usuario registrado        P -> producto añadido
+#   D -> producto eliminado        O -> pedido realizado
+#   K -> clave de idempotencia de un pedido (va en el mismo registro que el pedido)
+CABECERA = b"TIENDA\x00\x03"
+_TRAMA = struct.Struct("<II")
+_LONGITUD = struct.Struct("<I")
+_USUARIO = struct.Struct("<c16sc")
+_PRODUCTO = struct.Struct("<c16scdqi")
+_ELIMINACION = struct.Struct("<c16s")
+_PEDIDO = struct.Struct("<c16s16sqI")
+_LINEA = struct.Struct("<16sIq")
+_IDEMPOTENCIA = struct.Struct("<c16sqd")
+
+_EPOCA = datetime(1970, 1, 1)
+_MICROSEGUNDO = timedelta(microseconds=1)
+
+_FICHERO_WAL = re.compile(r"^wal-(\d{8})\.log$")
+_FICHERO_SNAPSHOT = re.compile(r"^snapshot-(\d{8})\.bin$")
+
+
+# ---------------------- CODIFICACIÓN ---------------------- #
+
+def _texto(valor: Optional[str]) -> bytes:
+    # Codificamos un texto como longitud + bytes UTF-8
+    datos = (valor or "").encode("utf-8")
+    return _LONGITUD.pack(len(datos)) + datos
+
+
+def _leer_texto(buffer, posicion: int) -> Tuple[str, int]:
+    # Leemos un texto codificado con _texto y devolvemos la nueva posición
+    (longitud,) = _LONGITUD.unpack_from(buffer, posicion)
+    posicion += _LONGITUD.size
+    return bytes(buffer[posicion:posicion + longitud]).decode("utf-8"), posicion + longitud
+
+
+def _trama(contenido: bytes) -> bytes:
+    # Envolvemos el contenido con su longitud y su crc para detectar registros rotos
+    return _TRAMA.pack(len(contenido), zlib.crc32(contenido)) + contenido
+
+
+def codificar_usuario(usuario: Usuario) -> bytes:
+    tipo = b"A" if usuario.is_admin() else b"C"
+    contenido = _USUARIO.pack(b"U", usuario.id.bytes, tipo)
+    contenido += _texto(usuario.nombre) + _texto(usuario.email) + _texto(getattr(usuario, "direccion", None))
+    return _trama(contenido)
+
+
+def codificar_producto(producto: Producto, stock: Optional[int] = None) -> bytes:
+    # 'stock' permite guardar en un snapshot el valor capturado en un instante concreto
+    if isinstance(producto, ProductoElectronico):
+        tipo = b"E"
+    elif isinstance(producto, ProductoRopa):
+        tipo = b"R"
+    else:
+        tipo = b"G"
+    contenido = _PRODUCTO.pack(
+        b"P",
+        producto.id.bytes,
+        tipo,
+        producto.precio,
+        producto.stock if stock is None else stock,
+        getattr(producto, "garantia_meses", 0),
+    )
+    contenido += _texto(producto.nombre) + _texto(getattr(producto, "talla", None)) + _texto(getattr(producto, "color", None))
+    return _trama(contenido)
+
+
+def codificar_eliminacion(producto_id: UUID) -> bytes:
+    return _trama(_ELIMINACION.pack(b"D", producto_id.bytes))
+
+
+def codificar_pedido(pedido: Pedido) -> bytes:
+    fecha = (pedido.fecha - _EPOCA) // _MICROSEGUNDO
+    lineas = list(pedido.lineas())
+    partes = [_PEDIDO.pack(b"O", pedido.id.bytes, pedido.cliente.id.bytes, fecha, len(lineas))]
+    for producto, cantidad, precio, _ in lineas:
+        partes.append(_LINEA.pack(producto.id.bytes, cantidad, precio))
+    return _trama(b"".join(partes))
+
+
+def codificar_idempotencia(cliente_id: UUID, clave: str, huella: int, cuerpo: bytes, caduca: float) -> bytes:
+    # 'caduca' en segundos desde la época (time.time), 'cuerpo' es la respuesta guardada
+    contenido = _IDEMPOTENCIA.pack(b"K", cliente_id.bytes, huella, caduca) + _texto(clave)
+    return _trama(contenido + _LONGITUD.pack(len(cuerpo)) + cuerpo)
+
+
+# ---------------------- DECODIFICACIÓN ---------------------- #
+
+def leer_tramas(buffer) -> Iterator[memoryview]:
+    # Recorremos las tramas de un buffer (por ejemplo un fichero mapeado en memoria)
+    # Nos detenemos en la primera trama incompleta o corrupta: es la cola de un
+    # fichero que no llegó a escribirse entero antes de una caída
+    if bytes(buffer[:len(CABECERA)]) != CABECERA:
+        raise ValueError("El fichero no tiene un formato de persistencia válido.")
+    vista = memoryview(buffer)
+    try:
+        posicion = len(CABECERA)
+        total = len(vista)
+        while posicion + _TRAMA.size <= total:
+            longitud, crc = _TRAMA.unpack_from(vista, posicion)
+            inicio = posicion + _TRAMA.size
+            fin = inicio + longitud
+            if fin > total or zlib.crc32(vista[inicio:fin]) != crc:
+                break
+            yield vista[inicio:fin]
+            posicion = fin
+    finally:
+        vista.release()
+
+
+class Reconstruccion:
+    # Aplica registros decodificados sobre un TiendaService vacío
+    # Solo rellena los diccionarios: los índices se reconstruyen al final de la carga
+    # Mantiene un histórico de todos los productos vistos para poder resolver
+    # las líneas de pedidos cuyos productos se eliminaron después
+
+    def __init__(self, servicio):
+        self.servicio = servicio
+        self.historico: Dict[UUID, Producto] = {}
+
+    def aplicar(self, contenido: memoryview, aplicar_stock: bool) -> None:
+        tipo = bytes(contenido[:1])
+        if tipo == b"U":
+            usuario = self.usuario(contenido)
+            self.servicio.usuarios[usuario.id] = usuario
+        elif tipo == b"P":
+            producto = self.producto(contenido)
+            self.servicio.productos[producto.id] = producto
+        elif tipo == b"D":
+            self.servicio.productos.pop(self.eliminacion(contenido), None)
+        elif tipo == b"O":
+            pedido, lineas = self.pedido(contenido)
+            if aplicar_stock:
+                # El pedido ya se validó al registrarlo, solo repetimos el descuento
+                for producto, cantidad in lineas.items():
+                    producto.stock -= cantidad
+            self.servicio.pedidos[pedido.id] = pedido
+        elif tipo == b"K":
+            self.servicio.idempotencia.guardar(*self.idempotencia(contenido))
+        else:
+            raise ValueError(f"Tipo de registro desconocido: {tipo!r}")
+
+    # Decodificación de cada tipo de registro (sin modificar el servicio)
+    def usuario(self, contenido: memoryview) -> Usuario:
+        _, usuario_id, tipo = _USUARIO.unpack_from(contenido)
+        nombre, posicion = _leer_texto(contenido, _USUARIO.size)
+        email, posicion = _leer_texto(contenido, posicion)
+        direccion, posicion = _leer_texto(contenido, posicion)
+        usuario = Cliente(nombre, email, direccion) if tipo == b"C" else Administrador(nombre, email)
+        usuario.id = UUID(bytes=usuario_id)
+        return usuario
+
+    def producto(self, contenido: memoryview) -> Producto:
+        _, producto_id, tipo, precio, stock, garantia = _PRODUCTO.unpack_from(contenido)
+        nombre, posicion = _leer_texto(contenido, _PRODUCTO.size)
+        talla, posicion = _leer_texto(contenido, posicion)
+        color, posicion = _leer_texto(contenido, posicion)
+        if tipo == b"E":
+            producto = ProductoElectronico(nombre, precio, stock, garantia)
+        elif tipo == b"R":
+            producto = ProductoRopa(nombre, precio, stock, talla, color)
+        else:
+            producto = Producto(nombre, precio, stock)
+        producto.id = UUID(bytes=producto_id)
+        self.historico[producto.id] = producto
+        return producto
+
+    @staticmethod
+    def idempotencia(contenido: memoryview) -> Tuple[UUID, str, int, bytes, float]:
+        _, cliente_id, huella, caduca = _IDEMPOTENCIA.unpack_from(contenido)
+        clave, posicion = _leer_texto(contenido, _IDEMPOTENCIA.size)
+        (longitud,) = _LONGITUD.unpack_from(contenido, posicion)
+        posicion += _LONGITUD.size
+        return UUID(bytes=cliente_id), clave, huella, bytes(contenido[posicion:posicion + longitud]), caduca
+
+    @staticmethod
+    def eliminacion(contenido: memoryview) -> UUID:
+        _, producto_id = _ELIMINACION.unpack_from(contenido)
+        return UUID(bytes=producto_id)
+
+    def pedido(self, contenido: memoryview) -> Tuple[Pedido, Dict[Producto, int]]:
+        # Devolvemos el pedido y sus cantidades por producto (para descontar el stock)
+        _, pedido_id, cliente_id, fecha, num_lineas = _PEDIDO.unpack_from(contenido)
+        lineas = []
+        cantidades: Dict[Producto, int] = {}
+        posicion = _PEDIDO.size
+        for _ in range(num_lineas):
+            producto_id, cantidad, precio = _LINEA.unpack_from(contenido, posicion)
+            posicion += _LINEA.size
+            producto = self._buscar_producto(UUID(bytes=producto_id))
+            cantidades[producto] = cantidades.get(producto, 0) + cantidad
+            lineas.append((producto, cantidad, precio))
+        pedido = Pedido.restaurar(
+            UUID(bytes=pedido_id),
+            self.servicio.usuarios[UUID(bytes=cliente_id)],
+            _EPOCA + fecha * _MICROSEGUNDO,
+            lineas,
+        )
+        return pedido, cantidades
+
+    def _buscar_producto(self, producto_id: UUID) -> Producto:
+        # Primero el histórico (incluye eliminados) y si no el catálogo del servicio
+        # (productos que se crearon en este proceso sin pasar por aquí)
+        producto = self.historico.get(producto_id)
+        return producto if producto is not None else self.servicio.productos[producto_id]
+
+
+# ---------------------- WAL ---------------------- #
+
+def _completar(futuro: asyncio.Future) -> None:
+    # Se ejecuta en el bucle de eventos del que espera (el futuro pudo cancelarse)
+    if not futuro.done():
+        futuro.set_result(None)
+
+
+class RegistroEscritura:
+    # Write-ahead log de solo escritura al final con "group commit":
+    # los hilos añaden registros a un buffer en memoria y un hilo de fondo los
+    # escribe por lotes con un único fsync, despertando después a todos los
+    # hilos que esperaban por alguno de los registros de ese lote
+
+    def __init__(self, ruta: str, intervalo_commit: float = 0.002):
+        self._intervalo = intervalo_commit
+        self._archivo = self._abrir(ruta)
+        self._pendientes: List[bytes] = []
+        # Esperas asyncio pendientes: (lsn, bucle de eventos, futuro)
+        self._esperas_async: List[Tuple[int, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        # Número de secuencia (LSN) del último registro añadido y del último en disco
+        self._lsn_añadido = 0
+        self._lsn_durable = 0
+        self._cerrado = False
+        # '_io' protege el fichero, '_cond' protege el buffer y los LSN
+        # Orden de adquisición: siempre '_io' antes que '_cond'
+        self._io = threading.Lock()
+        self._cond = threading.Condition()
+        self._hilo = threading.Thread(target=self._bucle, name="wal-group-commit", daemon=True)
+        self._hilo.start()
+
+    @staticmethod
+    def _abrir(ruta: str):
+        archivo = open(ruta, "ab")
+        if archivo.tell() == 0:
+            archivo.write(CABECERA)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        return archivo
+
+    def añadir(self, datos: bytes) -> int:
+        # Añadimos un registro al buffer y devolvemos su LSN
+        with self._cond:
+            if self._cerrado:
+                raise RuntimeError("El registro de escritura está cerrado.")
+            self._pendientes.append(datos)
+            self._lsn_añadido += 1
+            self._cond.notify_all()
+            return self._lsn_añadido
+
+    def esperar(self, lsn: int) -> None:
+        # Bloqueamos hasta que el registro 'lsn' esté en disco
+        with self._cond:
+            while self._lsn_durable < lsn:
+                self._cond.wait()
+
+    async def esperar_async(self, lsn: int) -> None:
+        # Igual que 'esperar' pero sin bloquear el bucle de eventos: el hilo de
+        # group commit completa el futuro cuando el registro llega a disco
+        with self._cond:
+            if self._lsn_durable >= lsn:
+                return
+            bucle = asyncio.get_running_loop()
+            futuro = bucle.create_future()
+            self._esperas_async.append((lsn, bucle, futuro))
+        await futuro
+
+    def _volcar(self) -> None:
+        # Escribimos el lote pendiente con un único fsync (hay que tener '_io')
+        with self._cond:
+            lote, self._pendientes = self._pendientes, []
+            lsn = self._lsn_añadido
+        if lote:
+            self._archivo.write(b"".join(lote))
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+        with self._cond:
+            self._lsn_durable = lsn
+            self._cond.notify_all()
+            listas = [e for e in self._esperas_async if e[0] <= lsn]
+            if listas:
+                self._esperas_async = [e for e in self._esperas_async if e[0] > lsn]
+        for _, bucle, futuro in listas:
+            try:
+                bucle.call_soon_threadsafe(_completar, futuro)
+            except RuntimeError:
+                # El bucle de eventos ya se cerró: nadie espera ese futuro
+                pass
+
+    def _bucle(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pendientes and not self._cerrado:
+                    self._cond.wait()
+                if self._cerrado and not self._pendientes:
+                    return
+            # Esperamos un instante para agrupar más registros en el mismo fsync
+            if self._intervalo:
+                time.sleep(self._intervalo)
+            with self._io:
+                self._volcar()
+
+    def rotar(self, ruta: str) -> None:
+        # Volcamos lo pendiente en el fichero actual y seguimos escribiendo en otro
+        with self._io:
+            self._volcar()
+            self._archivo.close()
+            self._archivo = self._abrir(ruta)
+
+    def cerrar(self) -> None:
+        with self._cond:
+            self._cerrado = True
+            self._cond.notify_all()
+        self._hilo.join()
+        with self._io:
+            self._volcar()
+            self._archivo.close()
+
+
+# ---------------------- PERSISTENCIA ---------------------- #
+
+class Persistencia:
+    # Coordina el WAL y los snapshots de un directorio de datos
+    # Cada snapshot-N contiene el estado completo anterior a wal-N, así que al
+    # arrancar cargamos el último snapshot y solo reproducimos la cola del log
+
+    def __init__(
+        self,
+        directorio: str,
+        sincrono: bool = True,
+        snapshot_cada: int = 100_000,
+        intervalo_commit: float = 0.002,
+    ):
+        self.directorio = directorio
+        # Si es síncrono, cada mutación espera a que su registro esté en disco
+        self.sincrono = sincrono
+        # Número de registros tras el cual se genera un snapshot en segundo plano
+        self.snapshot_cada = snapshot_cada
+        self._intervalo_commit = intervalo_commit
+        self._lock = threading.Lock()
+        self._wal: Optional[RegistroEscritura] = None
+        self._generacion = 0
+        self._registros_desde_snapshot = 0
+        self._snapshot_en_curso = threading.Lock()
+        self._snapshot_solicitado = False
+        self._solicitar_snapshot: Optional[Callable[[], None]] = None
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, plantilla: str, generacion: int) -> str:
+        return os.path.join(self.directorio, plantilla.format(generacion))
+
+    def _generaciones(self, patron: re.Pattern) -> List[int]:
+        return sorted(int(m.group(1)) for m in map(patron.match, os.listdir(self.directorio)) if m)
+
+    # Arranque
+    def cargar(self, servicio, solicitar_snapshot: Optional[Callable[[], None]] = None) -> None:
+        # Reconstruimos el estado del servicio y abrimos un WAL nuevo
+        reconstruccion = Reconstruccion(servicio)
+        snapshots = self._generaciones(_FICHERO_SNAPSHOT)
+        base = snapshots[-1] if snapshots else 0
+        if snapshots:
+            self._reproducir(self._ruta("snapshot-{:08d}.bin", base), reconstruccion, aplicar_stock=False)
+        wals = [g for g in self._generaciones(_FICHERO_WAL) if g >= base]
+        for generacion in wals:
+            self._registros_desde_snapshot += self._reproducir(
+                self._ruta("wal-{:08d}.log", generacion), reconstruccion, aplicar_stock=True
+            )
+        servicio.reconstruir_indices()
+        # Cada arranque escribe en una generación nueva para no continuar tras una cola rota
+        self._generacion = max([base] + wals) + 1
+        self._wal = RegistroEscritura(self._ruta("wal-{:08d}.log", self._generacion), self._intervalo_commit)
+        self._solicitar_snapshot = solicitar_snapshot
+
+    @staticmethod
+    def _reproducir(ruta: str, reconstruccion: Reconstruccion, aplicar_stock: bool) -> int:
+        # Leemos el fichero a través de un mapeo en memoria y aplicamos sus registros
+        aplicados = 0
+        with open(ruta, "rb") as archivo:
+            if os.fstat(archivo.fileno()).st_size == 0:
+                return 0
+            with mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                for contenido in leer_tramas(mapa):
+                    reconstruccion.aplicar(contenido, aplicar_stock)
+                    contenido.release()
+                    aplicados += 1
+        return aplicados
+
+    # Escritura
+    def registrar(self, codificar: Callable[[], bytes], mutacion: Callable[[], T], esperar: bool = True) -> Tuple[T, int]:
+        # Aplicamos la mutación en memoria y añadimos su registro al WAL en la
+        # misma sección crítica, para que un snapshot nunca vea una sin la otra
+        # Con esperar=False lanza FranjasOcupadas si el lock lo tiene otro (un
+        # snapshot o un lote), sin haber aplicado nada
+        if not self._lock.acquire(esperar):
+            raise FranjasOcupadas()
+        try:
+            if self._wal is None:
+                raise RuntimeError("La persistencia está cerrada.")
+            resultado = mutacion()
+            lsn = self._wal.añadir(codificar())
+            self._registros_desde_snapshot += 1
+            lanzar_snapshot = (
+                self._solicitar_snapshot is not None
+                and self.snapshot_cada > 0
+                and self._registros_desde_snapshot >= self.snapshot_cada
+                and not self._snapshot_solicitado
+            )
+            if lanzar_snapshot:
+                self._snapshot_solicitado = True
+        finally:
+            self._lock.release()
+        if lanzar_snapshot:
+            threading.Thread(target=self._solicitar_snapshot, name="snapshot", daemon=True).start()
+        return resultado, lsn
+
+    def esperar(self, lsn: int) -> None:
+        # Esperamos a que el registro esté en disco si trabajamos en modo síncrono
+        wal = self._wal
+        if self.sincrono and wal is not None:
+            wal.esperar(lsn)
+
+    async def esperar_async(self, lsn: int) -> None:
+        # Versión asyncio de 'esperar' (no ocupa ningún hilo mientras tanto)
+        wal = self._wal
+        if self.sincrono and wal is not None:
+            await wal.esperar_async(lsn)
+
+    # Snapshots
+    def snapshot(
+        self,
+        pausa: Callable[[], AbstractContextManager],
+        capturar: Callable[[], T],
+        codificar: Callable[[T], Iterator[bytes]],
+    ) -> None:
+        # 'pausa' detiene las escrituras que no pasan por nuestro lock (los pedidos
+        # que ya tienen stock descontado), 'capturar' copia el estado rápidamente
+        # y 'codificar' genera los registros del snapshot fuera de cualquier lock
+        with self._snapshot_en_curso:
+            if self._wal is None:
+                return
+            with pausa(), self._lock:
+                self._generacion += 1
+                generacion = self._generacion
+                self._wal.rotar(self._ruta("wal-{:08d}.log", generacion))
+                self._registros_desde_snapshot = 0
+                self._snapshot_solicitado = False
+                estado = capturar()
+            ruta = self._ruta("snapshot-{:08d}.bin", generacion)
+            temporal = ruta + ".tmp"
+            with open(temporal, "wb") as archivo:
+                archivo.write(CABECERA)
+                lote: List[bytes] = []
+                for registro in codificar(estado):
+                    lote.append(registro)
+                    if len(lote) >= 10_000:
+                        archivo.write(b"".join(lote))
+                        lote.clear()
+                archivo.write(b"".join(lote))
+                archivo.flush()
+                os.fsync(archivo.fileno())
+            os.replace(temporal, ruta)
+            self._sincronizar_directorio()
+            # El snapshot nuevo sustituye a los ficheros de generaciones anteriores
+            for g in self._generaciones(_FICHERO_SNAPSHOT):
+                if g < generacion:
+                    os.remove(self._ruta("snapshot-{:08d}.bin", g))
+            for g in self._generaciones(_FICHERO_WAL):
+                if g < generacion:
+                    os.remove(self._ruta("wal-{:08d}.log", g))
+
+    def _sincronizar_directorio(self) -> None:
+        # Aseguramos que el renombrado del snapshot queda en disco
+        if hasattr(os, "O_DIRECTORY"):
+            descriptor = os.open(self.directorio, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+
+    def cerrar(self) -> None:
+        # Esperamos a que termine un snapshot en curso antes de cerrar el WAL
+        with self._snapshot_en_curso, self._lock:
+            if self._wal is not None:
+                self._wal.cerrar()
+                self._wal = None
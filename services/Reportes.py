@@ -0,0 +1,759 @@
+from __future__ import annotations
+import multiprocessing
+import os
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from itertools import islice
+from multiprocessing import shared_memory
+from threading import Lock
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from models import Cliente, Pedido, Producto
+from .Archivo_Pedidos import MICROSEGUNDOS_DIA, ORDINAL_EPOCA, SegmentoPedidos, microsegundos
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - sin NumPy los informes se calculan pedido a pedido
+    np = None
+
+# Informes pesados sobre todo el historial de pedidos, en procesos aparte
+# Un informe no se calcula en el proceso que atiende las peticiones (tendría el GIL
+# durante segundos) sino en un ProcessPoolExecutor. Los procesos leen los pedidos
+# en columnas desde memoria compartida:
+#   - cada segmento del archivo se copia una vez a su propio bloque y se reutiliza
+#     en todos los informes mientras el segmento exista (son inmutables)
+#   - los pedidos calientes se pasan a columnas poco a poco: cada informe solo
+#     añade los pedidos nuevos desde el anterior y quita los que se archivaron, y
+#     el bloque se copia de esas columnas (sin recorrer pedidos en Python)
+# Clientes y productos van como números propios del gestor, estables entre
+# informes; los segmentos guardan números del registro del archivo, que el proceso
+# traduce con un bloque de mapas. El proceso devuelve números y aquí se resuelven a
+# ids y nombres. Los resultados se guardan por versión de los datos: pedir el
+# mismo informe sin cambios en la tienda no vuelve a calcularlo.
+
+TIPOS = ("ingresos", "productos", "clientes")
+PERIODOS = ("dia", "semana", "mes")
+CRITERIOS = {"productos": ("unidades", "ingresos", "pedidos"), "clientes": ("gasto", "pedidos", "unidades")}
+
+# Columnas de un bloque: nombre -> código de array
+_COLUMNAS = {
+    "clientes": "I", "fechas": "q", "totales": "q", "inicio_lineas": "Q", "productos": "I", "lineas": "q",
+}
+# Columnas del bloque de mapas: número en el registro del archivo -> número del gestor
+_MAPAS = {"mapa_clientes": "I", "mapa_productos": "I"}
+# Bytes de una línea en la columna 'lineas' (cantidad, precio y subtotal)
+_BYTES_LINEA = 24
+# Pedidos archivados que se dejan en las columnas calientes antes de quitarlos
+_MIN_COMPACTAR = 4096
+# Cuánto bajan los procesos de informes su prioridad (nice)
+PRIORIDAD_PROCESOS = 10
+# Bytes que se copian a memoria compartida de una vez (entre copias se suelta el GIL)
+_TROZO_COPIA = 1 << 20
+
+
+class ReporteNoEncontrado(ValueError):
+    # No hay ningún trabajo con ese id (o ya se olvidó)
+    pass
+
+
+# ---------------------- MEMORIA COMPARTIDA ---------------------- #
+
+class BloqueCompartido:
+    # Columnas de pedidos copiadas a un bloque de memoria compartida
+    # 'descriptor' es lo que recibe el proceso: el nombre del bloque y, por columna,
+    # su código de array, desplazamiento y longitud en bytes
+    __slots__ = ("memoria", "descriptor", "usos", "tamaño")
+
+    def __init__(self, columnas: Dict[str, Any], codigos: Dict[str, str] = _COLUMNAS):
+        vistas = {nombre: memoryview(columnas[nombre]).cast("B") for nombre in codigos}
+        self.tamaño = sum(len(v) for v in vistas.values())
+        self.memoria = shared_memory.SharedMemory(create=True, size=max(self.tamaño, 1))
+        posiciones = {}
+        desplazamiento = 0
+        for nombre, vista in vistas.items():
+            for inicio in range(0, len(vista), _TROZO_COPIA):
+                trozo = vista[inicio:inicio + _TROZO_COPIA]
+                self.memoria.buf[desplazamiento + inicio:desplazamiento + inicio + len(trozo)] = trozo
+            posiciones[nombre] = (codigos[nombre], desplazamiento, len(vista))
+            desplazamiento += len(vista)
+            vista.release()
+        self.descriptor = (self.memoria.name, posiciones)
+        # Informes en curso que lo usan
+        self.usos = 0
+
+    def liberar(self) -> None:
+        self.memoria.close()
+        self.memoria.unlink()
+
+
+def _abrir(nombre: str) -> shared_memory.SharedMemory:
+    # Desde Python 3.13 se puede abrir sin que el resource tracker lo dé por nuestro
+    try:
+        return shared_memory.SharedMemory(name=nombre, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=nombre)
+
+
+# ---------------------- CÁLCULO (en los procesos) ---------------------- #
+
+def _preparar_proceso() -> None:
+    # Los procesos de informes ceden la CPU a los que atienden peticiones cuando no
+    # hay núcleos para todos
+    try:
+        os.nice(PRIORIDAD_PROCESOS)
+    except (AttributeError, OSError):
+        pass
+
+
+def calcular(tipo: str, parametros: Dict[str, Any], bloques: List[Tuple[Tuple[str, Dict[str, Tuple[str, int, int]]], bool]],
+             mapas: Optional[Tuple[str, Dict[str, Tuple[str, int, int]]]] = None) -> Dict[str, Any]:
+    # Punto de entrada de los procesos: leemos los bloques y calculamos el informe
+    # con clientes y productos como números. Cada bloque va con si sus números son
+    # del registro del archivo (los segmentos) y hay que traducirlos con 'mapas'
+    descriptores = [descriptor for descriptor, _ in bloques] + ([mapas] if mapas is not None else [])
+    memorias = [_abrir(nombre) for nombre, _ in descriptores]
+    try:
+        columnas = [
+            {nombre: _columna(memoria, *posicion) for nombre, posicion in posiciones.items()}
+            for memoria, (_, posiciones) in zip(memorias, descriptores)
+        ]
+        if mapas is not None:
+            _traducir(columnas.pop(), [c for c, (_, traducir) in zip(columnas, bloques) if traducir])
+        if np is not None:
+            resultado = _calcular_vectorizado(tipo, parametros, columnas)
+        else:
+            resultado = _calcular_por_pedido(tipo, parametros, columnas)
+        # Las vistas de NumPy sobre los bloques deben desaparecer antes de cerrarlos
+        del columnas
+        return resultado
+    finally:
+        for memoria in memorias:
+            try:
+                memoria.close()
+            except BufferError:
+                # Tras un error aún puede quedar alguna vista: se cierra al salir el proceso
+                pass
+
+
+def _traducir(mapas: Dict[str, Any], bloques: List[Dict[str, Any]]) -> None:
+    # Cambiamos en los bloques los números del registro del archivo por los del gestor
+    for bloque in bloques:
+        for nombre, mapa in (("clientes", mapas["mapa_clientes"]), ("productos", mapas["mapa_productos"])):
+            if np is not None:
+                bloque[nombre] = mapa[bloque[nombre]]
+            else:
+                bloque[nombre] = array("I", (mapa[numero] for numero in bloque[nombre]))
+
+
+def _columna(memoria: shared_memory.SharedMemory, codigo: str, inicio: int, longitud: int):
+    # Vista de NumPy sobre el bloque (sin copiar) o, sin NumPy, una copia en un array
+    if np is not None:
+        return np.frombuffer(memoria.buf, np.dtype(codigo), longitud // np.dtype(codigo).itemsize, inicio)
+    columna = array(codigo)
+    columna.frombytes(memoria.buf[inicio:inicio + longitud])
+    return columna
+
+
+def _calcular_vectorizado(tipo: str, parametros: Dict[str, Any], bloques: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Juntamos las columnas de todos los bloques y agregamos con bincount, como el
+    # recálculo de las estadísticas
+    if not bloques:
+        bloques = [{nombre: np.zeros(1 if nombre == "inicio_lineas" else 0, np.dtype(codigo))
+                    for nombre, codigo in _COLUMNAS.items()}]
+    clientes = np.concatenate([b["clientes"] for b in bloques]).astype(np.int64)
+    fechas = np.concatenate([b["fechas"] for b in bloques])
+    totales = np.concatenate([b["totales"] for b in bloques])
+    lineas_por_pedido = np.concatenate([np.diff(b["inicio_lineas"]).astype(np.int64) for b in bloques])
+    productos = np.concatenate([b["productos"] for b in bloques]).astype(np.int64)
+    lineas = np.concatenate([b["lineas"] for b in bloques]).reshape(-1, 3)
+    cantidades, subtotales = lineas[:, 0], lineas[:, 2]
+    indice_pedido = np.repeat(np.arange(len(fechas)), lineas_por_pedido)
+
+    # Pedidos dentro de las fechas pedidas (y sus líneas)
+    elegidos = np.ones(len(fechas), bool)
+    if parametros.get("desde_us") is not None:
+        elegidos &= fechas >= parametros["desde_us"]
+    if parametros.get("hasta_us") is not None:
+        elegidos &= fechas < parametros["hasta_us"]
+    if not elegidos.all():
+        lineas_elegidas = elegidos[indice_pedido]
+        productos, cantidades, subtotales = productos[lineas_elegidas], cantidades[lineas_elegidas], subtotales[lineas_elegidas]
+        # Renumeramos los pedidos que quedan para que sus líneas sigan apuntándoles
+        nuevo_indice = np.cumsum(elegidos) - 1
+        indice_pedido = nuevo_indice[indice_pedido[lineas_elegidas]]
+        clientes, fechas, totales = clientes[elegidos], fechas[elegidos], totales[elegidos]
+    num_pedidos = len(fechas)
+    unidades_pedido = _sumar(indice_pedido, cantidades, num_pedidos)
+
+    if tipo == "ingresos":
+        dias = fechas // MICROSEGUNDOS_DIA
+        if parametros["periodo"] == "semana":
+            # 1970-01-01 fue jueves: retrocedemos hasta el lunes
+            dias = dias - (dias + 3) % 7
+        elif parametros["periodo"] == "mes":
+            dias = dias.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+        periodos, indice = np.unique(dias, return_inverse=True)
+        filas = zip(
+            (periodos + ORDINAL_EPOCA).tolist(),
+            np.bincount(indice, minlength=len(periodos)).tolist(),
+            _sumar(indice, unidades_pedido, len(periodos)).tolist(),
+            _sumar(indice, totales, len(periodos)).tolist(),
+        )
+        return {"filas": list(filas), "totales": (num_pedidos, int(unidades_pedido.sum()), int(totales.sum()))}
+
+    if tipo == "productos":
+        numeros, indice = np.unique(productos, return_inverse=True)
+        valores = {
+            "unidades": _sumar(indice, cantidades, len(numeros)),
+            "ingresos": _sumar(indice, subtotales, len(numeros)),
+            # Un pedido no repite producto en dos líneas: cada línea es un pedido
+            "pedidos": np.bincount(indice, minlength=len(numeros)),
+        }
+        orden = _mayores(valores[parametros["criterio"]], parametros["n"])
+        filas = zip(
+            numeros[orden].tolist(), valores["unidades"][orden].tolist(),
+            valores["ingresos"][orden].tolist(), valores["pedidos"][orden].tolist(),
+        )
+        return {"filas": list(filas), "total": len(numeros)}
+
+    numeros, indice = np.unique(clientes, return_inverse=True)
+    valores = {
+        "pedidos": np.bincount(indice, minlength=len(numeros)),
+        "unidades": _sumar(indice, unidades_pedido, len(numeros)),
+        "gasto": _sumar(indice, totales, len(numeros)),
+    }
+    primero = np.full(len(numeros), np.iinfo(np.int64).max)
+    ultimo = np.full(len(numeros), np.iinfo(np.int64).min)
+    np.minimum.at(primero, indice, fechas)
+    np.maximum.at(ultimo, indice, fechas)
+    orden = _mayores(valores[parametros["criterio"]], parametros["n"])
+    filas = zip(
+        numeros[orden].tolist(), valores["pedidos"][orden].tolist(), valores["unidades"][orden].tolist(),
+        valores["gasto"][orden].tolist(), primero[orden].tolist(), ultimo[orden].tolist(),
+    )
+    return {"filas": list(filas), "total": len(numeros)}
+
+
+def _sumar(indices, pesos, tamaño):
+    # bincount suma en float64, exacto para enteros por debajo de 2**53
+    return np.rint(np.bincount(indices, weights=pesos, minlength=tamaño)).astype(np.int64)
+
+
+def _mayores(valores, n: int):
+    # Posiciones de los n mayores valores, de mayor a menor
+    if len(valores) > n:
+        candidatos = np.argpartition(-valores, n - 1)[:n]
+    else:
+        candidatos = np.arange(len(valores))
+    return candidatos[np.argsort(-valores[candidatos], kind="stable")]
+
+
+def _calcular_por_pedido(tipo: str, parametros: Dict[str, Any], bloques: List[Dict[str, array]]) -> Dict[str, Any]:
+    # Sin NumPy: recorremos los pedidos acumulando en diccionarios
+    desde, hasta = parametros.get("desde_us"), parametros.get("hasta_us")
+    grupos: Dict[int, List[int]] = {}
+    totales = [0, 0, 0]
+    for bloque in bloques:
+        inicio_lineas, lineas = bloque["inicio_lineas"], bloque["lineas"]
+        # Las columnas calientes pueden empezar a mitad de sus líneas
+        base = inicio_lineas[0]
+        for fila, (cliente, fecha, total) in enumerate(zip(bloque["clientes"], bloque["fechas"], bloque["totales"])):
+            if (desde is not None and fecha < desde) or (hasta is not None and fecha >= hasta):
+                continue
+            primera, ultima = inicio_lineas[fila] - base, inicio_lineas[fila + 1] - base
+            unidades = sum(lineas[3 * k] for k in range(primera, ultima))
+            totales[0] += 1
+            totales[1] += unidades
+            totales[2] += total
+            if tipo == "productos":
+                for k in range(primera, ultima):
+                    entrada = grupos.setdefault(bloque["productos"][k], [0, 0, 0])
+                    entrada[0] += lineas[3 * k]
+                    entrada[1] += lineas[3 * k + 2]
+                    entrada[2] += 1
+                continue
+            if tipo == "ingresos":
+                dia = date.fromordinal(fecha // MICROSEGUNDOS_DIA + ORDINAL_EPOCA)
+                if parametros["periodo"] == "semana":
+                    dia -= timedelta(days=dia.weekday())
+                elif parametros["periodo"] == "mes":
+                    dia = dia.replace(day=1)
+                entrada = grupos.setdefault(dia.toordinal(), [0, 0, 0])
+            else:
+                entrada = grupos.setdefault(cliente, [0, 0, 0, fecha, fecha])
+                entrada[3] = min(entrada[3], fecha)
+                entrada[4] = max(entrada[4], fecha)
+            entrada[0] += 1
+            entrada[1] += unidades
+            entrada[2] += total
+    if tipo == "ingresos":
+        return {"filas": [(clave, *valores) for clave, valores in sorted(grupos.items())], "totales": tuple(totales)}
+    if tipo == "productos":
+        posicion = ("unidades", "ingresos", "pedidos").index(parametros["criterio"])
+    else:
+        posicion = ("pedidos", "unidades", "gasto").index(parametros["criterio"])
+    mayores = sorted(grupos.items(), key=lambda e: e[1][posicion], reverse=True)[:parametros["n"]]
+    return {"filas": [(clave, *valores) for clave, valores in mayores], "total": len(grupos)}
+
+
+# ---------------------- TRABAJOS ---------------------- #
+
+class TrabajoReporte:
+    # Un informe pedido: su estado se lee del futuro del ProcessPoolExecutor
+    __slots__ = (
+        "id", "tipo", "parametros", "version", "clave", "creado", "segundos", "resultado", "error", "_futuro", "_inicio",
+    )
+
+    def __init__(self, tipo: str, parametros: Dict[str, Any], version: int):
+        self.id = uuid4()
+        self.tipo = tipo
+        self.parametros = parametros
+        self.version = version
+        # Lo que identifica el informe en la caché: mismos parámetros y mismos datos
+        self.clave = (tipo, tuple(sorted(parametros.items())), version)
+        self.creado = datetime.now()
+        self.segundos: Optional[float] = None
+        self.resultado: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self._futuro: Optional[Future] = None
+        self._inicio = time.perf_counter()
+
+    @property
+    def estado(self) -> str:
+        # "pendiente", "en_curso", "terminado" o "error"
+        if self.error is not None:
+            return "error"
+        if self.resultado is not None:
+            return "terminado"
+        if self._futuro is not None and self._futuro.running():
+            return "en_curso"
+        return "pendiente"
+
+
+class GestorReportes:
+    # Trabajos de informes sobre los datos de un TiendaService
+    # 'procesos' es el número de procesos del pool (por defecto, todos los núcleos
+    # menos uno) y 'max_trabajos' cuántos trabajos se recuerdan: los terminados más
+    # antiguos se olvidan, con su resultado. Se usa desde varios hilos (los del
+    # threadpool que envían y el del pool que avisa de los terminados).
+
+    def __init__(self, servicio, procesos: Optional[int] = None, max_trabajos: int = 1000):
+        if procesos is None:
+            procesos = max(1, (os.cpu_count() or 2) - 1)
+        if procesos <= 0 or max_trabajos <= 0:
+            raise ValueError("El número de procesos y de trabajos de informes debe ser mayor que cero.")
+        self.servicio = servicio
+        self.procesos = procesos
+        self.max_trabajos = max_trabajos
+        self._lock = Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._trabajos: OrderedDict[UUID, TrabajoReporte] = OrderedDict()
+        # (tipo, parámetros, versión) -> trabajo, para no repetir un informe con los mismos datos
+        self._por_clave: Dict[Hashable, TrabajoReporte] = {}
+        # Bloques de los segmentos del archivo: id del segmento -> (segmento, bloque)
+        self._segmentos: Dict[int, Tuple[SegmentoPedidos, BloqueCompartido]] = {}
+        # Números de clientes y productos de todos los informes y su bloque de mapas
+        self._numeracion = _Numeracion(servicio.archivo)
+        self._mapas: Optional[BloqueCompartido] = None
+        # Columnas de los pedidos calientes (se completan en cada informe) y su bloque
+        self._calientes = _ColumnasCalientes()
+        self._bloque_calientes: Optional[BloqueCompartido] = None
+        # Estadísticas
+        self.aciertos = 0
+        self.calculados = 0
+        self.fallidos = 0
+
+    def _ejecutor(self) -> ProcessPoolExecutor:
+        # Creamos el pool al primer informe. Con "spawn" los procesos no heredan los
+        # hilos ni los locks de este proceso; solo importan este módulo
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.procesos, mp_context=multiprocessing.get_context("spawn"), initializer=_preparar_proceso
+            )
+        return self._pool
+
+    def version(self) -> int:
+        # Versión de los datos que usa un informe: todas salen de un único contador
+        # creciente, así que la mayor identifica el estado de pedidos, productos y usuarios
+        versiones = self.servicio.versiones
+        return max(versiones.coleccion(c) for c in ("pedidos", "productos", "usuarios"))
+
+    def enviar(self, tipo: str, parametros: Dict[str, Any]) -> TrabajoReporte:
+        # Lanzamos un informe (o devolvemos el que ya hay con los mismos datos)
+        trabajo = TrabajoReporte(tipo, normalizar_parametros(tipo, parametros), self.version())
+        with self._lock:
+            anterior = self._por_clave.get(trabajo.clave)
+            if anterior is not None and anterior.error is None:
+                self.aciertos += 1
+                self._trabajos.move_to_end(anterior.id)
+                return anterior
+            bloques, mapas = self._instantanea()
+            argumentos = (
+                calcular, tipo, _limites(trabajo.parametros),
+                [(bloque.descriptor, traducir) for bloque, traducir in bloques], mapas.descriptor,
+            )
+            try:
+                futuro = self._ejecutor().submit(*argumentos)
+            except BrokenProcessPool:
+                # Un proceso murió: el pool ya no sirve y lo creamos de nuevo
+                self._pool.shutdown(wait=False)
+                self._pool = None
+                futuro = self._ejecutor().submit(*argumentos)
+            trabajo._futuro = futuro
+            self._trabajos[trabajo.id] = trabajo
+            self._por_clave[trabajo.clave] = trabajo
+            self._purgar()
+        usados = [bloque for bloque, _ in bloques] + [mapas]
+        futuro.add_done_callback(lambda f: self._terminado(trabajo, f, usados))
+        return trabajo
+
+    def obtener(self, trabajo_id: UUID) -> TrabajoReporte:
+        trabajo = self._trabajos.get(trabajo_id)
+        if trabajo is None:
+            raise ReporteNoEncontrado(f"No hay ningún informe con id {trabajo_id}.")
+        return trabajo
+
+    def _instantanea(self) -> Tuple[List[Tuple[BloqueCompartido, bool]], BloqueCompartido]:
+        # Bloques con todos los pedidos en un mismo instante (los segmentos del archivo,
+        # cuyos números hay que traducir, y los calientes) y el bloque de mapas.
+        # Solo se recorren en Python los pedidos calientes nuevos desde el último informe
+        calientes = self._calientes
+        vista, lectura = self.servicio._leer_pedidos(lambda: calientes.leer(self.servicio.pedidos))
+        # Los números de los segmentos de la vista son menores que los registrados ahora
+        if self._numeracion.ampliar(*vista.archivo.registrados()) or self._mapas is None:
+            self._reemplazar("_mapas", self._numeracion.bloque())
+        if calientes.actualizar(lectura, self._numeracion) or self._bloque_calientes is None:
+            self._reemplazar("_bloque_calientes", calientes.bloque() if len(calientes) else None)
+        bloques = []
+        vigentes = set()
+        for segmento in vista.segmentos:
+            vigentes.add(id(segmento))
+            entrada = self._segmentos.get(id(segmento))
+            if entrada is None:
+                entrada = self._segmentos[id(segmento)] = (segmento, BloqueCompartido({
+                    nombre: getattr(segmento, nombre) for nombre in _COLUMNAS
+                }))
+            bloques.append((entrada[1], True))
+        if self._bloque_calientes is not None:
+            bloques.append((self._bloque_calientes, False))
+        for bloque, _ in bloques:
+            bloque.usos += 1
+        self._mapas.usos += 1
+        self._liberar_segmentos(vigentes)
+        return bloques, self._mapas
+
+    def _reemplazar(self, atributo: str, bloque: Optional[BloqueCompartido]) -> None:
+        # Cambiamos el bloque de mapas o el de calientes; el viejo se libera cuando
+        # no lo usa ningún informe
+        anterior = getattr(self, atributo)
+        setattr(self, atributo, bloque)
+        if anterior is not None and anterior.usos == 0:
+            anterior.liberar()
+
+    def _liberar_segmentos(self, vigentes: set) -> None:
+        # Los segmentos que ya se fusionaron no vuelven: liberamos sus bloques si nadie los usa
+        for clave, (_, bloque) in list(self._segmentos.items()):
+            if clave not in vigentes and bloque.usos == 0:
+                del self._segmentos[clave]
+                bloque.liberar()
+
+    def _terminado(self, trabajo: TrabajoReporte, futuro: Future, bloques: List[BloqueCompartido]) -> None:
+        # Resolvemos los números del resultado y soltamos los bloques
+        try:
+            trabajo.resultado = self._numeracion.resultado(trabajo.tipo, trabajo.parametros, futuro.result())
+            self.calculados += 1
+        except BaseException as e:
+            trabajo.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            self.fallidos += 1
+        trabajo.segundos = time.perf_counter() - trabajo._inicio
+        trabajo._futuro = None
+        with self._lock:
+            if trabajo.error is not None and self._por_clave.get(trabajo.clave) is trabajo:
+                del self._por_clave[trabajo.clave]
+            propios = {id(bloque) for _, bloque in self._segmentos.values()}
+            propios.update((id(self._mapas), id(self._bloque_calientes)))
+            for bloque in bloques:
+                bloque.usos -= 1
+                if bloque.usos == 0 and id(bloque) not in propios:
+                    bloque.liberar()
+            self._liberar_segmentos({id(segmento) for segmento in self.servicio.archivo.segmentos})
+
+    def _purgar(self) -> None:
+        # Olvidamos los trabajos terminados más antiguos que sobran
+        sobran = len(self._trabajos) - self.max_trabajos
+        for trabajo in list(self._trabajos.values()):
+            if sobran <= 0:
+                break
+            if trabajo.estado in ("terminado", "error"):
+                del self._trabajos[trabajo.id]
+                if self._por_clave.get(trabajo.clave) is trabajo:
+                    del self._por_clave[trabajo.clave]
+                sobran -= 1
+
+    def estadisticas(self) -> Dict[str, int]:
+        # Trabajos recordados por estado, informes reutilizados y memoria compartida
+        estados = {"pendiente": 0, "en_curso": 0, "terminado": 0, "error": 0}
+        for trabajo in list(self._trabajos.values()):
+            estados[trabajo.estado] += 1
+        return {
+            **estados,
+            "aciertos": self.aciertos,
+            "calculados": self.calculados,
+            "fallidos": self.fallidos,
+            "bytes_compartidos": sum(
+                bloque.tamaño for bloque in [b for _, b in list(self._segmentos.values())] + [self._mapas, self._bloque_calientes]
+                if bloque is not None
+            ),
+        }
+
+    def cerrar(self) -> None:
+        # Paramos los procesos y liberamos toda la memoria compartida
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        with self._lock:
+            for _, bloque in self._segmentos.values():
+                bloque.liberar()
+            self._segmentos.clear()
+            self._reemplazar("_mapas", None)
+            self._reemplazar("_bloque_calientes", None)
+
+
+class _Numeracion:
+    # Números de clientes y productos de los informes, los mismos en todos: un
+    # cliente o producto tiene el mismo número salga en un segmento del archivo o en
+    # un pedido caliente. Los mapas traducen los números del registro del archivo,
+    # que solo crece, así que basta con ampliarlos con lo nuevo. Solo se modifica con
+    # el lock del gestor; las listas solo crecen y se leen sin él
+    __slots__ = ("archivo", "clientes", "productos", "_num_clientes", "_num_productos", "mapa_clientes", "mapa_productos")
+
+    def __init__(self, archivo):
+        self.archivo = archivo
+        self.clientes: List[Cliente] = []
+        # Por número, el producto o, si se vio en el archivo, su número en el registro
+        self.productos: List[Any] = []
+        self._num_clientes: Dict[UUID, int] = {}
+        self._num_productos: Dict[UUID, int] = {}
+        self.mapa_clientes = array("I")
+        self.mapa_productos = array("I")
+
+    def numero_cliente(self, cliente: Cliente) -> int:
+        numero = self._num_clientes.get(cliente.id)
+        if numero is None:
+            numero = self._num_clientes[cliente.id] = len(self.clientes)
+            self.clientes.append(cliente)
+        return numero
+
+    def numero_producto(self, producto_id: UUID, producto: Any) -> int:
+        numero = self._num_productos.get(producto_id)
+        if numero is None:
+            numero = self._num_productos[producto_id] = len(self.productos)
+            self.productos.append(producto)
+        return numero
+
+    def ampliar(self, num_clientes: int, num_productos: int) -> bool:
+        # Traducimos lo registrado en el archivo desde la última vez; devuelve si hubo algo
+        if len(self.mapa_clientes) == num_clientes and len(self.mapa_productos) == num_productos:
+            return False
+        for numero in range(len(self.mapa_clientes), num_clientes):
+            self.mapa_clientes.append(self.numero_cliente(self.archivo.cliente(numero)))
+        for numero in range(len(self.mapa_productos), num_productos):
+            self.mapa_productos.append(self.numero_producto(self.archivo.producto(numero).id, numero))
+        return True
+
+    def bloque(self) -> BloqueCompartido:
+        return BloqueCompartido({"mapa_clientes": self.mapa_clientes, "mapa_productos": self.mapa_productos}, _MAPAS)
+
+    def cliente(self, numero: int) -> Cliente:
+        return self.clientes[numero]
+
+    def producto(self, numero: int) -> Producto:
+        producto = self.productos[numero]
+        return self.archivo.producto(producto) if isinstance(producto, int) else producto
+
+    def resultado(self, tipo: str, parametros: Dict[str, Any], calculado: Dict[str, Any]) -> Dict[str, Any]:
+        # Informe listo para devolver en JSON (importes en euros)
+        if tipo == "ingresos":
+            pedidos, unidades, ingresos = calculado["totales"]
+            return {
+                "periodo": parametros["periodo"],
+                "pedidos": pedidos, "unidades": unidades, "ingresos": ingresos / 100,
+                "periodos": [
+                    {"inicio": date.fromordinal(ordinal), "pedidos": p, "unidades": u, "ingresos": i / 100}
+                    for ordinal, p, u, i in calculado["filas"]
+                ],
+            }
+        if tipo == "productos":
+            filas = []
+            for numero, unidades, ingresos, pedidos in calculado["filas"]:
+                producto = self.producto(numero)
+                filas.append({
+                    "producto_id": producto.id, "nombre": producto.nombre,
+                    "unidades": unidades, "ingresos": ingresos / 100, "pedidos": pedidos,
+                })
+            return {"criterio": parametros["criterio"], "total": calculado["total"], "productos": filas}
+        filas = []
+        for numero, pedidos, unidades, gasto, primero, ultimo in calculado["filas"]:
+            cliente = self.cliente(numero)
+            filas.append({
+                "cliente_id": cliente.id, "nombre": cliente.nombre,
+                "pedidos": pedidos, "unidades": unidades, "gasto": gasto / 100,
+                "primer_pedido": _fecha(primero), "ultimo_pedido": _fecha(ultimo),
+            })
+        return {"criterio": parametros["criterio"], "total": calculado["total"], "clientes": filas}
+
+
+class _ColumnasCalientes:
+    # Columnas de los pedidos calientes con el formato de un segmento, que se
+    # completan en cada informe con los pedidos nuevos. Los que se archivan salen del
+    # principio: primero se saltan ('primero') y, cuando son tantos como los vivos,
+    # se borran. 'inicio_lineas' cuenta líneas desde que se vaciaron las columnas:
+    # 'base' es la línea que está en la primera posición de 'productos' y 'lineas'
+    __slots__ = ("pedidos", "primero", "base", "columnas")
+
+    def __init__(self):
+        self._vaciar()
+
+    def _vaciar(self) -> None:
+        self.pedidos: List[Pedido] = []
+        self.primero = 0
+        self.base = 0
+        self.columnas: Dict[str, Any] = {nombre: array(codigo) for nombre, codigo in _COLUMNAS.items()}
+        self.columnas["inicio_lineas"].append(0)
+        self.columnas["lineas"] = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.pedidos) - self.primero
+
+    def leer(self, pedidos: Dict[UUID, Pedido]) -> Tuple[bool, List[Pedido]]:
+        # Qué cambió en los pedidos calientes, sin modificar nada (se puede repetir):
+        # (True, nuevos) si solo se añadieron pedidos o (False, todos) si no lo sabemos.
+        # Si el primero y el último que tenemos siguen en su sitio y el resto son
+        # nuevos, leemos solo el final del diccionario (islice sobre reversed corre en
+        # C sin soltar el GIL: la lectura es atómica)
+        vivos = len(self)
+        nuevos = len(pedidos) - vivos
+        if vivos and nuevos >= 0:
+            cola = list(islice(reversed(pedidos.values()), nuevos + 1))
+            if len(cola) == nuevos + 1 and cola[-1] is self.pedidos[-1] \
+                    and next(iter(pedidos.values()), None) is self.pedidos[self.primero]:
+                cola.pop()
+                cola.reverse()
+                return True, cola
+        return False, list(pedidos.values())
+
+    def actualizar(self, lectura: Tuple[bool, List[Pedido]], numeracion: _Numeracion) -> bool:
+        # Aplicamos lo leído con 'leer'; devuelve si cambiaron las columnas
+        solo_nuevos, pedidos = lectura
+        cambiadas = bool(pedidos)
+        if not solo_nuevos:
+            # Los que seguimos teniendo deben ir al principio, quitados los archivados
+            # (si el primero no está entre los nuestros, se archivaron todos)
+            vivos = self.pedidos[self.primero:]
+            try:
+                archivados = vivos.index(pedidos[0]) if pedidos else len(vivos)
+            except ValueError:
+                archivados = len(vivos)
+            quedan = len(vivos) - archivados
+            if pedidos[:quedan] == vivos[archivados:]:
+                self.primero += archivados
+                pedidos = pedidos[quedan:]
+                cambiadas = cambiadas or archivados > 0
+            else:
+                # Se archivaron pedidos de en medio: empezamos de cero
+                self._vaciar()
+                cambiadas = True
+        self._añadir(pedidos, numeracion)
+        self._compactar()
+        return cambiadas
+
+    def _añadir(self, pedidos: List[Pedido], numeracion: _Numeracion) -> None:
+        clientes, fechas, totales = self.columnas["clientes"], self.columnas["fechas"], self.columnas["totales"]
+        inicio_lineas, productos, lineas = self.columnas["inicio_lineas"], self.columnas["productos"], self.columnas["lineas"]
+        total_lineas = inicio_lineas[-1]
+        for pedido in pedidos:
+            clientes.append(numeracion.numero_cliente(pedido.cliente))
+            fechas.append(microsegundos(pedido.fecha))
+            totales.append(pedido.total_centimos)
+            productos_pedido, bloque = pedido.columnas()
+            productos.extend(numeracion.numero_producto(p.id, p) for p in productos_pedido)
+            lineas += bloque
+            total_lineas += len(productos_pedido)
+            inicio_lineas.append(total_lineas)
+        self.pedidos.extend(pedidos)
+
+    def _compactar(self) -> None:
+        # Borramos los archivados del principio cuando son muchos (memmove en C)
+        if not len(self):
+            self._vaciar()
+            return
+        k = self.primero
+        if k < _MIN_COMPACTAR or k < len(self):
+            return
+        fuera = self.columnas["inicio_lineas"][k] - self.base
+        del self.pedidos[:k]
+        for nombre in ("clientes", "fechas", "totales", "inicio_lineas"):
+            del self.columnas[nombre][:k]
+        del self.columnas["productos"][:fuera]
+        del self.columnas["lineas"][:fuera * _BYTES_LINEA]
+        self.base += fuera
+        self.primero = 0
+
+    def bloque(self) -> BloqueCompartido:
+        # Copia a memoria compartida de las columnas de los pedidos vivos
+        k = self.primero
+        desde = self.columnas["inicio_lineas"][k] - self.base
+        vistas = {nombre: memoryview(self.columnas[nombre])[k:] for nombre in ("clientes", "fechas", "totales", "inicio_lineas")}
+        vistas["productos"] = memoryview(self.columnas["productos"])[desde:]
+        vistas["lineas"] = memoryview(self.columnas["lineas"])[desde * _BYTES_LINEA:]
+        try:
+            return BloqueCompartido(vistas)
+        finally:
+            for vista in vistas.values():
+                vista.release()
+
+
+def _fecha(valor: int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(microseconds=valor)
+
+
+def normalizar_parametros(tipo: str, parametros: Dict[str, Any]) -> Dict[str, Any]:
+    # Validamos los parámetros de un informe y completamos los que faltan
+    # ('desde' y 'hasta' son días incluidos; 'n' el tamaño de los rankings)
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de informe no válido. Usa uno de: {', '.join(TIPOS)}.")
+    desde, hasta = parametros.get("desde"), parametros.get("hasta")
+    if desde is not None and hasta is not None and desde > hasta:
+        raise ValueError("La fecha 'desde' no puede ser posterior a 'hasta'.")
+    normalizados: Dict[str, Any] = {"desde": desde, "hasta": hasta}
+    if tipo == "ingresos":
+        periodo = parametros.get("periodo") or "dia"
+        if periodo not in PERIODOS:
+            raise ValueError(f"Periodo no válido. Usa uno de: {', '.join(PERIODOS)}.")
+        normalizados["periodo"] = periodo
+    else:
+        criterio = parametros.get("criterio") or CRITERIOS[tipo][0]
+        if criterio not in CRITERIOS[tipo]:
+            raise ValueError(f"Criterio no válido. Usa uno de: {', '.join(CRITERIOS[tipo])}.")
+        n = parametros.get("n") or 100
+        if n <= 0:
+            raise ValueError("El tamaño del ranking debe ser mayor que cero.")
+        normalizados["criterio"] = criterio
+        normalizados["n"] = n
+    return normalizados
+
+
+def _limites(parametros: Dict[str, Any]) -> Dict[str, Any]:
+    # Parámetros para el proceso: los días pasan a µs ('hasta' exclusivo)
+    limites = {k: v for k, v in parametros.items() if k not in ("desde", "hasta")}
+    desde, hasta = parametros.get("desde"), parametros.get("hasta")
+    limites["desde_us"] = microsegundos(datetime.combine(desde, datetime.min.time())) if desde else None
+    limites["hasta_us"] = (
+        microsegundos(datetime.combine(hasta + timedelta(days=1), datetime.min.time())) if hasta else None
+    )
+    return limites
@@ -0,0 +1,156 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from models import Producto
+
+T = TypeVar("T")
+
+
+class StockInsuficiente(ValueError):
+    # No hay stock para alguna línea del pedido
+    pass
+
+
+class FranjasOcupadas(Exception):
+    # Alguna franja (o el lock del WAL o el de un índice) estaba ocupada y se pidió
+    # no esperar (p. ej. desde el bucle de eventos)
+    pass
+
+
+@contextmanager
+def tomar_sin_esperar(locks: Iterable) -> Iterator[None]:
+    # Adquirimos unos locks sin bloquearnos: si alguno está ocupado soltamos los ya
+    # adquiridos y lanzamos FranjasOcupadas (como 'bloquear' con esperar=False)
+    adquiridos = []
+    try:
+        for lock in locks:
+            if not lock.acquire(False):
+                raise FranjasOcupadas()
+            adquiridos.append(lock)
+        yield
+    finally:
+        for lock in reversed(adquiridos):
+            lock.release()
+
+
+class MotorReservas:
+    # Motor de reservas de stock con "lock striping": repartimos los productos
+    # entre un número fijo de locks según su id. Un pedido bloquea solo las
+    # franjas de sus productos, siempre en orden creciente, así que dos pedidos
+    # nunca pueden esperarse mutuamente (no hay interbloqueos) y los pedidos
+    # sobre productos distintos avanzan en paralelo sin un lock global.
+
+    def __init__(self, num_franjas: int = 64):
+        if num_franjas <= 0:
+            raise ValueError("El número de franjas debe ser mayor que cero.")
+        self._franjas: List[Lock] = [Lock() for _ in range(num_franjas)]
+
+    def _indice_franja(self, producto: Producto) -> int:
+        # Elegimos la franja a partir del id del producto (estable durante su vida)
+        return producto.id.int % len(self._franjas)
+
+    @contextmanager
+    def bloquear(self, productos: Iterable[Producto], esperar: bool = True) -> Iterator[None]:
+        # Adquirimos las franjas de todos los productos en orden determinista
+        # Con esperar=False no nos bloqueamos: si alguna está ocupada soltamos las
+        # ya adquiridas y lanzamos FranjasOcupadas
+        indices = sorted({self._indice_franja(p) for p in productos})
+        adquiridos: List[Lock] = []
+        try:
+            for indice in indices:
+                lock = self._franjas[indice]
+                if not lock.acquire(esperar):
+                    raise FranjasOcupadas()
+                adquiridos.append(lock)
+            yield
+        finally:
+            # Liberamos en orden inverso al de adquisición
+            for lock in reversed(adquiridos):
+                lock.release()
+
+    @contextmanager
+    def bloquear_todo(self) -> Iterator[None]:
+        # Adquirimos todas las franjas (en el mismo orden) para detener los pedidos,
+        # por ejemplo mientras se captura un snapshot consistente del inventario
+        for lock in self._franjas:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._franjas):
+                lock.release()
+
+    def reservar(
+        self,
+        productos_cantidades: Dict[Producto, int],
+        al_reservar: Optional[Callable[[], T]] = None,
+        esperar: bool = True,
+    ) -> Optional[T]:
+        # Reservamos todas las líneas de un pedido de forma atómica:
+        # o se descuenta el stock de todos los productos o de ninguno
+        # 'al_reservar' se ejecuta aún con las franjas adquiridas (p. ej. para registrar el pedido)
+        with self.bloquear(productos_cantidades, esperar):
+            self._comprobar(productos_cantidades)
+            self._descontar(productos_cantidades)
+            if al_reservar is None:
+                return None
+            try:
+                return al_reservar()
+            except BaseException:
+                # Si no se pudo registrar el pedido devolvemos el stock reservado
+                for producto, cantidad in productos_cantidades.items():
+                    producto.actualizar_stock(cantidad)
+                raise
+
+    def reservar_lote(
+        self,
+        pedidos: List[Dict[Producto, int]],
+        al_reservar: Callable[[List[Optional[str]]], T],
+    ) -> T:
+        # Reservamos un lote de pedidos agrupando el stock por producto: bloqueamos
+        # una sola vez las franjas de todos los productos del lote, decidimos qué
+        # pedidos caben en orden de llegada y ajustamos cada producto una única vez
+        # 'al_reservar' recibe por cada pedido None si se aceptó o el motivo del rechazo
+        productos = {producto for pedido in pedidos for producto in pedido}
+        with self.bloquear(productos):
+            disponible = {producto: producto.stock for producto in productos}
+            errores: List[Optional[str]] = []
+            for pedido in pedidos:
+                error = None
+                for producto, cantidad in pedido.items():
+                    if cantidad <= 0 or disponible[producto] < cantidad:
+                        error = f"No hay stock suficiente para {producto.nombre}."
+                        break
+                if error is None:
+                    for producto, cantidad in pedido.items():
+                        disponible[producto] -= cantidad
+                errores.append(error)
+            # Aplicamos el descuento neto de cada producto de una sola vez
+            ajustados: List[Tuple[Producto, int]] = []
+            try:
+                for producto in productos:
+                    delta = disponible[producto] - producto.stock
+                    if delta:
+                        producto.actualizar_stock(delta)
+                        ajustados.append((producto, delta))
+                return al_reservar(errores)
+            except BaseException:
+                # Si no se pudo registrar el lote devolvemos el stock reservado
+                for producto, delta in ajustados:
+                    producto.actualizar_stock(-delta)
+                raise
+
+    @staticmethod
+    def _comprobar(productos_cantidades: Dict[Producto, int]) -> None:
+        # Verificamos el stock de todas las líneas antes de tocar nada
+        for producto, cantidad in productos_cantidades.items():
+            if not producto.hay_stock(cantidad):
+                raise StockInsuficiente(f"No hay stock suficiente para {producto.nombre}.")
+
+    @staticmethod
+    def _descontar(productos_cantidades: Dict[Producto, int]) -> None:
+        # Descontamos el stock ya validado (con las franjas adquiridas no puede fallar)
+        for producto, cantidad in productos_cantidades.items():
+            producto.actualizar_stock(-cantidad)
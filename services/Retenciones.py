@@ -0,0 +1,109 @@
+from __future__ import annotations
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from uuid import UUID, uuid4
+
+from models import Cliente, Producto
+from .Rueda_Temporizadores import RuedaTemporizadores
+
+
+class RetencionNoEncontrada(ValueError):
+    # La reserva no existe, ya caducó o ya se confirmó o canceló
+    pass
+
+
+class Retencion:
+    # Stock apartado para un cliente hasta que confirma el pedido, lo cancela o caduca
+    # 'vence' es el instante de caducidad en el reloj monotónico y 'expira' el mismo
+    # instante en hora local (el que se muestra en la API)
+    __slots__ = ("id", "cliente", "productos_cantidades", "vence", "expira")
+
+    def __init__(self, cliente: Cliente, productos_cantidades: Dict[Producto, int], vence: float, expira: datetime):
+        self.id = uuid4()
+        self.cliente = cliente
+        self.productos_cantidades = productos_cantidades
+        self.vence = vence
+        self.expira = expira
+
+
+class GestorRetenciones:
+    # Retenciones activas y su caducidad
+    # Las caducidades se programan en una rueda de temporizadores: crear, confirmar
+    # o cancelar una retención cuesta O(1) y un hilo de fondo avanza la rueda cada
+    # 'resolucion' segundos y pasa las caducadas a 'liberar', sin recorrer las demás.
+    # Aquí solo se guardan las retenciones: el stock lo aparta y lo devuelve
+    # TiendaService con las franjas del motor de reservas adquiridas.
+
+    def __init__(
+        self,
+        liberar: Callable[[List[Retencion]], None],
+        resolucion: float = 0.1,
+        reloj: Callable[[], float] = time.monotonic,
+    ):
+        self._liberar = liberar
+        self._reloj = reloj
+        self.rueda = RuedaTemporizadores(resolucion, reloj=reloj)
+        self._activas: Dict[UUID, Retencion] = {}
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._activas)
+
+    def crear(self, cliente: Cliente, productos_cantidades: Dict[Producto, int], ttl: float) -> Retencion:
+        # Creamos una retención que caduca dentro de 'ttl' segundos (aún sin activarla)
+        if ttl <= 0:
+            raise ValueError("La duración de la reserva debe ser mayor que cero.")
+        return Retencion(
+            cliente, productos_cantidades, self._reloj() + ttl, datetime.now() + timedelta(seconds=ttl)
+        )
+
+    def agregar(self, retencion: Retencion) -> None:
+        # Activamos la retención (su stock ya está apartado) y programamos su caducidad
+        with self._lock:
+            self._activas[retencion.id] = retencion
+        self.rueda.programar(retencion.id, retencion.vence)
+        if self._hilo is None:
+            self._arrancar()
+
+    def obtener(self, retencion_id: UUID) -> Optional[Retencion]:
+        return self._activas.get(retencion_id)
+
+    def tomar(self, retencion_id: UUID) -> Optional[Retencion]:
+        # Sacamos la retención de las activas (para confirmarla o cancelarla)
+        # Devolvemos None si ya no está: otro hilo la tomó o caducó
+        with self._lock:
+            retencion = self._activas.pop(retencion_id, None)
+        if retencion is not None:
+            self.rueda.cancelar(retencion_id)
+        return retencion
+
+    def vencer(self, ahora: Optional[float] = None) -> int:
+        # Avanzamos la rueda y liberamos las retenciones caducadas; devolvemos cuántas
+        vencidas = self.rueda.avanzar(ahora)
+        if not vencidas:
+            return 0
+        with self._lock:
+            retenciones = [r for r in (self._activas.pop(i, None) for i in vencidas) if r is not None]
+        if retenciones:
+            self._liberar(retenciones)
+        return len(retenciones)
+
+    def _arrancar(self) -> None:
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="retenciones", daemon=True)
+        self._hilo.start()
+
+    def _bucle(self) -> None:
+        while not self._parar.wait(self.rueda.resolucion):
+            self.vencer()
+
+    def cerrar(self) -> None:
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join()
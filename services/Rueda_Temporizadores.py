@@ -0,0 +1,114 @@
+from __future__ import annotations
+import math
+import time
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, Tuple
+
+
+class RuedaTemporizadores:
+    # Rueda de temporizadores jerárquica: cada nivel tiene 'ranuras' ranuras y cada
+    # ranura del nivel N abarca ranuras**N ticks de 'resolucion' segundos. Un
+    # temporizador se guarda en el nivel más bajo cuyo alcance cubre su vencimiento;
+    # cuando el tick llega al inicio de una ranura de un nivel superior sus
+    # temporizadores bajan (en cascada) a niveles inferiores, y al llegar a una
+    # ranura del nivel 0 vencen. Programar y cancelar son O(1) y avanzar cuesta
+    # O(1) por tick más O(1) por temporizador vencido o bajado de nivel, sin
+    # recorrer los temporizadores pendientes.
+    # Los vencimientos más lejanos que el alcance del último nivel se guardan en
+    # su última ranura y se vuelven a programar al bajar.
+
+    def __init__(
+        self,
+        resolucion: float = 0.1,
+        ranuras: int = 64,
+        niveles: int = 4,
+        reloj: Callable[[], float] = time.monotonic,
+    ):
+        if resolucion <= 0 or ranuras < 2 or niveles <= 0:
+            raise ValueError("Resolución, ranuras y niveles de la rueda no válidos.")
+        self.resolucion = resolucion
+        self._num_ranuras = ranuras
+        self._niveles: List[List[Dict[Hashable, int]]] = [[{} for _ in range(ranuras)] for _ in range(niveles)]
+        # Nivel y ranura de cada temporizador, para cancelarlo sin buscarlo
+        self._posicion: Dict[Hashable, Tuple[int, int]] = {}
+        self._reloj = reloj
+        self._origen = reloj()
+        self._tick = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._posicion)
+
+    def __contains__(self, clave: Hashable) -> bool:
+        return clave in self._posicion
+
+    def programar(self, clave: Hashable, vence: float) -> None:
+        # Programamos (o reprogramamos) 'clave' para el instante 'vence' del reloj
+        tick = math.ceil((vence - self._origen) / self.resolucion)
+        with self._lock:
+            self._quitar(clave)
+            self._insertar(clave, tick, self._tick + 1)
+
+    def cancelar(self, clave: Hashable) -> bool:
+        # Quitamos el temporizador; devolvemos False si no existía (p. ej. ya venció)
+        with self._lock:
+            return self._quitar(clave)
+
+    def avanzar(self, ahora: float | None = None) -> List[Hashable]:
+        # Movemos la rueda hasta 'ahora' y devolvemos las claves vencidas
+        objetivo = int(((self._reloj() if ahora is None else ahora) - self._origen) / self.resolucion)
+        vencidas: List[Hashable] = []
+        with self._lock:
+            while self._tick < objetivo:
+                self._tick += 1
+                self._cascada()
+                ranura = self._niveles[0][self._tick % self._num_ranuras]
+                if not ranura:
+                    continue
+                self._niveles[0][self._tick % self._num_ranuras] = {}
+                for clave, tick in ranura.items():
+                    if tick <= self._tick:
+                        del self._posicion[clave]
+                        vencidas.append(clave)
+                    else:
+                        # Vencimiento fuera del alcance de la rueda: vuelve a su sitio
+                        self._insertar(clave, tick, self._tick + 1)
+        return vencidas
+
+    def _insertar(self, clave: Hashable, tick: int, minimo: int) -> None:
+        # Hay que tener '_lock'; lo que ya debería haber vencido sale en el tick 'minimo'
+        # (el siguiente al programar, el actual al bajar de nivel, que aún no se ha procesado)
+        tick = max(tick, minimo)
+        distancia = tick - self._tick
+        alcance = self._num_ranuras
+        nivel = 0
+        while distancia >= alcance and nivel < len(self._niveles) - 1:
+            alcance *= self._num_ranuras
+            nivel += 1
+        # Más lejos que el alcance total: lo dejamos en la ranura más lejana del último nivel
+        posicion = min(tick, self._tick + alcance - 1)
+        ranura = (posicion // (alcance // self._num_ranuras)) % self._num_ranuras
+        self._niveles[nivel][ranura][clave] = tick
+        self._posicion[clave] = (nivel, ranura)
+
+    def _quitar(self, clave: Hashable) -> bool:
+        posicion = self._posicion.pop(clave, None)
+        if posicion is None:
+            return False
+        nivel, ranura = posicion
+        del self._niveles[nivel][ranura][clave]
+        return True
+
+    def _cascada(self) -> None:
+        # Al empezar una ranura de un nivel superior bajamos sus temporizadores
+        tamaño = 1
+        for nivel in range(1, len(self._niveles)):
+            tamaño *= self._num_ranuras
+            if self._tick % tamaño:
+                return
+            indice = (self._tick // tamaño) % self._num_ranuras
+            ranura = self._niveles[nivel][indice]
+            if ranura:
+                self._niveles[nivel][indice] = {}
+                for clave, tick in ranura.items():
+                    self._insertar(clave, tick, self._tick)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Tuple
+
+from pydantic_core import to_json
+
+from models import Pedido, Producto, Usuario
+
+
+# Serialización directa de los objetos del dominio a bytes JSON.
+# Los esquemas de respuesta de la API (ProductoRead, PedidoRead, UsuarioRead)
+# siguen documentando el formato, pero crear un modelo de Pydantic por objeto y
+# volver a validarlo cuesta más que el propio JSON en los listados grandes.
+# Aquí construimos diccionarios con las mismas claves y en el mismo orden que
+# esos esquemas y los codificamos de una vez con el codificador de pydantic_core
+# (UUID y datetime salen con el mismo formato que con los modelos).
+
+# Atributos que solo tienen algunas clases de producto (null en el resto)
+CAMPOS_OPCIONALES_PRODUCTO = ("garantia_meses", "talla", "color")
+_NULOS_PRODUCTO = dict.fromkeys(CAMPOS_OPCIONALES_PRODUCTO)
+
+# Clase de producto -> (etiqueta de tipo, atributos opcionales que tiene)
+_PLANTILLAS_PRODUCTO: Dict[type, Tuple[str, Tuple[str, ...]]] = {}
+
+
+def _plantilla_producto(clase: type) -> Tuple[str, Tuple[str, ...]]:
+    # Resolvemos una sola vez por clase qué atributos opcionales declara
+    plantilla = _PLANTILLAS_PRODUCTO.get(clase)
+    if plantilla is None:
+        declarados = {campo for c in clase.__mro__ for campo in getattr(c, "__slots__", ())}
+        plantilla = (clase.tipo, tuple(c for c in CAMPOS_OPCIONALES_PRODUCTO if c in declarados))
+        _PLANTILLAS_PRODUCTO[clase] = plantilla
+    return plantilla
+
+
+def producto_a_dict(p: Producto) -> Dict[str, Any]:
+    # Mismo contenido que ProductoRead (el precio siempre como float)
+    tipo, opcionales = _plantilla_producto(type(p))
+    datos = {
+        "id": p.id, "tipo": tipo, "nombre": p.nombre, "precio": float(p.precio), "stock": p.stock,
+        "retenido": p.retenido, **_NULOS_PRODUCTO,
+    }
+    for campo in opcionales:
+        datos[campo] = getattr(p, campo, None)
+    return datos
+
+
+def pedido_a_dict(pedido: Pedido) -> Dict[str, Any]:
+    # Mismo contenido que PedidoRead, con los importes guardados al crear el pedido
+    return {
+        "id": pedido.id,
+        "cliente_id": pedido.cliente.id,
+        "nombre_cliente": pedido.cliente.nombre,
+        "fecha": pedido.fecha,
+        "items": [
+            {
+                "producto_id": producto.id,
+                "nombre_producto": producto.nombre,
+                "cantidad": cantidad,
+                "precio_unitario": precio / 100,
+                "subtotal": subtotal / 100,
+            }
+            for producto, cantidad, precio, subtotal in pedido.lineas()
+        ],
+        "total": pedido.total,
+    }
+
+
+def usuario_a_dict(u: Usuario) -> Dict[str, Any]:
+    # Mismo contenido que UsuarioRead
+    return {"id": u.id, "nombre": u.nombre, "email": u.email, "es_admin": u.is_admin()}
+
+
+def producto_json(p: Producto) -> bytes:
+    return to_json(producto_a_dict(p))
+
+
+def productos_json(productos: Iterable[Producto]) -> bytes:
+    return to_json([producto_a_dict(p) for p in productos])
+
+
+def pedido_json(pedido: Pedido) -> bytes:
+    return to_json(pedido_a_dict(pedido))
+
+
+def pedidos_json(pedidos: Iterable[Pedido]) -> bytes:
+    return to_json([pedido_a_dict(p) for p in pedidos])
+
+
+def usuario_json(u: Usuario) -> bytes:
+    return to_json(usuario_a_dict(u))
+
+
+def usuarios_json(usuarios: Iterable[Usuario]) -> bytes:
+    return to_json([usuario_a_dict(u) for u in usuarios])
@@ -0,0 +1,112 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from uuid import UUID
+
+from models import Usuario, Producto, Pedido
+from .Tienda_Service import TiendaService
+from .Reserva_Stock import FranjasOcupadas
+from .Retenciones import Retencion
+from .Idempotencia import ClaveIdempotencia
+
+T = TypeVar("T")
+
+
+class TiendaServiceAsync:
+    # Fachada asyncio sobre TiendaService
+    # Las operaciones en memoria tardan microsegundos, así que en modo asíncrono
+    # se ejecutan directamente en el bucle de eventos, sin saltar al threadpool:
+    # - los pedidos toman las franjas, los locks de índices, catálogo y estadísticas
+    #   y, con persistencia, el del WAL sin esperar; si alguno está ocupado (por un
+    #   lote, un alta masiva, un archivado o un snapshot en otro hilo) ese pedido se
+    #   pasa a un hilo
+    # - la espera del fsync se hace con un futuro que completa el hilo del WAL
+    # - las tareas pesadas (listados completos, lotes) y, con persistencia, las
+    #   escrituras que pueden esperar al lock del WAL durante un snapshot van a un hilo
+    # - con almacén compartido todas las escrituras van a un hilo: esperan al lock
+    #   de escritura de SQLite, que puede tener otro proceso
+    # Con usar_hilos=True todo se ejecuta en hilos, como los endpoints síncronos.
+
+    def __init__(
+        self,
+        servicio: TiendaService,
+        usar_hilos: bool = False,
+        ejecutar_en_hilo: Callable[..., Awaitable[Any]] = asyncio.to_thread,
+    ):
+        self.servicio = servicio
+        self.usar_hilos = usar_hilos
+        self._ejecutar_en_hilo = ejecutar_en_hilo
+
+    async def ejecutar(self, funcion: Callable[..., T], *args: Any, pesado: bool = False) -> T:
+        # Ejecutamos una función síncrona en el bucle o en un hilo según el modo
+        if self.usar_hilos or pesado:
+            return await self._ejecutar_en_hilo(funcion, *args)
+        return funcion(*args)
+
+    def _escritura_en_hilo(self) -> bool:
+        # Con persistencia una escritura puede esperar al lock del WAL (snapshot)
+        # y con almacén compartido, a que otro proceso termine su transacción
+        return self.usar_hilos or self.servicio.persistencia is not None or self.servicio.compartido is not None
+
+    # USUARIOS
+    async def registrar_usuario(self, tipo: str, nombre: str, email: str, direccion: Optional[str] = None) -> Usuario:
+        return await self.ejecutar(
+            self.servicio.registrar_usuario, tipo, nombre, email, direccion, pesado=self._escritura_en_hilo()
+        )
+
+    # PRODUCTOS
+    async def añadir_producto(self, producto: Producto) -> Producto:
+        return await self.ejecutar(self.servicio.añadir_producto, producto, pesado=self._escritura_en_hilo())
+
+    async def añadir_productos(self, productos: List[Producto]) -> List[Producto]:
+        return await self.ejecutar(self.servicio.añadir_productos, productos, pesado=True)
+
+    async def eliminar_producto(self, producto_id: UUID) -> None:
+        await self.ejecutar(self.servicio.eliminar_producto, producto_id, pesado=self._escritura_en_hilo())
+
+    # PEDIDOS
+    async def realizar_pedido(
+        self, cliente_id: UUID, items: Dict[UUID, int], idempotencia: Optional[ClaveIdempotencia] = None
+    ) -> Pedido:
+        # Reservamos el stock en el bucle de eventos y esperamos al disco sin bloquearlo
+        if self.usar_hilos or self.servicio.compartido is not None:
+            return await self._ejecutar_en_hilo(self.servicio.realizar_pedido, cliente_id, items, idempotencia)
+        try:
+            pedido, lsn = self.servicio.reservar_pedido(cliente_id, items, esperar=False, idempotencia=idempotencia)
+        except FranjasOcupadas:
+            # Otro hilo tiene alguna de sus franjas: esperamos en un hilo, no en el bucle
+            pedido, lsn = await self._ejecutar_en_hilo(
+                self.servicio.reservar_pedido, cliente_id, items, True, idempotencia
+            )
+        await self.servicio.confirmar_async(lsn)
+        return pedido
+
+    async def _sin_esperar(self, funcion: Callable[..., T], *args: Any) -> T:
+        # Tomamos las franjas sin esperar en el bucle; si están ocupadas, esperamos en un hilo
+        if self.usar_hilos or self.servicio.compartido is not None:
+            return await self._ejecutar_en_hilo(funcion, *args)
+        try:
+            return funcion(*args, esperar=False)
+        except FranjasOcupadas:
+            return await self._ejecutar_en_hilo(funcion, *args)
+
+    async def realizar_pedidos(self, lote: List[Tuple[UUID, Dict[UUID, int]]]) -> List[Pedido | ValueError]:
+        return await self.ejecutar(self.servicio.realizar_pedidos, lote, pesado=True)
+
+    # RESERVAS
+    async def retener_stock(self, cliente_id: UUID, items: Dict[UUID, int], ttl: float) -> Retencion:
+        return await self._sin_esperar(self.servicio.retener_stock, cliente_id, items, ttl)
+
+    async def confirmar_retencion(self, retencion_id: UUID) -> Pedido:
+        # Como un pedido: el registro va al WAL y esperamos al disco sin bloquear el bucle
+        # Con persistencia se confirma en un hilo: una vez tomada la retención no se
+        # puede ceder el paso si el lock del WAL está ocupado
+        if self.servicio.persistencia is not None:
+            pedido, lsn = await self._ejecutar_en_hilo(self.servicio.confirmar_retencion, retencion_id)
+        else:
+            pedido, lsn = await self._sin_esperar(self.servicio.confirmar_retencion, retencion_id)
+        await self.servicio.confirmar_async(lsn)
+        return pedido
+
+    async def cancelar_retencion(self, retencion_id: UUID) -> None:
+        await self._sin_esperar(self.servicio.cancelar_retencion, retencion_id)
@@ -1,21 +1,163 @@
 from __future__ import annotations
-from typing import Dict, List
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 from uuid import UUID
 
 from models import Usuario, Cliente, Administrador
 from models import Producto
 from models import Pedido
+from .Indice_Pedidos import IndicePedidosCliente
+from .Archivo_Pedidos import ArchivoPedidos, VistaArchivo, BYTES_PEDIDO_CALIENTE
+from .Indice_Usuarios import IndiceUsuarios, codificar_cursor_usuarios, decodificar_cursor_usuarios, normalizar_email
+from .Reserva_Stock import MotorReservas, StockInsuficiente, tomar_sin_esperar
+from .Retenciones import GestorRetenciones, Retencion, RetencionNoEncontrada
+from .Eventos_Stock import CanalStock
+from .Catalogo_Versionado import CatalogoVersionado, InstantaneaCatalogo
+from .Indice_Productos import IndiceProductos, codificar_cursor, decodificar_cursor
+from .Versiones import RegistroVersiones
+from .Estadisticas import AgregadosVentas
+from .Metricas import RegistroMetricas, LIMITES_SERVICIO
+from .Persistencia import Persistencia, Reconstruccion
+from .Persistencia import codificar_usuario, codificar_producto, codificar_eliminacion, codificar_pedido
+from .Persistencia import codificar_idempotencia
+from .Almacen_Compartido import AlmacenCompartido
+from .Idempotencia import ClaveIdempotencia, RegistroIdempotencia
+from .Serializadores import pedido_json
+
+T = TypeVar("T")
+
+
+def _cronometrado(metodo: Callable[..., T]) -> Callable[..., T]:
+    # Registramos la duración de cada llamada en el histograma del servicio
+    nombre = metodo.__name__
+    
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        inicio = perf_counter()
+        try:
+            return metodo(self, *args, **kwargs)
+        finally:
+            self._tiempos.con(nombre).observar(perf_counter() - inicio)
+    
+    return envoltura
 
 
 class TiendaService:
     # Definimos el servicio central de gestión de la tienda online
-    def __init__(self):
+    def __init__(
+        self,
+        num_franjas: int = 64,
+        persistencia: Optional[Persistencia] = None,
+        compartido: Optional[AlmacenCompartido] = None,
+        archivar_tras: Optional[float] = None,
+        memoria_pedidos: Optional[int] = None,
+        intervalo_archivo: float = 30.0,
+    ):
+        if persistencia is not None and compartido is not None:
+            raise ValueError("La persistencia en disco y el almacén compartido son excluyentes.")
         # Creamos un diccionario para almacenar los usuarios por id
         self.usuarios: Dict[UUID, Usuario] = {}
         # Creamos un diccionario para almacenar los productos por id
         self.productos: Dict[UUID, Producto] = {}
         # Creamos un diccionario para almacenar los pedidos por id
         self.pedidos: Dict[UUID, Pedido] = {}
+        # Creamos los índices de usuarios (email único y listas por rol)
+        self.indice_usuarios = IndiceUsuarios()
+        # Creamos un índice secundario de pedidos por cliente ordenados por fecha
+        self.indice_pedidos = IndicePedidosCliente()
+        # Pedidos antiguos compactados en columnas: salen de 'pedidos' (el nivel caliente)
+        # cuando tienen más de 'archivar_tras' segundos o cuando los calientes ocupan
+        # más de 'memoria_pedidos' bytes, y un hilo lo comprueba cada 'intervalo_archivo'
+        self.archivo = ArchivoPedidos(self.productos)
+        self.archivar_tras = archivar_tras
+        self.memoria_pedidos = memoria_pedidos
+        self.intervalo_archivo = intervalo_archivo
+        # '_lock_archivo' hace que publicar un segmento y quitar sus pedidos del nivel
+        # caliente sea atómico para las lecturas que combinan los dos niveles; esas
+        # lecturas no lo toman salvo que coincidan con una publicación, que marcamos
+        # con '_version_archivo' (impar mientras se publica, ver '_leer_pedidos')
+        self._lock_archivo = threading.Lock()
+        self._version_archivo = 0
+        self._lock_compactacion = threading.Lock()
+        self._parar_archivo = threading.Event()
+        self._hilo_archivo: Optional[threading.Thread] = None
+        # Creamos los índices del catálogo (texto, tipo, talla, color, stock y precio)
+        self.indice_productos = IndiceProductos()
+        # Versiones inmutables del catálogo para las lecturas: cada mutación publica
+        # una nueva y los listados leen la última sin bloquear a los pedidos
+        self.catalogo = CatalogoVersionado()
+        # Creamos el motor que reserva el stock de cada pedido de forma atómica
+        self.reservas = MotorReservas(num_franjas)
+        # Retenciones de stock pendientes de confirmar (caducan con una rueda de temporizadores)
+        self.retenciones = GestorRetenciones(self._liberar_caducadas)
+        # Versiones de colecciones y entidades (suben con cada mutación, sirven para cachear respuestas)
+        self.versiones = RegistroVersiones()
+        # Claves de idempotencia de los pedidos guardadas en el WAL (solo con persistencia)
+        self.idempotencia = RegistroIdempotencia()
+        # Agregados de ventas (por producto, cliente y día) actualizados con cada pedido
+        self.estadisticas = AgregadosVentas()
+        # Canal de eventos de productos (altas, stock y bajas) para los clientes suscritos
+        self.canal_stock = CanalStock()
+        # Métricas del servicio: duración de las operaciones, resultado de los pedidos y tamaños
+        self.metricas = RegistroMetricas()
+        self._tiempos = self.metricas.histograma(
+            "tienda_servicio_segundos", "Duración de las operaciones de TiendaService.", LIMITES_SERVICIO, ("operacion",)
+        )
+        resultados_pedidos = self.metricas.contador(
+            "tienda_pedidos_total", "Pedidos procesados por resultado.", ("resultado",)
+        )
+        self._pedidos_aceptados = resultados_pedidos.con("aceptado")
+        self._pedidos_sin_stock = resultados_pedidos.con("sin_stock")
+        self._pedidos_invalidos = resultados_pedidos.con("invalido")
+        self._retenciones_total = self.metricas.contador(
+            "tienda_reservas_total", "Reservas de stock por evento.", ("evento",)
+        )
+        self.metricas.indicador(
+            "tienda_entidades", "Número de elementos de cada colección.",
+            lambda: (
+                (("usuarios",), len(self.usuarios)),
+                (("productos",), len(self.productos)),
+                (("pedidos",), len(self.pedidos)),
+                (("pedidos_archivados",), len(self.archivo)),
+            ),
+            ("coleccion",),
+        )
+        self.metricas.indicador(
+            "tienda_archivo_bytes", "Memoria ocupada por los pedidos archivados.", self.archivo.memoria
+        )
+        self.metricas.indicador(
+            "tienda_reservas_activas", "Reservas de stock pendientes de confirmar.", lambda: len(self.retenciones)
+        )
+        self.metricas.indicador(
+            "tienda_eventos_suscriptores", "Clientes suscritos a los cambios de productos.",
+            lambda: self.canal_stock.suscriptores,
+        )
+        self.metricas.indicador(
+            "tienda_eventos_stock_total", "Repartos y eventos de productos entregados, agrupados y descartados.",
+            lambda: (
+                ((evento,), self.canal_stock.estadisticas()[evento])
+                for evento in ("repartos", "eventos", "agrupados", "desbordes")
+            ),
+            ("evento",),
+            tipo="counter",
+        )
+        # Si hay persistencia, reconstruimos el estado desde disco antes de empezar
+        self.persistencia = persistencia
+        if persistencia is not None:
+            persistencia.cargar(self, solicitar_snapshot=self.crear_snapshot)
+        # Con un almacén compartido (varios procesos) el estado sale de la base de datos
+        self.compartido = compartido
+        if compartido is not None:
+            compartido.cargar(self)
+        # Con una política de archivo el hilo compacta primero lo recuperado y luego periódicamente
+        if archivar_tras is not None or memoria_pedidos is not None:
+            self._hilo_archivo = threading.Thread(target=self._bucle_archivo, name="archivo-pedidos", daemon=True)
+            self._hilo_archivo.start()
     
     # USUARIOS 
     def registrar_usuario(self, tipo: str, nombre: str, email: str, direccion: str | None = None) -> Usuario:
@@ -29,11 +171,26 @@ class TiendaService:
             usuario = Administrador(nombre, email)
         else:
             raise ValueError("Tipo de usuario no válido. Usa 'cliente' o 'admin'.")
+        # Comprobación rápida; la definitiva la hace el índice al guardar (o la base de
+        # datos con almacén compartido), sin que llegue a escribirse el registro
+        if self.indice_usuarios.contiene_email(usuario.email):
+            raise ValueError("Ya existe un usuario con ese email.")
         
-        # Guardamos el usuario en el diccionario
-        self.usuarios[usuario.id] = usuario
+        _, lsn = self._registrar(
+            lambda: codificar_usuario(usuario),
+            lambda: self._guardar_usuario(usuario, unico=self.compartido is None),
+            email=normalizar_email(usuario.email),
+        )
+        self._confirmar(lsn)
         return usuario
     
+    def _guardar_usuario(self, usuario: Usuario, unico: bool = True) -> None:
+        # Indexamos el usuario (falla si su email ya existe) y lo guardamos en el diccionario
+        self.indice_usuarios.agregar(usuario, unico)
+        self.usuarios[usuario.id] = usuario
+        self.versiones.incrementar("usuarios")
+    
+    @_cronometrado
     def obtener_usuario(self, usuario_id: UUID) -> Usuario:
         # Obtenemos un usuario por id o lanzamos error si no existe
         usuario = self.usuarios.get(usuario_id)
@@ -41,16 +198,48 @@ class TiendaService:
             raise ValueError(f"Usuario con id {usuario_id} no encontrado.")
         return usuario
     
-    def listar_usuarios(self) -> List[Usuario]:
-        # Devolvemos la lista de todos los usuarios registrados
-        return list(self.usuarios.values())
+    @_cronometrado
+    def obtener_usuario_por_email(self, email: str) -> Usuario:
+        # Buscamos un usuario por email (sin distinguir mayúsculas) en el índice
+        usuario = self.indice_usuarios.por_email(email)
+        if not usuario:
+            raise ValueError(f"Usuario con email {email} no encontrado.")
+        return usuario
+    
+    @_cronometrado
+    def listar_usuarios(self, rol: Optional[str] = None) -> List[Usuario]:
+        # Devolvemos los usuarios registrados (de un rol, 'cliente' o 'admin', si se indica)
+        return self.indice_usuarios.listar(rol)
+    
+    @_cronometrado
+    def paginar_usuarios(
+        self, rol: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None
+    ) -> Tuple[List[Usuario], Optional[str]]:
+        # Devolvemos una página de usuarios por orden de registro junto con el
+        # cursor de la página siguiente (None si no hay más)
+        if limit <= 0:
+            raise ValueError("El límite debe ser mayor que cero.")
+        posicion = decodificar_cursor_usuarios(rol, cursor) if cursor else 0
+        usuarios, siguiente = self.indice_usuarios.pagina(rol, limit, posicion)
+        return usuarios, codificar_cursor_usuarios(rol, siguiente) if siguiente is not None else None
     
     # PRODUCTOS 
     def añadir_producto(self, producto: Producto) -> Producto:
         # Añadimos un producto al inventario
-        self.productos[producto.id] = producto
+        _, lsn = self._registrar(
+            lambda: codificar_producto(producto), lambda: self._guardar_producto(producto), altas=(producto,)
+        )
+        self._confirmar(lsn)
         return producto
     
+    def _guardar_producto(self, producto: Producto) -> None:
+        self.productos[producto.id] = producto
+        self.indice_productos.agregar(producto)
+        self.catalogo.publicar((producto,), altas=True)
+        self.versiones.incrementar("productos")
+        self.canal_stock.publicar((producto,))
+    
+    @_cronometrado
     def obtener_producto(self, producto_id: UUID) -> Producto:
         # Obtenemos un producto por id o lanzamos error si no existe
         producto = self.productos.get(producto_id)
@@ -60,18 +249,99 @@ class TiendaService:
     
     def eliminar_producto(self, producto_id: UUID) -> None:
         # Eliminamos un producto del inventario si existe
-        if producto_id in self.productos:
+        _, lsn = self._registrar(
+            lambda: codificar_eliminacion(producto_id), lambda: self._eliminar_producto(producto_id), baja=producto_id
+        )
+        self._confirmar(lsn)
+    
+    def _eliminar_producto(self, producto_id: UUID) -> None:
+        producto = self.productos.get(producto_id)
+        if producto is not None:
             del self.productos[producto_id]
+            self.archivo.retirar(producto)
+            self.indice_productos.eliminar(producto_id)
+            self.catalogo.eliminar(producto)
+            self.versiones.eliminar("productos", (producto_id,))
+            self.canal_stock.publicar((producto,), eliminados=True)
         else:
             raise ValueError("Producto no encontrado.")
     
+    def añadir_productos(self, productos: List[Producto]) -> List[Producto]:
+        # Añadimos un lote de productos con una única mutación (y un único registro en el WAL)
+        _, lsn = self._registrar(
+            lambda: b"".join(codificar_producto(p) for p in productos),
+            lambda: self._guardar_productos(productos),
+            altas=productos,
+        )
+        self._confirmar(lsn)
+        return productos
+    
+    def _guardar_productos(self, productos: List[Producto]) -> None:
+        for producto in productos:
+            self.productos[producto.id] = producto
+        # Indexamos el lote de una vez (una sola reordenación de los índices)
+        self.indice_productos.agregar_lote(productos)
+        self.catalogo.publicar(productos, altas=True)
+        self.versiones.incrementar("productos")
+        self.canal_stock.publicar(productos)
+    
+    @_cronometrado
     def listar_productos(self) -> List[Producto]:
-        # Devolvemos la lista de productos del inventario
-        return list(self.productos.values())
+        # Devolvemos la lista de productos del inventario tal como estaba en la última
+        # versión publicada del catálogo (copias: ningún pedido a medias)
+        return self.catalogo.actual().productos()
+    
+    def instantanea_catalogo(self) -> InstantaneaCatalogo:
+        # Última versión publicada del catálogo (inmutable, se toma en O(1))
+        return self.catalogo.actual()
+    
+    @_cronometrado
+    def buscar_productos(
+        self,
+        texto: Optional[str] = None,
+        tipo: Optional[str] = None,
+        talla: Optional[str] = None,
+        color: Optional[str] = None,
+        precio_min: Optional[float] = None,
+        precio_max: Optional[float] = None,
+        solo_con_stock: bool = False,
+        orden: str = "precio",
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Producto], Optional[str]]:
+        # Buscamos productos usando los índices del catálogo y devolvemos una página
+        # junto con el cursor de la página siguiente (None si no hay más)
+        after = decodificar_cursor(orden, cursor) if cursor else None
+        productos, siguiente = self.indice_productos.buscar(
+            texto=texto,
+            tipo=tipo,
+            talla=talla,
+            color=color,
+            precio_min=precio_min,
+            precio_max=precio_max,
+            solo_con_stock=solo_con_stock,
+            orden=orden,
+            limit=limit,
+            after=after,
+        )
+        # El índice da los productos de la página; su stock sale de la versión publicada
+        productos = self.catalogo.actual().copias(productos)
+        return productos, codificar_cursor(orden, siguiente) if siguiente else None
+    
+    def iterar_productos(self, tipo: Optional[str] = None, tamaño_pagina: int = 1000) -> Iterator[Producto]:
+        # Recorremos el catálogo por orden de nombre en páginas del índice, sin copiar
+        # la lista completa: cada página continúa tras la clave de la anterior, así
+        # que las altas y bajas concurrentes no invalidan el recorrido
+        after = None
+        while True:
+            productos, after = self.indice_productos.buscar(tipo=tipo, orden="nombre", limit=tamaño_pagina, after=after)
+            yield from self.catalogo.actual().copias(productos)
+            if after is None:
+                return
     
     # PEDIDOS 
-    def realizar_pedido(self, cliente_id: UUID, items: Dict[UUID, int]) -> Pedido:
-        # Creamos un pedido de un cliente verificando stock
+    def _preparar_pedido(self, cliente_id: UUID, items: Dict[UUID, int]) -> Tuple[Cliente, Dict[Producto, int]]:
+        # Validamos el cliente y resolvemos los productos de un pedido
         cliente = self.usuarios.get(cliente_id)
         if not cliente or not isinstance(cliente, Cliente):
             raise ValueError("El usuario debe existir y ser un cliente.")
@@ -82,19 +352,575 @@ class TiendaService:
             producto = self.productos.get(producto_id)
             if not producto:
                 raise ValueError(f"Producto con id {producto_id} no encontrado.")
-            if not producto.hay_stock(cantidad):
-                raise ValueError(f"No hay stock suficiente para {producto.nombre}.")
             productos_cantidades[producto] = cantidad
+        return cliente, productos_cantidades
+    
+    @_cronometrado
+    def realizar_pedido(
+        self, cliente_id: UUID, items: Dict[UUID, int], idempotencia: Optional[ClaveIdempotencia] = None
+    ) -> Pedido:
+        # Creamos un pedido de un cliente verificando stock (incluye la espera del WAL)
+        pedido, lsn = self.reservar_pedido(cliente_id, items, idempotencia=idempotencia)
+        # Esperamos a que el pedido sea durable ya sin bloquear a otros pedidos
+        self._confirmar(lsn)
+        return pedido
+    
+    @_cronometrado
+    def reservar_pedido(
+        self,
+        cliente_id: UUID,
+        items: Dict[UUID, int],
+        esperar: bool = True,
+        idempotencia: Optional[ClaveIdempotencia] = None,
+    ) -> Tuple[Pedido, int]:
+        # Creamos y registramos el pedido sin esperar a que llegue a disco: devolvemos
+        # el pedido y el LSN de su registro para que el llamante lo confirme
+        # Con esperar=False lanza FranjasOcupadas en vez de esperar a otro pedido, al
+        # lock del WAL o a los índices (el stock descontado se devuelve)
+        # Con persistencia o almacén compartido la clave de 'idempotencia' y la
+        # respuesta se guardan con el pedido (en su registro del WAL o en su
+        # transacción); si la clave ya tiene respuesta lanza RespuestaRepetida sin
+        # tocar el stock. Sin ellos basta con la caché de la API
+        clave = idempotencia if self.persistencia is not None or self.compartido is not None else None
+        if clave is not None and self.persistencia is not None:
+            # Antes de reservar: el reintento de un pedido aceptado no debe fallar por stock
+            self.idempotencia.comprobar(cliente_id, clave)
+        try:
+            cliente, productos_cantidades = self._preparar_pedido(cliente_id, items)
+        except ValueError:
+            self._pedidos_invalidos.incrementar()
+            raise
         
-        # Descontamos el stock de los productos vendidos
-        for producto, cantidad in productos_cantidades.items():
-            producto.actualizar_stock(-cantidad)
-        
-        # Creamos el pedido y lo guardamos
+        # Creamos el pedido
         pedido = Pedido(cliente, productos_cantidades)
-        self.pedidos[pedido.id] = pedido
-        return pedido
+        if clave is not None:
+            cuerpo = pedido_json(pedido)
+            caduca = time.time() + clave.ttl
+        
+        def guardar() -> None:
+            if clave is not None and self.persistencia is not None:
+                # Con el lock del WAL: nadie ha podido guardar la clave entre medias
+                self.idempotencia.comprobar(cliente_id, clave)
+            self._guardar_pedidos((pedido,), productos_cantidades)
+            if clave is not None and self.persistencia is not None:
+                self.idempotencia.guardar(cliente_id, clave.clave, clave.huella, cuerpo, caduca)
+        
+        def codificar() -> bytes:
+            registro = codificar_pedido(pedido)
+            if clave is not None:
+                registro += codificar_idempotencia(cliente_id, clave.clave, clave.huella, cuerpo, caduca)
+            return registro
+        
+        def registrar() -> Tuple[None, int]:
+            # Con el stock ya descontado sabemos si el índice de productos cambia
+            indice = self.indice_productos.cambia_disponibilidad(productos_cantidades)
+            with self._indices_sin_esperar(esperar, indice):
+                return self._registrar(codificar, guardar, esperar)
+        
+        # Comprobamos y descontamos el stock de todas las líneas de forma atómica
+        # y guardamos el pedido sin soltar todavía los productos reservados
+        # Con almacén compartido el stock de referencia es el de la base de datos:
+        # si allí se acepta, repetimos el descuento en la copia en memoria
+        try:
+            if self.compartido is not None:
+                lsn = 0
+                self.compartido.escribir(
+                    codificar_pedido(pedido),
+                    lambda: self._descontar_replica(productos_cantidades, guardar),
+                    descontar=productos_cantidades,
+                    idempotencia=(cliente_id, clave.clave, clave.huella, cuerpo, caduca) if clave else None,
+                )
+            else:
+                _, lsn = self.reservas.reservar(productos_cantidades, registrar, esperar)
+        except StockInsuficiente:
+            self._pedidos_sin_stock.incrementar()
+            raise
+        self._pedidos_aceptados.incrementar()
+        return pedido, lsn
+    
+    @_cronometrado
+    def realizar_pedidos(self, lote: List[Tuple[UUID, Dict[UUID, int]]]) -> List[Pedido | ValueError]:
+        # Realizamos un lote de pedidos (cliente_id, items) y devolvemos, en el mismo
+        # orden, el pedido creado o el error que impidió crearlo
+        resultados: List[Pedido | ValueError] = []
+        preparados: List[Tuple[int, Cliente, Dict[Producto, int]]] = []
+        for cliente_id, items in lote:
+            try:
+                cliente, productos_cantidades = self._preparar_pedido(cliente_id, items)
+            except ValueError as e:
+                resultados.append(e)
+                continue
+            preparados.append((len(resultados), cliente, productos_cantidades))
+            resultados.append(None)
+        
+        nuevos: List[Pedido] = []
+        afectados = {producto for _, _, productos_cantidades in preparados for producto in productos_cantidades}
+        
+        def crear(errores: List[Optional[str]]) -> None:
+            # Creamos los pedidos aceptados
+            for (posicion, cliente, productos_cantidades), error in zip(preparados, errores):
+                if error is None:
+                    pedido = Pedido(cliente, productos_cantidades)
+                    nuevos.append(pedido)
+                    resultados[posicion] = pedido
+                else:
+                    resultados[posicion] = ValueError(error)
+        
+        def guardar(errores: List[Optional[str]]) -> int:
+            # Creamos los pedidos aceptados y los registramos todos juntos
+            crear(errores)
+            _, lsn = self._registrar(
+                lambda: b"".join(codificar_pedido(p) for p in nuevos), lambda: self._guardar_pedidos(nuevos, afectados)
+            )
+            return lsn
+        
+        def codificar(errores: List[Optional[str]]) -> bytes:
+            crear(errores)
+            return b"".join(codificar_pedido(p) for p in nuevos)
+        
+        def almacenar() -> None:
+            # Descontamos en memoria lo que ya se descontó en la base de datos compartida
+            cantidades: Dict[Producto, int] = {}
+            for pedido in nuevos:
+                for producto, cantidad in pedido.productos_cantidades.items():
+                    cantidades[producto] = cantidades.get(producto, 0) + cantidad
+            self._descontar_replica(cantidades, lambda: self._guardar_pedidos(nuevos, afectados))
+        
+        if preparados and self.compartido is not None:
+            self.compartido.escribir_lote([pc for _, _, pc in preparados], codificar, almacenar)
+        elif preparados:
+            lsn = self.reservas.reservar_lote([pc for _, _, pc in preparados], guardar)
+            self._confirmar(lsn)
+        aceptados = sum(1 for r in resultados if isinstance(r, Pedido))
+        self._pedidos_aceptados.incrementar(aceptados)
+        self._pedidos_sin_stock.incrementar(len(preparados) - aceptados)
+        self._pedidos_invalidos.incrementar(len(resultados) - len(preparados))
+        return resultados
+    
+    def _guardar_pedidos(self, pedidos: Iterable[Pedido], afectados: Iterable[Producto]) -> None:
+        # Guardamos pedidos ya reservados y actualizamos índices, estadísticas y versiones
+        for pedido in pedidos:
+            self.pedidos[pedido.id] = pedido
+            self.indice_pedidos.agregar(pedido)
+        self.indice_productos.actualizar_stock(afectados)
+        self.catalogo.publicar(afectados)
+        self.estadisticas.registrar(pedidos)
+        if pedidos:
+            # Los pedidos cambian el stock de sus productos y el historial de sus clientes
+            self.versiones.incrementar("productos", [p.id for p in afectados])
+            self.versiones.incrementar("pedidos", {pedido.cliente.id for pedido in pedidos})
+            self.canal_stock.publicar(afectados)
+    
+    @contextmanager
+    def _indices_sin_esperar(self, esperar: bool, indice_productos: bool = True) -> Iterator[None]:
+        # Con esperar=False (desde el bucle de eventos) tomamos antes y sin esperar los
+        # locks de índices, catálogo y estadísticas que toca la escritura: un alta
+        # masiva o un archivado en otro hilo los tiene mientras dura y el bucle no
+        # debe quedarse parado detrás. Si alguno está ocupado lanzamos FranjasOcupadas
+        # y la operación se repite en un hilo. Son reentrantes: la escritura los
+        # vuelve a tomar dentro sin bloquearse (el de versiones solo se tiene
+        # microsegundos). El índice de productos solo hace falta si cambia la
+        # disponibilidad de algún producto
+        if esperar:
+            yield
+            return
+        locks = [self.indice_pedidos.lock, self.catalogo.lock, self.estadisticas.lock]
+        if indice_productos:
+            locks.append(self.indice_productos.lock)
+        if self.canal_stock.suscriptores:
+            locks.append(self.canal_stock.lock)
+        with tomar_sin_esperar(locks):
+            yield
+    
+    def _stock_cambiado(self, productos: Iterable[Producto]) -> None:
+        # Reindexamos el stock de los productos, subimos sus versiones y avisamos a los suscritos
+        self.indice_productos.actualizar_stock(productos)
+        self.catalogo.publicar(productos)
+        self.versiones.incrementar("productos", [p.id for p in productos])
+        self.canal_stock.publicar(productos)
+    
+    def _descontar_replica(self, cantidades: Dict[Producto, int], guardar: Callable[[], None]) -> None:
+        # Repetimos en memoria un descuento ya aceptado por el almacén compartido
+        # (en el orden del log el stock nunca queda negativo)
+        with self.reservas.bloquear(cantidades):
+            for producto, cantidad in cantidades.items():
+                producto.actualizar_stock(-cantidad)
+            guardar()
+    
+    # RESERVAS 
+    @_cronometrado
+    def retener_stock(self, cliente_id: UUID, items: Dict[UUID, int], ttl: float, esperar: bool = True) -> Retencion:
+        # Apartamos el stock de un pedido durante 'ttl' segundos mientras el cliente paga
+        # Las unidades retenidas dejan de estar disponibles hasta que se confirma el
+        # pedido, se cancela la reserva o caduca (entonces vuelven al stock)
+        # Las retenciones solo viven en memoria: no se escriben en el WAL
+        if self.compartido is not None:
+            raise ValueError("Las reservas de stock no están disponibles con almacén compartido.")
+        cliente, productos_cantidades = self._preparar_pedido(cliente_id, items)
+        retencion = self.retenciones.crear(cliente, productos_cantidades, ttl)
+        
+        def apartar() -> None:
+            indice = self.indice_productos.cambia_disponibilidad(productos_cantidades)
+            with self._indices_sin_esperar(esperar, indice):
+                for producto, cantidad in productos_cantidades.items():
+                    producto.retenido += cantidad
+                self._stock_cambiado(productos_cantidades)
+            self.retenciones.agregar(retencion)
+        
+        self.reservas.reservar(productos_cantidades, apartar, esperar)
+        self._retenciones_total.con("creada").incrementar()
+        return retencion
+    
+    def obtener_retencion(self, retencion_id: UUID) -> Retencion:
+        # Obtenemos una reserva activa o lanzamos error si no existe (o ya caducó)
+        retencion = self.retenciones.obtener(retencion_id)
+        if retencion is None:
+            raise RetencionNoEncontrada(f"Reserva con id {retencion_id} no encontrada o caducada.")
+        return retencion
+    
+    @_cronometrado
+    def confirmar_retencion(self, retencion_id: UUID, esperar: bool = True) -> Tuple[Pedido, int]:
+        # Convertimos la reserva en un pedido con el stock ya apartado (sin volver a
+        # descontarlo) y devolvemos el pedido y el LSN de su registro en el WAL
+        productos_cantidades = self.obtener_retencion(retencion_id).productos_cantidades
+        with self.reservas.bloquear(productos_cantidades, esperar), self._indices_sin_esperar(esperar):
+            retencion = self._tomar_retencion(retencion_id)
+            eliminados = [p.nombre for p in productos_cantidades if self.productos.get(p.id) is not p]
+            if eliminados:
+                self._liberar(retencion)
+                raise ValueError(f"Producto eliminado: {', '.join(eliminados)}.")
+            pedido = Pedido(retencion.cliente, productos_cantidades)
+            for producto, cantidad in productos_cantidades.items():
+                producto.retenido -= cantidad
+            try:
+                # El pedido entra en el WAL como cualquier otro: al recuperar se descuenta su stock
+                _, lsn = self._registrar(
+                    lambda: codificar_pedido(pedido), lambda: self._guardar_pedidos((pedido,), productos_cantidades)
+                )
+            except BaseException:
+                # Si no se pudo registrar el pedido devolvemos el stock retenido
+                for producto, cantidad in productos_cantidades.items():
+                    producto.actualizar_stock(cantidad)
+                self._stock_cambiado(productos_cantidades)
+                raise
+        self._retenciones_total.con("confirmada").incrementar()
+        self._pedidos_aceptados.incrementar()
+        return pedido, lsn
+    
+    @_cronometrado
+    def cancelar_retencion(self, retencion_id: UUID, esperar: bool = True) -> None:
+        # Devolvemos al stock las unidades de una reserva activa
+        productos_cantidades = self.obtener_retencion(retencion_id).productos_cantidades
+        with self.reservas.bloquear(productos_cantidades, esperar), self._indices_sin_esperar(esperar):
+            self._liberar(self._tomar_retencion(retencion_id))
+        self._retenciones_total.con("cancelada").incrementar()
+    
+    def _tomar_retencion(self, retencion_id: UUID) -> Retencion:
+        # Sacamos la reserva de las activas con sus franjas ya adquiridas
+        retencion = self.retenciones.tomar(retencion_id)
+        if retencion is None:
+            # Caducó (o se confirmó o canceló en otro hilo) mientras esperábamos las franjas
+            raise RetencionNoEncontrada(f"Reserva con id {retencion_id} no encontrada o caducada.")
+        return retencion
+    
+    def _liberar(self, retencion: Retencion) -> None:
+        # Hay que tener las franjas de sus productos: las unidades vuelven a estar disponibles
+        for producto, cantidad in retencion.productos_cantidades.items():
+            producto.retenido -= cantidad
+            producto.actualizar_stock(cantidad)
+        self._stock_cambiado(retencion.productos_cantidades)
+    
+    def _liberar_caducadas(self, retenciones: List[Retencion]) -> None:
+        # Lo llama el hilo de la rueda de temporizadores con las reservas ya caducadas
+        for retencion in retenciones:
+            with self.reservas.bloquear(retencion.productos_cantidades):
+                self._liberar(retencion)
+        self._retenciones_total.con("caducada").incrementar(len(retenciones))
+    
+    @_cronometrado
+    def listar_pedidos_usuario(
+        self,
+        usuario_id: UUID,
+        desde: Optional[datetime] = None,
+        hasta: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        after: Optional[UUID] = None,
+    ) -> List[Pedido]:
+        # Devolvemos los pedidos de un usuario por orden de fecha: primero los
+        # archivados y después los del índice de pedidos calientes
+        # 'after' es el id del último pedido de la página anterior (cursor)
+        if limit is not None and limit <= 0:
+            raise ValueError("El límite debe ser mayor que cero.")
+        desde = self._normalizar_fecha(desde)
+        hasta = self._normalizar_fecha(hasta)
+        
+        def leer_calientes() -> Tuple[Optional[Pedido], List[Pedido]]:
+            cursor = self.pedidos.get(after) if after is not None else None
+            return cursor, self.indice_pedidos.consultar(usuario_id, desde=desde, hasta=hasta, limit=limit, after=cursor)
+        
+        vista, (cursor, calientes) = self._leer_pedidos(leer_calientes)
+        if cursor is not None:
+            if cursor.cliente.id != usuario_id:
+                raise ValueError(f"Cursor {after} no válido para este usuario.")
+            # El cursor es un pedido caliente: los archivados ya se devolvieron
+            return calientes
+        posicion = None
+        if after is not None:
+            posicion = vista.posicion(after, usuario_id)
+            if posicion is None:
+                raise ValueError(f"Cursor {after} no válido para este usuario.")
+        archivados = vista.consultar(usuario_id, desde=desde, hasta=hasta, limit=limit, after=posicion)
+        if limit is not None:
+            calientes = calientes[:limit - len(archivados)]
+        return archivados + calientes
+    
+    def iterar_pedidos(
+        self,
+        cliente_id: Optional[UUID] = None,
+        desde: Optional[datetime] = None,
+        hasta: Optional[datetime] = None,
+    ) -> Iterator[Pedido]:
+        # Recorremos los pedidos cliente a cliente y, dentro de cada uno, por fecha:
+        # los archivados se crean según se recorren y de los calientes solo se copia
+        # la lista del cliente (junto con la vista del archivo, para no perder ni
+        # repetir pedidos si se compacta a mitad del recorrido)
+        if cliente_id is not None:
+            clientes = [cliente_id]
+        else:
+            clientes = [u.id for u in list(self.usuarios.values()) if isinstance(u, Cliente)]
+        desde = self._normalizar_fecha(desde)
+        hasta = self._normalizar_fecha(hasta)
+        for cliente in clientes:
+            vista, calientes = self._leer_pedidos(
+                lambda: self.indice_pedidos.consultar(cliente, desde=desde, hasta=hasta)
+            )
+            yield from vista.iterar_cliente(cliente, desde, hasta)
+            yield from calientes
+    
+    def _leer_pedidos(self, leer: Callable[[], T]) -> Tuple[VistaArchivo, T]:
+        # Tomamos la vista del archivo y leemos los pedidos calientes como si fuera en
+        # el mismo instante, sin lock: si la versión del archivo no cambió entre medias
+        # no se publicó ningún segmento. Solo si coincidimos con una publicación
+        # (cada 'intervalo_archivo' como mucho) repetimos la lectura con el lock
+        version = self._version_archivo
+        if version % 2 == 0:
+            vista = self.archivo.vista()
+            resultado = leer()
+            if self._version_archivo == version:
+                return vista, resultado
+        with self._lock_archivo:
+            return self.archivo.vista(), leer()
+    
+    @staticmethod
+    def _normalizar_fecha(fecha: Optional[datetime]) -> Optional[datetime]:
+        # Las fechas de los pedidos son locales sin zona horaria, así que
+        # convertimos a hora local cualquier fecha que venga con zona horaria
+        if fecha is not None and fecha.tzinfo is not None:
+            return fecha.astimezone().replace(tzinfo=None)
+        return fecha
+    
+    # ÍNDICES 
+    def reconstruir_indices(self) -> None:
+        # Reconstruimos de una vez los índices secundarios a partir de los diccionarios
+        # (se usa tras una carga masiva, por ejemplo al recuperar el estado desde disco)
+        self.indice_usuarios.reconstruir(self.usuarios.values())
+        self.indice_pedidos.reconstruir(self.pedidos.values())
+        self.indice_productos.reconstruir(self.productos.values())
+        self.catalogo.reconstruir(self.productos.values())
+        self.recalcular_estadisticas()
+    
+    @_cronometrado
+    def recalcular_estadisticas(self) -> int:
+        # Recalculamos desde cero los agregados de ventas (vectorizado con NumPy)
+        # Detenemos los pedidos solo mientras copiamos la lista; devolvemos las líneas procesadas
+        return self.estadisticas.recalcular(self.reservas.bloquear_todo, self._capturar_pedidos)
+    
+    def _capturar_pedidos(self):
+        # Pedidos calientes y vista del archivo en el mismo instante
+        vista, pedidos = self._leer_pedidos(lambda: list(self.pedidos.values()))
+        return pedidos, vista
+    
+    # ARCHIVO DE PEDIDOS 
+    @_cronometrado
+    def archivar_pedidos(self, antes: Optional[datetime] = None) -> int:
+        # Compactamos en un segmento del archivo los pedidos anteriores a 'antes' (por
+        # defecto, según la política de edad y memoria) y devolvemos cuántos se archivaron
+        # El segmento se construye sin bloquear a nadie; solo su publicación (y quitar
+        # sus pedidos del nivel caliente) se hace con '_lock_archivo'
+        with self._lock_compactacion:
+            corte = self._normalizar_fecha(antes) if antes is not None else self._corte_archivo()
+            if corte is None:
+                return 0
+            por_cliente = self.indice_pedidos.anteriores(corte)
+            if not por_cliente:
+                return 0
+            segmento = self.archivo.compactar(por_cliente)
+            with self._lock_archivo:
+                self._version_archivo += 1
+                try:
+                    self.archivo.agregar(segmento)
+                    self.indice_pedidos.quitar(por_cliente)
+                    for pedidos in por_cliente.values():
+                        for pedido in pedidos:
+                            self.pedidos.pop(pedido.id, None)
+                finally:
+                    self._version_archivo += 1
+            self.archivo.fusionar()
+            return len(segmento)
+    
+    def archivar_historico(self, por_cliente: Dict[UUID, List[Pedido]]) -> int:
+        # Añadimos al archivo pedidos históricos (de una carga masiva) sin pasar por el
+        # nivel caliente; los de cada cliente deben ser posteriores a los ya archivados
+        with self._lock_compactacion:
+            segmento = self.archivo.compactar(por_cliente)
+            with self._lock_archivo:
+                self._version_archivo += 1
+                try:
+                    self.archivo.agregar(segmento)
+                finally:
+                    self._version_archivo += 1
+            self.archivo.fusionar()
+            return len(segmento)
+    
+    def _corte_archivo(self) -> Optional[datetime]:
+        # Fecha a partir de la cual los pedidos siguen calientes según la política
+        cortes = []
+        if self.archivar_tras is not None:
+            cortes.append(datetime.now() - timedelta(seconds=self.archivar_tras))
+        if self.memoria_pedidos is not None:
+            maximo = self.memoria_pedidos // BYTES_PEDIDO_CALIENTE
+            if len(self.pedidos) > maximo:
+                # Por encima del presupuesto bajamos hasta 3/4 para no compactar a cada
+                # pedido; el diccionario está por orden de llegada (casi por fecha)
+                pedidos = list(self.pedidos.values())
+                cortes.append(pedidos[-max(1, maximo * 3 // 4)].fecha)
+        return max(cortes) if cortes else None
+    
+    def _bucle_archivo(self) -> None:
+        while True:
+            self.archivar_pedidos()
+            if self._parar_archivo.wait(self.intervalo_archivo):
+                return
+    
+    # PERSISTENCIA 
+    def _registrar(
+        self, codificar: Callable[[], bytes], mutacion: Callable[[], T], esperar: bool = True, **almacen
+    ) -> Tuple[T, int]:
+        # Aplicamos una mutación y, si hay persistencia, la añadimos al WAL
+        # 'codificar' solo se llama cuando hace falta escribir el registro
+        # Con esperar=False lanza FranjasOcupadas si el lock del WAL está tomado
+        # 'almacen' indica al almacén compartido los productos dados de alta o de baja
+        # y el email de los usuarios nuevos (que debe ser único entre todos los procesos)
+        if self.compartido is not None:
+            return self.compartido.escribir(codificar(), mutacion, **almacen), 0
+        if self.persistencia is None:
+            return mutacion(), 0
+        return self.persistencia.registrar(codificar, mutacion, esperar)
+    
+    def _confirmar(self, lsn: int) -> None:
+        # Esperamos a que el registro llegue a disco (group commit)
+        if self.persistencia is not None:
+            self.persistencia.esperar(lsn)
+    
+    async def confirmar_async(self, lsn: int) -> None:
+        # Igual que '_confirmar' pero esperando en el bucle de eventos
+        if self.persistencia is not None:
+            await self.persistencia.esperar_async(lsn)
+    
+    def crear_snapshot(self) -> None:
+        # Guardamos el estado completo para que el arranque solo lea la cola del WAL
+        if self.persistencia is None:
+            raise ValueError("La persistencia no está activada.")
+        self.persistencia.snapshot(self.reservas.bloquear_todo, self._capturar_estado, self._codificar_estado)
+    
+    def _capturar_estado(self):
+        # Copiamos las colecciones y el stock actual (se llama con las escrituras detenidas)
+        pedidos, archivo = self._capturar_pedidos()
+        return (
+            list(self.usuarios.values()),
+            # Las retenciones no se guardan: sus unidades cuentan como disponibles
+            [(p, p.stock + p.retenido) for p in self.productos.values()],
+            pedidos,
+            archivo,
+            self.idempotencia.entradas(),
+        )
+    
+    @staticmethod
+    def _codificar_estado(estado) -> Iterator[bytes]:
+        usuarios, productos, calientes, archivo, claves = estado
+        
+        def pedidos() -> Iterator[Pedido]:
+            # Primero los archivados (los más antiguos), creados según se codifican
+            yield from archivo.iterar()
+            yield from calientes
+        
+        for usuario in usuarios:
+            yield codificar_usuario(usuario)
+        activos = set()
+        for producto, stock in productos:
+            activos.add(producto.id)
+            yield codificar_producto(producto, stock)
+        # Los pedidos pueden referenciar productos ya eliminados: los guardamos
+        # seguidos de su eliminación para poder reconstruir esas líneas
+        eliminados: Dict[UUID, Producto] = {}
+        for pedido in pedidos():
+            for producto, _, _, _ in pedido.lineas():
+                if producto.id not in activos:
+                    eliminados[producto.id] = producto
+        for producto in eliminados.values():
+            yield codificar_producto(producto)
+            yield codificar_eliminacion(producto.id)
+        for pedido in pedidos():
+            yield codificar_pedido(pedido)
+        for clave in claves:
+            yield codificar_idempotencia(*clave)
+    
+    # ALMACÉN COMPARTIDO 
+    def replicar(self, reconstruccion: Reconstruccion, contenidos: List[bytes]) -> None:
+        # Aplicamos los registros que escribió otro proceso en el almacén compartido,
+        # igual que si la mutación se hubiera hecho aquí (índices, versiones y estadísticas)
+        # Los productos y pedidos seguidos de un mismo registro se aplican como lote
+        productos: List[Producto] = []
+        pedidos: List[Pedido] = []
+        cantidades: Dict[Producto, int] = {}
+        
+        def aplicar_lotes() -> None:
+            if productos:
+                self._guardar_productos(list(productos))
+                productos.clear()
+            if pedidos:
+                self._descontar_replica(cantidades, lambda: self._guardar_pedidos(list(pedidos), list(cantidades)))
+                pedidos.clear()
+                cantidades.clear()
+        
+        for contenido in contenidos:
+            tipo = bytes(contenido[:1])
+            if tipo == b"P":
+                productos.append(reconstruccion.producto(contenido))
+                continue
+            if tipo == b"O":
+                pedido, lineas = reconstruccion.pedido(contenido)
+                pedidos.append(pedido)
+                for producto, cantidad in lineas.items():
+                    cantidades[producto] = cantidades.get(producto, 0) + cantidad
+                continue
+            aplicar_lotes()
+            if tipo == b"U":
+                # La base de datos ya comprobó que el email es único
+                self._guardar_usuario(reconstruccion.usuario(contenido), unico=False)
+            elif tipo == b"D":
+                self._eliminar_producto(reconstruccion.eliminacion(contenido))
+            else:
+                raise ValueError(f"Tipo de registro desconocido: {tipo!r}")
+        aplicar_lotes()
     
-    def listar_pedidos_usuario(self, usuario_id: UUID) -> List[Pedido]:
-        # Devolvemos todos los pedidos de un usuario por orden de fecha
-        return [p for p in self.pedidos.values() if p.cliente.id == usuario_id]
+    def cerrar(self) -> None:
+        # Volcamos a disco lo pendiente y cerramos el WAL
+        self.retenciones.cerrar()
+        self._parar_archivo.set()
+        if self._hilo_archivo is not None:
+            self._hilo_archivo.join()
+        if self.persistencia is not None:
+            self.persistencia.cerrar()
+        if self.compartido is not None:
+            self.compartido.cerrar()
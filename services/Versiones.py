@@ -0,0 +1,59 @@
+from __future__ import annotations
+import secrets
+from threading import Lock
+from typing import Dict, Hashable, Iterable
+
+
+class RegistroVersiones:
+    # Contadores de versión de las colecciones (usuarios, productos, pedidos) y de
+    # sus entidades. Todas las versiones salen de un único contador creciente, así
+    # que una versión nunca se repite. Se incrementan después de aplicar cada
+    # mutación: quien lee una versión ve al menos los cambios hasta esa versión.
+    # Las entidades que nunca han cambiado no ocupan memoria (su versión es 0).
+
+    def __init__(self):
+        # Época aleatoria: distingue las versiones de este proceso de las de un arranque anterior
+        self.epoca = secrets.token_hex(4)
+        self._ultima = 0
+        self._colecciones: Dict[str, int] = {}
+        self._entidades: Dict[str, Dict[Hashable, int]] = {}
+        self._lock = Lock()
+
+    def incrementar(self, coleccion: str, entidades: Iterable[Hashable] = ()) -> int:
+        # Asignamos una versión nueva a la colección y a las entidades indicadas
+        with self._lock:
+            self._ultima += 1
+            version = self._ultima
+            self._colecciones[coleccion] = version
+            if entidades:
+                por_id = self._entidades.setdefault(coleccion, {})
+                for entidad in entidades:
+                    por_id[entidad] = version
+            return version
+
+    def eliminar(self, coleccion: str, entidades: Iterable[Hashable]) -> int:
+        # Nueva versión de la colección tras dar de baja unas entidades, cuya versión
+        # dejamos de guardar: los ids no se reutilizan y las lecturas de una entidad
+        # que ya no existe no se cachean, así que nadie vuelve a necesitarla
+        with self._lock:
+            self._ultima += 1
+            version = self._ultima
+            self._colecciones[coleccion] = version
+            por_id = self._entidades.get(coleccion)
+            if por_id:
+                for entidad in entidades:
+                    por_id.pop(entidad, None)
+            return version
+
+    def coleccion(self, coleccion: str) -> int:
+        # Versión actual de una colección completa
+        return self._colecciones.get(coleccion, 0)
+
+    def entidad(self, coleccion: str, entidad: Hashable) -> int:
+        # Versión actual de una entidad concreta de una colección
+        por_id = self._entidades.get(coleccion)
+        return por_id.get(entidad, 0) if por_id else 0
+
+    def etag(self, version: int) -> str:
+        # ETag fuerte de una respuesta generada con esta versión
+        return f'"{self.epoca}-{version}"'
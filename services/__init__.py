@@ -1,4 +1,15 @@
-# Importamos la clase para que esté disponible al importar el paquete services
+# Importamos las clases para que estén disponibles al importar el paquete services
 from .Tienda_Service import TiendaService
+from .Tienda_Async import TiendaServiceAsync
+from .Persistencia import Persistencia
+from .Almacen_Compartido import AlmacenCompartido
+from .Cache_Respuestas import CacheRespuestas
+from .Metricas import RegistroMetricas, MiddlewareMetricas
+from .Idempotencia import CacheIdempotencia, ConflictoIdempotencia, ClaveIdempotencia
+from .Admision import ControlAdmision, MiddlewareAdmision, LimiteSuperado
 
-__all__ = ["TiendaService"]
\ No newline at end of file
+__all__ = [
+    "TiendaService", "TiendaServiceAsync", "Persistencia", "AlmacenCompartido", "CacheRespuestas",
+    "RegistroMetricas", "MiddlewareMetricas", "CacheIdempotencia", "ConflictoIdempotencia", "ClaveIdempotencia",
+    "ControlAdmision", "MiddlewareAdmision", "LimiteSuperado",
+]
\ No newline at end of file
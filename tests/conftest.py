@@ -0,0 +1,16 @@
+import pytest
+
+
+class Reloj:
+    # Reloj manual para mover el tiempo sin esperar (con valores exactos en binario
+    # para comparar en el límite)
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self) -> float:
+        return self.ahora
+
+
+@pytest.fixture
+def reloj():
+    return Reloj()
@@ -0,0 +1,53 @@
+import pytest
+
+from services.Admision import LimitadorTokens
+
+
+def test_rafaga_completa_y_despues_la_tasa(reloj):
+    limitador = LimitadorTokens(tasa=2, rafaga=3, reloj=reloj)
+    assert [limitador.consumir("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    # El cubo está vacío: falta medio segundo para el siguiente token
+    assert limitador.consumir("a") == 0.5
+    # Los rechazos no gastan: seguimos esperando lo mismo
+    assert limitador.consumir("a") == 0.5
+    reloj.ahora += 0.25
+    assert limitador.consumir("a") == 0.25
+    # Justo al reponerse el token se admite una y solo una
+    reloj.ahora += 0.25
+    assert limitador.consumir("a") == 0.0
+    assert limitador.consumir("a") == 0.5
+    assert (limitador.admitidas, limitador.rechazadas) == (4, 4)
+
+
+def test_claves_independientes(reloj):
+    limitador = LimitadorTokens(tasa=1, rafaga=1, reloj=reloj)
+    assert limitador.consumir("a") == 0.0
+    assert limitador.consumir("a") == 1.0
+    assert limitador.consumir("b") == 0.0
+
+
+def test_cubo_lleno_tras_la_inactividad_se_olvida(reloj):
+    limitador = LimitadorTokens(tasa=2, rafaga=3, reloj=reloj)
+    for _ in range(3):
+        limitador.consumir("a")
+    # En 1,5 s el cubo vuelve a estar lleno: la clave no ocupa nada y tiene la ráfaga entera
+    reloj.ahora += 1.5
+    assert limitador.consumir("b") == 0.0
+    assert "a" not in limitador._llenos and len(limitador) == 1
+    assert [limitador.consumir("a") for _ in range(4)] == [0.0, 0.0, 0.0, 0.5]
+
+
+def test_max_claves_olvida_las_mas_antiguas(reloj):
+    limitador = LimitadorTokens(tasa=1, rafaga=1, max_claves=2, reloj=reloj)
+    for clave in ("a", "b", "c"):
+        assert limitador.consumir(clave) == 0.0
+    assert len(limitador) == 2 and limitador.olvidadas == 1
+    # La olvidada vuelve a empezar con el cubo lleno
+    assert limitador.consumir("a") == 0.0
+    assert limitador.consumir("c") == 1.0
+
+
+@pytest.mark.parametrize("tasa, rafaga, max_claves", [(0, 1, 1), (1, 0, 1), (1, 1, 0)])
+def test_parametros_no_validos(tasa, rafaga, max_claves):
+    with pytest.raises(ValueError):
+        LimitadorTokens(tasa, rafaga, max_claves)
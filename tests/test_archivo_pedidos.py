@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from models import Cliente, Pedido, ProductoElectronico
+from services import TiendaService
+from services.Archivo_Pedidos import ArchivoPedidos
+
+
+def archivo_con_segmentos(tamaños):
+    # Archivo con un segmento por cada tamaño; cada segmento lleva pedidos de dos
+    # clientes, con fechas crecientes entre segmentos
+    productos = {p.id: p for p in (ProductoElectronico(f"Producto {i}", 1 + i, 100) for i in range(3))}
+    lista = list(productos.values())
+    ana, luis = Cliente("Ana", "ana@tienda.es", "Calle 1"), Cliente("Luis", "luis@tienda.es", "Calle 2")
+    archivo = ArchivoPedidos(productos)
+    fecha = datetime(2024, 1, 1)
+    for tamaño in tamaños:
+        por_cliente = {ana.id: [], luis.id: []}
+        for i in range(tamaño):
+            fecha += timedelta(minutes=5)
+            cliente = ana if i % 3 else luis
+            pedido = Pedido.restaurar(uuid4(), cliente, fecha, [(lista[i % 3], 1 + i % 2, 150)])
+            por_cliente[cliente.id].append(pedido)
+        archivo.agregar(archivo.compactar(por_cliente))
+    return archivo, productos, lista, ana
+
+
+def paginas(archivo, cliente, limit):
+    # Recorremos el historial de un cliente página a página con 'after', tomando
+    # una vista nueva en cada página como hace TiendaService
+    vistos = []
+    after = None
+    while True:
+        vista = archivo.vista()
+        if vistos:
+            after = vista.posicion(vistos[-1].id, cliente.id)
+            assert after is not None
+        pagina = vista.consultar(cliente.id, limit=limit, after=after)
+        if not pagina:
+            return vistos
+        assert len(pagina) <= limit
+        vistos.extend(pagina)
+
+
+def test_paginas_cruzan_segmentos_tras_eliminar_productos():
+    archivo, productos, lista, ana = archivo_con_segmentos([7, 5, 9])
+    completo = archivo.vista().consultar(ana.id)
+    assert len(archivo.segmentos) == 3 and len(completo) == 13
+    # Un producto eliminado sigue saliendo en los pedidos archivados con su id y su nombre
+    eliminado = lista[1]
+    del productos[eliminado.id]
+    for limit in (1, 2, 3, 4, 13, 50):
+        pedidos = paginas(archivo, ana, limit)
+        assert [p.id for p in pedidos] == [p.id for p in completo]
+        assert [p.fecha for p in pedidos] == sorted(p.fecha for p in pedidos)
+    lineas = [producto for p in completo for producto, _, _, _ in p.lineas()]
+    retirados = {id(p) for p in lineas if p.id == eliminado.id}
+    assert len(retirados) == 1
+    assert all(p.nombre == eliminado.nombre for p in lineas if p.id == eliminado.id)
+
+
+def test_paginas_tras_fusionar_segmentos():
+    archivo, _, _, ana = archivo_con_segmentos([6, 3, 3])
+    completo = [p.id for p in archivo.vista().consultar(ana.id)]
+    primera = archivo.vista().consultar(ana.id, limit=3)
+    # Entre dos páginas se fusionan los segmentos: las posiciones cambian, pero la
+    # siguiente página sigue donde acabó la anterior
+    assert archivo.fusionar() > 0
+    vista = archivo.vista()
+    resto = vista.consultar(ana.id, after=vista.posicion(primera[-1].id, ana.id))
+    assert [p.id for p in primera + resto] == completo
+
+
+def test_producto_eliminado_es_el_mismo_objeto_en_archivados_y_calientes():
+    # Un pedido archivado y otro caliente de un producto que después se elimina:
+    # el recálculo de las estadísticas lo cuenta como un único producto
+    servicio = TiendaService()
+    try:
+        producto = servicio.añadir_producto(ProductoElectronico("x", 2, 10))
+        cliente = servicio.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+        servicio.realizar_pedido(cliente.id, {producto.id: 1})
+        servicio.archivar_pedidos(datetime.now() + timedelta(seconds=1))
+        servicio.realizar_pedido(cliente.id, {producto.id: 2})
+        servicio.eliminar_producto(producto.id)
+        servicio.recalcular_estadisticas()
+        assert [(p.nombre, u, i) for p, u, i in servicio.estadisticas.top_productos(10)] == [("x", 3, 600)]
+        numero = servicio.archivo.numero_producto(producto.id)
+        assert servicio.archivo.producto(numero) is producto
+    finally:
+        servicio.cerrar()
+
+
+def test_producto_eliminado_antes_de_archivar_sus_pedidos():
+    servicio = TiendaService()
+    try:
+        producto = servicio.añadir_producto(ProductoElectronico("x", 2, 10))
+        cliente = servicio.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+        servicio.realizar_pedido(cliente.id, {producto.id: 1})
+        servicio.eliminar_producto(producto.id)
+        servicio.archivar_pedidos(datetime.now() + timedelta(seconds=1))
+        pedido, = servicio.archivo.vista().consultar(cliente.id)
+        assert next(pedido.lineas())[0] is producto
+    finally:
+        servicio.cerrar()
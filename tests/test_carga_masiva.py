@@ -0,0 +1,49 @@
+import json
+from uuid import uuid4
+
+import pytest
+
+from services import TiendaService
+from services.Carga_Masiva import CargaMasiva, ErrorCarga, cargar_tienda
+
+
+def escribir(ruta, filas):
+    ruta.write_text("".join(json.dumps(fila) + "\n" for fila in filas))
+    return str(ruta)
+
+
+def ficheros(tmp_path, fechas):
+    # Un cliente, un producto y un pedido por fecha, en el orden dado
+    cliente_id, producto_id = str(uuid4()), str(uuid4())
+    usuarios = escribir(tmp_path / "usuarios.jsonl", [
+        {"id": cliente_id, "nombre": "Ana", "email": "ana@tienda.es", "direccion_postal": "Calle 1"},
+    ])
+    productos = escribir(tmp_path / "productos.jsonl", [
+        {"id": producto_id, "tipo": "generico", "nombre": "Taza", "precio": 5, "stock": 10},
+    ])
+    pedidos = escribir(tmp_path / "pedidos.jsonl", [
+        {"cliente_id": cliente_id, "fecha": fecha, "items": [{"producto_id": producto_id, "cantidad": 1}]}
+        for fecha in fechas
+    ])
+    return usuarios, productos, pedidos
+
+
+def test_pedidos_fuera_de_orden_entre_segmentos_detienen_la_carga(tmp_path):
+    # El segundo segmento empieza antes del ya archivado: no es un error de fila que
+    # 'max_errores' pueda tolerar, la carga se detiene sin contar filas no válidas
+    fechas = ["2024-01-02T00:00:00", "2024-01-03T00:00:00", "2024-01-01T00:00:00", "2024-01-04T00:00:00"]
+    usuarios, productos, pedidos = ficheros(tmp_path, fechas)
+    carga = CargaMasiva(TiendaService(), pedidos_por_segmento=2, max_errores=10)
+    carga.cargar("usuarios", usuarios)
+    carga.cargar("productos", productos)
+    with pytest.raises(ErrorCarga, match="orden de fecha"):
+        carga.cargar("pedidos", pedidos)
+    assert carga.resumen["total_errores"] == 0
+
+
+def test_segmentos_completos_se_archivan_durante_la_carga(tmp_path):
+    fechas = [f"2024-01-0{dia}T00:00:00" for dia in range(1, 6)]
+    servicio = TiendaService()
+    resumen = cargar_tienda(servicio, *ficheros(tmp_path, fechas), pedidos_por_segmento=2)
+    assert resumen["pedidos"]["cargadas"] == 5 and resumen["total_errores"] == 0
+    assert len(servicio.archivo) == 5 and not servicio.pedidos
@@ -0,0 +1,22 @@
+import asyncio
+from uuid import uuid4
+
+from services.Eventos_Stock import CanalStock
+
+
+def test_cancelar_quita_los_grupos_vacios():
+    async def probar():
+        canal = CanalStock()
+        a, b = uuid4(), uuid4()
+        primera = canal.suscribir(productos=[a, b])
+        segunda = canal.suscribir(productos=[a])
+        por_tipo = canal.suscribir(tipo="ropa")
+        canal.cancelar(primera)
+        # 'a' sigue teniendo un suscriptor; 'b' ya no tiene ninguno
+        assert set(canal._por_producto) == {a}
+        canal.cancelar(segunda)
+        canal.cancelar(por_tipo)
+        assert canal._por_producto == {} and canal._por_tipo == {}
+        assert canal.suscriptores == 0
+
+    asyncio.run(probar())
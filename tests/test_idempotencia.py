@@ -0,0 +1,62 @@
+import pytest
+
+from models import ProductoElectronico
+from services import AlmacenCompartido, ClaveIdempotencia, Persistencia, TiendaService
+from services.Idempotencia import ConflictoIdempotencia, RespuestaRepetida
+
+
+def clave(texto="reintento-1", huella=7):
+    return ClaveIdempotencia(texto, huella, ttl=3600)
+
+
+def test_reintento_en_otro_worker_devuelve_el_pedido_original(tmp_path):
+    # Dos servicios sobre la misma base SQLite hacen de dos workers
+    ruta = str(tmp_path / "tienda.db")
+    primero = TiendaService(compartido=AlmacenCompartido(ruta))
+    segundo = TiendaService(compartido=AlmacenCompartido(ruta))
+    try:
+        cliente = primero.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+        producto = primero.añadir_producto(ProductoElectronico("Portátil", 900, 1))
+        segundo.compartido.sincronizar()
+
+        pedido = primero.realizar_pedido(cliente.id, {producto.id: 1}, clave())
+        # El reintento llega al otro worker: aunque ya no queda stock devuelve la
+        # respuesta del primero sin crear otro pedido
+        with pytest.raises(RespuestaRepetida) as repetida:
+            segundo.realizar_pedido(cliente.id, {producto.id: 1}, clave())
+        assert str(pedido.id).encode() in repetida.value.cuerpo
+        with pytest.raises(ConflictoIdempotencia):
+            segundo.realizar_pedido(cliente.id, {producto.id: 1}, clave(huella=8))
+
+        segundo.compartido.sincronizar()
+        assert primero.compartido.stock(producto.id) == 0
+        assert list(segundo.pedidos) == [pedido.id]
+    finally:
+        primero.cerrar()
+        segundo.cerrar()
+
+
+@pytest.mark.parametrize("con_snapshot", [False, True])
+def test_reintento_tras_reiniciar_devuelve_el_pedido_original(tmp_path, con_snapshot):
+    directorio = str(tmp_path)
+    servicio = TiendaService(persistencia=Persistencia(directorio, snapshot_cada=0))
+    cliente = servicio.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+    producto = servicio.añadir_producto(ProductoElectronico("Portátil", 900, 5))
+    pedido = servicio.realizar_pedido(cliente.id, {producto.id: 2}, clave())
+    if con_snapshot:
+        servicio.crear_snapshot()
+    servicio.cerrar()
+
+    # Tras reiniciar (desde el WAL o desde el snapshot) la clave sigue guardada
+    servicio = TiendaService(persistencia=Persistencia(directorio, snapshot_cada=0))
+    try:
+        with pytest.raises(RespuestaRepetida) as repetida:
+            servicio.realizar_pedido(cliente.id, {producto.id: 2}, clave())
+        assert str(pedido.id).encode() in repetida.value.cuerpo
+        assert servicio.productos[producto.id].stock == 3
+        assert list(servicio.pedidos) == [pedido.id]
+        # Otra clave es otro pedido
+        servicio.realizar_pedido(cliente.id, {producto.id: 2}, clave("reintento-2"))
+        assert servicio.productos[producto.id].stock == 1
+    finally:
+        servicio.cerrar()
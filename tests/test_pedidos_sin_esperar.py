@@ -0,0 +1,105 @@
+import gc
+import threading
+from time import perf_counter
+
+import pytest
+
+from models import ProductoElectronico
+from services import TiendaService
+from services.Reserva_Stock import FranjasOcupadas
+
+
+def tienda_con_producto(stock=1000):
+    servicio = TiendaService()
+    cliente = servicio.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+    producto = servicio.añadir_producto(ProductoElectronico("Portátil", 900, stock))
+    return servicio, cliente, producto
+
+
+@pytest.mark.parametrize("lock", ["catalogo", "estadisticas", "indice_pedidos"])
+def test_lock_ocupado_lanza_franjas_ocupadas_y_devuelve_el_stock(lock):
+    servicio, cliente, producto = tienda_con_producto()
+    tomado, soltar = threading.Event(), threading.Event()
+
+    def ocupar():
+        # Otro hilo tiene el lock (como un alta masiva)
+        with getattr(servicio, lock).lock:
+            tomado.set()
+            soltar.wait(5)
+
+    hilo = threading.Thread(target=ocupar)
+    hilo.start()
+    tomado.wait()
+    try:
+        with pytest.raises(FranjasOcupadas):
+            servicio.reservar_pedido(cliente.id, {producto.id: 3}, esperar=False)
+    finally:
+        soltar.set()
+        hilo.join()
+    assert producto.stock == 1000
+    assert not servicio.pedidos
+    # Sin nadie en el lock el mismo pedido entra sin esperar
+    pedido, _ = servicio.reservar_pedido(cliente.id, {producto.id: 3}, esperar=False)
+    assert producto.stock == 997
+    assert servicio.pedidos == {pedido.id: pedido}
+
+
+def test_indice_de_productos_solo_se_toma_si_cambia_la_disponibilidad():
+    servicio, cliente, producto = tienda_con_producto(stock=5)
+    with servicio.indice_productos.lock:
+        # Desde otro hilo el lock está ocupado: un pedido que no agota el stock entra...
+        resultado = []
+        hilo = threading.Thread(
+            target=lambda: resultado.append(servicio.reservar_pedido(cliente.id, {producto.id: 2}, esperar=False))
+        )
+        hilo.start()
+        hilo.join()
+        assert len(resultado) == 1 and producto.stock == 3
+
+        # ...y uno que lo agota cede el paso
+        def agotar():
+            try:
+                servicio.reservar_pedido(cliente.id, {producto.id: 3}, esperar=False)
+            except FranjasOcupadas:
+                resultado.append(None)
+
+        hilo = threading.Thread(target=agotar)
+        hilo.start()
+        hilo.join(5)
+        assert resultado[-1] is None and producto.stock == 3
+
+
+def test_alta_masiva_no_para_los_pedidos_sin_esperar():
+    # Un alta masiva en otro hilo tiene los locks del índice y del catálogo mientras
+    # dura; los pedidos sin esperar (los del bucle de eventos) ceden el paso en vez
+    # de quedarse parados detrás
+    servicio, cliente, producto = tienda_con_producto(stock=1_000_000)
+    lote = [ProductoElectronico(f"Producto {i}", 1 + i % 500, 10) for i in range(100_000)]
+    hilo = threading.Thread(target=servicio.añadir_productos, args=(lote,))
+    peor = aceptados = cedidos = 0
+    # Las pasadas completas del recolector de ciclos paran a todos los hilos sea
+    # cual sea el lock; aquí medimos solo las esperas que causa el alta
+    reactivar = gc.isenabled()
+    gc.disable()
+    try:
+        inicio = perf_counter()
+        hilo.start()
+        while hilo.is_alive():
+            t = perf_counter()
+            try:
+                servicio.reservar_pedido(cliente.id, {producto.id: 1}, esperar=False)
+                aceptados += 1
+            except FranjasOcupadas:
+                cedidos += 1
+            peor = max(peor, perf_counter() - t)
+        hilo.join()
+    finally:
+        if reactivar:
+            gc.enable()
+    duracion = perf_counter() - inicio
+    assert len(servicio.productos) == 100_001
+    assert producto.stock == 1_000_000 - aceptados
+    assert cedidos > 0
+    # El peor pedido tarda como mucho unos pocos cambios de hilo (5 ms cada uno),
+    # no lo que dura el alta
+    assert peor < min(0.05, duracion / 4), (peor, duracion)
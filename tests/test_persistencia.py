@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+from models import ProductoElectronico
+from services import Persistencia, TiendaService
+from services.Persistencia import CABECERA, _TRAMA
+
+
+def abrir(directorio):
+    return TiendaService(persistencia=Persistencia(str(directorio), snapshot_cada=0))
+
+
+def tienda_con_pedidos(directorio, pedidos=3):
+    # Un cliente, un producto con 10 unidades y 'pedidos' pedidos de 1 unidad
+    servicio = abrir(directorio)
+    cliente = servicio.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+    producto = servicio.añadir_producto(ProductoElectronico("Portátil", 900, 10))
+    ids = [servicio.realizar_pedido(cliente.id, {producto.id: 1}).id for _ in range(pedidos)]
+    servicio.cerrar()
+    return producto.id, ids
+
+
+def tramas(datos):
+    # Posición en la que empieza cada trama de un fichero
+    inicios, posicion = [], len(CABECERA)
+    while posicion < len(datos):
+        inicios.append(posicion)
+        posicion += _TRAMA.size + _TRAMA.unpack_from(datos, posicion)[0]
+    return inicios
+
+
+def ficheros(directorio):
+    return sorted(f for f in os.listdir(directorio) if not f.endswith(".tmp"))
+
+
+@pytest.mark.parametrize("cortar", [1, 7, 12])
+def test_cola_del_wal_cortada_se_descarta_al_arrancar(tmp_path, cortar):
+    producto_id, ids = tienda_con_pedidos(tmp_path)
+    # La caída dejó a medias el último registro (la cabecera de la trama o su contenido)
+    wal = tmp_path / "wal-00000001.log"
+    os.truncate(wal, wal.stat().st_size - cortar)
+
+    servicio = abrir(tmp_path)
+    try:
+        assert list(servicio.pedidos) == ids[:-1]
+        assert servicio.productos[producto_id].stock == 8
+        # Seguimos escribiendo en otra generación: la cola rota no se continúa
+        assert ficheros(tmp_path) == ["wal-00000001.log", "wal-00000002.log"]
+        cliente_id = next(iter(servicio.usuarios))
+        nuevo = servicio.realizar_pedido(cliente_id, {producto_id: 1})
+    finally:
+        servicio.cerrar()
+
+    servicio = abrir(tmp_path)
+    try:
+        assert list(servicio.pedidos) == ids[:-1] + [nuevo.id]
+        assert servicio.productos[producto_id].stock == 7
+    finally:
+        servicio.cerrar()
+
+
+def test_registro_con_crc_incorrecto_corta_la_reproduccion(tmp_path):
+    producto_id, ids = tienda_con_pedidos(tmp_path)
+    # Cambiamos un byte del penúltimo pedido: desde ahí nada es fiable
+    wal = tmp_path / "wal-00000001.log"
+    datos = bytearray(wal.read_bytes())
+    inicios = tramas(datos)
+    datos[inicios[-2] + _TRAMA.size + 1] ^= 0xFF
+    wal.write_bytes(bytes(datos))
+
+    servicio = abrir(tmp_path)
+    try:
+        assert list(servicio.pedidos) == ids[:-2]
+        assert servicio.productos[producto_id].stock == 9
+    finally:
+        servicio.cerrar()
+
+
+def test_snapshot_rota_los_ficheros_y_conserva_el_estado(tmp_path):
+    producto_id, ids = tienda_con_pedidos(tmp_path)
+    servicio = abrir(tmp_path)
+    cliente_id = next(iter(servicio.usuarios))
+    servicio.crear_snapshot()
+    # El snapshot sustituye al WAL anterior; lo siguiente va a la generación nueva
+    assert ficheros(tmp_path) == ["snapshot-00000003.bin", "wal-00000003.log"]
+    ids.append(servicio.realizar_pedido(cliente_id, {producto_id: 1}).id)
+    servicio.crear_snapshot()
+    ids.append(servicio.realizar_pedido(cliente_id, {producto_id: 1}).id)
+    servicio.cerrar()
+    assert ficheros(tmp_path) == ["snapshot-00000004.bin", "wal-00000004.log"]
+
+    servicio = abrir(tmp_path)
+    try:
+        assert list(servicio.pedidos) == ids
+        # El snapshot guarda el stock ya descontado y el WAL solo el último pedido
+        assert servicio.productos[producto_id].stock == 5
+        assert [p.id for p in servicio.listar_pedidos_usuario(cliente_id)] == ids
+    finally:
+        servicio.cerrar()
+
+
+@pytest.mark.parametrize("con_snapshot", [False, True])
+def test_eliminar_producto_tras_un_pedido(tmp_path, con_snapshot):
+    servicio = abrir(tmp_path)
+    cliente = servicio.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+    producto = servicio.añadir_producto(ProductoElectronico("Portátil", 900, 10))
+    otro = servicio.añadir_producto(ProductoElectronico("Ratón", 20, 10))
+    primero = servicio.realizar_pedido(cliente.id, {producto.id: 2, otro.id: 1})
+    segundo = servicio.realizar_pedido(cliente.id, {producto.id: 3})
+    servicio.eliminar_producto(producto.id)
+    if con_snapshot:
+        servicio.crear_snapshot()
+    servicio.cerrar()
+
+    servicio = abrir(tmp_path)
+    try:
+        # Al reproducir la eliminación el producto sale del catálogo, pero los
+        # pedidos anteriores lo siguen resolviendo (al mismo objeto en los dos)
+        assert list(servicio.productos) == [otro.id]
+        assert servicio.productos[otro.id].stock == 9
+        lineas = [list(servicio.pedidos[p.id].lineas()) for p in (primero, segundo)]
+        eliminado = lineas[0][0][0]
+        assert (eliminado.id, eliminado.nombre) == (producto.id, "Portátil")
+        assert lineas[1][0][0] is eliminado
+        assert [(linea[1], linea[2]) for linea in lineas[0]] == [(2, 90000), (1, 2000)]
+        assert servicio.pedidos[primero.id].total == primero.total
+    finally:
+        servicio.cerrar()
+
+
+@pytest.mark.parametrize("con_snapshot", [False, True])
+def test_stock_retenido_vuelve_tras_reiniciar(tmp_path, con_snapshot):
+    servicio = abrir(tmp_path)
+    try:
+        cliente = servicio.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+        producto = servicio.añadir_producto(ProductoElectronico("Portátil", 900, 10))
+        servicio.realizar_pedido(cliente.id, {producto.id: 1})
+        confirmada = servicio.retener_stock(cliente.id, {producto.id: 2}, ttl=600)
+        servicio.confirmar_retencion(confirmada.id)
+        servicio.retener_stock(cliente.id, {producto.id: 4}, ttl=600)
+        assert (producto.stock, producto.retenido) == (3, 4)
+        if con_snapshot:
+            servicio.crear_snapshot()
+    finally:
+        servicio.cerrar()
+
+    # Las reservas pendientes no se guardan: sus unidades vuelven a estar disponibles,
+    # y la confirmada cuenta como un pedido más
+    servicio = abrir(tmp_path)
+    try:
+        recuperado = servicio.productos[producto.id]
+        assert (recuperado.stock, recuperado.retenido) == (7, 0)
+        assert len(servicio.pedidos) == 2
+    finally:
+        servicio.cerrar()
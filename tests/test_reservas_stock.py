@@ -0,0 +1,105 @@
+import random
+import sys
+import threading
+
+import pytest
+
+from models import ProductoElectronico
+from services import TiendaService
+from services.Reserva_Stock import MotorReservas, StockInsuficiente
+
+
+def test_pedidos_concurrentes_no_pierden_ni_duplican_stock():
+    # Versión reducida de benchmarks/stress_reservas.py: muchos hilos sobre pocos
+    # productos, con stock para que una parte de los pedidos se rechace
+    num_hilos, pedidos_por_hilo, stock = 8, 300, 500
+    tienda = TiendaService(num_franjas=4)
+    productos = [tienda.añadir_producto(ProductoElectronico(f"Producto {i}", 10 + i, stock)).id for i in range(6)]
+    clientes = [
+        tienda.registrar_usuario("cliente", f"Cliente {i}", f"cliente{i}@tienda.es", "Calle 1").id
+        for i in range(num_hilos)
+    ]
+    vendidos = [dict() for _ in range(num_hilos)]
+    rechazados = [0] * num_hilos
+    barrera = threading.Barrier(num_hilos)
+
+    def trabajador(indice):
+        aleatorio = random.Random(indice)
+        barrera.wait()
+        for _ in range(pedidos_por_hilo):
+            items = {p: aleatorio.randint(1, 3) for p in aleatorio.sample(productos, aleatorio.randint(1, 3))}
+            try:
+                tienda.realizar_pedido(clientes[indice], items)
+            except StockInsuficiente:
+                rechazados[indice] += 1
+                continue
+            for producto_id, cantidad in items.items():
+                vendidos[indice][producto_id] = vendidos[indice].get(producto_id, 0) + cantidad
+
+    # Cambios de hilo muy frecuentes para que los pedidos se crucen de verdad
+    intervalo = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(num_hilos)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+    finally:
+        sys.setswitchinterval(intervalo)
+
+    assert sum(rechazados) > 0
+    assert len(tienda.pedidos) + sum(rechazados) == num_hilos * pedidos_por_hilo
+    for producto_id in productos:
+        vendido = sum(v.get(producto_id, 0) for v in vendidos)
+        producto = tienda.obtener_producto(producto_id)
+        assert producto.stock >= 0
+        assert producto.stock + vendido == stock
+        # Los pedidos guardados cuentan lo mismo que lo que vieron los hilos
+        assert sum(p.productos_cantidades.get(producto, 0) for p in tienda.pedidos.values()) == vendido
+
+
+def test_reserva_sin_stock_en_una_linea_no_descuenta_ninguna():
+    motor = MotorReservas(num_franjas=2)
+    a = ProductoElectronico("A", 10, 5)
+    b = ProductoElectronico("B", 10, 1)
+    with pytest.raises(StockInsuficiente):
+        motor.reservar({a: 2, b: 2})
+    assert (a.stock, b.stock) == (5, 1)
+
+
+def test_reserva_devuelve_todo_el_stock_si_falla_al_reservar():
+    motor = MotorReservas(num_franjas=2)
+    a = ProductoElectronico("A", 10, 5)
+    b = ProductoElectronico("B", 10, 3)
+    vistos = []
+
+    def fallar():
+        # Con las franjas adquiridas el stock ya está descontado
+        vistos.append((a.stock, b.stock))
+        raise RuntimeError("no se pudo registrar")
+
+    with pytest.raises(RuntimeError):
+        motor.reservar({a: 2, b: 3}, fallar)
+    assert vistos == [(3, 0)]
+    assert (a.stock, b.stock) == (5, 3)
+    # Las franjas se liberaron: la misma reserva entra sin esperar
+    assert motor.reservar({a: 2, b: 3}, lambda: "ok", esperar=False) == "ok"
+    assert (a.stock, b.stock) == (3, 0)
+
+
+def test_reserva_de_lote_devuelve_todo_el_stock_si_falla_al_reservar():
+    motor = MotorReservas(num_franjas=2)
+    a = ProductoElectronico("A", 10, 5)
+    b = ProductoElectronico("B", 10, 3)
+    errores = []
+
+    def fallar(resultado):
+        errores.extend(resultado)
+        raise RuntimeError("no se pudo registrar")
+
+    with pytest.raises(RuntimeError):
+        motor.reservar_lote([{a: 2}, {a: 1, b: 3}, {b: 1}], fallar)
+    # El último pedido no cabía, pero los aceptados también se deshacen
+    assert errores[:2] == [None, None] and errores[2] is not None
+    assert (a.stock, b.stock) == (5, 3)
@@ -0,0 +1,45 @@
+from services.Rueda_Temporizadores import RuedaTemporizadores
+
+
+def test_cancelar_tras_vencer_devuelve_false(reloj):
+    rueda = RuedaTemporizadores(resolucion=0.25, ranuras=8, niveles=2, reloj=reloj)
+    rueda.programar("a", reloj.ahora + 0.5)
+    reloj.ahora += 0.5
+    assert rueda.avanzar() == ["a"]
+    assert "a" not in rueda and len(rueda) == 0
+    assert rueda.cancelar("a") is False
+    # Volver a programarlo después funciona como uno nuevo
+    rueda.programar("a", reloj.ahora + 0.25)
+    reloj.ahora += 0.25
+    assert rueda.avanzar() == ["a"]
+
+
+def test_cancelar_antes_de_vencer(reloj):
+    rueda = RuedaTemporizadores(resolucion=0.25, ranuras=8, niveles=2, reloj=reloj)
+    rueda.programar("a", reloj.ahora + 5)
+    assert rueda.cancelar("a") is True
+    reloj.ahora += 10
+    assert rueda.avanzar() == []
+
+
+def test_programado_en_el_pasado_vence_en_el_siguiente_tick(reloj):
+    rueda = RuedaTemporizadores(resolucion=0.25, ranuras=8, niveles=2, reloj=reloj)
+    reloj.ahora += 1
+    assert rueda.avanzar() == []
+    rueda.programar("viejo", reloj.ahora - 50)
+    rueda.programar("ahora", reloj.ahora)
+    # Sin avanzar el reloj no vence nada
+    assert rueda.avanzar() == []
+    reloj.ahora += 0.25
+    assert sorted(rueda.avanzar()) == ["ahora", "viejo"]
+    assert len(rueda) == 0
+
+
+def test_vencimiento_mas_alla_del_alcance(reloj):
+    # 8 ranuras y 2 niveles alcanzan 64 ticks (16 s): lo más lejano se reprograma al bajar
+    rueda = RuedaTemporizadores(resolucion=0.25, ranuras=8, niveles=2, reloj=reloj)
+    rueda.programar("lejos", reloj.ahora + 20)
+    reloj.ahora += 19.75
+    assert rueda.avanzar() == []
+    reloj.ahora += 0.25
+    assert rueda.avanzar() == ["lejos"]
@@ -0,0 +1,20 @@
+from models import ProductoElectronico
+from services import TiendaService
+
+
+def test_eliminar_producto_olvida_su_version():
+    servicio = TiendaService()
+    cliente = servicio.registrar_usuario("cliente", "Ana", "ana@tienda.es", "Calle 1")
+    producto = servicio.añadir_producto(ProductoElectronico("Portátil", 900, 10))
+    otro = servicio.añadir_producto(ProductoElectronico("Ratón", 20, 10))
+    servicio.realizar_pedido(cliente.id, {producto.id: 1, otro.id: 1})
+    versiones = servicio.versiones
+    antes = versiones.coleccion("productos")
+    assert versiones.entidad("productos", producto.id) == antes
+
+    servicio.eliminar_producto(producto.id)
+    # La colección cambia de versión y la entidad eliminada ya no ocupa memoria
+    assert versiones.coleccion("productos") > antes
+    assert producto.id not in versiones._entidades["productos"]
+    assert versiones.entidad("productos", producto.id) == 0
+    assert versiones.entidad("productos", otro.id) == antes